@@ -6,6 +6,8 @@ import terminalio
 from adafruit_display_text import label
 import adafruit_mlx90640
 from simpleio import map_range
+from thermal_render import ThermalRenderer
+from stage_profiler import StageProfiler
 
 # ==============================
 # MLX90640 Setup
@@ -51,6 +53,7 @@ grid = displayio.TileGrid(bitmap, pixel_shader=palette)
 img = displayio.Group(scale=SCALE, y=offset_y)
 img.append(grid)
 root.append(img)
+renderer = ThermalRenderer(bitmap, T_MIN, T_MAX, COLOR_DEPTH, flip=True)
 
 # ==============================
 # Color Bar
@@ -107,6 +110,14 @@ PELTIER_H = 3
 
 frame = [0] * (WIDTH * HEIGHT)
 
+# Stage timing: PROFILE: lines on the USB console every PROFILE_REPORT s
+PROFILE = False
+PROFILE_REPORT = 10.0
+ST_GETFRAME, ST_HOTSPOT, ST_RENDER, ST_OVERLAY, ST_REFRESH = range(5)
+profiler = StageProfiler(("getframe", "hotspot", "render", "overlay",
+                          "refresh"), enabled=PROFILE)
+next_report = time.monotonic() + PROFILE_REPORT
+
 # ==============================
 # Drawing Helpers (HORIZONTAL FLIP ONLY)
 # ==============================
@@ -135,11 +146,14 @@ def draw_block(bitmap, gx, gy, color=40):
 # Main Loop
 # ==============================
 while True:
+    profiler.start()
     try:
         mlx.getFrame(frame)
     except:
         continue
+    profiler.stop(ST_GETFRAME)
 
+    profiler.start()
     max_temp = -100.0
     max_index = 0
     for i, t in enumerate(frame):
@@ -152,29 +166,32 @@ while True:
 
     gx = px // PELTIER_W
     gy = py // PELTIER_H
+    profiler.stop(ST_HOTSPOT)
 
     # Render image (horizontal flip only)
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            t = frame[y * WIDTH + x]
-            if t < T_MIN:
-                t = T_MIN
-            elif t > T_MAX:
-                t = T_MAX
-
-            idx = int(map_range(t, T_MIN, T_MAX, 0, COLOR_DEPTH - 1))
-            bitmap[fx(x), y] = idx
+    profiler.start()
+    renderer.render(frame)
+    profiler.stop(ST_RENDER)
 
+    profiler.start()
     max_label.text = f"{max_temp:.1f}C"
 
     if max_temp >= THRESHOLD:
         draw_cross(bitmap, px, py)
         draw_block(bitmap, gx, gy)
-        hot_label.text = f"HOT px({px},{py}) grid({gx},{gy}) {max_temp:.1f}C"
+        hot_label.text = f"HOT px({px},{py}) box({gx * PELTIER_W},{gy * PELTIER_H}) {max_temp:.1f}C"
         hot_label.color = 0xFF0000
     else:
         hot_label.text = "NO HOTSPOT ≥35C"
         hot_label.color = 0x00FF00
+    profiler.stop(ST_OVERLAY)
 
+    profiler.start()
     display.refresh()
+    profiler.stop(ST_REFRESH)
+
+    if profiler.enabled and time.monotonic() >= next_report:
+        next_report = time.monotonic() + PROFILE_REPORT
+        for line in profiler.report():
+            print(line)
     time.sleep(0.2) 
@@ -7,6 +7,44 @@
   Trial: 5 min
   Buffer: 1 min
   Final heat: 60 s
+
+  PyBadge link: binary frames (uart_frames.py) after the
+  REQUEST_CALIB:BIN1 / CALIB_OK:BIN1 handshake, ASCII
+  TEMP:A:xx.xx,... lines otherwise. Both are always accepted.
+  The handshake is sent at boot and again on every PYBADGE_READY,
+  so a PyBadge that (re)starts after the ESP32 still switches.
+
+  Cool plate temperature (Remote_Web_Server /set_temperature):
+    SET_TEMP:<C>          target of the cooled plate for this and later
+                          trials, TEMP_COOL_MIN..TEMP_HEAT; answers
+                          OK:TEMP_SET or ERR:TEMP_RANGE
+
+  Identification logging (host/sysid.py):
+    LOG:ON / LOG:OFF      print one LOG line per temperature update:
+                          LOG:<ms>,<tA>,<pwmA>,<tB>,<pwmB>,...
+                          pwm signed as applied: + heat, - cool, 0 off
+    DRIVE:<label>:<pwm>   open-loop drive of one plate (signed PWM,
+                          0 = off); STOP or PATTERN return it to the PID
+  DRIVE and STOP are also accepted from the PyBadge (auto_calibrate.py).
+
+  Latency statistics (host/latency_monitor.py): one STATS: line every
+  STATS_INTERVAL ms with sensor->receive and sensor->actuation latency,
+  receive interval, dropped/duplicated frames and PID rate. The PyBadge
+  capture time comes from the binary frames; its clock is mapped to
+  millis() with a TIME? / TIME: exchange every TIME_SYNC_INTERVAL ms.
+    STATS:<ms>            set the summary interval, 0 = off
+
+  PyBadge stage timing (host/profile_report.py), forwarded to the PyBadge;
+  its PROFILE: lines are echoed here. Each command is answered
+  PROFILE SENT (not a PROFILE: line, so it is told from the reports):
+    PROFILE               one report now
+    PROFILE:ON / :OFF     start / stop timing
+    PROFILE:<s>           report every <s> seconds, 0 = on demand only
+
+  Phase markers (host/frame_archive.py index): every phase line is
+  followed by MARK:<esp_ms>,<pybadge_ms>,<phase> with phase TRIAL:<label>,
+  BUFFER, FINAL or COMPLETE. pybadge_ms is the same instant on the
+  PyBadge clock (the frame timestamps), -1 until the clock is synced.
 */
 
 #include <HardwareSerial.h>
@@ -44,6 +82,7 @@ HardwareSerial SerialPyBadge(1);
 // ================= TEMPERATURE =================
 #define TEMP_HEAT 36.0
 #define TEMP_COOL 25.0
+#define TEMP_COOL_MIN 15.0
 #define DEADBAND  0.25
 
 // ================= PID =================
@@ -52,6 +91,21 @@ HardwareSerial SerialPyBadge(1);
 #define KD 1.8
 #define PID_INTERVAL 500
 
+// ================= UART FRAMES =================
+// 0xA5, version, count, seq(u16), count x {ts_ms(u32), A..D(i16 centi-C)}, crc16
+#define FRAME_SYNC      0xA5
+#define FRAME_VERSION   1
+#define FRAME_MAX_BATCH 8
+#define FRAME_HEADER    5
+#define FRAME_RECORD    12
+#define FRAME_MAX_LEN   (FRAME_HEADER + FRAME_RECORD * FRAME_MAX_BATCH + 2)
+#define LINE_MAX        64
+
+// ================= LATENCY STATS =================
+#define STATS_INTERVAL      10000
+#define TIME_SYNC_INTERVAL  2000
+#define HIST_BINS           11
+
 // ================= TIMING =================
 #define TRIAL_TIME   (5UL * 60UL * 1000UL)
 #define BUFFER_TIME  (1UL * 60UL * 1000UL)
@@ -79,13 +133,14 @@ struct Peltier {
   bool heating;
   bool enabled;
   unsigned long lastUpdate;
+  int pwm;             // applied output: + heat, - cool, 0 off
 };
 
 Peltier peltiers[4] = {
-  {'A', IN1, IN2, ENA, 0, 0, 0, 0, true, false, 0},
-  {'B', IN3, IN4, ENB, 0, 0, 0, 0, true, false, 0},
-  {'C', IN5, IN6, ENC, 0, 0, 0, 0, true, false, 0},
-  {'D', IN7, IN8, END, 0, 0, 0, 0, true, false, 0}
+  {'A', IN1, IN2, ENA, 0, 0, 0, 0, true, false, 0, 0},
+  {'B', IN3, IN4, ENB, 0, 0, 0, 0, true, false, 0, 0},
+  {'C', IN5, IN6, ENC, 0, 0, 0, 0, true, false, 0, 0},
+  {'D', IN7, IN8, END, 0, 0, 0, 0, true, false, 0, 0}
 };
 
 // ================= PATTERN =================
@@ -93,6 +148,38 @@ String pattern = "";
 int patternIndex = 0;
 unsigned long phaseStart = 0;
 
+float tempCool = TEMP_COOL;        // SET_TEMP: changes it
+
+// ================= LOGGING =================
+bool logEnabled = false;
+
+// ================= LATENCY =================
+// histogram upper edges (ms); the last bin is everything above 500
+const uint16_t HIST_EDGES[HIST_BINS - 1] = {10, 20, 30, 50, 75, 100, 150, 200, 300, 500};
+
+struct LatencyStat {
+  uint32_t n;
+  float sum, sumSq;
+  uint32_t minV, maxV;
+  uint32_t hist[HIST_BINS];
+};
+
+LatencyStat linkStat, actStat, ivalStat;   // capture->rx, capture->PID, rx->rx
+unsigned long statsInterval = STATS_INTERVAL;
+unsigned long statsStart = 0;
+unsigned long rxCount = 0, dropCount = 0, dupCount = 0, pidCount = 0, freshCount = 0;
+unsigned long lastRxMs = 0;
+long lastSeq = -1;                 // PyBadge record sequence number
+unsigned long recordId = 0;        // counts every reading (ASCII too)
+unsigned long usedRecord[4] = {0, 0, 0, 0};
+bool captureValid = false;
+unsigned long captureEsp = 0;      // capture time of the newest reading, millis()
+long clockOffset = 0;              // PyBadge ms - ESP32 ms
+bool clockSynced = false;
+unsigned long syncBestRtt = 0xFFFFFFFF;
+int syncAge = 0;
+unsigned long lastSyncMs = 0;
+
 // ================= SETUP =================
 void setup() {
   Serial.begin(115200);
@@ -114,23 +201,13 @@ void setup() {
   Serial.println("ESP32 PID Pattern Controller READY");
   Serial.println("Command: PATTERN:C-D-A-B");
 
-  SerialPyBadge.println("REQUEST_CALIB");
+  SerialPyBadge.println("REQUEST_CALIB:BIN1");
 }
 
 // ================= LOOP =================
-String uartBuf = "";
-
 void loop() {
   // ---- UART TEMP ----
-  while (SerialPyBadge.available()) {
-    char c = SerialPyBadge.read();
-    if (c == '\n') {
-      uartBuf.trim();
-      if (uartBuf.startsWith("TEMP:"))
-        parseTemperatures(uartBuf);
-      uartBuf = "";
-    } else uartBuf += c;
-  }
+  readPyBadge();
 
   // ---- COMMANDS ----
   if (Serial.available()) {
@@ -147,6 +224,9 @@ void loop() {
   // ---- PATTERN FSM ----
   handlePattern();
 
+  // ---- LATENCY ----
+  serviceLatency();
+
   delay(20);
 }
 
@@ -171,12 +251,22 @@ void handlePattern() {
     stopAll();
     state = STATE_COMPLETE;
     Serial.println("EXPERIMENT COMPLETE");
+    printMark("COMPLETE");
   }
 }
 
 // ================= START PHASES =================
+void printMark(const char *phase) {
+  unsigned long now = millis();
+  Serial.printf("MARK:%lu,%ld,%s\n", now,
+                clockSynced ? (long)(now + clockOffset) : -1L, phase);
+}
+
 void startTrial(char coolLabel) {
   Serial.printf("TRIAL START — Cool %c\n", coolLabel);
+  char phase[] = "TRIAL:?";
+  phase[6] = coolLabel;
+  printMark(phase);
   phaseStart = millis();
   state = STATE_TRIAL;
 
@@ -186,7 +276,7 @@ void startTrial(char coolLabel) {
     p.lastError = 0;
     if (p.label == coolLabel) {
       p.heating = false;
-      p.targetTemp = TEMP_COOL;
+      p.targetTemp = tempCool;
     } else {
       p.heating = true;
       p.targetTemp = TEMP_HEAT;
@@ -196,6 +286,7 @@ void startTrial(char coolLabel) {
 
 void startBuffer() {
   Serial.println("BUFFER — All heat");
+  printMark("BUFFER");
   phaseStart = millis();
   state = STATE_BUFFER;
 
@@ -210,6 +301,7 @@ void startBuffer() {
 
 void startFinal() {
   Serial.println("FINAL HEAT — All heat 60s");
+  printMark("FINAL");
   phaseStart = millis();
   state = STATE_FINAL;
 
@@ -242,6 +334,52 @@ void processCommand(String cmd) {
     state = STATE_IDLE;
     Serial.println("STOPPED");
   }
+
+  else if (cmd.startsWith("STATS:")) {
+    statsInterval = cmd.substring(6).toInt();
+    resetStats();
+    Serial.printf("STATS EVERY %lu ms\n", statsInterval);
+  }
+
+  else if (cmd == "LOG:ON" || cmd == "LOG:OFF") {
+    logEnabled = (cmd == "LOG:ON");
+    Serial.println(logEnabled ? "LOG ON" : "LOG OFF");
+  }
+
+  else if (cmd == "PROFILE" || cmd.startsWith("PROFILE:")) {
+    SerialPyBadge.println(cmd);
+    Serial.println("PROFILE SENT");
+  }
+
+  else if (cmd.startsWith("SET_TEMP:")) {
+    float t = cmd.substring(9).toFloat();
+    if (t < TEMP_COOL_MIN || t >= TEMP_HEAT) {
+      Serial.println("ERR:TEMP_RANGE");
+      return;
+    }
+    tempCool = t;
+    if (state == STATE_TRIAL) {
+      for (auto &p : peltiers) {
+        if (p.label == pattern[patternIndex]) p.targetTemp = tempCool;
+      }
+    }
+    Serial.println("OK:TEMP_SET");
+  }
+
+  else if (cmd.startsWith("DRIVE:") && cmd.length() > 8 && cmd[7] == ':') {
+    for (auto &p : peltiers) {
+      if (p.label != cmd[6]) continue;
+      int pwm = constrain(cmd.substring(8).toInt(), -PWM_MAX, PWM_MAX);
+      p.enabled = false;                 // PID off for this plate
+      if (pwm == 0) {
+        stopDrive(p);
+      } else {
+        p.heating = pwm > 0;
+        drive(p, abs(pwm));
+      }
+      Serial.printf("DRIVE %c %d\n", p.label, pwm);
+    }
+  }
 }
 
 // ================= PID =================
@@ -254,6 +392,7 @@ void updatePID(Peltier &p) {
   if (abs(error) < DEADBAND) {
     stopDrive(p);
     p.errorSum = 0;
+    noteActuation(p, now);
     return;
   }
 
@@ -268,6 +407,7 @@ void updatePID(Peltier &p) {
   int pwm = constrain(abs((int)out), PWM_MIN, PWM_MAX);
 
   drive(p, pwm);
+  noteActuation(p, now);
 }
 
 // ================= DRIVE =================
@@ -275,12 +415,14 @@ void drive(Peltier &p, int pwm) {
   digitalWrite(p.pinP, p.heating ? HIGH : LOW);
   digitalWrite(p.pinN, p.heating ? LOW : HIGH);
   ledcWrite(p.pinE, pwm);
+  p.pwm = p.heating ? pwm : -pwm;
 }
 
 void stopDrive(Peltier &p) {
   digitalWrite(p.pinP, LOW);
   digitalWrite(p.pinN, LOW);
   ledcWrite(p.pinE, 0);
+  p.pwm = 0;
 }
 
 void stopAll() {
@@ -290,20 +432,242 @@ void stopAll() {
   }
 }
 
+// ================= PYBADGE LINK =================
+uint8_t frameBuf[FRAME_MAX_LEN];
+int frameLen = 0;        // bytes of the current binary frame, 0 = none
+int frameNeed = 0;       // full length once the header is in
+char lineBuf[LINE_MAX];
+int lineLen = 0;
+bool binaryLink = false;
+unsigned long crcErrors = 0;
+
+uint16_t crc16(const uint8_t *d, int n) {
+  uint16_t crc = 0xFFFF;
+  while (n--) {
+    crc ^= (uint16_t)(*d++) << 8;
+    for (int i = 0; i < 8; i++)
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+void readPyBadge() {
+  while (SerialPyBadge.available())
+    rxByte(SerialPyBadge.read());
+}
+
+void rxByte(uint8_t c) {
+  if (frameLen > 0) {
+    frameBuf[frameLen++] = c;
+    if (frameLen == FRAME_HEADER) {
+      uint8_t count = frameBuf[2];
+      if (frameBuf[1] != FRAME_VERSION || count < 1 || count > FRAME_MAX_BATCH) {
+        // false sync: rescan the bytes after it, the real 0xA5 may be there
+        uint8_t rescan[FRAME_HEADER - 1];
+        memcpy(rescan, frameBuf + 1, FRAME_HEADER - 1);
+        frameLen = 0;
+        for (int i = 0; i < FRAME_HEADER - 1; i++)
+          rxByte(rescan[i]);
+        return;
+      }
+      frameNeed = FRAME_HEADER + FRAME_RECORD * count + 2;
+    }
+    if (frameLen > FRAME_HEADER && frameLen == frameNeed) {
+      handleFrame();
+      frameLen = 0;
+    }
+  }
+  else if (c == FRAME_SYNC) {
+    frameBuf[0] = c;
+    frameLen = 1;
+    lineLen = 0;
+  }
+  else if (c == '\n') {
+    lineBuf[lineLen] = '\0';
+    handleLine(lineBuf);
+    lineLen = 0;
+  }
+  else if (c != '\r' && lineLen < LINE_MAX - 1) {
+    lineBuf[lineLen++] = c;
+  }
+}
+
+void handleFrame() {
+  int end = frameNeed - 2;
+  uint16_t crc = frameBuf[end] | (frameBuf[end + 1] << 8);
+  if (crc != crc16(frameBuf + 1, end - 1)) {
+    crcErrors++;
+    return;
+  }
+  // newest record of a batch wins
+  uint8_t count = frameBuf[2];
+  const uint8_t *r = frameBuf + FRAME_HEADER + FRAME_RECORD * (count - 1);
+  for (int i = 0; i < 4; i++) {
+    int16_t v = (int16_t)(r[4 + 2 * i] | (r[5 + 2 * i] << 8));
+    peltiers[i].currentTemp = v / 100.0;
+  }
+  uint16_t seq = frameBuf[3] | (frameBuf[4] << 8);
+  uint32_t ts = r[0] | (r[1] << 8) | ((uint32_t)r[2] << 16) | ((uint32_t)r[3] << 24);
+  noteReading(true, (uint16_t)(seq + count - 1), count, ts);
+  logSample();
+}
+
+void handleLine(const char *line) {
+  if (strncmp(line, "TEMP:", 5) == 0) {
+    parseTemperatures(line);
+    noteReading(false, 0, 1, 0);
+    logSample();
+  }
+  else if (strncmp(line, "TIME:", 5) == 0) {
+    handleTimeReply(line + 5);
+  }
+  else if (strncmp(line, "PROFILE:", 8) == 0) {
+    Serial.println(line);
+  }
+  else if (strncmp(line, "DRIVE:", 6) == 0 || strcmp(line, "STOP") == 0) {
+    processCommand(String(line));       // PyBadge auto-calibration
+  }
+  else if (strcmp(line, "CALIB_OK:BIN1") == 0) {
+    binaryLink = true;
+    Serial.println("PYBADGE LINK: BINARY");
+  }
+  else if (strcmp(line, "CALIB_OK") == 0) {
+    binaryLink = false;
+    Serial.println("PYBADGE LINK: ASCII");
+  }
+  else if (strcmp(line, "PYBADGE_READY") == 0) {
+    // PyBadge (re)booted: it talks ASCII until it acks the handshake
+    binaryLink = false;
+    SerialPyBadge.println("REQUEST_CALIB:BIN1");
+  }
+}
+
 // ================= TEMP PARSER =================
-void parseTemperatures(String data) {
-  int i = data.indexOf(':') + 1;
-  while (i < data.length()) {
-    char lbl = data.charAt(i);
-    int c1 = data.indexOf(':', i);
-    int c2 = data.indexOf(',', c1);
-    float t = data.substring(c1 + 1,
-               c2 > 0 ? c2 : data.length()).toFloat();
-
-    for (auto &p : peltiers)
-      if (p.label == lbl) p.currentTemp = t;
-
-    if (c2 < 0) break;
-    i = c2 + 1;
+void parseTemperatures(const char *data) {
+  const char *p = data + 5;          // after "TEMP:"
+  while (*p) {
+    char lbl = p[0];
+    if (p[1] != ':') break;
+    char *end;
+    float t = strtof(p + 2, &end);
+    if (end == p + 2) break;
+
+    for (auto &pl : peltiers)
+      if (pl.label == lbl) pl.currentTemp = t;
+
+    if (*end != ',') break;
+    p = end + 1;
+  }
+}
+
+// ================= LOG =================
+void logSample() {
+  if (!logEnabled) return;
+  Serial.printf("LOG:%lu", millis());
+  for (auto &p : peltiers)
+    Serial.printf(",%.2f,%d", p.currentTemp, p.pwm);
+  Serial.println();
+}
+
+// ================= LATENCY =================
+void statAdd(LatencyStat &s, long v) {
+  if (v < 0) v = 0;
+  s.n++;
+  s.sum += v;
+  s.sumSq += (float)v * v;
+  if (s.n == 1 || (uint32_t)v < s.minV) s.minV = v;
+  if ((uint32_t)v > s.maxV) s.maxV = v;
+  int b = 0;
+  while (b < HIST_BINS - 1 && v >= HIST_EDGES[b]) b++;
+  s.hist[b]++;
+}
+
+void printStat(const char *name, LatencyStat &s) {
+  float mean = s.n ? s.sum / s.n : 0;
+  float var = s.n ? s.sumSq / s.n - mean * mean : 0;
+  Serial.printf(",%s=%lu/%.1f/%lu/%lu/%.1f/", name, s.n, mean,
+                s.minV, s.maxV, sqrt(var > 0 ? var : 0));
+  for (int b = 0; b < HIST_BINS; b++)
+    Serial.printf(b ? ";%lu" : "%lu", s.hist[b]);
+}
+
+void resetStats() {
+  memset(&linkStat, 0, sizeof(linkStat));
+  memset(&actStat, 0, sizeof(actStat));
+  memset(&ivalStat, 0, sizeof(ivalStat));
+  rxCount = dropCount = dupCount = pidCount = freshCount = 0;
+  crcErrors = 0;
+  statsStart = millis();
+}
+
+// A reading arrived: binary frames carry seq and capture time, ASCII not
+void noteReading(bool binary, uint16_t seq, int count, uint32_t ts) {
+  unsigned long now = millis();
+  rxCount += count;
+  if (lastRxMs) statAdd(ivalStat, now - lastRxMs);
+  lastRxMs = now;
+  recordId++;
+  captureValid = false;
+  if (!binary) {
+    lastSeq = -1;
+    return;
+  }
+  if (lastSeq >= 0) {
+    uint16_t expect = (uint16_t)(lastSeq + count);
+    int16_t gap = (int16_t)(seq - expect);
+    if (gap > 0) dropCount += gap;
+    else if (gap < 0) dupCount += count;
+  }
+  lastSeq = seq;
+  if (clockSynced) {
+    captureEsp = ts - clockOffset;
+    captureValid = true;
+    statAdd(linkStat, (long)(now - captureEsp));
+  }
+}
+
+void noteActuation(Peltier &p, unsigned long now) {
+  int i = &p - peltiers;
+  pidCount++;
+  if (usedRecord[i] != recordId) {
+    usedRecord[i] = recordId;
+    freshCount++;
+  }
+  if (captureValid) statAdd(actStat, (long)(now - captureEsp));
+}
+
+// TIME:<esp_ms>,<pybadge_ms> answers our TIME?<esp_ms>
+void handleTimeReply(const char *data) {
+  char *end;
+  unsigned long sent = strtoul(data, &end, 10);
+  if (*end != ',') return;
+  unsigned long badge = strtoul(end + 1, NULL, 10);
+  unsigned long now = millis();
+  unsigned long rtt = now - sent;
+  // keep the offset of the fastest exchange; re-arm every 8 syncs (drift)
+  if (rtt <= syncBestRtt || ++syncAge >= 8) {
+    syncBestRtt = rtt;
+    syncAge = 0;
+    clockOffset = (long)(badge - (sent + rtt / 2));
+    clockSynced = true;
+  }
+}
+
+void serviceLatency() {
+  unsigned long now = millis();
+  if (binaryLink && now - lastSyncMs >= TIME_SYNC_INTERVAL) {
+    lastSyncMs = now;
+    SerialPyBadge.printf("TIME?%lu\n", now);
+  }
+  if (statsInterval && now - statsStart >= statsInterval) {
+    Serial.printf("STATS:ms=%lu,win=%lu,rx=%lu,drop=%lu,dup=%lu,crc=%lu,pid=%lu,fresh=%lu,rtt=%ld",
+                  now, now - statsStart, rxCount, dropCount, dupCount,
+                  crcErrors, pidCount, freshCount,
+                  clockSynced ? (long)syncBestRtt : -1L);
+    printStat("link", linkStat);
+    printStat("act", actStat);
+    printStat("ival", ivalStat);
+    Serial.println();
+    resetStats();
   }
 }
@@ -25,6 +25,8 @@ import terminalio
 from adafruit_display_text import label
 import adafruit_mlx90640
 from simpleio import map_range
+from thermal_render import ThermalRenderer
+from plate_regions import PlateRegions, read_plates
 
 print("=" * 50)
 print("UART TEMPERATURE TEST - PyBadge Side")
@@ -76,6 +78,7 @@ tile_grid = displayio.TileGrid(bitmap, pixel_shader=palette)
 image_group = displayio.Group(scale=SCALE, x=offset_x, y=offset_y)
 image_group.append(tile_grid)
 main_group.append(image_group)
+renderer = ThermalRenderer(bitmap, color_depth=COLOR_DEPTH, flip=False)
 
 # --- Color Bar ---
 bar_x = DISP_W - BAR_W
@@ -99,48 +102,22 @@ main_group.append(status_label)
 temp_display_label = label.Label(terminalio.FONT, text="", color=0xFFFFFF, x=5, y=DISP_H - 15, scale=1)
 main_group.append(temp_display_label)
 
-# --- Grid Configuration ---
-PELTIER_W, PELTIER_H = 4, 3
+# --- Plate masks ---
 frame = [0] * (WIDTH * HEIGHT)
 peltier_coords = {}
+outline = []   # (x, y) of every plate mask edge pixel
 
 # === Functions ===
-def get_block_temp(frame, gx, gy):
-    """Get average temperature of a 4x3 pixel block"""
-    temps = []
-    for py in range(PELTIER_H):
-        for px in range(PELTIER_W):
-            x = gx * PELTIER_W + px
-            y = gy * PELTIER_H + py
-            if x < WIDTH and y < HEIGHT:
-                temps.append(frame[y * WIDTH + x])
-    return sum(temps) / len(temps) if temps else 0.0
-
-def draw_box(bitmap, gx, gy, color_idx=63):
-    """Draw outline around grid cell"""
-    x0, y0 = gx * PELTIER_W, gy * PELTIER_H
-    for x in range(x0, min(x0 + PELTIER_W, WIDTH)):
-        if y0 < HEIGHT: bitmap[x, y0] = color_idx
-        if y0 + PELTIER_H - 1 < HEIGHT: bitmap[x, y0 + PELTIER_H - 1] = color_idx
-    for y in range(y0, min(y0 + PELTIER_H, HEIGHT)):
-        if x0 < WIDTH: bitmap[x0, y] = color_idx
-        if x0 + PELTIER_W - 1 < WIDTH: bitmap[x0 + PELTIER_W - 1, y] = color_idx
-
 def load_coordinates():
-    """Load coordinates from file"""
+    """Load plate masks (PLATES 2, or legacy label:gx:gy grid cells)"""
     print("\nLoading coordinates from /coordinates.txt...")
     try:
-        with open("/coordinates.txt", "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#"):
-                    parts = line.split(":")
-                    if len(parts) == 3:
-                        label = parts[0]
-                        gx = int(parts[1])
-                        gy = int(parts[2])
-                        peltier_coords[label] = (gx, gy)
-                        print(f"  {label}: Grid ({gx}, {gy})")
+        peltier_coords.update(read_plates("/coordinates.txt", legacy_grid=True))
+        for label in sorted(peltier_coords):
+            mask = peltier_coords[label]
+            x, y = mask.pixels()[0]
+            print(f"  {label}: {len(mask.indices)} px from ({x}, {y})")
+            outline.extend(mask.outline())
         
         if len(peltier_coords) == 4:
             print("✓ All 4 coordinates loaded")
@@ -164,6 +141,9 @@ if not load_coordinates():
     while True:
         time.sleep(1)
 
+# The test sends the (weighted) mean of each plate mask
+regions = PlateRegions(peltier_coords, reducer="mean", compute=("mean",))
+
 # === Send Initial Handshake ===
 print("\nSending handshake to ESP32...")
 time.sleep(1)
@@ -193,39 +173,24 @@ while True:
         time.sleep(0.1)
         continue
     
-    t_min, t_max = min(frame), max(frame)
-    
     # Update thermal image display
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            val = frame[y * WIDTH + x]
-            idx = int(map_range(val, t_min, t_max, 0, COLOR_DEPTH - 1))
-            bitmap[x, y] = idx
+    t_min, t_max = renderer.render_autoscale(frame)
     
     max_label.text = f"{t_max:.1f}C"
     min_label.text = f"{t_min:.1f}C"
     
     # Draw boxes around Peltier zones
-    for label in ['A', 'B', 'C', 'D']:
-        if label in peltier_coords:
-            gx, gy = peltier_coords[label]
-            draw_box(bitmap, gx, gy, 50)  # Yellow boxes
-    
-    # Get current temperatures
-    temps = {}
-    for label in ['A', 'B', 'C', 'D']:
-        if label in peltier_coords:
-            gx, gy = peltier_coords[label]
-            temps[label] = get_block_temp(frame, gx, gy)
+    for xy in outline:
+        bitmap[xy] = 50  # Yellow outlines
     
     # Send temperatures every 0.5 seconds (2 Hz)
     current_time = time.monotonic()
     if current_time - last_send_time >= 0.5:
         # Format: TEMP:A:35.2,B:36.1,C:35.8,D:36.3\n
+        regions.update(frame)
         temp_str = "TEMP:"
-        for label in ['A', 'B', 'C', 'D']:
-            if label in temps:
-                temp_str += f"{label}:{temps[label]:.1f},"
+        for label, t in zip(regions.labels, regions.values()):
+            temp_str += f"{label}:{t:.1f},"
         temp_str = temp_str.rstrip(',') + "\n"
         
         # Send via UART
@@ -0,0 +1,193 @@
+"""
+Automatic plate calibration: finds all four Peltier plates in the thermal
+image and returns their coordinates.txt positions.
+
+The plates are driven open-loop through the ESP32 (DRIVE:<label>:<pwm>), the
+sensor frames before and after are averaged, and the difference image is
+thresholded and split into connected components. Every step is an array
+operation (ulab on the PyBadge, NumPy on a host), so finding the plates
+takes a fraction of a second once the frames are in.
+
+Two ways to tell the plates apart:
+
+    sequential()     heat one plate at a time; the component that appears
+                     is that plate (robust, one settle time per plate)
+    simultaneous()   drive all four at once with distinct PWMs (strong and
+                     weak heating, weak and strong cooling) and match the
+                     components by the sign and size of their change
+
+Both return positions in sensor pixels (not flipped for the display), the
+top-left corner of the 4x3 box around each plate (legacy label:x:y
+coordinates), and leave the pixels each plate actually covered in
+self.masks as plate_regions.PlateMask (PLATES 2 coordinates.txt).
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+try:
+    from ulab import numpy as np
+    FLOAT = np.float
+except ImportError:
+    import numpy as np
+    FLOAT = np.float32
+
+from plate_regions import (WIDTH, HEIGHT, PELTIER_W, PELTIER_H, PLATE_LABELS,
+                           PlateMask)
+
+# the ESP32 clamps DRIVE: to +-PWM_MAX (ESP32.py), so larger values would
+# be cut to it
+PWM_MAX = 160
+# signed PWM per plate for simultaneous(): + heats, - cools
+SIMULTANEOUS_PWM = {"A": PWM_MAX, "B": 80, "C": -80, "D": -PWM_MAX}
+
+
+def label_components(mask):
+    """4-connected components of a 2D 0/1 float mask.
+
+    Every set pixel starts with a unique id and takes the largest id of its
+    set neighbours until nothing changes; returns the id image (0 = unset).
+    """
+    h, w = mask.shape
+    lab = np.arange(1, h * w + 1, dtype=FLOAT).reshape((h, w)) * mask
+    total = np.sum(lab)
+    while True:
+        # masked after every shift so ids never cross an unset pixel
+        lab[:, 1:] = np.maximum(lab[:, 1:], lab[:, :-1]) * mask[:, 1:]
+        lab[:, :-1] = np.maximum(lab[:, :-1], lab[:, 1:]) * mask[:, :-1]
+        lab[1:, :] = np.maximum(lab[1:, :], lab[:-1, :]) * mask[1:, :]
+        lab[:-1, :] = np.maximum(lab[:-1, :], lab[1:, :]) * mask[:-1, :]
+        new_total = np.sum(lab)
+        if new_total == total:       # ids only grow, so equal sum = stable
+            return lab
+        total = new_total
+
+
+def plate_origin(cx, cy):
+    """Top-left pixel of the 4x3 plate box centred on (cx, cy), for the
+    legacy label:x:y format"""
+    x0 = int(cx - (PELTIER_W - 1) / 2 + 0.5)
+    y0 = int(cy - (PELTIER_H - 1) / 2 + 0.5)
+    return (min(max(x0, 0), WIDTH - PELTIER_W),
+            min(max(y0, 0), HEIGHT - PELTIER_H))
+
+
+class AutoCalibrator:
+    """Drives the plates and locates them in averaged difference images.
+
+    grab(buf) fills buf with one frame (768 floats, e.g. mlx.getFrame),
+    drive(label, pwm) sends a signed open-loop PWM to one plate (0 = off)
+    and wait(seconds) lets the plates settle. progress(text), if given, is
+    called with a short status message before each step.
+    """
+
+    def __init__(self, grab, drive, wait, n_frames=8, settle_s=8.0, pwm=PWM_MAX,
+                 min_delta=1.0, frac=0.3, min_size=4, progress=None):
+        self.grab = grab
+        self.drive = drive
+        self.wait = wait
+        self.n_frames = n_frames
+        self.settle_s = settle_s
+        self.pwm = pwm
+        self.min_delta = min_delta
+        self.frac = frac
+        self.min_size = min_size
+        self.progress = progress or (lambda text: None)
+        self.masks = {}
+        self.buf = [0.0] * (WIDTH * HEIGHT)
+        self.xs = np.array([x for y in range(HEIGHT) for x in range(WIDTH)],
+                           dtype=FLOAT).reshape((HEIGHT, WIDTH))
+        self.ys = np.array([y for y in range(HEIGHT) for x in range(WIDTH)],
+                           dtype=FLOAT).reshape((HEIGHT, WIDTH))
+
+    # ---------- frames ----------
+    def average(self):
+        """Mean of n_frames frames as a HEIGHT x WIDTH array"""
+        acc = np.zeros(WIDTH * HEIGHT, dtype=FLOAT)
+        for _ in range(self.n_frames):
+            self.grab(self.buf)
+            acc += np.array(self.buf, dtype=FLOAT)
+        return (acc / self.n_frames).reshape((HEIGHT, WIDTH))
+
+    # ---------- image analysis ----------
+    def components(self, diff, sign=1):
+        """Components of the difference image that changed in direction sign.
+
+        The threshold is min_delta or frac of the strongest change, whichever
+        is larger. Returns [(mean_delta, size, cx, cy, indices)], largest
+        change first; indices are the component's flat frame indices.
+        """
+        d = diff * sign
+        peak = np.max(d)
+        level = max(self.min_delta, self.frac * peak)
+        if peak < level:
+            return []
+        mask = np.array(d > level, dtype=FLOAT)
+        lab = label_components(mask)
+        found = []
+        while True:
+            top = np.max(lab)
+            if top == 0:
+                break
+            comp = np.array(lab == top, dtype=FLOAT)
+            lab = lab * (1.0 - comp)
+            size = np.sum(comp)
+            if size < self.min_size:
+                continue
+            weight = comp * d
+            total = np.sum(weight)
+            found.append((sign * total / size, int(size),
+                          np.sum(weight * self.xs) / total,
+                          np.sum(weight * self.ys) / total,
+                          [i for i, v in enumerate(comp.flatten()) if v]))
+        found.sort(key=lambda c: -abs(c[0]))
+        return found
+
+    # ---------- procedures ----------
+    def sequential(self, labels=PLATE_LABELS):
+        """Heat one plate at a time; {label: (x, y)}"""
+        coords = {}
+        self.masks = {}
+        self.progress("BASELINE")
+        base = self.average()
+        for lbl in labels:
+            self.progress("HEAT " + lbl)
+            self.drive(lbl, self.pwm)
+            self.wait(self.settle_s)
+            hot = self.average()
+            self.drive(lbl, 0)
+            found = self.components(hot - base)
+            if not found:
+                raise RuntimeError("plate " + lbl + " not found")
+            coords[lbl] = plate_origin(found[0][2], found[0][3])
+            self.masks[lbl] = PlateMask(found[0][4])
+            # the next plate is compared with this plate already on its way
+            # back down, which only shows up as cooling
+            base = self.average()
+        return coords
+
+    def simultaneous(self, pwms=SIMULTANEOUS_PWM):
+        """Drive all plates at once with distinct PWMs; {label: (x, y)}"""
+        self.progress("BASELINE")
+        base = self.average()
+        self.progress("DRIVE ALL")
+        for lbl in pwms:
+            self.drive(lbl, pwms[lbl])
+        self.wait(self.settle_s)
+        diff = self.average() - base
+        for lbl in pwms:
+            self.drive(lbl, 0)
+
+        coords = {}
+        self.masks = {}
+        for sign in (1, -1):
+            # labels driven this way, strongest drive first
+            order = sorted((lbl for lbl in pwms if pwms[lbl] * sign > 0),
+                           key=lambda lbl: -abs(pwms[lbl]))
+            found = self.components(diff, sign)[:len(order)]
+            if len(found) < len(order):
+                raise RuntimeError("found %d of %d %s plates" % (
+                    len(found), len(order), "heated" if sign > 0 else "cooled"))
+            for lbl, comp in zip(order, found):
+                coords[lbl] = plate_origin(comp[2], comp[3])
+                self.masks[lbl] = PlateMask(comp[4])
+        return coords
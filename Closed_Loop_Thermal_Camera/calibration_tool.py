@@ -6,6 +6,9 @@ import terminalio
 from adafruit_display_text import label
 import adafruit_mlx90640
 from simpleio import map_range
+from thermal_render import ThermalRenderer
+from stage_profiler import StageProfiler
+from plate_regions import format_plates, write_plates
 
 # ==============================
 # MLX90640 Setup
@@ -46,6 +49,7 @@ grid = displayio.TileGrid(bitmap, pixel_shader=palette)
 img = displayio.Group(scale=SCALE, y=offset_y)
 img.append(grid)
 root.append(img)
+renderer = ThermalRenderer(bitmap, color_depth=COLOR_DEPTH, flip=False)
 
 # ==============================
 # Labels
@@ -77,6 +81,23 @@ PELTIER_H = 3
 
 frame = [0] * (WIDTH * HEIGHT)
 
+# Stage timing: PROFILE: lines on the USB console every PROFILE_REPORT s
+PROFILE = False
+PROFILE_REPORT = 10.0
+ST_GETFRAME, ST_HOTSPOT, ST_RENDER, ST_OVERLAY, ST_REFRESH = range(5)
+profiler = StageProfiler(("getframe", "hotspot", "render", "overlay",
+                          "refresh"), enabled=PROFILE)
+next_report = time.monotonic() + PROFILE_REPORT
+
+# Auto-calibration (auto_calibrate.py, needs ulab): None = hotspot view only,
+# "sequential" or "simultaneous" = drive the plates through the ESP32, find
+# all four and write their pixel masks to /coordinates.txt (the drive must be
+# writable from code, see readme) before the hotspot view starts
+AUTO_CALIBRATE = None
+AUTO_FRAMES = 4        # frames averaged per image
+AUTO_SETTLE = 8.0      # seconds of drive before the "after" image
+outline = []           # (x, y) of the mask edges found by auto-calibration
+
 # ==============================
 # Drawing helpers
 # ==============================
@@ -89,8 +110,9 @@ def draw_cross(bitmap, px, py, color=63):
             bitmap[px, py + dy] = color
 
 def draw_block(bitmap, gx, gy, color=40):
-    x0 = gx * PELTIER_W
-    y0 = gy * PELTIER_H
+    draw_box(bitmap, gx * PELTIER_W, gy * PELTIER_H, color)
+
+def draw_box(bitmap, x0, y0, color=40):
     for x in range(x0, min(x0 + PELTIER_W, WIDTH)):
         bitmap[x, y0] = color
         bitmap[x, min(y0 + PELTIER_H - 1, HEIGHT - 1)] = color
@@ -98,16 +120,72 @@ def draw_block(bitmap, gx, gy, color=40):
         bitmap[x0, y] = color
         bitmap[min(x0 + PELTIER_W - 1, WIDTH - 1), y] = color
 
+# ==============================
+# Auto-calibration
+# ==============================
+def grab(buf):
+    while True:
+        try:
+            mlx.getFrame(buf)
+            return
+        except (ValueError, RuntimeError):
+            pass
+
+def show_status(text):
+    hot_label.text = text
+    hot_label.color = 0xFFFF00
+    display.refresh()
+
+def auto_calibrate(mode):
+    from auto_calibrate import AutoCalibrator
+    uart = busio.UART(board.TX, board.RX, baudrate=115200, timeout=0.01)
+
+    def drive(lbl, pwm):
+        uart.write(("DRIVE:%s:%d\n" % (lbl, pwm)).encode())
+
+    cal = AutoCalibrator(grab, drive, time.sleep, n_frames=AUTO_FRAMES,
+                         settle_s=AUTO_SETTLE, progress=show_status)
+    try:
+        if mode == "simultaneous":
+            cal.simultaneous()
+        else:
+            cal.sequential()
+    except RuntimeError as e:
+        uart.write(b"STOP\n")
+        print("AUTO CALIBRATION FAILED:", e)
+        show_status("AUTO FAILED")
+        time.sleep(2)
+        return []
+    uart.write(b"STOP\n")
+    # the pixels each plate covered, not the 4x3 box around them
+    masks = cal.masks
+    note = "auto-calibrated (" + mode + ")"
+    print(format_plates(masks, note))
+    try:
+        write_plates(masks, note=note)
+        show_status("SAVED coordinates.txt")
+    except OSError:
+        # read-only from code: copy the lines above from the console
+        show_status("READ-ONLY: SEE CONSOLE")
+    time.sleep(2)
+    return [xy for lbl in masks for xy in masks[lbl].outline()]
+
+if AUTO_CALIBRATE:
+    outline = auto_calibrate(AUTO_CALIBRATE)
+
 # ==============================
 # Main Loop
 # ==============================
 while True:
+    profiler.start()
     try:
         mlx.getFrame(frame)
     except:
         continue
+    profiler.stop(ST_GETFRAME)
 
     # Find hottest pixel
+    profiler.start()
     max_temp = -100.0
     max_index = 0
     for i, t in enumerate(frame):
@@ -120,30 +198,40 @@ while True:
 
     gx = px // PELTIER_W
     gy = py // PELTIER_H
+    profiler.stop(ST_HOTSPOT)
 
     # Render thermal image (visual only)
-    t_min = min(frame)
-    t_max = max(frame)
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            idx = int(map_range(frame[y * WIDTH + x], t_min, t_max, 0, COLOR_DEPTH - 1))
-            bitmap[x, y] = idx
+    profiler.start()
+    renderer.render_autoscale(frame)
+    profiler.stop(ST_RENDER)
 
+    profiler.start()
     max_label.text = f"{max_temp:.1f}C"
 
+    for x, y in outline:
+        bitmap[x, y] = 45
+
     if max_temp >= THRESHOLD:
         draw_cross(bitmap, px, py, 63)
         draw_block(bitmap, gx, gy, 45)
 
         hot_label.text = (
             f"HOT px({px},{py})  "
-            f"grid({gx},{gy})  "
+            f"box({gx * PELTIER_W},{gy * PELTIER_H})  "
             f"{max_temp:.1f}C"
         )
         hot_label.color = 0xFF0000
     else:
         hot_label.text = "NO HOTSPOT ≥35C"
         hot_label.color = 0x00FF00
+    profiler.stop(ST_OVERLAY)
 
+    profiler.start()
     display.refresh()
+    profiler.stop(ST_REFRESH)
+
+    if profiler.enabled and time.monotonic() >= next_report:
+        next_report = time.monotonic() + PROFILE_REPORT
+        for line in profiler.report():
+            print(line)
     time.sleep(0.2)
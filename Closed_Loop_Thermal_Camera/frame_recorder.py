@@ -0,0 +1,123 @@
+"""
+Thermal frame recorder: keeps whole MLX90640 frames for later diagnosis.
+
+Every frame is packed as one fixed-size record (little endian):
+
+    offset  size  field
+    0       2     MAGIC b"TF"
+    2       1     VERSION (1)
+    3       1     FLAGS: bit 0 sub-page of the update, bit 7 CRC present
+    4       4     uint32 frame counter (frame_seq)
+    8       4     uint32 capture time, monotonic ms
+    12      1536  768 x int16 centi-degrees, row-major 32 x 24
+    1548    4     CRC32 (binascii) of bytes 2..1547, 0 without binascii
+
+add() packs the frame into the next slot of a preallocated ring (the only
+per-frame work in the caller's path) and returns at once; a full ring drops
+the new frame and counts it. service() writes pending records to the sink
+from its own task, at most max_records per call, and copes with short
+writes, so a slow or absent reader never stalls the control loop.
+
+Sinks: usb_cdc.data (needs usb_cdc.enable(console=True, data=True) in
+boot.py; the console keeps working) or a file on flash / SD. The host side
+is host/frame_receiver.py.
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+import struct
+
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+try:
+    from ulab import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"TF"
+VERSION = 1
+WIDTH, HEIGHT = 32, 24
+HEADER_SIZE = 12
+PIXELS_SIZE = 2 * WIDTH * HEIGHT
+RECORD_SIZE = HEADER_SIZE + PIXELS_SIZE + 4
+FLAG_CRC = 0x80
+
+
+def pack_pixels(frame, buf, offset):
+    """frame (C) -> int16 centi-degrees at buf[offset:offset + 1536]"""
+    if np is not None:
+        try:
+            v = np.frombuffer(frame, dtype=np.float)
+        except (TypeError, ValueError):
+            v = np.array(frame, dtype=np.float)
+        q = np.array(np.clip(np.around(v * 100), -32768, 32767),
+                     dtype=np.int16)
+        buf[offset:offset + PIXELS_SIZE] = q.tobytes()
+        return
+    pack = struct.pack_into
+    for i in range(WIDTH * HEIGHT):
+        t = frame[i]
+        v = int(t * 100 + (0.5 if t >= 0 else -0.5))
+        if v > 32767:
+            v = 32767
+        elif v < -32768:
+            v = -32768
+        pack("<h", buf, offset + 2 * i, v)
+
+
+class FrameRecorder:
+    def __init__(self, write, slots=8):
+        """write(buf) sends bytes to the sink and returns how many it took"""
+        self.write = write
+        self.slots = [bytearray(RECORD_SIZE) for _ in range(slots)]
+        self.views = [memoryview(s) for s in self.slots]
+        self.head = 0           # next slot to fill
+        self.tail = 0           # next slot to send
+        self.pending = 0
+        self.sent = 0           # bytes of the tail slot already written
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+
+    def add(self, frame, counter, ts_ms, subpage=0):
+        """Queue one frame; False (and counted) when the ring is full"""
+        if self.pending == len(self.slots):
+            self.dropped += 1
+            return False
+        buf = self.slots[self.head]
+        flags = (subpage & 1) | (FLAG_CRC if crc32 else 0)
+        struct.pack_into("<2sBBII", buf, 0, MAGIC, VERSION, flags,
+                         counter & 0xFFFFFFFF, ts_ms & 0xFFFFFFFF)
+        pack_pixels(frame, buf, HEADER_SIZE)
+        crc = crc32(self.views[self.head][2:RECORD_SIZE - 4]) if crc32 else 0
+        struct.pack_into("<I", buf, RECORD_SIZE - 4, crc & 0xFFFFFFFF)
+        self.head = (self.head + 1) % len(self.slots)
+        self.pending += 1
+        self.recorded += 1
+        return True
+
+    def service(self, max_records=1):
+        """Write up to max_records pending records; returns records finished"""
+        done = 0
+        while self.pending and done < max_records:
+            n = self.write(self.views[self.tail][self.sent:])
+            if n is None:
+                n = RECORD_SIZE - self.sent
+            if not n:
+                break                       # sink busy, try again later
+            self.sent += n
+            if self.sent < RECORD_SIZE:
+                break
+            self.sent = 0
+            self.tail = (self.tail + 1) % len(self.slots)
+            self.pending -= 1
+            self.written += 1
+            done += 1
+        return done
+
+    def status(self):
+        return "REC:rec=%d,out=%d,drop=%d,pend=%d" % (
+            self.recorded, self.written, self.dropped, self.pending)
@@ -0,0 +1,168 @@
+"""
+Thermal model of the arena for host-side simulation.
+
+Each Peltier plate is a lumped thermal mass sitting in the bulk heating
+array (held at 36 C):
+
+    C dT/dt = G (T_bulk - T) + P(t - dead_time)
+
+where P is the Peltier heat flow set by the H-bridge: +heat_power * duty when
+heating, -cool_power * duty when cooling, 0 when stopped (duty = pwm / 255).
+The update uses the exact discretisation of the first-order system, so it is
+stable for any step size.
+
+ArenaPlant.from_model() builds the plates from a host/sysid.py model file
+instead of the defaults below.
+
+ThermalScene renders the plates into a 32x24 MLX90640-like frame at their
+coordinates.txt positions, with per-pixel sensor noise.
+"""
+
+import json
+import math
+import random
+
+WIDTH, HEIGHT = 32, 24
+PELTIER_W, PELTIER_H = 4, 3
+T_BULK = 36.0
+PWM_FULL = 255
+PLATE_LABELS = ("A", "B", "C", "D")
+DEFAULT_COORDS = {"A": (4, 3), "B": (20, 3), "C": (4, 15), "D": (20, 15)}
+
+
+class PeltierPlate:
+    """One plate: thermal mass, leak to the bulk array, Peltier drive"""
+
+    def __init__(self, heat_capacity=20.0, conductance=0.5, heat_power=20.0,
+                 cool_power=28.0, dead_time=1.0, t_bulk=T_BULK, temp=None):
+        self.heat_capacity = heat_capacity    # J/K
+        self.conductance = conductance        # W/K to the bulk array
+        self.heat_power = heat_power          # W at full duty, heating
+        self.cool_power = cool_power          # W at full duty, cooling
+        self.dead_time = dead_time            # s, drive -> surface
+        self.t_bulk = t_bulk
+        self.temp = t_bulk if temp is None else temp
+        self.pwm = 0                          # signed: + heat, - cool
+        self._delay = []                      # (apply_at, power)
+        self._power = 0.0
+
+    @classmethod
+    def from_first_order(cls, tau, heat_gain, cool_gain, dead_time=0.0,
+                         t_bulk=T_BULK, conductance=1.0):
+        """Build from time constant (s) and steady-state gains (C at full duty)"""
+        return cls(heat_capacity=tau * conductance, conductance=conductance,
+                   heat_power=heat_gain * conductance,
+                   cool_power=cool_gain * conductance,
+                   dead_time=dead_time, t_bulk=t_bulk)
+
+    @property
+    def tau(self):
+        return self.heat_capacity / self.conductance
+
+    def power(self, pwm):
+        duty = min(abs(pwm), PWM_FULL) / PWM_FULL
+        if pwm > 0:
+            return self.heat_power * duty
+        if pwm < 0:
+            return -self.cool_power * duty
+        return 0.0
+
+    def set_drive(self, pwm, now):
+        """Signed PWM from the H-bridge (+ heating, - cooling, 0 off)"""
+        if pwm != self.pwm:
+            self.pwm = pwm
+            self._delay.append((now + self.dead_time, self.power(pwm)))
+
+    def step(self, dt, now):
+        """Advance by dt seconds ending at time now"""
+        delay = self._delay
+        while delay and delay[0][0] <= now:
+            self._power = delay.pop(0)[1]
+        t_ss = self.t_bulk + self._power / self.conductance
+        self.temp += (t_ss - self.temp) * (1.0 - math.exp(-dt / self.tau))
+
+
+class ArenaPlant:
+    """The four plates, addressed by label"""
+
+    def __init__(self, plates=None, **plate_kwargs):
+        if plates is None:
+            plates = {lbl: PeltierPlate(**plate_kwargs) for lbl in PLATE_LABELS}
+        self.plates = plates
+
+    @classmethod
+    def from_model(cls, model):
+        """Plates from a sysid model (dict or JSON path).
+
+        The plate model has one time constant; the heating and cooling fits
+        share it (sample-weighted mean) and keep their own gains.
+        """
+        if isinstance(model, str):
+            model = load_model(model)
+        plates = {}
+        for lbl in PLATE_LABELS:
+            fits = model["plates"][lbl]
+            heat, cool = fits.get("heat"), fits.get("cool")
+            both = [f for f in (heat, cool) if f]
+            if not both:
+                raise ValueError("no fit for plate " + lbl)
+            n = sum(f["samples"] for f in both)
+
+            def mean(key):
+                return sum(f[key] * f["samples"] for f in both) / n
+            plates[lbl] = PeltierPlate.from_first_order(
+                tau=mean("tau"),
+                heat_gain=heat["gain"] if heat else 0.0,
+                cool_gain=cool["gain"] if cool else 0.0,
+                dead_time=mean("dead_time"), t_bulk=mean("t_bulk"))
+        return cls(plates)
+
+    def __getitem__(self, lbl):
+        return self.plates[lbl]
+
+    def temps(self):
+        return [self.plates[lbl].temp for lbl in PLATE_LABELS]
+
+    def step(self, dt, now):
+        for plate in self.plates.values():
+            plate.step(dt, now)
+
+
+def load_model(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class ThermalScene:
+    """Renders the arena as an MLX90640 frame (row-major, 768 floats)"""
+
+    def __init__(self, plant, coords=None, noise=0.1, bulk_ripple=0.15,
+                 seed=0):
+        self.plant = plant
+        self.coords = dict(coords or DEFAULT_COORDS)
+        self.noise = noise
+        self.rng = random.Random(seed)
+        # fixed spatial non-uniformity of the bulk array
+        self.background = [T_BULK + self.rng.uniform(-bulk_ripple, bulk_ripple)
+                           for _ in range(WIDTH * HEIGHT)]
+        self.plate_pixels = {}
+        for lbl, (x0, y0) in self.coords.items():
+            self.plate_pixels[lbl] = tuple(
+                y * WIDTH + x
+                for y in range(y0, min(y0 + PELTIER_H, HEIGHT))
+                for x in range(x0, min(x0 + PELTIER_W, WIDTH)))
+
+    def coordinates_txt(self):
+        return "".join(f"{lbl}:{x}:{y}\n"
+                       for lbl, (x, y) in sorted(self.coords.items()))
+
+    def render(self, buf):
+        gauss = self.rng.gauss
+        noise = self.noise
+        bg = self.background
+        for i in range(WIDTH * HEIGHT):
+            buf[i] = bg[i] + gauss(0.0, noise)
+        for lbl, pixels in self.plate_pixels.items():
+            t = self.plant[lbl].temp
+            for i in pixels:
+                buf[i] = t + gauss(0.0, noise)
@@ -0,0 +1,110 @@
+"""
+Acquisition throughput on the host: blocking getFrame() against
+mlx_acquire.SubpageReader, using the fake MLX90640 in host/stubs.
+
+The fake sensor replays recorded (here: synthetic) frames with per-pixel
+noise that grows with sqrt(sub-page rate), so the table shows both sides of
+the trade: plate update rate and the noise of the plate values.
+
+Usage:
+    python bench_acquire.py [--seconds 3] [--reducer mean]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "stubs"))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import stub_hw                                     # noqa: E402  (stub)
+import adafruit_mlx90640                           # noqa: E402  (stub)
+import busio                                       # noqa: E402  (stub)
+from mlx_acquire import SubpageReader, SUBPAGE_RATE  # noqa: E402
+from plate_regions import PlateRegions             # noqa: E402
+
+RR = adafruit_mlx90640.RefreshRate
+COORDS = {"A": (4, 3), "B": (20, 3), "C": (4, 15), "D": (20, 15)}
+NETD_1HZ = 0.1   # pixel noise (C rms) at 1 Hz sub-page rate
+
+
+def noisy_frames(rate_hz, n=64, seed=3):
+    rng = random.Random(seed)
+    sigma = NETD_1HZ * rate_hz ** 0.5
+    base = [0.0] * 768
+    stub_hw.synthetic_frame(base)
+    return [[t + rng.gauss(0, sigma) for t in base] for _ in range(n)]
+
+
+def std(values):
+    m = sum(values) / len(values)
+    return (sum((v - m) ** 2 for v in values) / len(values)) ** 0.5
+
+
+def run_blocking(mlx, regions, seconds):
+    frame = [0.0] * 768
+    values, busy = [], 0.0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        t0 = time.monotonic()
+        mlx.getFrame(frame)
+        busy += time.monotonic() - t0
+        regions.update(frame)
+        values.append(regions.values()[0])
+    return values, busy
+
+
+def run_reader(mlx, regions, seconds, mode, poll_s):
+    frame = [0.0] * 768
+    reader = SubpageReader(mlx, frame)
+    values, busy = [], 0.0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        t0 = time.monotonic()
+        page = reader.poll()
+        busy += time.monotonic() - t0
+        if page >= 0 and reader.subpages >= 2:
+            if mode == "subpage" or reader.complete:
+                regions.update(frame)
+                values.append(regions.values()[0])
+        time.sleep(poll_s)
+    return values, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--reducer", default="mean")
+    parser.add_argument("--poll-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    i2c = busio.I2C()
+    regions = PlateRegions(COORDS, reducer=args.reducer)
+    print(f"{'acquisition':<26}{'updates/s':>10}{'blocked %':>10}"
+          f"{'plate std C':>12}")
+    configs = [("getFrame", RR.REFRESH_2_HZ, None)]
+    for rate in (RR.REFRESH_4_HZ, RR.REFRESH_8_HZ, RR.REFRESH_16_HZ):
+        configs.append(("frame", rate, "frame"))
+        configs.append(("subpage", rate, "subpage"))
+
+    for name, rate, mode in configs:
+        stub_hw.frame_source = stub_hw.ReplaySource(
+            noisy_frames(SUBPAGE_RATE[rate]))
+        mlx = adafruit_mlx90640.MLX90640(i2c)
+        mlx.refresh_rate = rate
+        if mode is None:
+            values, busy = run_blocking(mlx, regions, args.seconds)
+        else:
+            values, busy = run_reader(mlx, regions, args.seconds, mode,
+                                      args.poll_ms / 1000.0)
+        label = f"{name} @ {SUBPAGE_RATE[rate]:g} Hz sub-pages"
+        print(f"{label:<26}{len(values) / args.seconds:>10.2f}"
+              f"{100 * busy / args.seconds:>10.1f}"
+              f"{std(values) if len(values) > 1 else 0.0:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Host test of auto_calibrate.py on synthetic frames.
+
+Every trial places the four plates at random (non-touching) positions,
+renders noisy MLX90640 frames from the plate model (arena_model.py) and runs
+the auto-calibration against it on a virtual clock: drive() sets the plate
+PWM (clamped to +-PWM_MAX, as the ESP32 does), wait() and every grabbed
+frame advance the model. Reports how often all four plates were found at
+the right pixel, the position error, the overlap of the detected pixel
+masks with the true plates (intersection over union), the simulated
+procedure time and the wall time of the image analysis.
+
+    python bench_calibrate.py --trials 50 --noise 0.3
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEVICE_DIR = os.path.dirname(HERE)
+for path in (HERE, DEVICE_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from arena_model import ArenaPlant, ThermalScene              # noqa: E402
+from auto_calibrate import AutoCalibrator, PWM_MAX            # noqa: E402
+from plate_regions import (WIDTH, HEIGHT, PELTIER_W, PELTIER_H,  # noqa: E402
+                           PLATE_LABELS, PlateMask)
+
+FRAME_S = 0.5      # getFrame() at the 4 Hz sub-page rate
+
+
+def random_coords(rng, gap=1):
+    """Four plate boxes that do not touch (at least gap pixels apart)"""
+    while True:
+        coords = {}
+        for lbl in PLATE_LABELS:
+            for _ in range(100):
+                x = rng.randrange(0, WIDTH - PELTIER_W + 1)
+                y = rng.randrange(0, HEIGHT - PELTIER_H + 1)
+                if all(x + PELTIER_W + gap <= ox or ox + PELTIER_W + gap <= x
+                       or y + PELTIER_H + gap <= oy or oy + PELTIER_H + gap <= y
+                       for ox, oy in coords.values()):
+                    coords[lbl] = (x, y)
+                    break
+        if len(coords) == len(PLATE_LABELS):
+            return coords
+
+
+class VirtualRig:
+    """Plant + sensor on a virtual clock, with the AutoCalibrator callbacks"""
+
+    def __init__(self, coords, noise, seed):
+        self.plant = ArenaPlant()
+        self.scene = ThermalScene(self.plant, coords, noise=noise, seed=seed)
+        self.now = 0.0
+
+    def advance(self, seconds, dt=0.1):
+        end = self.now + seconds
+        while self.now < end - 1e-9:
+            step = min(dt, end - self.now)
+            self.now += step
+            self.plant.step(step, self.now)
+
+    def grab(self, buf):
+        self.advance(FRAME_S)
+        self.scene.render(buf)
+
+    def drive(self, lbl, pwm):
+        # clamped as the ESP32 does, so the plates see the real drive levels
+        pwm = max(-PWM_MAX, min(PWM_MAX, pwm))
+        self.plant[lbl].set_drive(pwm, self.now)
+
+
+def run_trial(mode, rng, args):
+    truth = random_coords(rng)
+    rig = VirtualRig(truth, args.noise, rng.randrange(1 << 30))
+    rig.advance(5.0)
+    cal = AutoCalibrator(rig.grab, rig.drive, rig.advance,
+                         n_frames=args.frames, settle_s=args.settle)
+    spent = [0.0]
+    components = cal.components
+
+    def timed(diff, sign=1):
+        t0 = time.perf_counter()
+        out = components(diff, sign)
+        spent[0] += time.perf_counter() - t0
+        return out
+    cal.components = timed
+
+    try:
+        found = getattr(cal, mode)()
+    except RuntimeError as e:
+        return None, None, truth, rig.now, spent[0], str(e)
+    return found, cal.masks, truth, rig.now, spent[0], None
+
+
+def mask_iou(mask, x, y):
+    box = set(PlateMask.box(x, y).indices)
+    got = set(mask.indices)
+    return len(box & got) / len(box | got)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--trials", type=int, default=30)
+    parser.add_argument("--noise", type=float, default=0.2,
+                        help="pixel noise, C rms")
+    parser.add_argument("--frames", type=int, default=4,
+                        help="frames averaged per image")
+    parser.add_argument("--settle", type=float, default=8.0,
+                        help="seconds of drive before the after image")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mode", choices=("sequential", "simultaneous",
+                                           "both"), default="both")
+    args = parser.parse_args()
+
+    modes = (("sequential", "simultaneous") if args.mode == "both"
+             else (args.mode,))
+    print(f"{'mode':<14}{'trials':>7}{'exact':>7}{'failed':>8}{'err px':>8}"
+          f"{'mask IoU':>9}{'sim s':>8}{'analysis ms':>13}")
+    for mode in modes:
+        rng = random.Random(args.seed)
+        exact = failed = 0
+        errors, iou, sim_s, wall = [], [], [], []
+        messages = {}
+        for _ in range(args.trials):
+            found, masks, truth, now, spent, msg = run_trial(mode, rng, args)
+            sim_s.append(now)
+            wall.append(spent)
+            if found is None:
+                failed += 1
+                messages[msg] = messages.get(msg, 0) + 1
+                continue
+            iou += [mask_iou(masks[lbl], *truth[lbl]) for lbl in truth]
+            err = [abs(found[lbl][0] - truth[lbl][0])
+                   + abs(found[lbl][1] - truth[lbl][1]) for lbl in truth]
+            errors.append(sum(err) / len(err))
+            exact += not any(err)
+        mean_err = sum(errors) / len(errors) if errors else float("nan")
+        mean_iou = sum(iou) / len(iou) if iou else float("nan")
+        print(f"{mode:<14}{args.trials:>7}{exact:>7}{failed:>8}"
+              f"{mean_err:>8.2f}{mean_iou:>9.2f}{sum(sim_s) / len(sim_s):>8.1f}"
+              f"{1e3 * sum(wall) / len(wall):>13.2f}")
+        for msg, n in messages.items():
+            print(f"    {n} x {msg}")
+
+
+if __name__ == "__main__":
+    main()
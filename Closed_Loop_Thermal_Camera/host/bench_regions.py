@@ -0,0 +1,142 @@
+"""
+CPython benchmark for plate_regions.PlateRegions.
+
+One "send" is the region work pid_control_pybadge.py did per transmission:
+four hottest_pixel_in_region() calls for the UART message plus four more for
+the info label. The engine does one update() and eight cached reads. The
+mean rows compare the single pass over the flat index/weight tables with
+the weight-matrix product used when ulab is present (NumPy here).
+
+The request behind the engine set a target of at least TARGET x the legacy
+send. It is not met on CPython: measured on the development machine
+(varying from run to run), max only is 3-3.5x, the table mean 2-3.5x, and
+with all four reducers (an insertion sort per plate) or the NumPy dot
+product the engine is 0.8-1.1x, no faster than the legacy loops. A vectorised pass (take on the index table, one
+reduction per plate) measured 2.4x for max and 0.6x for all reducers here,
+NumPy's per-call overhead outweighing the 12 pixels per plate. The last
+line of the output states the best speedup against the target.
+
+Usage:
+    python bench_regions.py [--sends 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from plate_regions import PlateRegions, REDUCERS   # noqa: E402
+
+WIDTH, HEIGHT = 32, 24
+PELTIER_W, PELTIER_H = 4, 3
+COORDS = {"A": (4, 3), "B": (20, 3), "C": (4, 15), "D": (20, 15)}
+TARGET = 8.0                 # speedup over the legacy send asked for
+
+
+class CountingFrame(list):
+    """Frame that counts pixel reads"""
+    reads = 0
+
+    def __getitem__(self, i):
+        CountingFrame.reads += 1
+        return list.__getitem__(self, i)
+
+
+# ---------- original code, copied from pid_control_pybadge.py ----------
+def hottest_pixel_in_region(frame, px0, py0):
+    max_t = -100.0
+    for dy in range(PELTIER_H):
+        for dx in range(PELTIER_W):
+            px = px0 + dx
+            py = py0 + dy
+            if px < WIDTH and py < HEIGHT:
+                t = frame[py * WIDTH + px]
+                if t > max_t:
+                    max_t = t
+    return max_t
+
+
+def legacy_send(frame):
+    for lbl in "ABCD":
+        hottest_pixel_in_region(frame, *COORDS[lbl])
+    for lbl in "ABCD":
+        hottest_pixel_in_region(frame, *COORDS[lbl])
+
+
+def engine_send(regions, frame):
+    regions.update(frame)
+    for lbl in "ABCD":
+        regions.value(lbl)
+    for lbl in "ABCD":
+        regions.value(lbl)
+
+
+def time_per_send(fn, frame, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(frame)
+    return (time.perf_counter() - start) / n
+
+
+def reads_per_send(fn):
+    frame = CountingFrame(36.0 for _ in range(WIDTH * HEIGHT))
+    CountingFrame.reads = 0
+    fn(frame)
+    return CountingFrame.reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sends", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    frame = [36.0 + rng.gauss(0, 0.4) for _ in range(WIDTH * HEIGHT)]
+
+    all_r = PlateRegions(COORDS)
+    max_r = PlateRegions(COORDS, reducer="max", compute=("max",))
+    mean_r = PlateRegions(COORDS, reducer="mean", compute=("mean",), dot=False)
+    try:
+        dot_r = PlateRegions(COORDS, reducer="mean", compute=("mean",),
+                             dot=True)
+    except ImportError:
+        dot_r = None
+    rows = [
+        ("legacy 8x hottest_pixel", legacy_send),
+        ("engine, all reducers", lambda f: engine_send(all_r, f)),
+        ("engine, max only", lambda f: engine_send(max_r, f)),
+        ("engine, mean (tables)", lambda f: engine_send(mean_r, f)),
+    ]
+    if dot_r is not None:
+        rows.append(("engine, mean (dot)", lambda f: engine_send(dot_r, f)))
+
+    base = None
+    best = (0.0, None)
+    print(f"{'region work':<26}{'us/send':>9}{'speedup':>9}{'reads':>7}")
+    for name, fn in rows:
+        dt = time_per_send(fn, frame, args.sends)
+        if base is None:
+            base = dt
+        else:
+            best = max(best, (base / dt, name))
+        print(f"{name:<26}{dt * 1e6:>9.2f}{base / dt:>8.1f}x"
+              f"{reads_per_send(fn):>7}")
+    print(f"target {TARGET:.0f}x the legacy send: best {best[0]:.1f}x "
+          f"({best[1]}), " + ("met" if best[0] >= TARGET else
+                              "NOT met on this interpreter"))
+
+    all_r.update(frame)
+    legacy = [hottest_pixel_in_region(frame, *COORDS[lbl]) for lbl in "ABCD"]
+    assert list(all_r.values("max")) == legacy
+    print()
+    for name in REDUCERS:
+        vals = " ".join(f"{v:.2f}" for v in all_r.values(name))
+        print(f"{name:<8}{vals}")
+
+
+if __name__ == "__main__":
+    main()
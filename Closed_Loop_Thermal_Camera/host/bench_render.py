@@ -0,0 +1,111 @@
+"""
+CPython benchmark for the thermal renderer.
+
+Compares the original per-pixel map_range loop from pid_control_pybadge.py
+with thermal_render.ThermalRenderer (LUT with per-pixel writes, LUT with
+bulk arrayblit, and the vectorized path when numpy is installed).
+
+Absolute numbers are for the host CPU; the ratio between rows is what
+carries over to the PyBadge.
+
+Usage:
+    python bench_render.py [--frames 500]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "stubs"))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import displayio                      # noqa: E402  (stub)
+from simpleio import map_range        # noqa: E402  (stub)
+import thermal_render                 # noqa: E402
+
+WIDTH, HEIGHT = 32, 24
+COLOR_DEPTH = 64
+T_MIN, T_MAX = 20.0, 40.0
+
+
+def synthetic_frames(n, seed=1):
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(n):
+        frame = [36.0 + rng.gauss(0, 0.4) for _ in range(WIDTH * HEIGHT)]
+        for y in range(6, 9):
+            for x in range(8, 12):
+                frame[y * WIDTH + x] = 25.0 + rng.gauss(0, 0.3)
+        frame[rng.randrange(WIDTH * HEIGHT)] = 45.0
+        frame[rng.randrange(WIDTH * HEIGHT)] = 15.0
+        frames.append(frame)
+    return frames
+
+
+# ---------- original code, copied from pid_control_pybadge.py ----------
+def legacy_render(bitmap, frame):
+    def fx(x):
+        return WIDTH - 1 - x
+
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            t = frame[y * WIDTH + x]
+            if t < T_MIN:
+                t = T_MIN
+            elif t > T_MAX:
+                t = T_MAX
+            idx = int(map_range(t, T_MIN, T_MAX, 0, COLOR_DEPTH - 1))
+            bitmap[fx(x), y] = idx
+
+
+def time_per_frame(fn, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        fn(frame)
+    return (time.perf_counter() - start) / len(frames)
+
+
+def max_index_error(a, b):
+    return max(abs(a[i] - b[i]) for i in range(WIDTH * HEIGHT))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.frames)
+
+    ref = displayio.Bitmap(WIDTH, HEIGHT, COLOR_DEPTH)
+    rows = [("legacy map_range loop",
+             time_per_frame(lambda f: legacy_render(ref, f), frames), 0)]
+
+    variants = [("LUT, per-pixel writes", None, False)]
+    try:
+        import bitmaptools   # stub: whole-bitmap copy like the native memcpy
+        variants.append(("LUT + arrayblit", bitmaptools, False))
+        if thermal_render.np is not None:
+            variants.append(("vectorized + arrayblit", bitmaptools, True))
+    except ImportError:
+        pass
+
+    for name, blit, vector in variants:
+        thermal_render.bitmaptools = blit
+        bmp = displayio.Bitmap(WIDTH, HEIGHT, COLOR_DEPTH)
+        r = thermal_render.ThermalRenderer(bmp, T_MIN, T_MAX, COLOR_DEPTH,
+                                           flip=True, use_ulab=vector)
+        dt = time_per_frame(r.render, frames)
+        legacy_render(ref, frames[-1])
+        rows.append((name, dt, max_index_error(ref, bmp)))
+
+    base = rows[0][1]
+    print(f"{'renderer':<26}{'ms/frame':>10}{'speedup':>9}{'max idx err':>13}")
+    for name, dt, err in rows:
+        print(f"{name:<26}{dt * 1e3:>10.3f}{base / dt:>8.1f}x{err:>13}")
+
+
+if __name__ == "__main__":
+    main()
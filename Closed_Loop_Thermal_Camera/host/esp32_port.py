@@ -0,0 +1,455 @@
+"""
+Python port of the ESP32 PID pattern controller (ESP32.py).
+
+Same constants, same PID (including the fixed heating/cooling direction per
+phase and the abs() on the output), same pattern state machine and the same
+PyBadge link handling (binary frames and ASCII TEMP lines). Time comes from
+the caller in milliseconds, so it can run against a simulated clock.
+
+    esp = Esp32Controller(drive=lambda lbl, pwm: ..., pybadge_write=...)
+    esp.command("PATTERN:C-D-A-B-C-D")
+    esp.loop(now_ms)     # call every LOOP_DELAY ms, like loop()
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+from uart_decode import FrameDecoder   # noqa: E402
+
+# ================= PWM =================
+PWM_MIN = 40
+PWM_MAX = 160
+
+# ================= TEMPERATURE =================
+TEMP_HEAT = 36.0
+TEMP_COOL = 25.0
+TEMP_COOL_MIN = 15.0
+DEADBAND = 0.25
+
+# ================= PID =================
+KP = 7.0
+KI = 0.25
+KD = 1.8
+PID_INTERVAL = 500
+I_CLAMP = 20.0
+
+# ================= TIMING =================
+TRIAL_TIME = 5 * 60 * 1000
+BUFFER_TIME = 1 * 60 * 1000
+FINAL_TIME = 60 * 1000
+LOOP_DELAY = 20
+
+# ================= LATENCY STATS =================
+STATS_INTERVAL = 10000
+TIME_SYNC_INTERVAL = 2000
+HIST_EDGES = (10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+STATE_IDLE = "IDLE"
+STATE_TRIAL = "TRIAL"
+STATE_BUFFER = "BUFFER"
+STATE_FINAL = "FINAL"
+STATE_COMPLETE = "COMPLETE"
+
+
+def constrain(x, lo, hi):
+    return lo if x < lo else hi if x > hi else x
+
+
+class LatencyStat:
+    """Count, mean, min, max, std and histogram of millisecond values"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.min = 0
+        self.max = 0
+        self.hist = [0] * (len(HIST_EDGES) + 1)
+
+    def add(self, v):
+        v = max(int(v), 0)
+        self.n += 1
+        self.sum += v
+        self.sum_sq += v * v
+        if self.n == 1 or v < self.min:
+            self.min = v
+        self.max = max(self.max, v)
+        b = 0
+        while b < len(HIST_EDGES) and v >= HIST_EDGES[b]:
+            b += 1
+        self.hist[b] += 1
+
+    def format(self, name):
+        mean = self.sum / self.n if self.n else 0.0
+        var = self.sum_sq / self.n - mean * mean if self.n else 0.0
+        return (f",{name}={self.n}/{mean:.1f}/{self.min}/{self.max}/"
+                f"{max(var, 0.0) ** 0.5:.1f}/"
+                + ";".join(str(c) for c in self.hist))
+
+
+class Peltier:
+    def __init__(self, label):
+        self.label = label
+        self.current_temp = 0.0
+        self.target_temp = 0.0
+        self.error_sum = 0.0
+        self.last_error = 0.0
+        self.heating = True
+        self.enabled = False
+        self.last_update = 0
+        self.pwm = 0          # signed output actually applied
+
+
+class Esp32Controller:
+    """drive(label, signed_pwm) is called whenever a plate output changes;
+    pybadge_write(bytes) sends to the PyBadge UART; log lines from
+    Serial.println go to self.log as (ms, text)."""
+
+    def __init__(self, drive=None, pybadge_write=None, kp=KP, ki=KI, kd=KD,
+                 deadband=DEADBAND, pid_interval=PID_INTERVAL,
+                 i_clamp=I_CLAMP, signed_output=False):
+        self.drive_cb = drive
+        self.pybadge_write = pybadge_write
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.deadband = deadband
+        self.pid_interval = pid_interval
+        self.i_clamp = i_clamp
+        # False: firmware behaviour, direction fixed per phase (p.heating).
+        # True: the sign of the PID output picks heating or cooling.
+        self.signed_output = signed_output
+        self.peltiers = [Peltier(lbl) for lbl in "ABCD"]
+        self.state = STATE_IDLE
+        self.pattern = ""
+        self.pattern_index = 0
+        self.phase_start = 0
+        self.now = 0
+        self.log = []
+        self.decoder = FrameDecoder()
+        self.binary_link = False
+        self.log_enabled = False
+        self.temp_cool = TEMP_COOL
+        self._commands = []
+
+        # latency statistics, see ESP32.py
+        self.link_stat = LatencyStat()
+        self.act_stat = LatencyStat()
+        self.ival_stat = LatencyStat()
+        self.stats_interval = STATS_INTERVAL
+        self.stats_start = 0
+        self.crc_base = 0
+        self.rx_count = self.drop_count = self.dup_count = 0
+        self.pid_count = self.fresh_count = 0
+        self.last_rx_ms = 0
+        self.last_seq = -1
+        self.record_id = 0
+        self.used_record = {p.label: 0 for p in self.peltiers}
+        self.capture_esp = None
+        self.clock_offset = 0
+        self.clock_synced = False
+        self.sync_best_rtt = None
+        self.sync_age = 0
+        self.last_sync_ms = 0
+
+    # ---------- I/O ----------
+    def println(self, text):
+        self.log.append((self.now, text))
+
+    def setup(self, now_ms=0):
+        self.now = now_ms
+        self.stop_all()
+        self.println("ESP32 PID Pattern Controller READY")
+        if self.pybadge_write:
+            self.pybadge_write(b"REQUEST_CALIB:BIN1\r\n")
+
+    def receive(self, data):
+        """Bytes arriving from the PyBadge"""
+        for item in self.decoder.feed(data):
+            if item[0] == "temp":
+                self.on_temperatures(item)
+            elif item[1].startswith("TIME:"):
+                self.handle_time_reply(item[1][5:])
+            elif item[1].startswith("PROFILE:"):
+                self.println(item[1])
+            elif item[1].startswith("DRIVE:") or item[1] == "STOP":
+                self.process_command(item[1])
+            elif item[1] == "CALIB_OK:BIN1":
+                self.binary_link = True
+                self.println("PYBADGE LINK: BINARY")
+            elif item[1] == "CALIB_OK":
+                self.binary_link = False
+                self.println("PYBADGE LINK: ASCII")
+            elif item[1] == "PYBADGE_READY":
+                self.binary_link = False
+                if self.pybadge_write:
+                    self.pybadge_write(b"REQUEST_CALIB:BIN1\r\n")
+
+    def on_temperatures(self, item):
+        """One record (the decoder splits batched frames into records)"""
+        for p, t in zip(self.peltiers, item[3]):
+            if t is not None:
+                p.current_temp = t
+        self.note_reading(item[1], item[2])
+        self.log_sample()
+
+    def log_sample(self):
+        if not self.log_enabled:
+            return
+        fields = "".join(f",{p.current_temp:.2f},{p.pwm}" for p in self.peltiers)
+        self.println(f"LOG:{self.now}{fields}")
+
+    def command(self, cmd):
+        """Queue a USB serial command (processed on the next loop())"""
+        self._commands.append(cmd)
+
+    # ---------- loop ----------
+    def loop(self, now_ms):
+        self.now = now_ms
+        while self._commands:
+            self.process_command(self._commands.pop(0).strip())
+        for p in self.peltiers:
+            if p.enabled:
+                self.update_pid(p)
+        self.handle_pattern()
+        self.service_latency()
+
+    # ---------- pattern engine ----------
+    def handle_pattern(self):
+        now = self.now
+        if self.state == STATE_TRIAL and now - self.phase_start >= TRIAL_TIME:
+            self.pattern_index += 1
+            if self.pattern_index >= len(self.pattern):
+                self.start_final()
+            else:
+                self.start_buffer()
+        elif self.state == STATE_BUFFER and now - self.phase_start >= BUFFER_TIME:
+            self.start_trial(self.pattern[self.pattern_index])
+        elif self.state == STATE_FINAL and now - self.phase_start >= FINAL_TIME:
+            self.stop_all()
+            self.state = STATE_COMPLETE
+            self.println("EXPERIMENT COMPLETE")
+            self.print_mark("COMPLETE")
+
+    def print_mark(self, phase):
+        badge = self.now + self.clock_offset if self.clock_synced else -1
+        self.println(f"MARK:{self.now},{badge},{phase}")
+
+    def start_trial(self, cool_label):
+        self.println(f"TRIAL START — Cool {cool_label}")
+        self.print_mark("TRIAL:" + cool_label)
+        self.phase_start = self.now
+        self.state = STATE_TRIAL
+        for p in self.peltiers:
+            p.enabled = True
+            p.error_sum = 0.0
+            p.last_error = 0.0
+            if p.label == cool_label:
+                p.heating = False
+                p.target_temp = self.temp_cool
+            else:
+                p.heating = True
+                p.target_temp = TEMP_HEAT
+
+    def start_buffer(self):
+        self.println("BUFFER — All heat")
+        self.print_mark("BUFFER")
+        self._all_heat(STATE_BUFFER)
+
+    def start_final(self):
+        self.println("FINAL HEAT — All heat 60s")
+        self.print_mark("FINAL")
+        self._all_heat(STATE_FINAL)
+
+    def _all_heat(self, state):
+        self.phase_start = self.now
+        self.state = state
+        for p in self.peltiers:
+            p.enabled = True
+            p.heating = True
+            p.target_temp = TEMP_HEAT
+            p.error_sum = 0.0
+            p.last_error = 0.0
+
+    # ---------- commands ----------
+    def process_command(self, cmd):
+        cmd = cmd.upper()
+        if cmd.startswith("PATTERN:"):
+            pattern = cmd[8:].replace("-", "")
+            if not pattern or len(pattern) > 10:
+                self.println("INVALID PATTERN")
+                return
+            self.pattern = pattern
+            self.pattern_index = 0
+            self.start_trial(pattern[0])
+        elif cmd == "STOP":
+            self.stop_all()
+            self.state = STATE_IDLE
+            self.println("STOPPED")
+        elif cmd.startswith("STATS:"):
+            try:
+                self.stats_interval = int(cmd[6:])
+            except ValueError:
+                self.stats_interval = 0
+            self.reset_stats()
+            self.println(f"STATS EVERY {self.stats_interval} ms")
+        elif cmd in ("LOG:ON", "LOG:OFF"):
+            self.log_enabled = cmd == "LOG:ON"
+            self.println("LOG ON" if self.log_enabled else "LOG OFF")
+        elif cmd == "PROFILE" or cmd.startswith("PROFILE:"):
+            if self.pybadge_write:
+                self.pybadge_write(cmd.encode() + b"\r\n")
+            self.println("PROFILE SENT")
+        elif cmd.startswith("SET_TEMP:"):
+            try:
+                t = float(cmd[9:])
+            except ValueError:
+                t = 0.0                  # toFloat() of garbage
+            if not TEMP_COOL_MIN <= t < TEMP_HEAT:
+                self.println("ERR:TEMP_RANGE")
+                return
+            self.temp_cool = t
+            if self.state == STATE_TRIAL:
+                for p in self.peltiers:
+                    if p.label == self.pattern[self.pattern_index]:
+                        p.target_temp = t
+            self.println("OK:TEMP_SET")
+        elif cmd.startswith("DRIVE:") and len(cmd) > 8 and cmd[7] == ":":
+            for p in self.peltiers:
+                if p.label != cmd[6]:
+                    continue
+                try:
+                    pwm = int(cmd[8:])
+                except ValueError:
+                    pwm = 0                  # String.toInt() gives 0
+                pwm = constrain(pwm, -PWM_MAX, PWM_MAX)
+                p.enabled = False
+                if pwm == 0:
+                    self.stop_drive(p)
+                else:
+                    p.heating = pwm > 0
+                    self.drive(p, abs(pwm))
+                self.println(f"DRIVE {p.label} {pwm}")
+
+    # ---------- PID ----------
+    def update_pid(self, p):
+        if self.now - p.last_update < self.pid_interval:
+            return
+        p.last_update = self.now
+
+        error = p.target_temp - p.current_temp
+        if abs(error) < self.deadband:
+            self.stop_drive(p)
+            p.error_sum = 0.0
+            self.note_actuation(p)
+            return
+
+        dt = self.pid_interval / 1000.0
+        p.error_sum = constrain(p.error_sum + error * dt,
+                                -self.i_clamp, self.i_clamp)
+        d_err = (error - p.last_error) / dt
+        p.last_error = error
+
+        out = self.kp * error + self.ki * p.error_sum + self.kd * d_err
+        pwm = constrain(abs(int(out)), PWM_MIN, PWM_MAX)
+        if self.signed_output:
+            self._apply(p, pwm if out >= 0 else -pwm)
+        else:
+            self.drive(p, pwm)
+        self.note_actuation(p)
+
+    # ---------- drive ----------
+    def drive(self, p, pwm):
+        self._apply(p, pwm if p.heating else -pwm)
+
+    def stop_drive(self, p):
+        self._apply(p, 0)
+
+    def stop_all(self):
+        for p in self.peltiers:
+            p.enabled = False
+            self.stop_drive(p)
+
+    def _apply(self, p, signed_pwm):
+        p.pwm = signed_pwm
+        if self.drive_cb:
+            self.drive_cb(p.label, signed_pwm)
+
+    # ---------- latency ----------
+    def reset_stats(self):
+        for st in (self.link_stat, self.act_stat, self.ival_stat):
+            st.reset()
+        self.rx_count = self.drop_count = self.dup_count = 0
+        self.pid_count = self.fresh_count = 0
+        self.crc_base = self.decoder.crc_errors
+        self.stats_start = self.now
+
+    def note_reading(self, seq, ts):
+        now = self.now
+        self.rx_count += 1
+        if self.last_rx_ms:
+            self.ival_stat.add(now - self.last_rx_ms)
+        self.last_rx_ms = now
+        self.record_id += 1
+        self.capture_esp = None
+        if seq is None:
+            self.last_seq = -1
+            return
+        if self.last_seq >= 0:
+            gap = (seq - (self.last_seq + 1)) & 0xFFFF
+            if gap >= 0x8000:
+                gap -= 0x10000
+            if gap > 0:
+                self.drop_count += gap
+            elif gap < 0:
+                self.dup_count += 1
+        self.last_seq = seq
+        if self.clock_synced:
+            self.capture_esp = ts - self.clock_offset
+            self.link_stat.add(now - self.capture_esp)
+
+    def note_actuation(self, p):
+        self.pid_count += 1
+        if self.used_record[p.label] != self.record_id:
+            self.used_record[p.label] = self.record_id
+            self.fresh_count += 1
+        if self.capture_esp is not None:
+            self.act_stat.add(self.now - self.capture_esp)
+
+    def handle_time_reply(self, data):
+        try:
+            sent, badge = (int(v) for v in data.split(","))
+        except ValueError:
+            return
+        rtt = self.now - sent
+        self.sync_age += 1
+        if self.sync_best_rtt is None or rtt <= self.sync_best_rtt \
+                or self.sync_age >= 8:
+            self.sync_best_rtt = rtt
+            self.sync_age = 0
+            self.clock_offset = badge - (sent + rtt // 2)
+            self.clock_synced = True
+
+    def service_latency(self):
+        now = self.now
+        if (self.binary_link and self.pybadge_write
+                and now - self.last_sync_ms >= TIME_SYNC_INTERVAL):
+            self.last_sync_ms = now
+            self.pybadge_write(b"TIME?%d\n" % now)
+        if self.stats_interval and now - self.stats_start >= self.stats_interval:
+            rtt = self.sync_best_rtt if self.clock_synced else -1
+            self.println(
+                f"STATS:ms={now},win={now - self.stats_start},"
+                f"rx={self.rx_count},drop={self.drop_count},"
+                f"dup={self.dup_count},"
+                f"crc={self.decoder.crc_errors - self.crc_base},"
+                f"pid={self.pid_count},fresh={self.fresh_count},rtt={rtt}"
+                + self.link_stat.format("link")
+                + self.act_stat.format("act")
+                + self.ival_stat.format("ival"))
+            self.reset_stats()
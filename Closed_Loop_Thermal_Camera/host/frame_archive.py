@@ -0,0 +1,429 @@
+"""
+Chunked, memory-mappable archive of recorded thermal frames.
+
+One file per experiment: a 64-byte header followed by fixed-size records,
+
+    counter  uint32   device frame counter (gaps = frames not recorded)
+    ts_ms    uint32   device capture time, monotonic ms
+    flags    uint8    frame_recorder.py flags (bit 0 sub-page)
+    pad      3 bytes
+    pixels   int16[24][32]  centi-degrees (temps() gives float C)
+
+1548 bytes a frame: a 35 minute run at 8 Hz (16800 frames) is 26 MB.
+FrameWriter grows the file a chunk of frames at a time and rewrites the
+frame count in the header after every chunk, so a crashed receiver loses
+at most one chunk. FrameArchive maps the file with numpy.memmap; only the
+frames that are touched are read from disk.
+
+The sidecar index (<archive>.idx, numpy .npz) holds the capture time of
+every frame and a phase table built from the ESP32 MARK: lines (see
+ESP32.py): one row per trial, buffer and final heat with its time and frame
+range. Slicing by time or phase then searches the index only and returns
+memmap views, so opening any trial costs the same in a 10 minute or a 10
+hour file.
+
+    python frame_archive.py run.tfa                   summary
+    python frame_archive.py index run.tfa esp32.log   build run.tfa.idx
+    python frame_archive.py phases run.tfa            list the phases
+"""
+
+import argparse
+import os
+import re
+import struct
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from frame_recorder import WIDTH, HEIGHT  # noqa: E402
+
+MAGIC = b"TFARCH\x00\x01"
+HEADER_SIZE = 64
+# magic, width, height, record size, chunk frames, frame count, scale
+HEADER = struct.Struct("<8sHHIIQf")
+SCALE = 0.01
+INDEX_VERSION = 1
+RECORD = np.dtype([
+    ("counter", "<u4"),
+    ("ts_ms", "<u4"),
+    ("flags", "u1"),
+    ("pad", "u1", (3,)),
+    ("pixels", "<i2", (HEIGHT, WIDTH)),
+])
+PHASE = np.dtype([
+    ("kind", "U6"),        # TRIAL / BUFFER / FINAL
+    ("plate", "U1"),       # cooled plate of a trial, "" otherwise
+    ("trial", "<i2"),      # 1-based trial number, 0 otherwise
+    ("start_ms", "<i8"),   # PyBadge clock, same as the frame ts_ms
+    ("end_ms", "<i8"),
+    ("start", "<i8"),      # frame range start .. stop-1
+    ("stop", "<i8"),
+])
+MARK_RE = re.compile(r"MARK:(\d+),(-?\d+),(\w+)(?::(\w))?")
+
+
+class FrameWriter:
+    """Appends frames to an archive file; use as a context manager"""
+
+    def __init__(self, path, chunk_frames=256):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.f = open(path, "w+b")
+        self.count = 0
+        self.capacity = 0
+        self.rec = np.zeros(1, dtype=RECORD)
+        self._write_header()
+
+    def _write_header(self):
+        head = HEADER.pack(MAGIC, WIDTH, HEIGHT, RECORD.itemsize,
+                           self.chunk_frames, self.count, SCALE)
+        self.f.seek(0)
+        self.f.write(head.ljust(HEADER_SIZE, b"\0"))
+
+    def _offset(self, i):
+        return HEADER_SIZE + i * RECORD.itemsize
+
+    def append(self, counter, ts_ms, flags, pixels):
+        """pixels: 1536 bytes of little-endian int16 centi-degrees"""
+        if self.count == self.capacity:
+            if self.count:
+                self.flush()
+            self.capacity += self.chunk_frames
+            self.f.truncate(self._offset(self.capacity))
+        r = self.rec[0]
+        r["counter"] = counter
+        r["ts_ms"] = ts_ms
+        r["flags"] = flags
+        r["pixels"] = np.frombuffer(pixels, dtype="<i2").reshape(HEIGHT, WIDTH)
+        self.f.seek(self._offset(self.count))
+        self.f.write(self.rec.tobytes())
+        self.count += 1
+
+    def flush(self):
+        """Make every appended frame visible to readers"""
+        self._write_header()
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.f.truncate(self._offset(self.count))
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameArchive:
+    """Read-only view of an archive; records is a numpy.memmap.
+
+    The sidecar index is loaded when present (index_path(path)) unless
+    index is False; without it
+    time lookups read the ts_ms column of the body and phases are unknown.
+    """
+
+    def __init__(self, path, index=True):
+        with open(path, "rb") as f:
+            head = f.read(HEADER_SIZE)
+        if len(head) < HEADER_SIZE or head[:8] != MAGIC:
+            raise ValueError(path + " is not a frame archive")
+        (_, width, height, size, self.chunk_frames, count,
+         self.scale) = HEADER.unpack_from(head)
+        if (width, height, size) != (WIDTH, HEIGHT, RECORD.itemsize):
+            raise ValueError("unsupported archive layout")
+        # a receiver that died mid-chunk leaves a longer file: trust the header
+        room = (os.path.getsize(path) - HEADER_SIZE) // size
+        self.path = path
+        self.count = min(count, room)
+        self.records = (np.memmap(path, dtype=RECORD, mode="r",
+                                  offset=HEADER_SIZE, shape=(self.count,))
+                        if self.count else np.zeros(0, dtype=RECORD))
+        self.ts_ms = None
+        self.indexed = False
+        self.phases = np.zeros(0, dtype=PHASE)
+        if index and os.path.exists(index_path(path)):
+            self.load_index()
+
+    def __len__(self):
+        return self.count
+
+    # ---------- index ----------
+    def load_index(self):
+        """Phase table now; the frame times on first use (timestamps())"""
+        with np.load(index_path(self.path), allow_pickle=False) as idx:
+            if int(idx["version"]) != INDEX_VERSION:
+                raise ValueError("unsupported index version")
+            if int(idx["count"]) < self.count:
+                raise ValueError("index is older than the archive, rebuild it")
+            self.phases = idx["phases"]
+        self.indexed = True
+
+    def save_index(self, phases):
+        self.phases = phases
+        tmp = index_path(self.path) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, version=INDEX_VERSION, count=self.count,
+                     ts_ms=self.timestamps(), phases=phases)
+        os.replace(tmp, index_path(self.path))
+        self.indexed = True
+
+    def timestamps(self):
+        """Capture times in ms as int64, uint32 wrap-around undone"""
+        if self.ts_ms is None and self.indexed:
+            with np.load(index_path(self.path), allow_pickle=False) as idx:
+                self.ts_ms = idx["ts_ms"][:self.count]
+        elif self.ts_ms is None:
+            ts = self.records["ts_ms"].astype(np.int64)
+            wraps = np.cumsum(np.diff(ts, prepend=ts[:1]) < -(1 << 31))
+            self.ts_ms = ts + (wraps << 32)
+        return self.ts_ms
+
+    @property
+    def counters(self):
+        return self.records["counter"]
+
+    @property
+    def times(self):
+        """Capture times in seconds from the first frame"""
+        ts = self.timestamps()
+        return (ts - ts[0]) / 1000.0 if len(ts) else ts / 1000.0
+
+    # ---------- slicing (memmap views, nothing is read yet) ----------
+    def frame_range(self, t0, t1):
+        """start, stop of the frames captured t0 <= t < t1 s into the run"""
+        ts = self.timestamps()
+        if not len(ts):
+            return 0, 0
+        lo, hi = np.searchsorted(ts, (ts[0] + 1000 * t0, ts[0] + 1000 * t1))
+        return int(lo), int(hi)
+
+    def between(self, t0, t1):
+        """Records captured t0 <= t < t1 seconds into the run"""
+        start, stop = self.frame_range(t0, t1)
+        return self.records[start:stop]
+
+    def phase(self, n):
+        """Phase row n of the index and its records"""
+        row = self.phases[n]
+        return row, self.records[row["start"]:row["stop"]]
+
+    def trial(self, n):
+        """Phase row and records of trial n (1-based)"""
+        rows = np.nonzero(self.phases["trial"] == n)[0]
+        if not len(rows):
+            raise KeyError("no trial %d in the index" % n)
+        return self.phase(int(rows[0]))
+
+    def temps(self, start, stop=None):
+        """Frames start..stop-1 (or one frame) as float32 C"""
+        if stop is None:
+            return self.records[start]["pixels"] * np.float32(self.scale)
+        return self.records[start:stop]["pixels"] * np.float32(self.scale)
+
+    def chunks(self, n=None, start=0, stop=None):
+        """(start, temps) blocks of n frames (default: the file's chunk)"""
+        n = n or self.chunk_frames
+        stop = self.count if stop is None else stop
+        for a in range(start, stop, n):
+            yield a, self.temps(a, min(a + n, stop))
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+def read_marks(lines, offset_ms=None):
+    """(pybadge_ms, phase, plate) of every MARK: line in an ESP32 log.
+
+    Marks sent before the ESP32 synced its clock carry -1; offset_ms
+    (PyBadge ms - ESP32 ms) places those, otherwise they are an error.
+    """
+    marks = []
+    for line in lines:
+        m = MARK_RE.search(line)
+        if not m:
+            continue
+        esp, badge = int(m.group(1)), int(m.group(2))
+        if badge < 0:
+            if offset_ms is None:
+                raise ValueError("MARK at ESP32 %d ms has no PyBadge time "
+                                 "(clock not synced; give --offset-ms)" % esp)
+            badge = esp + offset_ms
+        marks.append((badge, m.group(3), m.group(4) or ""))
+    return marks
+
+
+def build_phases(ts_ms, marks):
+    """Phase table (PHASE rows) from the marks and the frame times"""
+    rows = []
+    trial = 0
+    end_of_run = int(ts_ms[-1]) + 1 if len(ts_ms) else 0
+    for i, (start_ms, kind, plate) in enumerate(marks):
+        if kind == "COMPLETE":
+            continue
+        end_ms = marks[i + 1][0] if i + 1 < len(marks) else end_of_run
+        if kind == "TRIAL":
+            trial += 1
+        a, b = np.searchsorted(ts_ms, (start_ms, end_ms))
+        rows.append((kind, plate, trial if kind == "TRIAL" else 0,
+                     start_ms, end_ms, a, b))
+    return np.array(rows, dtype=PHASE)
+
+
+class ArchiveReplay:
+    """stub_hw.frame_source that plays archived frames start..stop-1.
+
+    speed > 0 follows the recorded capture times, scaled by speed, on
+    clock (time.monotonic: wall time under run_pybadge.py, virtual time in
+    hil_sim.py, which then runs as fast as the host allows); speed 0 hands
+    out the next frame on every call. At the end the last frame is held
+    (done is set) or, with loop, playback starts over.
+    """
+
+    def __init__(self, arch, start=0, stop=None, speed=1.0, loop=False,
+                 clock=None):
+        self.arch = arch
+        self.start = start
+        self.stop = arch.count if stop is None else stop
+        if self.stop <= start:
+            raise ValueError("nothing to replay")
+        ts = arch.timestamps()[start:self.stop]
+        self.rel_ms = ts - ts[0]
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock       # None: time.monotonic, looked up per call
+        self.t0 = None
+        self.index = -1           # frame last handed out, relative to start
+        self.done = False
+
+    def now(self):
+        return self.clock() if self.clock else time.monotonic()
+
+    def next_index(self):
+        n = self.stop - self.start
+        if self.speed <= 0:
+            i = self.index + 1
+        else:
+            now = self.now()
+            if self.t0 is None:
+                self.t0 = now
+            elapsed_ms = 1000.0 * (now - self.t0) * self.speed
+            if self.loop:
+                elapsed_ms %= float(self.rel_ms[-1]) + 1.0
+            i = int(np.searchsorted(self.rel_ms, elapsed_ms, "right")) - 1
+        if i >= n:
+            if not self.loop:
+                self.done = True
+                return n - 1
+            i = 0
+        return i
+
+    def __call__(self, buf):
+        self.index = self.next_index()
+        temps = self.arch.temps(self.start + self.index).ravel().tolist()
+        for i, t in enumerate(temps):
+            buf[i] = t
+
+    def frames(self):
+        """(seconds into the replay, temps) paced like __call__ would be"""
+        for i in range(self.stop - self.start):
+            if self.speed > 0:
+                if self.t0 is None:
+                    self.t0 = self.now()
+                due = self.t0 + self.rel_ms[i] / 1000.0 / self.speed
+                wait = due - self.now()
+                if wait > 0:
+                    time.sleep(wait)
+            self.index = i
+            yield self.rel_ms[i] / 1000.0, self.arch.temps(self.start + i)
+        self.done = True
+
+
+def summary(arch):
+    """Text summary, reading the pixels one chunk at a time"""
+    if not len(arch):
+        return "empty archive"
+    counters = arch.counters.astype(np.int64)
+    steps = np.diff(counters)
+    missing = int(np.sum(steps[steps > 1] - 1))
+    span = float(arch.times[-1])
+    lo, hi = np.inf, -np.inf
+    mean = np.zeros((HEIGHT, WIDTH), dtype=np.float64)
+    for _, block in arch.chunks():
+        lo = min(lo, float(block.min()))
+        hi = max(hi, float(block.max()))
+        mean += block.sum(axis=0)
+    mean /= len(arch)
+    rate = (len(arch) - 1) / span if span > 0 else 0.0
+    return "\n".join([
+        f"frames    {len(arch)} (counter {counters[0]}..{counters[-1]}, "
+        f"{missing} missing)",
+        f"duration  {span:.1f} s, {rate:.2f} frames/s",
+        f"pixels    {lo:.2f} .. {hi:.2f} C, mean frame {mean.mean():.2f} C",
+        f"phases    {len(arch.phases)}" if len(arch.phases)
+        else "phases    none indexed",
+    ])
+
+
+def phase_table(arch):
+    t_first = int(arch.timestamps()[0]) if len(arch) else 0
+    lines = [f"{'#':>3} {'phase':<10}{'trial':>6}{'start s':>9}{'end s':>9}"
+             f"{'frames':>8}{'first':>8}"]
+    for n, row in enumerate(arch.phases):
+        name = row["kind"] + (" " + row["plate"] if row["plate"] else "")
+        lines.append(f"{n:>3} {name:<10}{row['trial'] or '':>6}"
+                     f"{(row['start_ms'] - t_first) / 1000:>9.1f}"
+                     f"{(row['end_ms'] - t_first) / 1000:>9.1f}"
+                     f"{row['stop'] - row['start']:>8}{row['start']:>8}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="cmd")
+    idx = sub.add_parser("index", help="build the sidecar index")
+    idx.add_argument("path")
+    idx.add_argument("log", nargs="?",
+                     help="ESP32 USB serial capture with MARK: lines")
+    idx.add_argument("--offset-ms", type=int, default=None,
+                     help="PyBadge ms - ESP32 ms, for marks sent unsynced")
+    ph = sub.add_parser("phases", help="list the indexed phases")
+    ph.add_argument("path")
+    sm = sub.add_parser("summary", help="frames, duration, pixel range")
+    sm.add_argument("path")
+    argv = sys.argv[1:]
+    if argv and argv[0] not in ("index", "phases", "summary", "-h", "--help"):
+        argv = ["summary"] + argv
+    args = parser.parse_args(argv)
+    if not args.cmd:
+        parser.error("give an archive path")
+
+    arch = FrameArchive(args.path, index=args.cmd != "index")
+    if args.cmd == "index":
+        marks = []
+        if args.log:
+            with open(args.log, errors="replace") as f:
+                marks = read_marks(f, args.offset_ms)
+        phases = build_phases(arch.timestamps(), marks)
+        arch.save_index(phases)
+        print(f"{index_path(args.path)}: {len(arch)} frames, "
+              f"{len(phases)} phases")
+        if len(phases):
+            print(phase_table(arch))
+    elif args.cmd == "phases":
+        print(phase_table(arch) if len(arch.phases) else "no phases indexed")
+    else:
+        print(summary(arch))
+
+
+if __name__ == "__main__":
+    main()
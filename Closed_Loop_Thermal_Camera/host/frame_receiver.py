@@ -0,0 +1,174 @@
+"""
+Receives the PyBadge frame recording (frame_recorder.py) and writes it to
+a frame archive (frame_archive.py).
+
+The byte stream is cut into records at the b"TF" magic; a record with a
+bad version or CRC is skipped and the parser resyncs on the next magic, so
+a receiver started mid-stream or a lost USB packet costs only the frames
+involved. Progress (frames, rate, counter gaps, CRC errors) is printed
+every few seconds; Ctrl-C closes the archive cleanly.
+
+Sources: the usb_cdc data port (the second CDC port of the PyBadge, needs
+pyserial), a raw capture (frames.bin from the SD card, run_pybadge.py
+--record) or stdin:
+
+    python frame_receiver.py --port /dev/ttyACM1 -o run.tfa
+    python frame_receiver.py frames.bin -o run.tfa
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+from binascii import crc32
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for path in (HERE, os.path.dirname(HERE)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from frame_archive import FrameWriter                     # noqa: E402
+from frame_recorder import (MAGIC, VERSION, HEADER_SIZE,  # noqa: E402
+                            PIXELS_SIZE, RECORD_SIZE, FLAG_CRC)
+
+HEAD = struct.Struct("<2sBBII")
+
+
+class RecordParser:
+    """Splits a byte stream into (counter, ts_ms, flags, pixels) records"""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.records = 0
+        self.crc_errors = 0
+        self.skipped = 0           # bytes thrown away while resyncing
+
+    def feed(self, data):
+        self.buf += data
+        out = []
+        buf = self.buf
+        pos = 0
+        while True:
+            start = buf.find(MAGIC, pos)
+            if start < 0:
+                # keep a trailing b"T" that may start the next magic
+                keep = 1 if buf[-1:] == MAGIC[:1] else 0
+                self.skipped += len(buf) - pos - keep
+                pos = len(buf) - keep
+                break
+            self.skipped += start - pos
+            if len(buf) - start < RECORD_SIZE:
+                pos = start
+                break
+            _, version, flags, counter, ts_ms = HEAD.unpack_from(buf, start)
+            end = start + RECORD_SIZE
+            if version != VERSION or flags & ~(FLAG_CRC | 1) or (
+                    flags & FLAG_CRC and crc32(buf[start + 2:end - 4])
+                    != struct.unpack_from("<I", buf, end - 4)[0]):
+                self.crc_errors += 1
+                self.skipped += 1
+                pos = start + 1        # a false magic: look again after it
+                continue
+            out.append((counter, ts_ms, flags,
+                        bytes(buf[start + HEADER_SIZE:
+                                  start + HEADER_SIZE + PIXELS_SIZE])))
+            self.records += 1
+            pos = end
+        del buf[:pos]
+        return out
+
+
+class Progress:
+    def __init__(self, parser, period=5.0, live=True):
+        self.parser = parser
+        self.period = period
+        self.live = live
+        self.t0 = self.last = time.monotonic()
+        self.first = None
+        self.prev = None
+        self.missing = 0
+
+    def add(self, counter):
+        if self.first is None:
+            self.first = counter
+        elif counter > self.prev + 1:
+            self.missing += counter - self.prev - 1
+        self.prev = counter
+
+    def line(self):
+        p = self.parser
+        dt = time.monotonic() - self.t0
+        head = f"{p.records:6d} frames  "
+        if self.live:
+            rate = p.records / dt if dt > 0 else 0.0
+            head = f"{dt:7.1f} s  {head}{rate:5.2f}/s  "
+        return (f"{head}{self.missing} missing  {p.crc_errors} crc  "
+                f"{p.skipped} bytes skipped")
+
+    def tick(self):
+        if not self.live:
+            return
+        now = time.monotonic()
+        if now - self.last >= self.period:
+            self.last = now
+            print(self.line(), flush=True)
+
+
+def chunks_from_serial(port, baud):
+    import serial                           # pyserial, only needed here
+    with serial.Serial(port, baud, timeout=0.2) as ser:
+        while True:
+            yield ser.read(max(ser.in_waiting, 1))
+
+
+def chunks_from_file(f, size=65536):
+    while True:
+        data = f.read(size)
+        if not data:
+            return
+        yield data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", nargs="?", default="-",
+                        help="raw capture file, - for stdin (default)")
+    parser.add_argument("--port", help="read the PyBadge usb_cdc data port")
+    parser.add_argument("--baud", type=int, default=115200,
+                        help="ignored by USB CDC, kept for adapters")
+    parser.add_argument("-o", "--output", required=True,
+                        help="frame archive to write")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="stop after this many seconds")
+    parser.add_argument("--chunk", type=int, default=256,
+                        help="frames per archive chunk")
+    args = parser.parse_args()
+
+    if args.port:
+        source = chunks_from_serial(args.port, args.baud)
+    elif args.source == "-":
+        source = chunks_from_file(sys.stdin.buffer)
+    else:
+        source = chunks_from_file(open(args.source, "rb"))
+
+    rp = RecordParser()
+    progress = Progress(rp, live=bool(args.port))
+    t0 = time.monotonic()
+    with FrameWriter(args.output, args.chunk) as out:
+        try:
+            for data in source:
+                for counter, ts_ms, flags, pixels in rp.feed(data):
+                    progress.add(counter)
+                    out.append(counter, ts_ms, flags, pixels)
+                progress.tick()
+                if args.duration and time.monotonic() - t0 >= args.duration:
+                    break
+        except KeyboardInterrupt:
+            pass
+    print(progress.line())
+    print(f"wrote {rp.records} frames to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Hardware-in-the-loop simulator for the four-Peltier closed loop.
+
+Runs the unmodified pid_control_pybadge.py (through the CircuitPython
+stand-ins in host/stubs) against:
+
+  * arena_model.ArenaPlant   - four plates: thermal mass, leak to the 36 C
+                               bulk array, H-bridge PWM heating/cooling
+  * arena_model.ThermalScene - MLX90640 frames with the plates at their
+                               coordinates.txt positions
+  * esp32_port.Esp32Controller - Python port of updatePID/handlePattern
+  * a UART loopback between the PyBadge stand-in and the controller port
+
+Everything shares one discrete-time virtual clock: time.monotonic/sleep are
+redirected to it and the PyBadge script's asyncio tasks run on an event loop
+that jumps straight to the next timer instead of waiting. The world (ESP32
+loop() every 20 ms + plant integration) is stepped up to every new clock
+value. A full PATTERN:C-D-A-B-C-D run (~35 min) takes seconds.
+
+Usage:
+    python hil_sim.py --pattern C-D-A-B-C-D [--trace run.csv] [--ascii]
+                      [--model plates.json] [--record frames.raw]
+
+--record turns on the script's USB frame recording and saves the stream;
+with the printed log (MARK: lines) it makes a test archive:
+
+    python hil_sim.py --record frames.raw > esp32.log
+    python frame_receiver.py frames.raw -o run.tfa
+    python frame_archive.py index run.tfa esp32.log
+
+--replay run.tfa [--trial N] feeds the PyBadge recorded frames instead of
+the scene (the plant still runs, but the controller only sees the
+recording), at the recorded pace on the virtual clock, so as fast as the
+host allows.
+"""
+
+import argparse
+import asyncio
+import os
+import selectors
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import run_pybadge                            # noqa: E402
+from arena_model import (                     # noqa: E402
+    ArenaPlant, ThermalScene, PLATE_LABELS,
+)
+from esp32_port import (                      # noqa: E402
+    Esp32Controller, LOOP_DELAY, TRIAL_TIME, BUFFER_TIME, FINAL_TIME,
+)
+
+PYBADGE_SCRIPT = os.path.join(run_pybadge.DEVICE_DIR, "pid_control_pybadge.py")
+
+
+class SimulationDeadlock(RuntimeError):
+    pass
+
+
+# ================= VIRTUAL TIME =================
+class VirtualClock:
+    """Simulated monotonic clock; advancing it steps the world"""
+
+    def __init__(self, world=None):
+        self.now = 0.0
+        self.world = world
+
+    def advance(self, dt):
+        target = self.now + max(dt, 0.0)
+        if self.world is not None:
+            self.world.advance_to(target, self)
+        self.now = target
+
+    # replacements for the time module
+    def monotonic(self):
+        return self.now
+
+    def monotonic_ns(self):
+        return int(self.now * 1e9)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    """Selector that never blocks: waiting means advancing the clock"""
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._map = {}
+
+    def register(self, fileobj, events, data=None):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        key = selectors.SelectorKey(fileobj, fd, events, data)
+        self._map[fd] = key
+        return key
+
+    def unregister(self, fileobj):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        return self._map.pop(fd)
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise SimulationDeadlock("no timers pending")
+        self._clock.advance(timeout)
+        return []
+
+    def get_map(self):
+        return self._map
+
+    def close(self):
+        self._map.clear()
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock):
+        super().__init__(_VirtualSelector(clock))
+        self._vclock = clock
+
+    def time(self):
+        return self._vclock.now
+
+
+class patched_time:
+    """Context manager routing time.monotonic/monotonic_ns/sleep to a clock"""
+
+    NAMES = ("monotonic", "monotonic_ns", "sleep")
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def __enter__(self):
+        self.saved = {n: getattr(time, n) for n in self.NAMES}
+        for n in self.NAMES:
+            setattr(time, n, getattr(self.clock, n))
+        return self.clock
+
+    def __exit__(self, *exc):
+        for n, f in self.saved.items():
+            setattr(time, n, f)
+
+
+# ================= WORLD =================
+class World:
+    """ESP32 controller port + plant, stepped every LOOP_DELAY ms"""
+
+    def __init__(self, plant, esp, step_s=LOOP_DELAY / 1000.0, on_step=None):
+        self.plant = plant
+        self.esp = esp
+        self.step_s = step_s
+        self.t = 0.0
+        self.on_step = on_step
+
+    def advance_to(self, target, clock):
+        while self.t + self.step_s <= target + 1e-12:
+            self.t += self.step_s
+            clock.now = self.t
+            self.esp.loop(int(round(self.t * 1000)))
+            self.plant.step(self.step_s, self.t)
+            if self.on_step:
+                self.on_step(self.t)
+
+
+class Simulation:
+    """Wires the PyBadge script, the controller port and the plant together"""
+
+    def __init__(self, script=PYBADGE_SCRIPT, plant=None, scene=None,
+                 esp=None, sensor_noise=0.1, binary=True, seed=0, record=False,
+                 frame_source=None):
+        run_pybadge.install_stubs()
+        import stub_hw
+        self.stub_hw = stub_hw
+
+        self.plant = plant or ArenaPlant()
+        self.scene = scene or ThermalScene(self.plant, noise=sensor_noise,
+                                           seed=seed)
+        port = stub_hw.SerialPort()
+        self.esp = esp or Esp32Controller()
+        self.esp.drive_cb = lambda lbl, pwm: self.plant[lbl].set_drive(
+            pwm, self.clock.now)
+        self.esp.pybadge_write = port.feed if binary else None
+        port.peer = self.esp.receive
+        self.port = port
+
+        self.clock = VirtualClock()
+        self.world = World(self.plant, self.esp)
+        self.clock.world = self.world
+        self.script = script
+        self.record = record
+        self.frame_source = frame_source
+        self.trace = []
+
+    def sample(self, every_s=1.0):
+        """Record (t, true temps, measured temps, targets, pwm) every every_s"""
+        last = [-every_s]
+
+        def on_step(t):
+            if t - last[0] >= every_s - 1e-9:
+                last[0] = t
+                ps = self.esp.peltiers
+                self.trace.append((
+                    t, self.plant.temps(),
+                    [p.current_temp for p in ps],
+                    [p.target_temp for p in ps],
+                    [p.pwm for p in ps],
+                ))
+        self.world.on_step = on_step
+
+    def run(self, pattern, extra_s=5.0, settle_s=10.0, commands=()):
+        """Simulate settle_s of idle, then the whole pattern; returns sim seconds
+
+        commands are extra ESP32 USB serial commands sent at the start.
+        """
+        n = len(pattern.replace("-", ""))
+        duration = (settle_s + n * TRIAL_TIME / 1000 + (n - 1) * BUFFER_TIME / 1000
+                    + FINAL_TIME / 1000 + extra_s)
+        stub_hw = self.stub_hw
+        stub_hw.uart_port = self.port
+        stub_hw.frame_source = self.frame_source or self.scene.render
+        stub_hw.events = []
+        stub_hw.refresh_cost_s = 0.0
+        stub_hw.usb_data = bytearray()
+
+        root = tempfile.mkdtemp(prefix="circuitpy_sim_")
+        with open(os.path.join(root, "coordinates.txt"), "w") as f:
+            f.write(self.scene.coordinates_txt())
+
+        loop = VirtualEventLoop(self.clock)
+        try:
+            with patched_time(self.clock), run_pybadge.device_files(root):
+                g = run_pybadge.load_script(self.script)
+                if self.record:
+                    g["main"].__globals__["RECORD"] = "usb"
+                self.esp.setup(0)
+
+                async def experiment():
+                    for cmd in commands:
+                        self.esp.command(cmd)
+                    await asyncio.sleep(settle_s)
+                    self.esp.command("PATTERN:" + pattern)
+
+                async def body():
+                    loop.create_task(experiment())
+                    try:
+                        await asyncio.wait_for(g["main"](), duration)
+                    except asyncio.TimeoutError:
+                        pass
+                loop.run_until_complete(body())
+        finally:
+            loop.close()
+        return self.clock.now
+
+
+# ================= REPORT =================
+def settle_times(trace, log, deadband=0.25):
+    """Seconds from each phase start until every plate is within deadband"""
+    starts = [(ms / 1000.0, text) for ms, text in log
+              if text.startswith(("TRIAL START", "BUFFER", "FINAL HEAT"))]
+    out = []
+    for i, (t0, text) in enumerate(starts):
+        t1 = starts[i + 1][0] if i + 1 < len(starts) else float("inf")
+        settled = None
+        for t, true, meas, target, pwm in trace:
+            if t < t0 or t >= t1:
+                continue
+            if all(abs(a - b) < deadband for a, b in zip(true, target)):
+                settled = t - t0
+                break
+        out.append((t0, text, settled))
+    return out
+
+
+def write_trace(path, trace):
+    with open(path, "w") as f:
+        cols = ["t"]
+        for kind in ("true", "meas", "target", "pwm"):
+            cols += [f"{kind}_{lbl}" for lbl in PLATE_LABELS]
+        f.write(",".join(cols) + "\n")
+        for t, true, meas, target, pwm in trace:
+            row = [f"{t:.2f}"]
+            row += [f"{v:.3f}" for v in true + meas + target]
+            row += [str(v) for v in pwm]
+            f.write(",".join(row) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pattern", default="C-D-A-B-C-D")
+    parser.add_argument("--noise", type=float, default=0.1,
+                        help="sensor pixel noise, C rms")
+    parser.add_argument("--ascii", action="store_true",
+                        help="do not negotiate binary UART frames")
+    parser.add_argument("--trace", help="write a 1 Hz CSV trace here")
+    parser.add_argument("--model", help="plant model from sysid.py")
+    parser.add_argument("--command", action="append", default=[],
+                        help="extra ESP32 serial command at start "
+                             "(repeatable), e.g. PROFILE:60")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record the frames (usb_cdc stream) into PATH")
+    parser.add_argument("--replay", metavar="ARCHIVE",
+                        help="sensor frames from this frame archive")
+    parser.add_argument("--trial", type=int, default=None,
+                        help="replay only this trial (needs the index)")
+    args = parser.parse_args()
+
+    plant = ArenaPlant.from_model(args.model) if args.model else None
+    source = (run_pybadge.replay_source(args.replay, args.trial)
+              if args.replay else None)
+    sim = Simulation(plant=plant, sensor_noise=args.noise,
+                     binary=not args.ascii, record=bool(args.record),
+                     frame_source=source)
+    sim.sample(1.0)
+    wall0 = time.perf_counter()
+    sim_s = sim.run(args.pattern, commands=args.command)
+    wall = time.perf_counter() - wall0
+
+    for ms, text in sim.esp.log:
+        print(f"[{ms / 1000:8.1f} s] {text}")
+    print()
+    print(f"{'phase':<28}{'start s':>9}{'settled after s':>17}")
+    for t0, text, settled in settle_times(sim.trace, sim.esp.log):
+        s = f"{settled:.1f}" if settled is not None else "never"
+        print(f"{text:<28}{t0:>9.1f}{s:>17}")
+    print(f"\nsimulated {sim_s / 60:.1f} min in {wall:.1f} s wall "
+          f"({sim_s / wall:.0f}x real time), "
+          f"{sim.esp.decoder.records} binary readings received, "
+          f"{sim.esp.decoder.crc_errors} CRC errors")
+    if args.trace:
+        write_trace(args.trace, sim.trace)
+        print(f"trace written to {args.trace}")
+    if args.record:
+        with open(args.record, "wb") as f:
+            f.write(sim.stub_hw.usb_data)
+        print(f"{len(sim.stub_hw.usb_data)} bytes of frames written to "
+              f"{args.record}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Collects the ESP32 latency summaries (STATS: lines, see ESP32.py) and
+reports sensor-to-actuation latency.
+
+Per summary window the ESP32 sends counters (readings received, dropped and
+duplicated sequence numbers, CRC errors, PID updates and how many of them
+used a new reading) and three distributions, each as
+n/mean/min/max/std/histogram:
+
+    link   PyBadge capture -> ESP32 receive (ms)
+    act    PyBadge capture -> PID output computed from it (ms)
+    ival   time between received readings (ms, jitter)
+
+The histograms have fixed edges (HIST_EDGES), so windows merge exactly.
+
+Sources: a serial port (needs pyserial), a capture file, or stdin:
+
+    python latency_monitor.py --port /dev/ttyUSB0 [--baud 115200]
+    python latency_monitor.py session.log
+    python hil_sim.py --pattern C | python latency_monitor.py -
+"""
+
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+from esp32_port import HIST_EDGES          # noqa: E402
+
+COUNTERS = ("rx", "drop", "dup", "crc", "pid", "fresh")
+DISTRIBUTIONS = ("link", "act", "ival")
+
+
+def parse_stats(line):
+    """A STATS: line (anywhere in line) -> dict, None if there is none"""
+    i = line.find("STATS:ms=")
+    if i < 0:
+        return None
+    out = {}
+    try:
+        for field in line[i + 6:].strip().split(","):
+            key, value = field.split("=", 1)
+            if key in DISTRIBUTIONS:
+                n, mean, lo, hi, std, hist = value.split("/")
+                out[key] = {"n": int(n), "mean": float(mean), "min": int(lo),
+                            "max": int(hi), "std": float(std),
+                            "hist": [int(c) for c in hist.split(";")]}
+            else:
+                out[key] = int(value)
+    except ValueError:
+        return None
+    return out
+
+
+class Distribution:
+    """Merges n/mean/min/max/std/histogram summaries"""
+
+    def __init__(self):
+        self.n = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.min = None
+        self.max = None
+        self.hist = [0] * (len(HIST_EDGES) + 1)
+
+    def merge(self, d):
+        n = d["n"]
+        if not n:
+            return
+        self.n += n
+        self.sum += d["mean"] * n
+        self.sum_sq += (d["std"] ** 2 + d["mean"] ** 2) * n
+        self.min = d["min"] if self.min is None else min(self.min, d["min"])
+        self.max = d["max"] if self.max is None else max(self.max, d["max"])
+        for i, c in enumerate(d["hist"][:len(self.hist)]):
+            self.hist[i] += c
+
+    @property
+    def mean(self):
+        return self.sum / self.n if self.n else 0.0
+
+    @property
+    def std(self):
+        if not self.n:
+            return 0.0
+        return max(self.sum_sq / self.n - self.mean ** 2, 0.0) ** 0.5
+
+    def percentile(self, q):
+        """Upper bin edge containing the q-th percentile (None: >last edge)"""
+        if not self.n:
+            return 0
+        need = q / 100.0 * self.n
+        acc = 0
+        for i, c in enumerate(self.hist):
+            acc += c
+            if acc >= need:
+                return HIST_EDGES[i] if i < len(HIST_EDGES) else None
+        return None
+
+
+class Collector:
+    def __init__(self):
+        self.windows = []
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self.win_ms = 0
+        self.dist = {k: Distribution() for k in DISTRIBUTIONS}
+        self.rtt = None
+
+    def add(self, s):
+        self.windows.append(s)
+        for k in COUNTERS:
+            self.totals[k] += s.get(k, 0)
+        self.win_ms += s.get("win", 0)
+        for k in DISTRIBUTIONS:
+            if k in s:
+                self.dist[k].merge(s[k])
+        if s.get("rtt", -1) >= 0:
+            self.rtt = s["rtt"]
+
+    # ---------- report ----------
+    @staticmethod
+    def window_header():
+        return (f"{'t s':>8}{'rx/s':>7}{'drop':>6}{'dup':>5}{'crc':>5}"
+                f"{'pid/s':>7}{'fresh/s':>8}{'link ms':>9}{'act ms':>8}"
+                f"{'act max':>8}{'jitter':>7}")
+
+    @staticmethod
+    def window_row(s):
+        win = max(s.get("win", 0), 1) / 1000.0
+        link, act, ival = (s.get(k, {"mean": 0, "max": 0, "std": 0, "n": 0})
+                           for k in DISTRIBUTIONS)
+        return (f"{s['ms'] / 1000:>8.0f}{s.get('rx', 0) / win:>7.2f}"
+                f"{s.get('drop', 0):>6}{s.get('dup', 0):>5}{s.get('crc', 0):>5}"
+                f"{s.get('pid', 0) / win:>7.2f}{s.get('fresh', 0) / win:>8.2f}"
+                f"{link['mean']:>9.1f}{act['mean']:>8.1f}{act['max']:>8}"
+                f"{ival['std']:>7.1f}")
+
+    def report(self, out=sys.stdout):
+        secs = self.win_ms / 1000.0 or 1.0
+        t = self.totals
+        expected = t["rx"] + t["drop"]
+        out.write(f"\n{len(self.windows)} windows, {secs:.0f} s\n")
+        out.write(f"readings  {t['rx']} received ({t['rx'] / secs:.2f}/s), "
+                  f"{t['drop']} dropped"
+                  f" ({100.0 * t['drop'] / expected if expected else 0:.2f}%), "
+                  f"{t['dup']} duplicated, {t['crc']} CRC errors\n")
+        out.write(f"control   {t['pid'] / secs:.2f} PID updates/s, "
+                  f"{t['fresh'] / secs:.2f}/s on a new reading "
+                  f"({100.0 * t['fresh'] / t['pid'] if t['pid'] else 0:.0f}%)\n")
+        if self.rtt is not None:
+            out.write(f"clock     sync round trip {self.rtt} ms "
+                      f"(capture times +-{self.rtt / 2:.0f} ms)\n")
+        else:
+            out.write("clock     not synced (ASCII link?): no link/act "
+                      "latency\n")
+        names = {"link": "capture -> receive",
+                 "act": "capture -> actuation",
+                 "ival": "receive interval"}
+        for k in DISTRIBUTIONS:
+            d = self.dist[k]
+            if not d.n:
+                continue
+            p50, p99 = d.percentile(50), d.percentile(99)
+            out.write(f"\n{names[k]}: n {d.n}, mean {d.mean:.1f} ms, "
+                      f"std {d.std:.1f}, min {d.min}, max {d.max}, "
+                      f"p50 <= {_edge(p50)}, p99 <= {_edge(p99)}\n")
+            out.write(histogram(d.hist))
+
+
+def _edge(v):
+    return f"{v} ms" if v is not None else f">{HIST_EDGES[-1]} ms"
+
+
+def histogram(hist, width=40):
+    peak = max(hist) or 1
+    lines = []
+    lo = 0
+    for i, c in enumerate(hist):
+        hi = HIST_EDGES[i] if i < len(HIST_EDGES) else None
+        rng = f"{lo}-{hi}" if hi is not None else f">{lo}"
+        bar = "#" * int(round(width * c / peak))
+        lines.append(f"  {rng:>9} ms {c:>8} {bar}\n")
+        lo = hi
+    return "".join(lines)
+
+
+def lines_from_serial(port, baud):
+    import serial                           # pyserial, only needed here
+    with serial.Serial(port, baud, timeout=1) as ser:
+        while True:
+            raw = ser.readline()
+            if raw:
+                yield raw.decode("ascii", "replace")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", nargs="?", default="-",
+                        help="capture file, - for stdin (default)")
+    parser.add_argument("--port", help="read the ESP32 USB serial port")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--quiet", action="store_true",
+                        help="only the final report, no per-window rows")
+    args = parser.parse_args()
+
+    if args.port:
+        lines = lines_from_serial(args.port, args.baud)
+    elif args.source == "-":
+        lines = sys.stdin
+    else:
+        lines = open(args.source)
+
+    col = Collector()
+    if not args.quiet:
+        print(Collector.window_header())
+    t0 = time.monotonic()
+    try:
+        for line in lines:
+            s = parse_stats(line)
+            if s is None:
+                continue
+            col.add(s)
+            if not args.quiet:
+                print(Collector.window_row(s), flush=True)
+    except KeyboardInterrupt:
+        pass
+    if not col.windows:
+        print("no STATS lines (%.0f s)" % (time.monotonic() - t0))
+        return
+    col.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""
+PID gain sweep and autotuner for the ESP32 plate controller.
+
+Every candidate (KP, KI, KD, DEADBAND, integral clamp) is scored on one
+closed-loop trial/buffer cycle: esp32_port.Esp32Controller driving
+arena_model.ArenaPlant, with the plates measured the way the PyBadge does
+it (max or mean of the plate pixels, sensor noise, one sub-page of delay).
+No PyBadge script or virtual event loop is involved, so one candidate is a
+few tenths of a second and candidates run in parallel on a process pool
+(all cores by default).
+
+Scored per candidate:
+    cool_s     time for the cooled plate to enter and stay within SETTLE_BAND
+               (or the deadband, if wider) of 25 C
+    recover_s  same for that plate returning to 36 C during the buffer
+    overshoot  worst excursion past the target, any plate, any phase (C)
+    ss_err     mean |error| over the last 60 s of each phase, all plates (C)
+    score      (cool_s + recover_s) / 60 + 2 * overshoot + 4 * ss_err
+
+Modes:
+    python pid_tune.py grid  --kp 2:20:10 --ki 0.05:1:10 --kd 0:4:10
+    python pid_tune.py bayes --trials 1000
+    python pid_tune.py relay [--rule tyreus-luyben]
+    python pid_tune.py eval  [--kp 7 --ki 0.25 --kd 1.8]
+
+Ranges are lo:hi:n (log spaced when lo > 0, else linear) or a single value.
+eval scores the firmware gains, with only the flags given replaced (the
+first value of a range).
+"""
+
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+from arena_model import ArenaPlant, PLATE_LABELS, load_model  # noqa: E402
+from esp32_port import (                                   # noqa: E402
+    Esp32Controller, KP, KI, KD, DEADBAND, I_CLAMP, PWM_MAX, LOOP_DELAY,
+    TRIAL_TIME, BUFFER_TIME, TEMP_COOL, TEMP_HEAT,
+)
+
+PARAMS = ("kp", "ki", "kd", "deadband", "i_clamp")
+FIRMWARE = {"kp": KP, "ki": KI, "kd": KD, "deadband": DEADBAND,
+            "i_clamp": I_CLAMP}
+COOL_LABEL = "C"
+SS_WINDOW = 60.0
+SETTLE_BAND = 0.5    # C; the max reducer alone reads ~0.16 C high
+W_OVERSHOOT = 2.0
+W_SS = 4.0
+
+
+# ================= MEASUREMENT =================
+class PlateSensor:
+    """Plate temperatures as the PyBadge reports them.
+
+    Every period s each plate is sampled as the reducer over n_pixels noisy
+    pixels; the controller sees the value one period later (acquisition +
+    UART).
+    """
+
+    def __init__(self, plant, period=0.25, noise=0.1, n_pixels=12,
+                 reducer="max", seed=0):
+        self.plant = plant
+        self.period = period
+        self.noise = noise
+        self.n_pixels = n_pixels
+        self.reduce = max if reducer == "max" else (
+            lambda v: sum(v) / len(v))
+        self.rng = random.Random(seed)
+        self.next_sample = 0.0
+        self.pending = None
+
+    def update(self, now, on_reading):
+        if now + 1e-9 < self.next_sample:
+            return
+        self.next_sample += self.period
+        if self.pending is not None:
+            on_reading(self.pending)
+        gauss = self.rng.gauss
+        sigma = self.noise
+        n = self.n_pixels
+        self.pending = [
+            self.reduce([t + gauss(0.0, sigma) for _ in range(n)])
+            for t in self.plant.temps()]
+
+
+# ================= CLOSED LOOP =================
+def make_plant(model=None, plant_kwargs=None):
+    if model:
+        return ArenaPlant.from_model(model)
+    return ArenaPlant(**(plant_kwargs or {}))
+
+
+def simulate(params, plant_kwargs=None, sensor_kwargs=None, step_ms=LOOP_DELAY,
+             cool=COOL_LABEL, signed_output=False, record=False, model=None):
+    """One trial (cool plate) + buffer cycle; returns the metrics dict"""
+    plant = make_plant(model, plant_kwargs)
+    sensor = PlateSensor(plant, **(sensor_kwargs or {}))
+    esp = Esp32Controller(
+        kp=params["kp"], ki=params["ki"], kd=params["kd"],
+        deadband=params["deadband"], i_clamp=params["i_clamp"],
+        signed_output=signed_output)
+    step_s = step_ms / 1000.0
+    clock = [0.0]
+    esp.drive_cb = lambda lbl, pwm: plant[lbl].set_drive(pwm, clock[0])
+    ps = esp.peltiers
+
+    def on_reading(temps):
+        for p, t in zip(ps, temps):
+            p.current_temp = t
+
+    # the second letter only makes the pattern engine enter BUFFER
+    esp.command("PATTERN:%s-%s" % (cool, "A" if cool != "A" else "B"))
+    trial_s = TRIAL_TIME / 1000.0
+    end_s = trial_s + BUFFER_TIME / 1000.0
+    steps = int(round(end_s / step_s))
+    temps = [[] for _ in PLATE_LABELS]
+    trace = []
+    for k in range(1, steps + 1):
+        now = k * step_s
+        clock[0] = now
+        sensor.update(now, on_reading)
+        esp.loop(k * step_ms)
+        plant.step(step_s, now)
+        for i, t in enumerate(plant.temps()):
+            temps[i].append(t)
+        if record:
+            trace.append((now, plant.temps(), [p.pwm for p in ps]))
+
+    split = int(round(trial_s / step_s))
+    metrics = score(temps, split, step_s, PLATE_LABELS.index(cool),
+                    params["deadband"])
+    if record:
+        metrics["trace"] = trace
+    return metrics
+
+
+def settle_time(series, target, band, step_s):
+    """Time after which series stays within band of target (None if never)"""
+    last_out = -1
+    for i, t in enumerate(series):
+        if abs(t - target) >= band:
+            last_out = i
+    if last_out == len(series) - 1:
+        return None
+    return (last_out + 1) * step_s
+
+
+def score(temps, split, step_s, cool_idx, deadband):
+    """Metrics for the trial (temps[:split]) and buffer (temps[split:])"""
+    band = max(deadband, SETTLE_BAND)
+    heat = TEMP_HEAT
+    n_ss = int(SS_WINDOW / step_s)
+    overshoot = 0.0
+    ss = []
+    cool_s = recover_s = None
+    for i, series in enumerate(temps):
+        trial, buffer = series[:split], series[split:]
+        t_trial = TEMP_COOL if i == cool_idx else heat
+        for phase, target in ((trial, t_trial), (buffer, heat)):
+            start = phase[0]
+            if start > target + band:          # approached from above
+                overshoot = max(overshoot, target - min(phase))
+            elif start < target - band:        # approached from below
+                overshoot = max(overshoot, max(phase) - target)
+            else:                              # holding
+                overshoot = max(overshoot, max(abs(t - target) for t in phase))
+            tail = phase[-n_ss:]
+            ss.append(sum(abs(t - target) for t in tail) / len(tail))
+        if i == cool_idx:
+            cool_s = settle_time(trial, t_trial, band, step_s)
+            recover_s = settle_time(buffer, heat, band, step_s)
+    ss_err = sum(ss) / len(ss)
+    trial_len = split * step_s
+    buffer_len = (len(temps[0]) - split) * step_s
+    s = ((cool_s if cool_s is not None else trial_len)
+         + (recover_s if recover_s is not None else buffer_len)) / 60.0
+    return {"cool_s": cool_s, "recover_s": recover_s,
+            "overshoot": max(overshoot, 0.0), "ss_err": ss_err,
+            "score": s + W_OVERSHOOT * max(overshoot, 0.0) + W_SS * ss_err}
+
+
+# ================= PROCESS POOL =================
+_CONFIG = {}
+
+
+def _init_worker(config):
+    _CONFIG.clear()
+    _CONFIG.update(config)
+
+
+def _evaluate(params):
+    m = simulate(params, _CONFIG.get("plant"), _CONFIG.get("sensor"),
+                 _CONFIG.get("step_ms", LOOP_DELAY),
+                 signed_output=_CONFIG.get("signed", False),
+                 model=_CONFIG.get("model"))
+    m.update(params)
+    return m
+
+
+def evaluate_all(candidates, config, workers=None):
+    """Score candidates on a process pool; results in input order"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(candidates) == 1:
+        _init_worker(config)
+        return [_evaluate(c) for c in candidates]
+    chunk = max(1, len(candidates) // (workers * 8))
+    with multiprocessing.Pool(workers, _init_worker, (config,)) as pool:
+        return pool.map(_evaluate, candidates, chunksize=chunk)
+
+
+# ================= SEARCH =================
+def parse_range(text):
+    """"lo:hi:n" -> n values (log spaced if lo > 0), "v" -> [v]"""
+    parts = [float(v) for v in text.split(":")]
+    if len(parts) == 1:
+        return parts
+    lo, hi, n = parts[0], parts[1], int(parts[2])
+    if n == 1:
+        return [lo]
+    if lo > 0:
+        r = (hi / lo) ** (1.0 / (n - 1))
+        return [lo * r ** i for i in range(n)]
+    return [lo + (hi - lo) * i / (n - 1) for i in range(n)]
+
+
+def grid(ranges):
+    out = [{}]
+    for name in PARAMS:
+        out = [dict(c, **{name: v}) for c in out for v in ranges[name]]
+    return out
+
+
+class ParzenSearch:
+    """Tree-structured Parzen estimator style sequential search.
+
+    Observations are split into the best gamma fraction and the rest; new
+    candidates are drawn from Gaussian kernels around the good points and
+    the one with the highest good/bad density ratio is proposed. Parameters
+    live in log space when their bounds are positive.
+    """
+
+    def __init__(self, bounds, gamma=0.2, n_startup=64, n_draws=48, seed=0):
+        self.bounds = bounds
+        self.gamma = gamma
+        self.n_startup = n_startup
+        self.n_draws = n_draws
+        self.rng = random.Random(seed)
+        self.obs = []      # (score, {name: unit value})
+
+    def _to_unit(self, name, v):
+        lo, hi = self.bounds[name]
+        if lo > 0:
+            return (math.log(v) - math.log(lo)) / (math.log(hi) - math.log(lo))
+        return (v - lo) / (hi - lo) if hi > lo else 0.0
+
+    def _from_unit(self, name, u):
+        lo, hi = self.bounds[name]
+        u = min(max(u, 0.0), 1.0)
+        if lo > 0:
+            return math.exp(math.log(lo) + u * (math.log(hi) - math.log(lo)))
+        return lo + u * (hi - lo)
+
+    def _density(self, points, x, bw):
+        s = 0.0
+        for p in points:
+            d = 0.0
+            for name in x:
+                d += ((x[name] - p[name]) / bw) ** 2
+            s += math.exp(-0.5 * d)
+        return s / len(points) + 1e-12
+
+    def propose(self):
+        rng = self.rng
+        names = list(self.bounds)
+        if len(self.obs) < self.n_startup:
+            u = {n: rng.random() for n in names}
+        else:
+            ranked = sorted(self.obs, key=lambda o: o[0])
+            n_good = max(2, int(self.gamma * len(ranked)))
+            good = [o[1] for o in ranked[:n_good]]
+            bad = [o[1] for o in ranked[n_good:]]
+            bw = max(0.05, len(good) ** (-1.0 / (len(names) + 4)) * 0.3)
+            best, best_ratio = None, -1.0
+            for _ in range(self.n_draws):
+                centre = rng.choice(good)
+                x = {n: _reflect(rng.gauss(centre[n], bw)) for n in names}
+                ratio = self._density(good, x, bw) / self._density(bad, x, bw)
+                if ratio > best_ratio:
+                    best, best_ratio = x, ratio
+            u = best
+        return {n: self._from_unit(n, u[n]) for n in names}
+
+    def observe(self, params, score):
+        self.obs.append((score, {n: self._to_unit(n, params[n])
+                                 for n in self.bounds}))
+
+
+def _reflect(u):
+    """Fold a kernel draw back into [0, 1] (clipping piles draws on the edges)"""
+    u = abs(u) % 2.0
+    return 2.0 - u if u > 1.0 else u
+
+
+def bayes(bounds, fixed, trials, config, workers, seed=0):
+    """Batched sequential search: one pool batch per proposal round"""
+    workers = workers or os.cpu_count() or 1
+    search = ParzenSearch(bounds, seed=seed)
+    results = []
+    config = dict(config)
+    with multiprocessing.Pool(workers, _init_worker, (config,)) as pool:
+        while len(results) < trials:
+            n = min(max(workers, 8), trials - len(results))
+            batch = [dict(fixed, **search.propose()) for _ in range(n)]
+            for m in pool.map(_evaluate, batch):
+                search.observe(m, m["score"])
+                results.append(m)
+    return results
+
+
+# ================= RELAY AUTOTUNE =================
+RULES = {
+    # name: (kp / Ku, Ti / Tu, Td / Tu)
+    "ziegler-nichols": (0.6, 0.5, 0.125),
+    "tyreus-luyben": (0.45, 2.2, 0.159),
+    "no-overshoot": (0.2, 0.5, 0.333),
+}
+
+
+def relay_test(plate_kwargs=None, sensor_kwargs=None, target=TEMP_COOL,
+               amplitude=PWM_MAX, hysteresis=0.3, duration=900.0,
+               step_s=LOOP_DELAY / 1000.0, model=None):
+    """Relay feedback on one plate (cooling at amplitude / off around
+    target); returns (Ku, Tu, amplitude C) from the sustained oscillation"""
+    plant = make_plant(model, plate_kwargs)
+    plate = plant[COOL_LABEL]
+    idx = PLATE_LABELS.index(COOL_LABEL)
+    sensor = PlateSensor(plant, **(sensor_kwargs or {}))
+    reading = [plate.temp]
+    on = True
+    switches = []
+    peaks = []
+    lo = hi = plate.temp
+    now = 0.0
+    while now < duration:
+        now += step_s
+        sensor.update(now, lambda temps: reading.__setitem__(0, temps[idx]))
+        t = reading[0]
+        # the extreme of each half-cycle comes after its switch (dead time)
+        if on and t < target - hysteresis:
+            on = False
+            switches.append(now)
+            peaks.append(hi)
+            lo = t
+        elif not on and t > target + hysteresis:
+            on = True
+            switches.append(now)
+            peaks.append(lo)
+            hi = t
+        lo = min(lo, t)
+        hi = max(hi, t)
+        plate.set_drive(-amplitude if on else 0, now)
+        plant.step(step_s, now)
+    # ignore the approach; use the last full cycles
+    if len(switches) < 6:
+        raise RuntimeError("relay test did not oscillate")
+    cycles = switches[-5::2]
+    tu = (cycles[-1] - cycles[0]) / (len(cycles) - 1)
+    a = (max(peaks[-4:]) - min(peaks[-4:])) / 2.0
+    # relay toggles between -amplitude and 0: d is half the swing
+    ku = 4.0 * (amplitude / 2.0) / (math.pi * a)
+    return ku, tu, a
+
+
+def relay_gains(ku, tu, rule):
+    c_kp, c_ti, c_td = RULES[rule]
+    kp = c_kp * ku
+    return {"kp": kp, "ki": kp / (c_ti * tu), "kd": kp * c_td * tu}
+
+
+# ================= OUTPUT =================
+def _fmt_s(v):
+    return "never" if v is None else "%.1f" % v
+
+
+def print_table(results, top):
+    ranked = sorted(results, key=lambda m: m["score"])
+    print(f"{'rank':>4}{'kp':>8}{'ki':>8}{'kd':>8}{'band':>6}{'iclamp':>7}"
+          f"{'score':>8}{'cool s':>8}{'recov s':>8}{'over C':>8}{'ss C':>7}")
+    for i, m in enumerate(ranked[:top]):
+        print(f"{i + 1:>4}{m['kp']:>8.3f}{m['ki']:>8.3f}{m['kd']:>8.3f}"
+              f"{m['deadband']:>6.2f}{m['i_clamp']:>7.1f}{m['score']:>8.2f}"
+              f"{_fmt_s(m['cool_s']):>8}{_fmt_s(m['recover_s']):>8}"
+              f"{m['overshoot']:>8.2f}{m['ss_err']:>7.2f}")
+
+
+def write_csv(path, results):
+    cols = list(PARAMS) + ["score", "cool_s", "recover_s", "overshoot",
+                           "ss_err"]
+    with open(path, "w") as f:
+        f.write(",".join(cols) + "\n")
+        for m in sorted(results, key=lambda m: m["score"]):
+            f.write(",".join("" if m[c] is None else "%g" % m[c]
+                             for c in cols) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("mode", choices=("grid", "bayes", "relay", "eval"))
+    parser.add_argument("--kp", help="default 2:20:10")
+    parser.add_argument("--ki", help="default 0.02:1:10")
+    parser.add_argument("--kd", help="default 0:4:10")
+    parser.add_argument("--deadband", help="default %g" % DEADBAND)
+    parser.add_argument("--i-clamp", help="default %g" % I_CLAMP)
+    parser.add_argument("--trials", type=int, default=1000,
+                        help="bayes: number of candidates")
+    parser.add_argument("--rule", choices=sorted(RULES), default="tyreus-luyben")
+    parser.add_argument("--model", help="plant model from sysid.py")
+    parser.add_argument("--reducer", choices=("max", "mean"), default="max")
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument("--step-ms", type=int, default=LOOP_DELAY,
+                        help="simulation step (ESP32 loop period)")
+    parser.add_argument("--signed", action="store_true",
+                        help="let the PID output sign pick heat/cool instead "
+                             "of the firmware's fixed direction per phase")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="processes, default all cores")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--csv", help="write every result here")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = {"sensor": {"noise": args.noise, "reducer": args.reducer,
+                         "seed": args.seed},
+              "step_ms": args.step_ms, "signed": args.signed,
+              "model": load_model(args.model) if args.model else None}
+    workers = args.workers or os.cpu_count() or 1
+    given = {"kp": args.kp, "ki": args.ki, "kd": args.kd,
+             "deadband": args.deadband, "i_clamp": args.i_clamp}
+    defaults = {"kp": "2:20:10", "ki": "0.02:1:10", "kd": "0:4:10",
+                "deadband": str(DEADBAND), "i_clamp": str(I_CLAMP)}
+    ranges = {n: parse_range(given[n] or defaults[n]) for n in PARAMS}
+
+    t0 = time.perf_counter()
+    if args.mode == "grid":
+        candidates = [FIRMWARE] + grid(ranges)
+        results = evaluate_all(candidates, config, workers)
+    elif args.mode == "bayes":
+        bounds = {n: (r[0], r[-1]) for n, r in ranges.items() if len(r) > 1}
+        fixed = {n: r[0] for n, r in ranges.items() if len(r) == 1}
+        results = evaluate_all([FIRMWARE], config, 1)
+        results += bayes(bounds, fixed, args.trials, config, workers,
+                         args.seed)
+    elif args.mode == "relay":
+        ku, tu, a = relay_test(sensor_kwargs=config["sensor"],
+                               model=config["model"])
+        print(f"relay on plate {COOL_LABEL} around {TEMP_COOL} C: "
+              f"Ku = {ku:.2f} PWM/C, Tu = {tu:.1f} s, amplitude {a:.2f} C")
+        candidates = [FIRMWARE]
+        for rule in sorted(RULES):
+            g = relay_gains(ku, tu, rule)
+            flag = "  <-" if rule == args.rule else ""
+            print(f"  {rule:<16} kp {g['kp']:7.3f}  ki {g['ki']:7.4f}  "
+                  f"kd {g['kd']:7.3f}{flag}")
+            candidates.append(dict(FIRMWARE, **g))
+        results = evaluate_all(candidates, config, workers)
+    else:
+        gains = dict(FIRMWARE, **{n: ranges[n][0] for n in PARAMS
+                                  if given[n] is not None})
+        results = evaluate_all([gains], config, 1)
+    wall = time.perf_counter() - t0
+
+    print_table(results, args.top)
+    base = next((m for m in results
+                 if all(m[n] == FIRMWARE[n] for n in PARAMS)), None)
+    if base is not None and args.mode != "eval":
+        print(f"\nfirmware gains (KP {KP}, KI {KI}, KD {KD}): "
+              f"score {base['score']:.2f}, cool {_fmt_s(base['cool_s'])} s")
+    print(f"\n{len(results)} candidates in {wall:.1f} s on {workers} "
+          f"process(es), {wall * workers / len(results):.2f} s/candidate")
+    if args.csv:
+        write_csv(args.csv, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Inspect and migrate coordinates.txt plate files.
+
+Legacy files (label:x:y) are ambiguous: pid_control_pybadge.py reads x, y as
+the pixel offset of a 4x3 box, the UART test script as a 4x3 grid cell.
+migrate writes the same boxes as explicit PLATES 2 masks (plate_regions.py),
+which every script reads the same way:
+
+    python plate_masks.py migrate coordinates.txt --units pixel -o new.txt
+    python plate_masks.py migrate coordinates.txt --units grid --in-place
+    python plate_masks.py migrate coordinates.txt --units pixel --edge-weight 0.5
+    python plate_masks.py show coordinates.txt
+
+--edge-weight gives the outline pixels of each mask a lower weight in the
+plate mean (pixels that partly see the plate border). show prints a map of
+the sensor with every plate pixel (lower case: weight below 1).
+"""
+
+import argparse
+import os
+import shutil
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from plate_regions import (WIDTH, HEIGHT, PlateMask, parse_plates,  # noqa: E402
+                           format_plates)
+
+
+def is_legacy(lines):
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            return not line.startswith("PLATES")
+    return False
+
+
+def with_edge_weight(mask, weight):
+    edge = set(y * WIDTH + x for x, y in mask.outline())
+    old = mask.weights or (1.0,) * len(mask.indices)
+    return PlateMask(mask.indices, [w * weight if i in edge else w
+                                    for i, w in zip(mask.indices, old)])
+
+
+def sensor_map(plates):
+    grid = [["." for _ in range(WIDTH)] for _ in range(HEIGHT)]
+    for lbl, mask in plates.items():
+        weights = mask.weights or (1.0,) * len(mask.indices)
+        for i, w in zip(mask.indices, weights):
+            x, y = i % WIDTH, i // WIDTH
+            ch = lbl.upper() if w >= 1.0 else lbl.lower()
+            grid[y][x] = "#" if grid[y][x] != "." else ch
+    head = "   " + "".join(str(x % 10) for x in range(WIDTH))
+    rows = [f"{y:>2} " + "".join(row) for y, row in enumerate(grid)]
+    return "\n".join([head] + rows) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    mig = sub.add_parser("migrate", help="legacy label:x:y -> PLATES 2")
+    mig.add_argument("path")
+    mig.add_argument("--units", choices=("pixel", "grid"), required=True,
+                     help="what x, y mean in the legacy file")
+    mig.add_argument("--edge-weight", type=float, default=1.0)
+    out = mig.add_mutually_exclusive_group()
+    out.add_argument("-o", "--output", help="write here (default: stdout)")
+    out.add_argument("--in-place", action="store_true",
+                     help="overwrite path, keeping path.bak")
+    show = sub.add_parser("show", help="print a sensor map of the masks")
+    show.add_argument("path")
+    show.add_argument("--units", choices=("pixel", "grid"), default="pixel",
+                      help="how to read a legacy file")
+    args = parser.parse_args()
+
+    with open(args.path) as f:
+        lines = f.read().splitlines()
+    plates = parse_plates(lines, legacy_grid=args.units == "grid")
+    if args.cmd == "show":
+        print(f"{'legacy' if is_legacy(lines) else 'PLATES 2'} file, "
+              f"{len(plates)} plates")
+        for lbl in sorted(plates):
+            m = plates[lbl]
+            print(f"  {lbl}: {len(m.indices)} px"
+                  f"{', weighted' if m.weights else ''}")
+        print(sensor_map(plates), end="")
+        return
+
+    if not is_legacy(lines):
+        print(f"{args.path} is already a PLATES file", file=sys.stderr)
+        if args.edge_weight == 1.0:
+            return
+    if args.edge_weight != 1.0:
+        plates = {lbl: with_edge_weight(m, args.edge_weight)
+                  for lbl, m in plates.items()}
+    text = format_plates(plates, note=f"migrated from {os.path.basename(args.path)}"
+                         f" ({args.units} units)")
+    if args.in_place:
+        shutil.copyfile(args.path, args.path + ".bak")
+        with open(args.path, "w") as f:
+            f.write(text)
+        print(f"wrote {args.path} (old file in {args.path}.bak)")
+    elif args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"wrote {args.output}")
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Turns captured PROFILE: lines (stage_profiler.py) into a per-stage timing
+table and compares captures, e.g. two firmware versions.
+
+Each report window is one "PROFILE:ms=..,win=.." line followed by one
+"PROFILE:<stage>=n/min/mean/p95/max" line per stage (microseconds). Windows
+are merged per stage: n-weighted mean, overall min and max, and the median
+and worst of the per-window p95 values.
+
+    python profile_report.py capture.log
+    python profile_report.py old.log new.log            # side by side
+    python profile_report.py --port /dev/ttyACM0        # PyBadge USB console
+
+With several captures the first is the baseline and every other one gets a
+change column (mean and p95, in percent). Lines may carry a prefix such as a
+timestamp, so ESP32 serial captures (PROFILE lines echoed from the PyBadge)
+work as they are.
+"""
+
+import argparse
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+from latency_monitor import lines_from_serial   # noqa: E402
+
+
+def parse_profile(line):
+    """One PROFILE: line -> ("window", ms, win) / ("stage", name, tuple) / None"""
+    i = line.find("PROFILE:")
+    if i < 0:
+        return None
+    body = line[i + 8:].strip()
+    try:
+        if body.startswith("ms="):
+            ms, win = (int(f.split("=", 1)[1]) for f in body.split(","))
+            return ("window", ms, win)
+        name, value = body.split("=", 1)
+        n, lo, mean, p95, hi = (int(v) for v in value.split("/"))
+    except ValueError:
+        return None
+    return ("stage", name, (n, lo, mean, p95, hi))
+
+
+class StageStats:
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.p95s = []
+
+    def add(self, n, lo, mean, p95, hi):
+        if not n:
+            return
+        self.n += n
+        self.total += mean * n
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        self.p95s.append(p95)
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else 0.0
+
+    @property
+    def p95(self):
+        """Median of the per-window p95 values"""
+        if not self.p95s:
+            return 0
+        s = sorted(self.p95s)
+        return s[len(s) // 2]
+
+    @property
+    def p95_worst(self):
+        return max(self.p95s) if self.p95s else 0
+
+
+class Capture:
+    def __init__(self, name):
+        self.name = name
+        self.windows = 0
+        self.seconds = 0.0
+        self.stages = {}            # insertion order = firmware stage order
+
+    def feed(self, line):
+        item = parse_profile(line)
+        if item is None:
+            return False
+        if item[0] == "window":
+            self.windows += 1
+            self.seconds += item[2] / 1000.0
+        else:
+            self.stages.setdefault(item[1], StageStats()).add(*item[2])
+        return True
+
+    def read(self, lines):
+        for line in lines:
+            self.feed(line)
+        return self
+
+
+def _ms(us):
+    return f"{us / 1000.0:.2f}"
+
+
+def table(cap, out=sys.stdout):
+    out.write(f"{cap.name}: {cap.windows} windows, {cap.seconds:.0f} s\n")
+    out.write(f"{'stage':<12}{'n':>7}{'min ms':>10}{'mean ms':>10}"
+              f"{'p95 ms':>10}{'p95 worst':>11}{'max ms':>10}\n")
+    for name, s in cap.stages.items():
+        out.write(f"{name:<12}{s.n:>7}{_ms(s.min or 0):>10}{_ms(s.mean):>10}"
+                  f"{_ms(s.p95):>10}{_ms(s.p95_worst):>11}{_ms(s.max or 0):>10}\n")
+
+
+def _change(new, old):
+    if not old:
+        return "-"
+    if new > 10 * old:
+        return f"x{new / old:.0f}"
+    return f"{100.0 * (new - old) / old:+.0f}%"
+
+
+def compare(caps, out=sys.stdout):
+    """mean / p95 per stage for every capture, change vs the first"""
+    base = caps[0]
+    names = list(base.stages)
+    for cap in caps[1:]:
+        names += [n for n in cap.stages if n not in names]
+    head = f"{'stage':<12}"
+    for i, cap in enumerate(caps):
+        label = os.path.basename(cap.name)[:20]
+        head += f"{label + ' mean/p95':>26}"
+        if i:
+            head += f"{'change':>16}"
+    out.write(head + "\n")
+    for name in names:
+        row = f"{name:<12}"
+        b = base.stages.get(name)
+        for i, cap in enumerate(caps):
+            s = cap.stages.get(name)
+            if s is None:
+                row += f"{'-':>26}"
+                if i:
+                    row += f"{'-':>16}"
+                continue
+            row += f"{_ms(s.mean) + ' / ' + _ms(s.p95):>26}"
+            if i:
+                delta = (f"{_change(s.mean, b.mean)}/{_change(s.p95, b.p95)}"
+                         if b is not None else "new")
+                row += f"{delta:>16}"
+        out.write(row + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("captures", nargs="*", default=["-"],
+                        help="capture files, - for stdin (default)")
+    parser.add_argument("--port", help="read a serial port until Ctrl-C")
+    parser.add_argument("--baud", type=int, default=115200)
+    args = parser.parse_args()
+
+    caps = []
+    if args.port:
+        cap = Capture(args.port)
+        try:
+            for line in lines_from_serial(args.port, args.baud):
+                if cap.feed(line) and line.find("PROFILE:ms=") >= 0:
+                    print(f"window {cap.windows}", flush=True)
+        except KeyboardInterrupt:
+            pass
+        caps.append(cap)
+    else:
+        for path in args.captures:
+            if path == "-":
+                caps.append(Capture("stdin").read(sys.stdin))
+            else:
+                with open(path, errors="replace") as f:
+                    caps.append(Capture(path).read(f))
+
+    caps = [c for c in caps if c.stages]
+    if not caps:
+        print("no PROFILE lines")
+        return
+    for cap in caps:
+        table(cap)
+        print()
+    if len(caps) > 1:
+        compare(caps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Run a PyBadge script on a Linux host with the CircuitPython stand-ins in
+host/stubs and report task timing.
+
+The script is loaded without its `if __name__ == "__main__"` block, then its
+async main() is run for --duration seconds. Paths starting with "/" are
+resolved against --root, which plays the role of the CIRCUITPY drive
+(coordinates.txt lives there).
+
+Usage:
+    python run_pybadge.py --duration 10 --refresh-ms 120 --root ./circuitpy
+    python run_pybadge.py --duration 30 --record frames.raw
+
+    python run_pybadge.py --duration 60 --replay run.tfa --trial 2
+
+--record turns on RECORD = "usb" and saves what the script wrote to the
+usb_cdc data channel (input for host/frame_receiver.py).
+--replay feeds the sensor stand-in from a frame archive (frame_archive.py)
+instead of synthetic frames: at the recorded pace times --speed, or with
+--speed 0 the next archived frame for every sensor sub-page.
+"""
+
+import argparse
+import asyncio
+import builtins
+import os
+import runpy
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEVICE_DIR = os.path.dirname(HERE)
+STUBS = os.path.join(HERE, "stubs")
+
+DEFAULT_COORDINATES = "A:4:3\nB:20:3\nC:4:15\nD:20:15\n"
+
+
+def install_stubs():
+    for path in (DEVICE_DIR, STUBS):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def device_open(root):
+    """open() that maps absolute device paths into the host directory root"""
+    real_open = builtins.open
+
+    def _open(file, *args, **kwargs):
+        if isinstance(file, str) and file.startswith("/"):
+            candidate = os.path.join(root, file.lstrip("/"))
+            if os.path.exists(candidate) or not os.path.exists(file):
+                file = candidate
+        return real_open(file, *args, **kwargs)
+
+    return _open
+
+
+class device_files:
+    """Context manager mapping absolute paths in open() into root, for
+    loading and running a script; the real open() is back on exit"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def __enter__(self):
+        self.saved = builtins.open
+        builtins.open = device_open(self.root)
+        return self.root
+
+    def __exit__(self, *exc):
+        builtins.open = self.saved
+
+
+def load_script(path):
+    """Execute a PyBadge script's module body and return its globals
+    (inside device_files(root), which its functions also need when run)"""
+    install_stubs()
+    return runpy.run_path(path, run_name="__pybadge__")
+
+
+async def run_for(main, duration):
+    try:
+        await asyncio.wait_for(main(), duration)
+    except asyncio.TimeoutError:
+        pass
+
+
+def intervals(times):
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def summarize(events, start):
+    by_kind = {}
+    for t, kind, info in events:
+        if kind == "uart_tx" and not (info.startswith(b"TEMP:")
+                                      or info[:1] == b"\xa5"):
+            continue
+        by_kind.setdefault(kind, []).append(t)
+
+    print(f"{'task event':<12}{'count':>7}{'rate Hz':>9}"
+          f"{'mean ms':>9}{'max ms':>9}")
+    for kind in ("subpage", "frame", "uart_tx", "refresh"):
+        times = by_kind.get(kind, [])
+        if not times:
+            continue
+        gaps = intervals(times)
+        span = (times[-1] - start) if times else 0.0
+        rate = len(times) / span if span > 0 else 0.0
+        mean = 1e3 * sum(gaps) / len(gaps) if gaps else 0.0
+        worst = 1e3 * max(gaps) if gaps else 0.0
+        print(f"{kind:<12}{len(times):>7}{rate:>9.2f}{mean:>9.1f}{worst:>9.1f}")
+
+    # sensor data -> temperatures-sent latency
+    frames = by_kind.get("subpage") or by_kind.get("frame", [])
+    lat = []
+    for t in by_kind.get("uart_tx", []):
+        prev = [f for f in frames if f <= t]
+        if prev:
+            lat.append(t - prev[-1])
+    if lat:
+        print(f"\nsensor->send latency: mean {1e3 * sum(lat) / len(lat):.1f} ms,"
+              f" max {1e3 * max(lat):.1f} ms")
+
+
+def replay_source(path, trial=None, speed=1.0, loop=True):
+    """ArchiveReplay over a whole archive or one indexed trial"""
+    from frame_archive import FrameArchive, ArchiveReplay
+
+    arch = FrameArchive(path)
+    start, stop = 0, len(arch)
+    if trial is not None:
+        row, _ = arch.trial(trial)
+        start, stop = int(row["start"]), int(row["stop"])
+    return ArchiveReplay(arch, start, stop, speed=speed, loop=loop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--script",
+                        default=os.path.join(DEVICE_DIR, "pid_control_pybadge.py"))
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--refresh-ms", type=float, default=0.0,
+                        help="simulated display.refresh() cost")
+    parser.add_argument("--binary", action="store_true",
+                        help="request binary UART frames like the ESP32 does")
+    parser.add_argument("--root", default=None,
+                        help="directory standing in for CIRCUITPY")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record frames over usb_cdc.data into PATH")
+    parser.add_argument("--usb-limit", type=int, default=None,
+                        help="bytes the usb_cdc host takes per write()")
+    parser.add_argument("--replay", metavar="ARCHIVE",
+                        help="sensor frames from this frame archive")
+    parser.add_argument("--trial", type=int, default=None,
+                        help="replay only this trial (needs the index)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed, 0 = one frame per sub-page")
+    args = parser.parse_args()
+
+    root = args.root
+    if root is None:
+        root = tempfile.mkdtemp(prefix="circuitpy_")
+        with open(os.path.join(root, "coordinates.txt"), "w") as f:
+            f.write(DEFAULT_COORDINATES)
+
+    install_stubs()
+    import stub_hw
+    import time
+
+    stub_hw.refresh_cost_s = args.refresh_ms / 1000.0
+    if args.replay:
+        stub_hw.frame_source = replay_source(args.replay, args.trial,
+                                             args.speed)
+    if args.binary:
+        stub_hw.uart_port.feed(b"REQUEST_CALIB:BIN1\r\n")
+    start = time.monotonic()
+    stub_hw.usb_write_limit = args.usb_limit
+    # opened before device_files() maps absolute paths into root
+    record = open(args.record, "wb") if args.record else None
+    with device_files(root):
+        g = load_script(args.script)
+        if args.record:
+            # run_path returns a copy; main() reads the module's own globals
+            g["main"].__globals__["RECORD"] = "usb"
+        asyncio.run(run_for(g["main"], args.duration))
+    summarize(stub_hw.events, start)
+    if args.record:
+        with record:
+            record.write(stub_hw.usb_data)
+        print(f"\nrecorded {len(stub_hw.usb_data)} bytes to {args.record}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""CPython stand-in for adafruit_display_text.label."""
+
+
+class Label:
+    def __init__(self, font, text="", color=0xFFFFFF, x=0, y=0, scale=1,
+                 **kwargs):
+        self.font = font
+        self.text = text
+        self.color = color
+        self.x = x
+        self.y = y
+        self.scale = scale
@@ -0,0 +1,120 @@
+"""
+CPython stand-in for adafruit_mlx90640.
+
+Behaves like a free-running sensor on the I2C bus: a new chess-pattern
+sub-page becomes ready every 1 / sub-page-rate seconds (time.monotonic),
+the status register at 0x8000 carries the data-ready and sub-page bits, and
+an unread sub-page is overwritten by the next one. The driver-level helpers
+(_GetFrameData, _GetTa, _CalculateTo, getFrame) follow the real library, with
+the temperatures of each sub-page taken from stub_hw.frame_source.
+"""
+
+import time
+
+import stub_hw
+
+OPENAIR_TA_SHIFT = 8
+
+
+class RefreshRate:
+    REFRESH_0_5_HZ = 0b000
+    REFRESH_1_HZ = 0b001
+    REFRESH_2_HZ = 0b010
+    REFRESH_4_HZ = 0b011
+    REFRESH_8_HZ = 0b100
+    REFRESH_16_HZ = 0b101
+    REFRESH_32_HZ = 0b110
+    REFRESH_64_HZ = 0b111
+
+
+def subpage_rate_hz(refresh_rate):
+    return 0.5 * (1 << refresh_rate)
+
+
+class MLX90640:
+    def __init__(self, i2c_bus, address=0x33):
+        self.i2c = i2c_bus
+        self._refresh_rate = RefreshRate.REFRESH_2_HZ
+        self._epoch = time.monotonic()
+        self._produced = 0        # sub-pages completed since _epoch
+        self._consumed = 0        # index of last sub-page read (+1)
+        self._image = [0.0] * 768
+        self.overruns = 0         # sub-pages overwritten before being read
+        self.i2c_words = 0        # words transferred, for throughput numbers
+
+    # ---------- configuration ----------
+    @property
+    def refresh_rate(self):
+        return self._refresh_rate
+
+    @refresh_rate.setter
+    def refresh_rate(self, value):
+        self._sync()
+        self._refresh_rate = value
+        self._epoch = time.monotonic()
+        self._produced = self._consumed = 0
+
+    # ---------- simulated sensor RAM ----------
+    def _sync(self):
+        period = 1.0 / subpage_rate_hz(self._refresh_rate)
+        produced = int((time.monotonic() - self._epoch) / period)
+        if produced > self._consumed + 1:
+            self.overruns += produced - self._consumed - 1
+            self._consumed = produced - 1
+        self._produced = produced
+
+    def _ready(self):
+        self._sync()
+        return self._produced > self._consumed
+
+    def _I2CReadWords(self, addr, buffer, *, end=None):
+        n = len(buffer) if end is None else end
+        self.i2c_words += n
+        if addr == 0x8000:
+            subpage = (self._produced - 1) & 1 if self._produced else 0
+            buffer[0] = (0x0008 if self._ready() else 0) | subpage
+        else:
+            for i in range(n):
+                buffer[i] = 0
+
+    def _I2CWriteWord(self, addr, data):
+        self.i2c_words += 1
+        if addr == 0x8000 and not data & 0x0008:
+            self._consumed = self._produced
+
+    def _GetFrameData(self, frameData):
+        while not self._ready():
+            period = 1.0 / subpage_rate_hz(self._refresh_rate)
+            wait = self._epoch + (self._consumed + 1) * period - time.monotonic()
+            time.sleep(max(wait, 0.0005))
+        page = (self._produced - 1) & 1
+        self._I2CWriteWord(0x8000, 0x0030)
+        self.i2c_words += 832
+        stub_hw.frame_source(self._image)
+        frameData[832] = 0x1901
+        frameData[833] = page
+        stub_hw.record("subpage", page)
+        return page
+
+    def _GetTa(self, frameData):
+        return 23.15 + OPENAIR_TA_SHIFT
+
+    def _CalculateTo(self, frameData, emissivity, tr, result):
+        page = frameData[833]
+        image = self._image
+        for row in range(24):
+            start = row * 32 + ((row + page) & 1)
+            # per pixel like the real driver, so list and array('f') both work
+            for i in range(start, row * 32 + 32, 2):
+                result[i] = image[i]
+
+    def getFrame(self, framebuf):
+        emissivity = 0.95
+        mlx90640Frame = [0] * 834
+        for _ in range(2):
+            status = self._GetFrameData(mlx90640Frame)
+            if status < 0:
+                raise RuntimeError("Frame data error")
+            tr = self._GetTa(mlx90640Frame) - OPENAIR_TA_SHIFT
+            self._CalculateTo(mlx90640Frame, emissivity, tr, framebuf)
+        stub_hw.record("frame")
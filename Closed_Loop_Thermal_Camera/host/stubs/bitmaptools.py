@@ -0,0 +1,21 @@
+"""CPython stand-in for CircuitPython's bitmaptools.arrayblit."""
+
+
+def arrayblit(bitmap, data, x1=0, y1=0, x2=None, y2=None, skip_index=None):
+    if x2 is None:
+        x2 = bitmap.width
+    if y2 is None:
+        y2 = bitmap.height
+    if (x1, y1, x2, y2) == (0, 0, bitmap.width, bitmap.height) and skip_index is None:
+        # Whole-bitmap copy, the case the native arrayblit handles as a memcpy
+        bitmap._data[:] = bytes(data)
+        return
+    w = x2 - x1
+    i = 0
+    for y in range(y1, y2):
+        row = y * bitmap.width
+        for x in range(x1, x1 + w):
+            v = int(data[i])
+            i += 1
+            if v != skip_index:
+                bitmap._data[row + x] = v
@@ -0,0 +1,28 @@
+"""CPython stand-in for the PyBadge `board` module."""
+
+import time
+
+import stub_hw
+
+TX = "TX"
+RX = "RX"
+SCL = "SCL"
+SDA = "SDA"
+
+
+class _Display:
+    width = 160
+    height = 128
+
+    def __init__(self):
+        self.root_group = None
+        self.auto_refresh = True
+
+    def refresh(self, **kwargs):
+        if stub_hw.refresh_cost_s:
+            time.sleep(stub_hw.refresh_cost_s)
+        stub_hw.record("refresh")
+        return True
+
+
+DISPLAY = _Display()
@@ -0,0 +1,48 @@
+"""CPython stand-in for CircuitPython's busio (UART and I2C)."""
+
+import stub_hw
+
+
+class UART:
+    def __init__(self, tx=None, rx=None, baudrate=9600, timeout=1.0, **kwargs):
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self._port = stub_hw.uart_port
+
+    @property
+    def in_waiting(self):
+        return self._port.in_waiting()
+
+    def read(self, nbytes=None):
+        n = self._port.in_waiting() if nbytes is None else nbytes
+        data = self._port.read(n)
+        return data or None
+
+    def readinto(self, buf):
+        data = self._port.read(len(buf))
+        buf[:len(data)] = data
+        return len(data) or None
+
+    def readline(self):
+        rx = self._port.rx
+        end = rx.find(b"\n")
+        if end < 0:
+            return self.read() if rx else None
+        return self._port.read(end + 1)
+
+    def write(self, buf):
+        return self._port.write(buf)
+
+    def reset_input_buffer(self):
+        self._port.read(self._port.in_waiting())
+
+
+class I2C:
+    def __init__(self, scl=None, sda=None, frequency=100000):
+        self.frequency = frequency
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
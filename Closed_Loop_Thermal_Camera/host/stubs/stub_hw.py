@@ -0,0 +1,86 @@
+"""
+Shared state behind the CircuitPython stand-ins in this directory.
+
+The stand-ins (board, busio, adafruit_mlx90640, ...) never talk to real
+hardware; they read frames from `frame_source`, move UART bytes through
+`uart_port` and append (time, kind, info) tuples to `events`. Host harnesses
+such as run_pybadge.py replace these hooks before loading a PyBadge script.
+"""
+
+import time
+
+WIDTH, HEIGHT = 32, 24
+
+events = []            # (time.monotonic(), kind, info)
+refresh_cost_s = 0.0   # simulated display.refresh() duration
+
+
+def record(kind, info=None):
+    events.append((time.monotonic(), kind, info))
+
+
+class SerialPort:
+    """Byte pipe for the device UART.
+
+    Bytes the device writes go to `written` (and to `peer`, if one is
+    attached); bytes for the device are queued with feed().
+    """
+
+    def __init__(self):
+        self.rx = bytearray()
+        self.written = bytearray()
+        self.peer = None
+
+    def feed(self, data):
+        self.rx += data
+
+    def in_waiting(self):
+        return len(self.rx)
+
+    def read(self, n):
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+    def write(self, data):
+        self.written += data
+        if self.peer is not None:
+            self.peer(bytes(data))
+        record("uart_tx", bytes(data))
+        return len(data)
+
+
+uart_port = SerialPort()
+
+# usb_cdc.data: bytes the device wrote, and how many one write() may take
+# (None = all; small values simulate a slow host)
+usb_data = bytearray()
+usb_write_limit = None
+
+
+def synthetic_frame(buf, plates=None, background=36.0, plate_temp=25.0):
+    """Fill buf with a flat background and cool 4x3 plate boxes"""
+    for i in range(WIDTH * HEIGHT):
+        buf[i] = background
+    for x0, y0 in (plates or ((4, 3), (20, 3), (4, 15), (20, 15))):
+        for y in range(y0, min(y0 + 3, HEIGHT)):
+            for x in range(x0, min(x0 + 4, WIDTH)):
+                buf[y * WIDTH + x] = plate_temp
+
+
+# Called by MLX90640.getFrame(buf) to produce the next frame
+frame_source = synthetic_frame
+
+
+class ReplaySource:
+    """frame_source that replays recorded frames in a loop"""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+
+    def __call__(self, buf):
+        src = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        for i in range(WIDTH * HEIGHT):
+            buf[i] = src[i]
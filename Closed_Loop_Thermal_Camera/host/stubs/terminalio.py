@@ -0,0 +1,3 @@
+"""CPython stand-in for CircuitPython's terminalio."""
+
+FONT = object()
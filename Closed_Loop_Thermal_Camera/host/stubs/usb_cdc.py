@@ -0,0 +1,35 @@
+"""CPython stand-in for CircuitPython's usb_cdc (data channel only)."""
+
+import stub_hw
+
+
+class Serial:
+    def __init__(self):
+        self.timeout = 1.0
+        self.write_timeout = None
+        self.connected = True
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        return b""
+
+    def write(self, buf):
+        n = len(buf)
+        if stub_hw.usb_write_limit is not None:
+            n = min(n, stub_hw.usb_write_limit)
+        stub_hw.usb_data.extend(bytes(buf[:n]))
+        return n
+
+    def flush(self):
+        pass
+
+
+console = None
+data = Serial()
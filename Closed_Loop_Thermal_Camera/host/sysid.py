@@ -0,0 +1,380 @@
+"""
+System identification of the Peltier plates from recorded logs.
+
+Input is the ESP32 USB serial output with logging on (send LOG:ON, see
+ESP32.py): one "LOG:<ms>,<tA>,<pwmA>,...,<tD>,<pwmD>" line per temperature
+update, PWM signed as applied (+ heat, - cool). Other lines are ignored, so a
+whole session capture can be passed as is. hil_sim.py / pid_tune traces
+(CSV with t, meas_X and pwm_X columns) are accepted too.
+
+Per plate and per direction (heating, cooling) a first-order model with dead
+time is fitted on a uniform grid (samples averaged into dt bins):
+
+    y[k+1] = c + a y[k] + b u[k-d]        u = duty of that direction (0..1)
+
+Rows where the other direction is driven are left out; rows with the plate
+off are shared by both fits. For each dead time d up to --max-delay the fit
+is an ordinary least-squares solve over the whole recording, refined with two
+instrumental-variable passes (instruments from the simulated model output) to
+remove the bias that sensor noise puts on a. The d with the smallest
+residual wins. --order 2 adds y[k-1] to the regression and stores the
+second-order coefficients next to the first-order fit.
+
+Saved model (JSON), loadable by arena_model.ArenaPlant.from_model():
+
+    {"format": "sysid/1", "dt": 0.5, "order": 1,
+     "plates": {"A": {"heat": {"tau": s, "gain": C at full duty,
+                               "t_bulk": C, "dead_time": s, "samples": n,
+                               "rmse": C, "sim_rmse": C}, "cool": {...}}}}
+
+Cooling gains are stored as magnitudes (C below t_bulk at full duty).
+
+Usage:
+    python sysid.py session.log [more.log ...] -o plates.json [--order 2]
+    python sysid.py run.csv                                  # hil_sim trace
+    python sysid.py --simulate ident.log --hours 3 --rate 8    # test data
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+from arena_model import (                       # noqa: E402
+    ArenaPlant, PeltierPlate, PLATE_LABELS, PWM_FULL,
+)
+
+FORMAT = "sysid/1"
+DIRECTIONS = ("heat", "cool")
+DEFAULT_DT = 0.5
+MIN_EXCITED = 20     # driven samples needed before a direction is fitted
+
+
+# ================= LOG PARSING =================
+def parse_log(path):
+    """-> (t seconds, temps (N, 4), signed pwm (N, 4)), sorted by time"""
+    with open(path) as f:
+        first = f.readline()
+        if first.startswith("t,"):
+            return _parse_trace(first, f)
+        rows = []
+        for line in [first] + f.readlines():
+            i = line.find("LOG:")
+            if i < 0:
+                continue
+            fields = line[i + 4:].strip().split(",")
+            if len(fields) != 1 + 2 * len(PLATE_LABELS):
+                continue
+            try:
+                rows.append([float(v) for v in fields])
+            except ValueError:
+                continue
+    if not rows:
+        raise ValueError(path + ": no LOG lines")
+    a = np.array(rows)
+    t = a[:, 0] / 1000.0
+    order = np.argsort(t, kind="stable")
+    return t[order], a[order, 1::2], a[order, 2::2]
+
+
+def _parse_trace(header, f):
+    cols = header.strip().split(",")
+    a = np.loadtxt(f, delimiter=",", ndmin=2)
+    t_col = cols.index("t")
+    meas = [cols.index("meas_" + lbl) for lbl in PLATE_LABELS]
+    pwm = [cols.index("pwm_" + lbl) for lbl in PLATE_LABELS]
+    return a[:, t_col], a[:, meas], a[:, pwm]
+
+
+def resample(t, temps, pwm, dt):
+    """Average samples into dt bins.
+
+    Returns (y (M, 4), u_heat (M, 4), u_cool (M, 4), valid (M,)) where u are
+    the mean duties (0..1) over each bin and valid marks non-empty bins.
+    """
+    idx = np.floor((t - t[0]) / dt).astype(np.int64)
+    m = int(idx[-1]) + 1
+    count = np.bincount(idx, minlength=m).astype(float)
+    valid = count > 0
+    safe = np.where(valid, count, 1.0)
+    y = np.empty((m, temps.shape[1]))
+    u_heat = np.empty_like(y)
+    u_cool = np.empty_like(y)
+    heat = np.clip(pwm, 0, None) / PWM_FULL
+    cool = np.clip(-pwm, 0, None) / PWM_FULL
+    for j in range(temps.shape[1]):
+        y[:, j] = np.bincount(idx, temps[:, j], m) / safe
+        u_heat[:, j] = np.bincount(idx, heat[:, j], m) / safe
+        u_cool[:, j] = np.bincount(idx, cool[:, j], m) / safe
+    return y, u_heat, u_cool, valid
+
+
+# ================= FITTING =================
+def _rows(valid, other, order, d, n):
+    """Indices k usable for predicting y[k+1] with dead time d"""
+    k = np.arange(max(order - 1, d), n - 1)
+    ok = valid[k + 1] & (other[k - d] == 0)
+    for i in range(order):
+        ok &= valid[k - i]
+    ok &= valid[k - d]
+    return k[ok]
+
+
+def _regressors(y, u, k, d, order):
+    cols = [np.ones(len(k))]
+    cols += [y[k - i] for i in range(order)]
+    cols.append(u[k - d])
+    return np.column_stack(cols)
+
+
+def _simulate(theta, y, u, k, d, order):
+    """Model output for rows k, re-anchored to the data at every gap"""
+    c, a, b = theta[0], theta[1:1 + order], theta[1 + order]
+    sim = y.copy()
+    rows = set(k.tolist())
+    # a Python loop, but only one pass over the grid per refinement
+    for kk in range(max(order - 1, d), len(y) - 1):
+        if kk not in rows:
+            continue
+        v = c + b * u[kk - d]
+        for i in range(order):
+            v += a[i] * sim[kk - i]
+        sim[kk + 1] = v
+    return sim
+
+
+def fit_arx(y, u, other, valid, dt, order=1, max_delay=10, iv_passes=2):
+    """Best dead time + ARX coefficients for one plate and direction"""
+    n = len(y)
+    best = None
+    for d in range(max_delay + 1):
+        k = _rows(valid, other, order, d, n)
+        if len(k) < 10 * (order + 2):
+            continue
+        if np.count_nonzero(u[k - d]) < MIN_EXCITED:
+            return None
+        X = _regressors(y, u, k, d, order)
+        target = y[k + 1]
+        theta = np.linalg.lstsq(X, target, rcond=None)[0]
+        mse = float(np.mean((target - X @ theta) ** 2))
+        if best is None or mse < best[0]:
+            best = (mse, d, k, theta)
+    if best is None:
+        return None
+    mse, d, k, theta = best
+    X = _regressors(y, u, k, d, order)
+    target = y[k + 1]
+    for _ in range(iv_passes):
+        sim = _simulate(theta, y, u, k, d, order)
+        Z = _regressors(sim, u, k, d, order)
+        try:
+            theta = np.linalg.solve(Z.T @ X, Z.T @ target)
+        except np.linalg.LinAlgError:
+            break
+    sim = _simulate(theta, y, u, k, d, order)
+    return {
+        "theta": theta, "dead_steps": d, "samples": int(len(k)),
+        "rmse": float(np.sqrt(np.mean((target - X @ theta) ** 2))),
+        "sim_rmse": float(np.sqrt(np.mean((y[k + 1] - sim[k + 1]) ** 2))),
+    }
+
+
+def first_order(fit, dt, cooling):
+    c, a, b = (float(v) for v in fit["theta"])
+    if not 0.0 < a < 1.0:
+        raise ValueError("unstable or non-decaying fit (a = %.4f)" % a)
+    gain = b / (1.0 - a)
+    return {
+        "tau": -dt / math.log(a),
+        "gain": -gain if cooling else gain,
+        "t_bulk": c / (1.0 - a),
+        "dead_time": fit["dead_steps"] * dt,
+        "samples": fit["samples"],
+        "rmse": fit["rmse"],
+        "sim_rmse": fit["sim_rmse"],
+    }
+
+
+def second_order(fit, dt, cooling):
+    c, a1, a2, b = (float(v) for v in fit["theta"])
+    s = 1.0 - a1 - a2
+    poles = np.roots([1.0, -a1, -a2])
+    taus = sorted((-dt / math.log(abs(p)) for p in poles if 0 < abs(p) < 1),
+                  reverse=True)
+    gain = b / s
+    return {
+        "a": [a1, a2], "b": b, "c": c,
+        "gain": -gain if cooling else gain,
+        "t_bulk": c / s,
+        "taus": taus,
+        "dead_time": fit["dead_steps"] * dt,
+        "samples": fit["samples"],
+        "rmse": fit["rmse"],
+        "sim_rmse": fit["sim_rmse"],
+    }
+
+
+def identify(paths, dt=None, order=1, max_delay=10):
+    """Fit every plate/direction over all logs; returns the model dict.
+
+    dt defaults to DEFAULT_DT, or the median sample interval if the logs are
+    sparser than that. Separate logs are joined with an empty bin between
+    them so no row spans two recordings.
+    """
+    logs = [parse_log(path) for path in paths]
+    if dt is None:
+        interval = float(np.median(np.concatenate(
+            [np.diff(t) for t, _, _ in logs])))
+        dt = max(DEFAULT_DT, round(interval, 3))
+    parts = [resample(t, temps, pwm, dt) for t, temps, pwm in logs]
+    gap = [np.zeros((1, len(PLATE_LABELS)))] * 3 + [np.zeros(1, bool)]
+    joined = []
+    for part in parts:
+        joined.append(part)
+        joined.append(gap)
+    y, u_heat, u_cool, valid = (np.concatenate(c) for c in zip(*joined[:-1]))
+
+    model = {"format": FORMAT, "dt": dt, "order": order,
+             "sources": [os.path.basename(p) for p in paths], "plates": {}}
+    for j, lbl in enumerate(PLATE_LABELS):
+        plate = {}
+        for direction in DIRECTIONS:
+            cooling = direction == "cool"
+            u = (u_cool if cooling else u_heat)[:, j]
+            other = (u_heat if cooling else u_cool)[:, j]
+            fit = fit_arx(y[:, j], u, other, valid, dt, 1, max_delay)
+            if fit is None:
+                continue
+            try:
+                entry = first_order(fit, dt, cooling)
+            except ValueError as e:
+                print(f"plate {lbl} {direction}: {e}")
+                continue
+            if order == 2:
+                fit2 = fit_arx(y[:, j], u, other, valid, dt, 2, max_delay)
+                if fit2 is not None:
+                    entry["second_order"] = second_order(fit2, dt, cooling)
+            plate[direction] = entry
+        model["plates"][lbl] = plate
+    return model
+
+
+# ================= TEST DATA =================
+def simulate_log(path, hours=3.0, rate=8.0, noise=0.1, seed=1):
+    """Write an identification log from the plant model: random open-loop
+    DRIVE steps on every plate through the ESP32 port, LOG lines at the
+    sensor rate. Returns the true plates for comparison."""
+    from esp32_port import Esp32Controller, PWM_MIN, PWM_MAX
+    from pid_tune import PlateSensor
+
+    rng = random.Random(seed)
+    plates = {lbl: PeltierPlate(
+        heat_capacity=rng.uniform(12, 30), conductance=rng.uniform(0.4, 0.7),
+        heat_power=rng.uniform(14, 26), cool_power=rng.uniform(20, 34),
+        dead_time=rng.choice((0.5, 1.0, 1.5, 2.0)),
+        t_bulk=36.0 + rng.uniform(-0.3, 0.3)) for lbl in PLATE_LABELS}
+    for p in plates.values():
+        p.temp = p.t_bulk
+    plant = ArenaPlant(plates)
+    sensor = PlateSensor(plant, period=1.0 / rate, noise=noise, seed=seed)
+    now = [0.0]
+    esp = Esp32Controller(
+        drive=lambda lbl, pwm: plant[lbl].set_drive(pwm, now[0]))
+    esp.setup(0)
+    esp.command("LOG:ON")
+    next_step = {lbl: 0.0 for lbl in PLATE_LABELS}
+    step_ms = 50
+    for k in range(1, int(hours * 3600 * 1000 / step_ms) + 1):
+        now[0] = k * step_ms / 1000.0
+        for lbl in PLATE_LABELS:
+            if now[0] >= next_step[lbl]:
+                next_step[lbl] = now[0] + rng.uniform(20, 150)
+                level = rng.choice((0, 1, 1, -1, -1))
+                pwm = level * rng.randint(PWM_MIN, PWM_MAX)
+                esp.command(f"DRIVE:{lbl}:{pwm}")
+        esp.loop(k * step_ms)
+        sensor.update(now[0], lambda temps: esp.on_temperatures(
+            ("temp", None, None, temps)))
+        plant.step(step_ms / 1000.0, now[0])
+    with open(path, "w") as f:
+        for ms, text in esp.log:
+            f.write(text + "\n")
+    return plates
+
+
+# ================= OUTPUT =================
+def print_model(model, truth=None):
+    print(f"{'plate':<6}{'dir':<6}{'tau s':>8}{'gain C':>8}{'bulk C':>8}"
+          f"{'dead s':>8}{'rmse':>7}{'sim':>7}{'n':>8}")
+    for lbl, plate in model["plates"].items():
+        for direction in DIRECTIONS:
+            e = plate.get(direction)
+            if e is None:
+                print(f"{lbl:<6}{direction:<6}   (not excited)")
+                continue
+            print(f"{lbl:<6}{direction:<6}{e['tau']:>8.1f}{e['gain']:>8.2f}"
+                  f"{e['t_bulk']:>8.2f}{e['dead_time']:>8.2f}"
+                  f"{e['rmse']:>7.3f}{e['sim_rmse']:>7.3f}{e['samples']:>8}")
+            if "second_order" in e:
+                s = e["second_order"]
+                taus = "/".join("%.1f" % v for v in s["taus"])
+                print(f"{'':<6}{'  2nd':<6}{taus:>8}{s['gain']:>8.2f}"
+                      f"{s['t_bulk']:>8.2f}{s['dead_time']:>8.2f}"
+                      f"{s['rmse']:>7.3f}{s['sim_rmse']:>7.3f}")
+        if truth is not None:
+            p = truth[lbl]
+            print(f"{lbl:<6}{'true':<6}{p.tau:>8.1f}"
+                  f"{p.heat_power / p.conductance:>8.2f}{p.t_bulk:>8.2f}"
+                  f"{p.dead_time:>8.2f}   (cool gain "
+                  f"{p.cool_power / p.conductance:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("logs", nargs="*")
+    parser.add_argument("-o", "--output", help="model JSON to write")
+    parser.add_argument("--dt", type=float,
+                        help="fit grid, s (samples are averaged into bins); "
+                             "default 0.5 or the log's sample interval")
+    parser.add_argument("--order", type=int, choices=(1, 2), default=1)
+    parser.add_argument("--max-delay", type=int, default=10,
+                        help="largest dead time tried, in dt steps")
+    parser.add_argument("--simulate", metavar="LOG",
+                        help="write a test log from the plant model and fit it")
+    parser.add_argument("--hours", type=float, default=3.0)
+    parser.add_argument("--rate", type=float, default=8.0,
+                        help="--simulate: temperature updates per second")
+    args = parser.parse_args()
+
+    truth = None
+    if args.simulate:
+        t0 = time.perf_counter()
+        truth = simulate_log(args.simulate, args.hours, args.rate)
+        print(f"wrote {args.simulate} ({args.hours} h at {args.rate} Hz) in "
+              f"{time.perf_counter() - t0:.1f} s")
+        args.logs = [args.simulate]
+    if not args.logs:
+        parser.error("no logs given")
+
+    t0 = time.perf_counter()
+    model = identify(args.logs, args.dt, args.order, args.max_delay)
+    wall = time.perf_counter() - t0
+    print_model(model, truth)
+    print(f"\nfitted in {wall:.2f} s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(model, f, indent=1)
+        print(f"model written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
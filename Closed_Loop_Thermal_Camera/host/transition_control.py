@@ -0,0 +1,434 @@
+"""
+Setpoint transitions for the pattern engine: feed-forward and short-horizon
+MPC, as a Python reference for the ESP32 controller.
+
+At every phase change the firmware jumps the targets between 25 and 36 C,
+resets the integrators and lets the PID catch up. TransitionController
+(an esp32_port.Esp32Controller) instead uses a first-order model of each
+plate (arena_model defaults or a host/sysid.py fit) and the pattern
+schedule:
+
+  ff   predicts the plate temperature one dead time ahead from the last
+       reading and the PWM already applied (Smith predictor), drives at
+       PWM_MAX until the prediction is within boost_band of the target, then
+       holds with the model's steady-state duty plus a PID trim (full drive
+       only comes back for errors above rearm_band, not for sensor noise).
+       lead_s before a phase change it already drives toward the next
+       target.
+  mpc  every PID interval evaluates two-block input sequences (first 1 s,
+       then held) over a horizon_s horizon against the scheduled
+       reference, which includes the next phase's targets, and applies the
+       first move of the cheapest one. Vectorized over all candidates with
+       numpy.
+
+Output is signed (+ heat, - cool) and respects PWM_MIN/PWM_MAX like the
+firmware.
+
+Run as a script to compare the current firmware behaviour with the signed
+PID, ff and mpc on a pattern and print, for every transition, the time
+until the plate stays within --band of its new target:
+
+    python transition_control.py --pattern C-D-A-B [--mismatch 0.2]
+        [--model plates.json]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+from arena_model import ArenaPlant, PLATE_LABELS, PWM_FULL, T_BULK  # noqa: E402
+from esp32_port import (                                             # noqa: E402
+    Esp32Controller, constrain, PWM_MIN, PWM_MAX, LOOP_DELAY, TEMP_HEAT,
+    TEMP_COOL, TRIAL_TIME, BUFFER_TIME, FINAL_TIME, STATE_TRIAL,
+    STATE_BUFFER, STATE_FINAL,
+)
+from pid_tune import PlateSensor, SETTLE_BAND                        # noqa: E402
+
+HOLD_S = 20.0        # a transition is done once the plate stays in band this long
+
+
+# ================= PLATE MODEL =================
+class PlateModel:
+    """First-order plate: T -> t_bulk + gain * duty with time constant tau"""
+
+    def __init__(self, tau, heat_gain, cool_gain, t_bulk=T_BULK,
+                 dead_time=0.0):
+        self.tau = tau
+        self.heat_gain = heat_gain
+        self.cool_gain = cool_gain
+        self.t_bulk = t_bulk
+        self.dead_time = dead_time
+
+    @classmethod
+    def from_plate(cls, plate, scale=None):
+        """From an arena_model.PeltierPlate; scale perturbs the parameters
+        ({name: factor}) to test model mismatch"""
+        scale = scale or {}
+        return cls(tau=plate.tau * scale.get("tau", 1.0),
+                   heat_gain=plate.heat_power / plate.conductance
+                   * scale.get("heat_gain", 1.0),
+                   cool_gain=plate.cool_power / plate.conductance
+                   * scale.get("cool_gain", 1.0),
+                   t_bulk=plate.t_bulk,
+                   dead_time=plate.dead_time * scale.get("dead_time", 1.0))
+
+    def steady(self, pwm):
+        duty = min(abs(pwm), PWM_FULL) / PWM_FULL
+        if pwm > 0:
+            return self.t_bulk + self.heat_gain * duty
+        if pwm < 0:
+            return self.t_bulk - self.cool_gain * duty
+        return self.t_bulk
+
+    def advance(self, temp, pwm, dt):
+        ss = self.steady(pwm)
+        return ss + (temp - ss) * math.exp(-dt / self.tau)
+
+    def hold_pwm(self, target):
+        """Signed PWM that holds target in steady state"""
+        diff = target - self.t_bulk
+        gain = self.heat_gain if diff > 0 else self.cool_gain
+        if gain <= 0:
+            return 0.0
+        return diff / gain * PWM_FULL
+
+
+def plant_models(plant, mismatch=0.0, seed=0):
+    """PlateModels for every plate of an ArenaPlant, each parameter off by up
+    to +-mismatch (relative)"""
+    rng = random.Random(seed)
+    models = {}
+    for lbl in PLATE_LABELS:
+        scale = {k: 1.0 + rng.uniform(-mismatch, mismatch)
+                 for k in ("tau", "heat_gain", "cool_gain", "dead_time")}
+        models[lbl] = PlateModel.from_plate(plant[lbl], scale)
+    return models
+
+
+# ================= CONTROLLER =================
+class TransitionController(Esp32Controller):
+    """Esp32Controller with model-based transitions (mode "ff" or "mpc")"""
+
+    def __init__(self, models, mode="ff", lead_s=None, boost_band=0.3,
+                 rearm_band=1.5, horizon_s=12.0, sensor_lag=0.25, kp=4.0, ki=0.2, kd=0.0,
+                 move_weight=0.02, **kwargs):
+        kwargs.setdefault("signed_output", True)
+        super().__init__(kp=kp, ki=ki, kd=kd, **kwargs)
+        if mode not in ("ff", "mpc"):
+            raise ValueError("mode must be ff or mpc")
+        self.models = models
+        self.mode = mode
+        self.lead_s = lead_s
+        self.boost_band = boost_band
+        self.rearm_band = rearm_band
+        self.sensor_lag = sensor_lag
+        self.move_weight = move_weight
+        self.history = {lbl: [(0.0, 0)] for lbl in PLATE_LABELS}
+        self.ff_target = {lbl: None for lbl in PLATE_LABELS}
+        self.boosting = {lbl: False for lbl in PLATE_LABELS}
+
+        # MPC candidates: first block (1 s) x rest of the horizon
+        dt = self.pid_interval / 1000.0
+        self.horizon = max(2, int(round(horizon_s / dt)))
+        self.first_block = min(2, self.horizon - 1)
+        mags = np.linspace(PWM_MIN, PWM_MAX, 25)
+        levels = np.concatenate((-mags[::-1], [0.0], mags))
+        u1, u2 = np.meshgrid(levels, levels, indexing="ij")
+        self.u1 = u1.ravel()
+        self.u2 = u2.ravel()
+
+    # ---------- schedule ----------
+    def next_switch(self):
+        """(time_ms, {label: target or None}) of the next phase change"""
+        if self.state == STATE_TRIAL:
+            return (self.phase_start + TRIAL_TIME,
+                    {lbl: TEMP_HEAT for lbl in PLATE_LABELS})
+        if self.state == STATE_BUFFER:
+            cool = self.pattern[self.pattern_index]
+            return (self.phase_start + BUFFER_TIME,
+                    {lbl: TEMP_COOL if lbl == cool else TEMP_HEAT
+                     for lbl in PLATE_LABELS})
+        if self.state == STATE_FINAL:
+            return (self.phase_start + FINAL_TIME,
+                    {lbl: None for lbl in PLATE_LABELS})
+        return None
+
+    def target_at(self, p, t_ms, switch):
+        if switch is not None and t_ms >= switch[0]:
+            return switch[1][p.label]
+        return p.target_temp
+
+    # ---------- prediction ----------
+    def _apply(self, p, signed_pwm):
+        hist = self.history[p.label]
+        if signed_pwm != hist[-1][1]:
+            hist.append((self.now / 1000.0, signed_pwm))
+        super()._apply(p, signed_pwm)
+
+    def predict(self, p, m):
+        """Plate temperature when an output set now starts to act.
+
+        The reading describes the plate sensor_lag ago; everything that acts
+        between then and now + dead_time was applied in the window
+        [reading - dead_time, now], so it is already in the history.
+        """
+        now = self.now / 1000.0
+        t0 = now - self.sensor_lag - m.dead_time
+        hist = self.history[p.label]
+        while len(hist) > 1 and hist[1][0] <= t0:
+            hist.pop(0)
+        temp = p.current_temp
+        t = t0
+        for i, (t_set, pwm) in enumerate(hist):
+            t_end = hist[i + 1][0] if i + 1 < len(hist) else now
+            if t_end <= t:
+                continue
+            temp = m.advance(temp, pwm, t_end - t)
+            t = t_end
+        return temp
+
+    # ---------- control ----------
+    def update_pid(self, p):
+        if self.now - p.last_update < self.pid_interval:
+            return
+        p.last_update = self.now
+        m = self.models[p.label]
+        y = self.predict(p, m)
+        switch = self.next_switch()
+        if self.mode == "mpc":
+            pwm = self.mpc(p, m, y, switch)
+        else:
+            pwm = self.feed_forward(p, m, y, switch)
+        self._apply(p, self.quantize(pwm))
+
+    def feed_forward(self, p, m, y, switch):
+        target = p.target_temp
+        lead_s = m.dead_time if self.lead_s is None else self.lead_s
+        if switch is not None and switch[0] - self.now <= lead_s * 1000:
+            target = switch[1][p.label]
+        if target is None:
+            return 0
+        error = target - y
+        if target != self.ff_target[p.label]:
+            self.ff_target[p.label] = target
+            self.boosting[p.label] = True
+            p.error_sum = 0.0
+            p.last_error = 0.0
+        elif abs(error) > self.rearm_band:
+            self.boosting[p.label] = True
+        if self.boosting[p.label]:
+            if abs(error) > self.boost_band:
+                return PWM_MAX if error > 0 else -PWM_MAX
+            self.boosting[p.label] = False
+        dt = self.pid_interval / 1000.0
+        p.error_sum = constrain(p.error_sum + error * dt,
+                                -self.i_clamp, self.i_clamp)
+        d_err = (error - p.last_error) / dt
+        p.last_error = error
+        return (m.hold_pwm(target) + self.kp * error
+                + self.ki * p.error_sum + self.kd * d_err)
+
+    def mpc(self, p, m, y0, switch):
+        dt_ms = self.pid_interval
+        start = self.now + m.dead_time * 1000
+        refs = [self.target_at(p, start + (k + 1) * dt_ms, switch)
+                for k in range(self.horizon)]
+        if refs[0] is None:
+            return 0
+        u1, u2 = self.u1, self.u2
+        a = math.exp(-dt_ms / 1000.0 / m.tau)
+        ss1 = self._steady(m, u1)
+        ss2 = self._steady(m, u2)
+        y = np.full(u1.shape, y0)
+        cost = np.zeros(u1.shape)
+        for k, ref in enumerate(refs):
+            ss = ss1 if k < self.first_block else ss2
+            y = ss + (y - ss) * a
+            if ref is not None:
+                cost += (y - ref) ** 2
+        cost += self.move_weight * self.horizon * (
+            ((u1 - p.pwm) / PWM_MAX) ** 2)
+        return float(u1[int(np.argmin(cost))])
+
+    @staticmethod
+    def _steady(m, u):
+        duty = np.abs(u) / PWM_FULL
+        return m.t_bulk + np.where(u > 0, m.heat_gain * duty,
+                                   -m.cool_gain * duty)
+
+    @staticmethod
+    def quantize(pwm):
+        """Signed output within the firmware's PWM_MIN..PWM_MAX"""
+        mag = abs(pwm)
+        if mag < PWM_MIN / 2:
+            return 0
+        mag = int(constrain(round(mag), PWM_MIN, PWM_MAX))
+        return mag if pwm > 0 else -mag
+
+
+# ================= BENCHMARK =================
+PHASE_PREFIXES = ("TRIAL START", "BUFFER", "FINAL HEAT")
+
+
+def run(esp, plant, pattern, sensor_kwargs=None, step_ms=LOOP_DELAY,
+        settle_s=10.0):
+    """Closed loop over the whole pattern; returns (trace, end_s).
+
+    trace is a list of (t_s, true temps) at every step.
+    """
+    sensor = PlateSensor(plant, **(sensor_kwargs or {}))
+    clock = [0.0]
+    esp.drive_cb = lambda lbl, pwm: plant[lbl].set_drive(pwm, clock[0])
+    ps = esp.peltiers
+
+    def on_reading(temps):
+        for p, t in zip(ps, temps):
+            p.current_temp = t
+
+    n = len(pattern.replace("-", ""))
+    end_s = (settle_s + n * TRIAL_TIME / 1000 + (n - 1) * BUFFER_TIME / 1000
+             + FINAL_TIME / 1000)
+    step_s = step_ms / 1000.0
+    trace = []
+    for k in range(1, int(round(end_s / step_s)) + 1):
+        now = k * step_s
+        clock[0] = now
+        if k * step_ms == int(settle_s * 1000):
+            esp.command("PATTERN:" + pattern)
+        sensor.update(now, on_reading)
+        esp.loop(k * step_ms)
+        plant.step(step_s, now)
+        trace.append((now, plant.temps()))
+    return trace, end_s
+
+
+def phase_targets(log):
+    """[(start_s, text, {label: target})] from the controller log"""
+    out = []
+    for ms, text in log:
+        if not text.startswith(PHASE_PREFIXES):
+            continue
+        cool = text[-1] if text.startswith("TRIAL START") else None
+        out.append((ms / 1000.0, text, {
+            lbl: TEMP_COOL if lbl == cool else TEMP_HEAT
+            for lbl in PLATE_LABELS}))
+    return out
+
+
+def transition_times(trace, log, band=SETTLE_BAND, hold_s=HOLD_S):
+    """For every plate whose target changes at a phase start: seconds until
+    it enters band and stays there hold_s (None if it does not in time)"""
+    phases = phase_targets(log)
+    prev = {lbl: T_BULK for lbl in PLATE_LABELS}
+    times = np.array([t for t, _ in trace])
+    temps = np.array([v for _, v in trace])
+    out = []
+    for i, (t0, text, targets) in enumerate(phases):
+        t1 = phases[i + 1][0] if i + 1 < len(phases) else times[-1]
+        sel = (times >= t0) & (times < t1)
+        t_phase = times[sel]
+        for j, lbl in enumerate(PLATE_LABELS):
+            if targets[lbl] == prev[lbl]:
+                continue
+            inside = np.abs(temps[sel, j] - targets[lbl]) < band
+            out.append((text, lbl, prev[lbl], targets[lbl],
+                        _settled(t_phase, inside, t0, hold_s)))
+        prev = targets
+    return out
+
+
+def _settled(t, inside, t0, hold_s):
+    """First time from which inside holds for hold_s (or to the phase end)"""
+    start = None
+    for ti, ok in zip(t, inside):
+        if ok:
+            if start is None:
+                start = ti
+            if ti - start >= hold_s:
+                return start - t0
+        else:
+            start = None
+    if start is not None and t[-1] - start >= hold_s / 2:
+        return start - t0
+    return None
+
+
+def make_controllers(plant, mismatch, seed):
+    models = plant_models(plant, mismatch, seed)
+    return {
+        "firmware": lambda: Esp32Controller(),
+        "pid-signed": lambda: Esp32Controller(signed_output=True),
+        "ff": lambda: TransitionController(models, "ff"),
+        "mpc": lambda: TransitionController(models, "mpc"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pattern", default="C-D-A-B")
+    parser.add_argument("--model", help="plant model from sysid.py")
+    parser.add_argument("--mismatch", type=float, default=0.0,
+                        help="controller model error, relative (e.g. 0.2)")
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument("--band", type=float, default=SETTLE_BAND)
+    parser.add_argument("--only", help="comma separated controller names")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def new_plant():
+        if args.model:
+            return ArenaPlant.from_model(args.model)
+        return ArenaPlant()
+
+    controllers = make_controllers(new_plant(), args.mismatch, args.seed)
+    if args.only:
+        controllers = {k: v for k, v in controllers.items()
+                       if k in args.only.split(",")}
+    results = {}
+    walls = {}
+    for name, factory in controllers.items():
+        esp = factory()
+        t0 = time.perf_counter()
+        trace, _ = run(esp, new_plant(), args.pattern,
+                       {"noise": args.noise, "seed": args.seed})
+        walls[name] = time.perf_counter() - t0
+        results[name] = transition_times(trace, esp.log, args.band)
+
+    names = list(results)
+    rows = results[names[0]]
+    print(f"time until within {args.band} C of the new target "
+          f"(held {HOLD_S:.0f} s), s")
+    print(f"{'phase':<24}{'plate':>6}{'':>14}"
+          + "".join(f"{n:>12}" for n in names))
+    for i, (text, lbl, t_from, t_to, _) in enumerate(rows):
+        cells = "".join(f"{_fmt(results[n][i][4]):>12}" for n in names)
+        print(f"{text[:23]:<24}{lbl:>6}{t_from:>7.0f} ->{t_to:>3.0f}{cells}")
+    print(f"{'mean (never = phase)':<44}" + "".join(
+        f"{_mean(results[n]):>12.1f}" for n in names))
+    print(f"{'simulation wall s':<44}" + "".join(
+        f"{walls[n]:>12.1f}" for n in names))
+
+
+def _fmt(v):
+    return "never" if v is None else "%.1f" % v
+
+
+def _mean(rows):
+    vals = []
+    for text, _, _, _, v in rows:
+        limit = (TRIAL_TIME if text.startswith("TRIAL") else BUFFER_TIME) / 1000
+        vals.append(limit if v is None else v)
+    return sum(vals) / len(vals)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Host-side reference decoder for the PyBadge -> ESP32 UART stream.
+
+Decodes the binary frames defined in uart_frames.py and the ASCII lines
+(TEMP:..., CALIB_OK, ...) that can be interleaved with them, resynchronising
+on the next SYNC byte after a CRC error. The ESP32 parser in ESP32.py follows
+the same state machine.
+
+Run as a script to benchmark encode/decode throughput against the ASCII
+format:
+
+    python uart_decode.py [--frames 200000] [--batch 4]
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from uart_frames import (  # noqa: E402
+    SYNC, VERSION, MAX_BATCH, HEADER_SIZE, RECORD_SIZE, CRC_SIZE,
+    FrameEncoder, crc16,
+)
+
+RECORD = struct.Struct("<I4h")
+LABELS = "ABCD"
+
+
+class FrameDecoder:
+    """Incremental decoder for a mixed binary/ASCII byte stream.
+
+    feed() returns a list of items: ("temp", seq, timestamp_ms, temps) for
+    every record (ASCII TEMP lines have seq and timestamp None) and
+    ("line", text) for other ASCII lines.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.frames = 0
+        self.records = 0
+        self.crc_errors = 0
+        self.bad_headers = 0
+        self.skipped = 0
+
+    def feed(self, data):
+        buf = self.buf
+        buf += data
+        out = []
+        pos = 0
+        n = len(buf)
+        while pos < n:
+            if buf[pos] == SYNC:
+                if n - pos < HEADER_SIZE:
+                    break
+                version, count = buf[pos + 1], buf[pos + 2]
+                if version != VERSION or not 1 <= count <= MAX_BATCH:
+                    self.bad_headers += 1
+                    pos = self._resync(pos)
+                    continue
+                end = pos + HEADER_SIZE + RECORD_SIZE * count
+                if n < end + CRC_SIZE:
+                    break
+                (crc,) = struct.unpack_from("<H", buf, end)
+                if crc != crc16(buf, pos + 1, end):
+                    self.crc_errors += 1
+                    pos = self._resync(pos)
+                    continue
+                (seq,) = struct.unpack_from("<H", buf, pos + 3)
+                off = pos + HEADER_SIZE
+                for i in range(count):
+                    ts, a, b, c, d = RECORD.unpack_from(buf, off)
+                    out.append(("temp", (seq + i) & 0xFFFF, ts,
+                                (a / 100, b / 100, c / 100, d / 100)))
+                    off += RECORD_SIZE
+                self.frames += 1
+                self.records += count
+                pos = end + CRC_SIZE
+                continue
+            nl = buf.find(b"\n", pos)
+            sync = buf.find(bytes((SYNC,)), pos)
+            if 0 <= sync < (nl if nl >= 0 else n):
+                # garbage (or a line cut by a frame) before the next frame
+                self.skipped += sync - pos
+                pos = sync
+                continue
+            if nl < 0:
+                break
+            line = bytes(buf[pos:nl]).strip()
+            pos = nl + 1
+            if line.startswith(b"TEMP:"):
+                temps = parse_ascii(line)
+                if temps is not None:
+                    out.append(("temp", None, None, temps))
+            elif line:
+                out.append(("line", line.decode("ascii", "replace")))
+        del buf[:pos]
+        return out
+
+    def _resync(self, pos):
+        """Skip a broken frame up to the next SYNC or past the next newline"""
+        buf = self.buf
+        sync = buf.find(bytes((SYNC,)), pos + 1)
+        nl = buf.find(b"\n", pos + 1)
+        candidates = [p for p in (sync, nl + 1 if nl >= 0 else -1) if p > 0]
+        new = min(candidates) if candidates else len(buf)
+        self.skipped += new - pos
+        return new
+
+
+def parse_ascii(line):
+    """b"TEMP:A:35.20,B:..." -> (A, B, C, D), None if malformed"""
+    temps = [None] * 4
+    try:
+        for field in line[5:].split(b","):
+            lbl, value = field.split(b":")
+            temps[LABELS.index(lbl.decode())] = float(value)
+    except ValueError:
+        return None
+    return tuple(temps)
+
+
+# ---------- benchmark ----------
+def _readings(n, seed=5):
+    rng = random.Random(seed)
+    return [tuple(36.0 + rng.gauss(0, 0.5) for _ in range(4))
+            for _ in range(n)]
+
+
+def bench(frames, batch):
+    readings = _readings(frames)
+
+    enc = FrameEncoder(batch)
+    stream = bytearray()
+    t0 = time.perf_counter()
+    for i, temps in enumerate(readings):
+        n = enc.add(i * 125, temps)
+        if n:
+            stream += enc.frame(n)
+    n = enc.finish()
+    if n:
+        stream += enc.frame(n)
+    t_enc = time.perf_counter() - t0
+
+    ascii_stream = bytearray()
+    t0 = time.perf_counter()
+    for temps in readings:
+        msg = "TEMP:"
+        for lbl, t in zip(LABELS, temps):
+            msg += f"{lbl}:{t:.2f},"
+        ascii_stream += (msg.rstrip(",") + "\n").encode()
+    t_ascii_enc = time.perf_counter() - t0
+
+    rows = []
+    for name, data, t_e in (("binary", stream, t_enc),
+                            ("ascii", ascii_stream, t_ascii_enc)):
+        dec = FrameDecoder()
+        t0 = time.perf_counter()
+        got = 0
+        for i in range(0, len(data), 64):   # UART-sized chunks
+            got += len(dec.feed(data[i:i + 64]))
+        t_dec = time.perf_counter() - t0
+        assert got == frames, (name, got)
+        rows.append((name, len(data) / frames, t_e, t_dec))
+
+    # Corruption check: flip one byte in every 50th frame
+    dec = FrameDecoder()
+    bad = bytearray(stream)
+    size = HEADER_SIZE + RECORD_SIZE * batch + CRC_SIZE
+    for off in range(size // 2, len(bad), 50 * size):
+        bad[off] ^= 0x5A
+    got = sum(1 for item in dec.feed(bad) if item[0] == "temp")
+
+    print(f"{frames} readings, batch={batch}")
+    print(f"{'format':<8}{'bytes/reading':>14}{'enc us':>9}{'dec us':>9}"
+          f"{'dec readings/s':>16}")
+    for name, size_per, t_e, t_d in rows:
+        print(f"{name:<8}{size_per:>14.1f}{1e6 * t_e / frames:>9.2f}"
+              f"{1e6 * t_d / frames:>9.2f}{frames / t_d:>16.0f}")
+    print(f"\ncorrupted 1/50 frames: {dec.crc_errors} CRC errors detected, "
+          f"{got}/{frames} readings kept")
+    baud_bytes = 115200 / 10
+    print(f"115200 baud wire time per reading: binary "
+          f"{1e3 * rows[0][1] / baud_bytes:.2f} ms, ascii "
+          f"{1e3 * rows[1][1] / baud_bytes:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=1)
+    args = parser.parse_args()
+    bench(args.frames, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Checks that the bulk Peltier array stays uniform in recorded frames.
+
+Place learning assumes the 60-plate bulk array holds every spot within
++-1 C. This reads frame archives (frame_archive.py) chunk by chunk, masks
+out the four precision plates from coordinates.txt (plus --margin pixels
+around them, which see the plate edges) and computes for every frame, as
+array operations over the whole chunk:
+
+    std     spatial standard deviation of the bulk pixels, C
+    span    max - min of the bulk pixels, C
+    grad    largest difference between two neighbouring bulk pixels, C/px
+    in %    bulk pixels within --tol of the reference (the frame's bulk
+            median, or --target)
+
+plus a per-pixel map of the fraction of frames each pixel was in spec. A
+frame counts as uniform when at least --frame-pct of its bulk pixels are
+in spec. With an index (frame_archive.py index) the report is also split
+by trial phase. Memory stays at one chunk per worker; files are analysed
+in parallel, one process each.
+
+    python uniformity.py run*.tfa --plates coordinates.txt
+    python uniformity.py run.tfa --plates coordinates.txt --target 36 --map
+    python uniformity.py runs/*.tfa --plates coordinates.txt --require 99
+
+With --require the exit status is 1 when any file has fewer uniform frames
+than that percentage, for use in an automatic pipeline.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for path in (HERE, os.path.dirname(HERE)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from frame_archive import FrameArchive                   # noqa: E402
+from plate_regions import WIDTH, HEIGHT, read_plates      # noqa: E402
+
+STATS = ("std", "span", "grad", "in_pct")
+
+
+def bulk_mask(plates, margin=1, roi=None):
+    """HEIGHT x WIDTH bool: True for bulk pixels (not a plate, inside roi)"""
+    plate = np.zeros((HEIGHT, WIDTH), dtype=bool)
+    for mask in plates.values():
+        for x, y in mask.pixels():
+            plate[y, x] = True
+    for _ in range(margin):
+        grown = plate.copy()
+        grown[1:, :] |= plate[:-1, :]
+        grown[:-1, :] |= plate[1:, :]
+        grown[:, 1:] |= plate[:, :-1]
+        grown[:, :-1] |= plate[:, 1:]
+        plate = grown
+    bulk = ~plate
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        inside = np.zeros_like(bulk)
+        inside[y0:y1 + 1, x0:x1 + 1] = True
+        bulk &= inside
+    return bulk
+
+
+def neighbour_pairs(bulk):
+    """Flat index pairs of horizontally / vertically adjacent bulk pixels"""
+    idx = np.arange(WIDTH * HEIGHT).reshape(HEIGHT, WIDTH)
+    h = bulk[:, :-1] & bulk[:, 1:]
+    v = bulk[:-1, :] & bulk[1:, :]
+    a = np.concatenate([idx[:, :-1][h], idx[:-1, :][v]])
+    b = np.concatenate([idx[:, 1:][h], idx[1:, :][v]])
+    return a, b
+
+
+class Analyzer:
+    """Per-frame statistics and the in-spec map for one archive"""
+
+    def __init__(self, bulk, tol=1.0, target=None, frame_pct=95.0):
+        self.idx = np.flatnonzero(bulk)
+        if not len(self.idx):
+            raise ValueError("no bulk pixels left after masking")
+        self.pair_a, self.pair_b = neighbour_pairs(bulk)
+        self.tol = tol
+        self.target = target
+        self.frame_pct = frame_pct
+
+    def chunk(self, temps):
+        """(stats N x 4, in-spec count per bulk pixel) for N frames"""
+        flat = temps.reshape(len(temps), -1)
+        b = flat[:, self.idx]
+        if self.target is None:
+            ref = np.median(b, axis=1)
+        else:
+            ref = np.full(len(b), self.target, dtype=b.dtype)
+        ok = np.abs(b - ref[:, None]) <= self.tol
+        stats = np.empty((len(b), len(STATS)), dtype=np.float32)
+        stats[:, 0] = b.std(axis=1)
+        stats[:, 1] = b.max(axis=1) - b.min(axis=1)
+        if len(self.pair_a):
+            stats[:, 2] = np.abs(flat[:, self.pair_a]
+                                 - flat[:, self.pair_b]).max(axis=1)
+        else:
+            stats[:, 2] = 0.0
+        stats[:, 3] = 100.0 * ok.mean(axis=1)
+        return stats, ok.sum(axis=0)
+
+    def run(self, arch, chunk_frames=512):
+        """stats (frames x 4) and the in-spec fraction map of an archive"""
+        stats = np.empty((len(arch), len(STATS)), dtype=np.float32)
+        counts = np.zeros(len(self.idx), dtype=np.int64)
+        for start, temps in arch.chunks(chunk_frames):
+            s, c = self.chunk(temps)
+            stats[start:start + len(s)] = s
+            counts += c
+        frac = np.full(WIDTH * HEIGHT, np.nan)
+        frac[self.idx] = counts / max(len(arch), 1)
+        return stats, frac.reshape(HEIGHT, WIDTH)
+
+
+def describe(stats, frame_pct):
+    """Summary numbers of a stats block (frames x 4)"""
+    if not len(stats):
+        return None
+    return {
+        "frames": len(stats),
+        "std": float(stats[:, 0].mean()),
+        "std_p95": float(np.percentile(stats[:, 0], 95)),
+        "span_max": float(stats[:, 1].max()),
+        "grad_p95": float(np.percentile(stats[:, 2], 95)),
+        "in_pct": float(stats[:, 3].mean()),
+        "uniform_pct": float(100.0 * np.mean(stats[:, 3] >= frame_pct)),
+    }
+
+
+def analyse_file(job):
+    """Worker: one archive -> result dict (runs in a pool process)"""
+    path, opts = job
+    t0 = time.perf_counter()
+    arch = FrameArchive(path)
+    analyzer = Analyzer(opts["bulk"], opts["tol"], opts["target"],
+                        opts["frame_pct"])
+    stats, frac = analyzer.run(arch, opts["chunk"])
+    phases = []
+    for row in arch.phases:
+        name = str(row["kind"]) + (" " + str(row["plate"])
+                                   if row["plate"] else "")
+        d = describe(stats[row["start"]:row["stop"]], opts["frame_pct"])
+        if d:
+            phases.append((name, d))
+    if opts["csv"]:
+        write_csv(os.path.join(opts["csv"], os.path.basename(path) + ".csv"),
+                  arch, stats)
+    return {"path": path, "total": describe(stats, opts["frame_pct"]),
+            "phases": phases, "map": frac,
+            "seconds": time.perf_counter() - t0}
+
+
+def write_csv(path, arch, stats):
+    with open(path, "w") as f:
+        f.write("t,counter," + ",".join(STATS) + "\n")
+        for t, c, s in zip(arch.times, arch.counters, stats):
+            f.write(f"{t:.3f},{c}," + ",".join(f"{v:.3f}" for v in s) + "\n")
+
+
+def map_text(frac):
+    """Time-in-spec map: 0-9 = tenths of the frames in spec, # = masked"""
+    rows = []
+    for y in range(HEIGHT):
+        rows.append(f"{y:>2} " + "".join(
+            "#" if np.isnan(v) else str(min(int(v * 10), 9))
+            for v in frac[y]))
+    head = "   " + "".join(str(x % 10) for x in range(WIDTH))
+    return "\n".join([head] + rows)
+
+
+def row_text(name, d):
+    return (f"{name:<24}{d['frames']:>8}{d['std']:>7.2f}{d['std_p95']:>8.2f}"
+            f"{d['span_max']:>9.2f}{d['grad_p95']:>9.2f}{d['in_pct']:>8.1f}"
+            f"{d['uniform_pct']:>10.1f}")
+
+
+def analyse_all(paths, opts, workers=None):
+    """Results for all paths in input order, one process per file"""
+    jobs = [(p, opts) for p in paths]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [analyse_file(j) for j in jobs]
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(analyse_file, jobs, chunksize=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("archives", nargs="+")
+    parser.add_argument("--plates", required=True, help="coordinates.txt")
+    parser.add_argument("--units", choices=("pixel", "grid"), default="pixel",
+                        help="how to read a legacy coordinates.txt")
+    parser.add_argument("--margin", type=int, default=1,
+                        help="pixels around each plate left out")
+    parser.add_argument("--roi", help="x0,y0,x1,y1: only this part of the "
+                                      "sensor is bulk array")
+    parser.add_argument("--tol", type=float, default=1.0,
+                        help="in spec: within this many C of the reference")
+    parser.add_argument("--target", type=float, default=None,
+                        help="reference temperature (default: frame median)")
+    parser.add_argument("--frame-pct", type=float, default=95.0,
+                        help="a frame is uniform with this %% in spec")
+    parser.add_argument("--require", type=float, default=None,
+                        help="exit 1 if a file has fewer uniform frames (%%)")
+    parser.add_argument("--chunk", type=int, default=512,
+                        help="frames per chunk")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="processes, default all cores")
+    parser.add_argument("--map", action="store_true",
+                        help="print the time-in-spec map of every file")
+    parser.add_argument("--csv", metavar="DIR",
+                        help="write per-frame statistics here")
+    args = parser.parse_args()
+
+    plates = read_plates(args.plates, legacy_grid=args.units == "grid")
+    roi = tuple(int(v) for v in args.roi.split(",")) if args.roi else None
+    bulk = bulk_mask(plates, args.margin, roi)
+    if args.csv:
+        os.makedirs(args.csv, exist_ok=True)
+    opts = {"bulk": bulk, "tol": args.tol, "target": args.target,
+            "frame_pct": args.frame_pct, "chunk": args.chunk,
+            "csv": args.csv}
+
+    t0 = time.perf_counter()
+    results = analyse_all(args.archives, opts, args.workers)
+    wall = time.perf_counter() - t0
+
+    ref = f"{args.target:.1f} C" if args.target is not None else "frame median"
+    print(f"bulk: {int(bulk.sum())} pixels, in spec = within {args.tol:g} C "
+          f"of {ref}, uniform frame = {args.frame_pct:g} % in spec\n")
+    print(f"{'file / phase':<24}{'frames':>8}{'std':>7}{'std95':>8}"
+          f"{'span max':>9}{'grad95':>9}{'in %':>8}{'uniform %':>10}")
+    failed = []
+    frames = 0
+    for r in results:
+        d = r["total"]
+        name = os.path.basename(r["path"])
+        if d is None:
+            print(f"{name:<24}{'empty':>8}")
+            continue
+        frames += d["frames"]
+        print(row_text(name, d))
+        for phase, pd in r["phases"]:
+            print(row_text("  " + phase, pd))
+        if args.require is not None and d["uniform_pct"] < args.require:
+            failed.append(name)
+        if args.map:
+            print(map_text(r["map"]))
+    print(f"\n{frames} frames in {len(results)} files, {wall:.2f} s "
+          f"({frames / wall:.0f} frames/s)")
+    if failed:
+        print(f"below {args.require:g} % uniform frames: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
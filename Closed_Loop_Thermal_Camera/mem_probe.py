@@ -0,0 +1,68 @@
+"""
+Per-stage heap allocation counter for CircuitPython loops.
+
+Wrap a stage in begin() / end(stage) and the bytes it took from the heap
+(gc.mem_free() before minus after) are added up per stage. If a garbage
+collection ran inside the stage, mem_free goes up instead; that sample is
+counted as a collection and not as an allocation. Nothing is allocated on
+the measuring path, so the probe itself shows up as 0 bytes.
+
+    probe = MemProbe(("acquire", "send"))
+    probe.begin(); reader.poll(); probe.end(0)
+    ...
+    print(probe.report())     # "MEM:acquire=0/12,send=0/4,gc=0,free=81234"
+
+report() gives bytes per iteration (average over the window, /iterations)
+and resets the window. With enabled=False, or without gc.mem_free
+(CPython), the probe is disabled and report() returns None.
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+import gc
+
+try:
+    _mem_free = gc.mem_free
+except AttributeError:
+    _mem_free = None
+
+
+class MemProbe:
+    def __init__(self, stages, enabled=True):
+        self.stages = tuple(stages)
+        n = len(self.stages)
+        self.enabled = enabled and _mem_free is not None
+        self.bytes = [0] * n
+        self.iters = [0] * n
+        self.collections = 0
+        self._mark = 0
+
+    def begin(self):
+        if self.enabled:
+            self._mark = _mem_free()
+
+    def end(self, stage):
+        if not self.enabled:
+            return
+        used = self._mark - _mem_free()
+        if used < 0:
+            self.collections += 1
+        else:
+            self.bytes[stage] += used
+        self.iters[stage] += 1
+
+    def report(self):
+        """One MEM: line for the window since the last report, then reset"""
+        if not self.enabled:
+            return None
+        parts = []
+        for i, name in enumerate(self.stages):
+            n = self.iters[i]
+            per = self.bytes[i] // n if n else 0
+            parts.append("%s=%d/%d" % (name, per, n))
+            self.bytes[i] = 0
+            self.iters[i] = 0
+        line = "MEM:%s,gc=%d,free=%d" % (",".join(parts), self.collections,
+                                         _mem_free())
+        self.collections = 0
+        return line
@@ -0,0 +1,89 @@
+"""
+Non-blocking MLX90640 sub-page acquisition.
+
+adafruit_mlx90640.MLX90640.getFrame() busy-waits for both chess-pattern
+sub-pages, so one call takes two sub-page periods. SubpageReader instead
+checks the data-ready bit and, only when a sub-page is waiting, reads it and
+merges its 384 pixels into the caller's frame. It uses the driver's own
+read/calculate routines, so temperatures are identical to getFrame().
+
+    reader = SubpageReader(mlx, frame, RefreshRate.REFRESH_8_HZ)
+    while True:
+        page = reader.poll()      # -1: nothing new, else 0 or 1
+        if page >= 0 and (MODE == "subpage" or reader.complete):
+            ...                   # frame holds the latest merged image
+
+Higher refresh rates give fresher plate values but more pixel noise
+(roughly sqrt(rate)); in "frame" mode the caller only acts on complete
+frames, in "subpage" mode it acts on every half-frame update.
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+STATUS_REG = 0x8000
+STATUS_DATA_READY = 0x0008
+STATUS_SUBPAGE = 0x0001
+EMISSIVITY = 0.95
+OPENAIR_TA_SHIFT = 8
+
+# refresh_rate register value -> sub-page rate (Hz)
+SUBPAGE_RATE = {0: 0.5, 1: 1, 2: 2, 3: 4, 4: 8, 5: 16, 6: 32, 7: 64}
+
+
+def chess_indices(subpage, width=32, height=24):
+    """Frame indices updated by one sub-page in the default chess mode"""
+    return tuple(
+        y * width + x
+        for y in range(height)
+        for x in range(width)
+        if ((x + y) & 1) == subpage
+    )
+
+
+class SubpageReader:
+    """Polls an MLX90640 for sub-pages without blocking"""
+
+    def __init__(self, mlx, frame, refresh_rate=None, emissivity=EMISSIVITY):
+        self.mlx = mlx
+        self.frame = frame
+        if refresh_rate is not None:
+            mlx.refresh_rate = refresh_rate
+        self.emissivity = emissivity
+        self._status = [0]
+        self._raw = [0] * 834          # reused for every sub-page
+        self._seen = 0                 # bit mask of sub-pages merged so far
+        self.complete = False          # both sub-pages merged since last full frame
+        self.subpages = 0              # total sub-pages read
+        self.errors = 0
+
+    @property
+    def subpage_period(self):
+        return 1.0 / SUBPAGE_RATE[self.mlx.refresh_rate]
+
+    def ready(self):
+        """True if a sub-page is waiting in the sensor RAM"""
+        self.mlx._I2CReadWords(STATUS_REG, self._status)
+        return bool(self._status[0] & STATUS_DATA_READY)
+
+    def poll(self):
+        """Merge a waiting sub-page into frame; returns its number or -1"""
+        if not self.ready():
+            return -1
+        raw = self._raw
+        try:
+            page = self.mlx._GetFrameData(raw)
+            if page < 0:
+                raise RuntimeError("Frame data error")
+            tr = self.mlx._GetTa(raw) - OPENAIR_TA_SHIFT
+            self.mlx._CalculateTo(raw, self.emissivity, tr, self.frame)
+        except (OSError, RuntimeError):
+            self.errors += 1
+            return -1
+        self.subpages += 1
+        if self.complete:
+            self.complete = False
+            self._seen = 0
+        self._seen |= 1 << page
+        if self._seen == 0b11:
+            self.complete = True
+        return page
@@ -1,9 +1,27 @@
 """
 PyBadge MLX90640 PID Sender
 FIXED SCALE + CORRECT ORIENTATION + COLOR BAR + GRID OVERLAY
+
+Runs as independent asyncio tasks (sensor, send, UART commands, display),
+each at its own rate, sharing the latest frame. The send path never waits
+for a display refresh.
+
+Steady state avoids heap allocations in our own code: the frame is an
+array('f'), UART messages are formatted into preallocated buffers and the
+info label is only rebuilt when a shown value changes. With MEM_REPORT set,
+a "MEM:" line on the USB console gives the bytes allocated per iteration of
+each stage (mem_probe.py).
+
+The same stages can be timed (stage_profiler.py): set PROFILE = True, or
+send PROFILE:ON over the UART. PROFILE:<s> prints min/mean/p95/max per
+stage every <s> seconds, PROFILE alone once; the PROFILE: lines go to the
+USB console and, when asked for over the UART, back over the UART.
 """
 
+import gc
 import time
+import array
+import asyncio
 import board
 import busio
 import displayio
@@ -11,27 +29,100 @@ import terminalio
 from adafruit_display_text import label
 from simpleio import map_range
 import adafruit_mlx90640
+from thermal_render import ThermalRenderer
+from plate_regions import PlateRegions, read_plates
+from mlx_acquire import SubpageReader
+from uart_frames import (
+    FrameEncoder, AsciiEncoder, BIN_REQUEST, BIN_ACK, TIME_REQUEST,
+)
+from mem_probe import MemProbe
+from stage_profiler import StageProfiler
+from frame_recorder import FrameRecorder
 
 # ================= CONSTANTS =================
 WIDTH, HEIGHT = 32, 24
-PELTIER_W, PELTIER_H = 4, 3
 COLOR_DEPTH = 64
 SCALE = 4
-SEND_INTERVAL = 0.5   # 2 Hz
+
+# Task periods (seconds)
+SENSOR_POLL = 0.02     # data-ready polling
+SEND_INTERVAL = 0.25   # 4 Hz temperatures to the ESP32
+UART_PERIOD = 0.05     # command polling
+DISPLAY_PERIOD = 0.25  # screen refresh
 
 T_MIN = 20.0
 T_MAX = 40.0
 
 GRID_COLOR = 45   # palette index for grid outline
+REDUCER = "max"   # plate value sent to the ESP32: max / mean / median / trimmed
+
+# Sensor sub-page rate: REFRESH_4_HZ / 8_HZ / 16_HZ. Faster is fresher but
+# noisier. ACQUIRE_MODE "subpage" publishes every half-frame update (fastest),
+# "frame" only complete frames (both chess sub-pages from the same period).
+REFRESH_RATE = adafruit_mlx90640.RefreshRate.REFRESH_4_HZ
+ACQUIRE_MODE = "subpage"
+
+# Binary frames are used only after the ESP32 asks for them
+# (REQUEST_CALIB:BIN1); BIN_BATCH > 1 packs several readings per frame.
+BIN_BATCH = 1
+
+# Seconds between MEM: allocation reports on the USB console (0 = off: no
+# gc.mem_free() calls in the loop at all)
+MEM_REPORT = 0
+
+# Stage timing: on at start-up, and seconds between reports (0 = on demand)
+PROFILE = False
+PROFILE_REPORT = 10.0
+
+# Whole-frame recording (frame_recorder.py): None = off, "usb" = the
+# usb_cdc data channel (enable it in boot.py, read it with
+# host/frame_receiver.py), "file" = /sd/frames.bin when an SD card is
+# mounted, else /frames.bin (CIRCUITPY must be writable from code).
+# RECORD_SLOTS frames are buffered; a frame that finds the buffer full is
+# dropped, never waited for.
+RECORD = None
+RECORD_SLOTS = 4
+RECORD_REPORT = 10.0   # seconds between REC: status lines on the console
 
 # ================= UART =================
 uart = busio.UART(board.TX, board.RX, baudrate=115200, timeout=0.01)
+encoder = FrameEncoder(BIN_BATCH)
+ascii_encoder = AsciiEncoder()
+binary_mode = False
 
 # ================= MLX90640 =================
 i2c = busio.I2C(board.SCL, board.SDA, frequency=400000)
 mlx = adafruit_mlx90640.MLX90640(i2c)
-mlx.refresh_rate = adafruit_mlx90640.RefreshRate.REFRESH_2_HZ
-frame = [0] * (WIDTH * HEIGHT)
+frame = array.array("f", [0.0] * (WIDTH * HEIGHT))
+reader = SubpageReader(mlx, frame, REFRESH_RATE)
+frame_seq = 0   # incremented by the sensor task for every new frame
+frame_ms = 0    # monotonic ms when that frame was read (capture time)
+frame_page = 0  # sub-page of the last update
+sent_seq = 0    # frame_seq of the last frame sent to the ESP32
+new_frame = asyncio.Event()
+
+# ================= PROBES =================
+STAGES = ("acquire", "regions", "send", "uart", "render", "grid", "label",
+          "refresh", "record")
+(ST_ACQUIRE, ST_REGIONS, ST_SEND, ST_UART, ST_RENDER, ST_GRID, ST_LABEL,
+ ST_REFRESH, ST_RECORD) = range(len(STAGES))
+probe = MemProbe(STAGES, enabled=MEM_REPORT > 0)
+profiler = StageProfiler(STAGES, enabled=PROFILE)
+profile_period = PROFILE_REPORT
+profile_uart = False   # also send periodic reports over the UART
+
+def stage_begin():
+    profiler.start()
+    probe.begin()
+
+def stage_end(stage):
+    probe.end(stage)
+    profiler.stop(stage)
+
+if not probe.enabled:
+    # the memory probe costs nothing unless MEM_REPORT asks for it
+    stage_begin = profiler.start
+    stage_end = profiler.stop
 
 # ================= DISPLAY =================
 display = board.DISPLAY
@@ -54,6 +145,7 @@ tile = displayio.TileGrid(bitmap, pixel_shader=palette)
 img = displayio.Group(scale=SCALE, y=offset_y)
 img.append(tile)
 root.append(img)
+renderer = ThermalRenderer(bitmap, T_MIN, T_MAX, COLOR_DEPTH, flip=True)
 
 # ================= COLOR BAR =================
 BAR_WIDTH = 6
@@ -96,117 +188,269 @@ info = label.Label(
 root.append(info)
 
 # ================= COORDINATES =================
-peltier_pixels = {}
+plates = {}
+outline = []   # (display x, y) of every plate mask edge pixel
+regions = None
 
 def load_coordinates():
+    global regions
     try:
-        with open("/coordinates.txt", "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                lbl, px, py = line.split(":")
-                peltier_pixels[lbl] = (int(px), int(py))
-        return len(peltier_pixels) == 4
-    except:
+        # PLATES 2 masks, or legacy label:x:y pixel offsets
+        plates.update(read_plates("/coordinates.txt"))
+        # ValueError unless the plates are exactly A..D
+        regions = PlateRegions(plates, reducer=REDUCER,
+                               compute=(REDUCER,))
+        for lbl in plates:
+            for x, y in plates[lbl].outline():
+                outline.append((fx(x), y))
+        return True
+    except (OSError, ValueError) as e:
+        print("coordinates.txt:", e)
         return False
 
 # ================= HELPERS =================
-def hottest_pixel_in_region(px0, py0):
-    max_t = -100.0
-    for dy in range(PELTIER_H):
-        for dx in range(PELTIER_W):
-            px = px0 + dx
-            py = py0 + dy
-            if px < WIDTH and py < HEIGHT:
-                t = frame[py * WIDTH + px]
-                if t > max_t:
-                    max_t = t
-    return max_t
-
 # Horizontal flip (DISPLAY ONLY)
 def fx(x):
     return WIDTH - 1 - x
 
-def draw_peltier_outline(px0, py0):
-    for dx in range(PELTIER_W):
-        x = px0 + dx
-        if x < WIDTH:
-            bitmap[fx(x), py0] = GRID_COLOR
-            bitmap[fx(x), min(py0 + PELTIER_H - 1, HEIGHT - 1)] = GRID_COLOR
-    for dy in range(PELTIER_H):
-        y = py0 + dy
-        if y < HEIGHT:
-            bitmap[fx(px0), y] = GRID_COLOR
-            bitmap[fx(min(px0 + PELTIER_W - 1, WIDTH - 1)), y] = GRID_COLOR
+shown_deci = [None] * 4   # info label values, tenths of a degree
+
+def update_info():
+    """Rebuild the info label only if a shown (0.1 C) value changed"""
+    changed = False
+    vals = regions.values()
+    for i in range(4):
+        d = int(vals[i] * 10 + 0.5) if vals[i] >= 0 else int(vals[i] * 10 - 0.5)
+        if d != shown_deci[i]:
+            shown_deci[i] = d
+            changed = True
+    if changed:
+        info.text = (
+            f"A:{vals[0]:.1f} "
+            f"B:{vals[1]:.1f} "
+            f"C:{vals[2]:.1f} "
+            f"D:{vals[3]:.1f}"
+        )
 
 # ================= UART =================
 def send_temperatures():
-    msg = "TEMP:"
-    for lbl in ["A", "B", "C", "D"]:
-        px, py = peltier_pixels[lbl]
-        t = hottest_pixel_in_region(px, py)
-        msg += f"{lbl}:{t:.2f},"
-    msg = msg.rstrip(",") + "\n"
-    uart.write(msg.encode())
-    time.sleep(0.01)
+    if binary_mode:
+        n = encoder.add(frame_ms, regions.values())
+        if n:
+            uart.write(encoder.frame(n))
+        return
+    uart.write(ascii_encoder.encode(regions.values()))
+
+def report_profile(to_uart):
+    for line in profiler.report():
+        print(line)
+        if to_uart:
+            uart.write(line.encode() + b"\n")
+
+def profile_command(arg):
+    """PROFILE[:ON|:OFF|:<seconds>] from the ESP32"""
+    global profile_period, profile_uart
+    if arg == b"":
+        report_profile(True)
+    elif arg == b":ON" or arg == b":OFF":
+        profiler.enabled = arg == b":ON"
+        profiler.clear()
+    else:
+        profile_period = float(arg[1:])
+        profile_uart = profile_period > 0
+        profiler.enabled = profiler.enabled or profile_uart
+        profiler.clear()
 
 def process_uart():
+    global binary_mode
     if uart.in_waiting:
         try:
-            cmd = uart.readline().decode().strip()
-            if cmd == "REQUEST_CALIB":
+            cmd = uart.readline().strip()
+            if cmd == BIN_REQUEST:
+                binary_mode = True
+                uart.write(BIN_ACK)
+            elif cmd == b"REQUEST_CALIB":
+                binary_mode = False
                 uart.write(b"CALIB_OK\n")
+            elif cmd.startswith(TIME_REQUEST):
+                # clock sync for the ESP32 latency stats: echo + our time
+                uart.write(b"TIME:" + cmd[len(TIME_REQUEST):] + b","
+                           + str(time.monotonic_ns() // 1000000).encode()
+                           + b"\n")
+            elif cmd.startswith(b"PROFILE"):
+                profile_command(cmd[7:])
         except:
             pass
 
-# ================= STARTUP =================
-if not load_coordinates():
-    status.text = "ERROR"
+# ================= TASKS =================
+async def sleep_until(deadline):
+    """Sleep to an absolute monotonic deadline, return the next one"""
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    else:
+        await asyncio.sleep(0)
+    return max(deadline, time.monotonic())
+
+async def sensor_task():
+    global frame_seq, frame_ms, frame_page
     while True:
-        time.sleep(1)
-
-uart.write(b"PYBADGE_READY\n")
-status.text = "READY"
-status.color = 0x00FF00
-
-last_send = 0
-
-# ================= MAIN LOOP =================
-while True:
-    try:
-        mlx.getFrame(frame)
-    except:
-        continue
-
-    # ---- THERMAL IMAGE ----
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            t = frame[y * WIDTH + x]
-            if t < T_MIN:
-                t = T_MIN
-            elif t > T_MAX:
-                t = T_MAX
-            idx = int(map_range(t, T_MIN, T_MAX, 0, COLOR_DEPTH - 1))
-            bitmap[fx(x), y] = idx
-
-    # ---- GRID OVERLAY (PERMANENT) ----
-    for lbl in peltier_pixels:
-        px, py = peltier_pixels[lbl]
-        draw_peltier_outline(px, py)
-
-    process_uart()
-
-    now = time.monotonic()
-    if now - last_send >= SEND_INTERVAL:
+        stage_begin()
+        try:
+            page = reader.poll()
+        except:
+            page = -1
+        stage_end(ST_ACQUIRE)
+        # wait for one full frame before publishing half-frame updates
+        if page >= 0 and reader.subpages >= 2:
+            if ACQUIRE_MODE == "subpage" or reader.complete:
+                frame_ms = time.monotonic_ns() // 1000000
+                frame_page = page
+                frame_seq += 1
+                new_frame.set()
+        await asyncio.sleep(SENSOR_POLL)
+
+async def send_task():
+    global sent_seq
+    deadline = time.monotonic()
+    while True:
+        await new_frame.wait()
+        new_frame.clear()
+        stage_begin()
+        regions.update(frame, frame_seq)
+        stage_end(ST_REGIONS)
+        stage_begin()
         send_temperatures()
-        info.text = (
-            f"A:{hottest_pixel_in_region(*peltier_pixels['A']):.1f} "
-            f"B:{hottest_pixel_in_region(*peltier_pixels['B']):.1f} "
-            f"C:{hottest_pixel_in_region(*peltier_pixels['C']):.1f} "
-            f"D:{hottest_pixel_in_region(*peltier_pixels['D']):.1f}"
-        )
-        last_send = now
+        stage_end(ST_SEND)
+        sent_seq = frame_seq
+        # at most one send per SEND_INTERVAL, then the next new frame
+        deadline = await sleep_until(deadline + SEND_INTERVAL)
+
+async def uart_task():
+    deadline = time.monotonic()
+    while True:
+        stage_begin()
+        process_uart()
+        stage_end(ST_UART)
+        deadline = await sleep_until(deadline + UART_PERIOD)
+
+async def display_task():
+    shown_seq = 0
+    label_seq = 0
+    deadline = time.monotonic()
+    while True:
+        if frame_seq != shown_seq:
+            shown_seq = frame_seq
+
+            # ---- THERMAL IMAGE ----
+            stage_begin()
+            renderer.render(frame)
+            stage_end(ST_RENDER)
+
+            # ---- GRID OVERLAY (PERMANENT) ----
+            stage_begin()
+            for xy in outline:
+                bitmap[xy] = GRID_COLOR
+            stage_end(ST_GRID)
+
+            if sent_seq != label_seq:
+                label_seq = sent_seq
+                stage_begin()
+                update_info()
+                stage_end(ST_LABEL)
+
+            # let a due send go out before the (slow) refresh
+            await asyncio.sleep(0)
+            stage_begin()
+            display.refresh()
+            stage_end(ST_REFRESH)
+        deadline = await sleep_until(deadline + DISPLAY_PERIOD)
+
+async def mem_task():
+    while True:
+        await asyncio.sleep(MEM_REPORT)
+        line = probe.report()
+        if line:
+            print(line)
 
-    display.refresh()
-    time.sleep(0.25)
+async def profile_task():
+    last = time.monotonic()
+    while True:
+        await asyncio.sleep(0.5)
+        now = time.monotonic()
+        if not profiler.enabled or profile_period <= 0:
+            last = now
+        elif now - last >= profile_period:
+            last = now
+            report_profile(profile_uart)
+
+def open_recorder():
+    """FrameRecorder and its sink for RECORD, or (None, None)"""
+    if RECORD == "usb":
+        import usb_cdc
+        port = usb_cdc.data
+        if port is None:
+            print("REC: usb_cdc data channel is off (boot.py)")
+            return None, None
+        port.write_timeout = 0   # never wait for the host
+        return FrameRecorder(port.write, RECORD_SLOTS), port
+    if RECORD == "file":
+        import os
+        path = "/sd/frames.bin" if "sd" in os.listdir("/") else "/frames.bin"
+        try:
+            f = open(path, "ab")
+        except OSError:
+            print("REC: cannot write " + path)
+            return None, None
+        print("REC: " + path)
+        return FrameRecorder(f.write, RECORD_SLOTS), f
+    return None, None
+
+async def recorder_task(rec, sink):
+    recorded_seq = frame_seq
+    last = time.monotonic()
+    while True:
+        if frame_seq != recorded_seq:
+            recorded_seq = frame_seq
+            stage_begin()
+            rec.add(frame, frame_seq, frame_ms, frame_page)
+            stage_end(ST_RECORD)
+        # one record per pass keeps a slow sink from holding the loop
+        rec.service(1)
+        now = time.monotonic()
+        if RECORD_REPORT and now - last >= RECORD_REPORT:
+            last = now
+            if RECORD == "file":
+                sink.flush()   # usb_cdc flush() would wait for the host
+            print(rec.status())
+        await asyncio.sleep(SENSOR_POLL)
+
+# ================= MAIN =================
+async def main():
+    if not load_coordinates():
+        status.text = "ERROR"
+        while True:
+            await asyncio.sleep(1)
+
+    uart.write(b"PYBADGE_READY\n")
+    status.text = "READY"
+    status.color = 0x00FF00
+
+    tasks = [
+        asyncio.create_task(sensor_task()),
+        asyncio.create_task(send_task()),
+        asyncio.create_task(uart_task()),
+        asyncio.create_task(display_task()),
+        asyncio.create_task(profile_task()),
+    ]
+    if probe.enabled:
+        tasks.append(asyncio.create_task(mem_task()))
+    if RECORD:
+        rec, sink = open_recorder()
+        if rec:
+            tasks.append(asyncio.create_task(recorder_task(rec, sink)))
+    gc.collect()   # start the steady state with a clean heap
+    await asyncio.gather(*tasks)
+
+if __name__ == "__main__":
+    asyncio.run(main())
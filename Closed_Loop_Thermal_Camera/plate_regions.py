@@ -0,0 +1,333 @@
+"""
+Per-frame region statistics for the four Peltier plates.
+
+coordinates.txt is read once and every plate becomes a pixel mask; all masks
+are flattened into one index table and one weight table (bounds-checked at
+load time, not per frame). update() then computes the configured reducers
+for all plates in a single pass over those tables and caches the result
+until the next frame, so the UART message and the on-screen label read the
+same numbers without touching the frame again.
+
+coordinates.txt formats:
+
+    PLATES 2                      versioned masks (read_plates/write_plates)
+    A 4,3 5,3 6,3 7,3 4,4*0.5 ... one line per plate: sensor pixels x,y with
+                                  an optional *weight (default 1)
+
+    A:4:3                         legacy: top-left corner of a 4x3 box, in
+                                  pixels (pid_control_pybadge.py) or in 4x3
+                                  grid cells (UART test script)
+
+A legacy file is read as boxes; host/plate_masks.py migrate rewrites it as
+PLATES 2 so every script reads the same pixels.
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+import array
+
+try:
+    from ulab import numpy as ulab_np
+except ImportError:
+    ulab_np = None
+
+WIDTH, HEIGHT = 32, 24
+PELTIER_W, PELTIER_H = 4, 3
+PLATE_LABELS = ("A", "B", "C", "D")
+REDUCERS = ("max", "mean", "median", "trimmed")
+PLATES_VERSION = 2
+
+
+def read_coordinates(path="/coordinates.txt"):
+    """Parse legacy label:x:y lines into {label: (x, y)}"""
+    coords = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(":")
+            if len(parts) == 3:
+                coords[parts[0]] = (int(parts[1]), int(parts[2]))
+    return coords
+
+
+def region_indices(x0, y0, w=PELTIER_W, h=PELTIER_H,
+                   width=WIDTH, height=HEIGHT):
+    """Flat frame indices of a w x h box, clipped to the sensor"""
+    idx = []
+    for dy in range(h):
+        for dx in range(w):
+            px, py = x0 + dx, y0 + dy
+            if 0 <= px < width and 0 <= py < height:
+                idx.append(py * width + px)
+    return tuple(idx)
+
+
+class PlateMask:
+    """Flat frame indices of one plate and their weights (None = all 1)"""
+
+    def __init__(self, indices, weights=None):
+        self.indices = tuple(indices)
+        self.weights = tuple(weights) if weights is not None else None
+        if self.weights is not None and len(self.weights) != len(self.indices):
+            raise ValueError("one weight per pixel")
+
+    @classmethod
+    def box(cls, x0, y0, w=PELTIER_W, h=PELTIER_H, width=WIDTH, height=HEIGHT):
+        return cls(region_indices(x0, y0, w, h, width, height))
+
+    def pixels(self, width=WIDTH):
+        return [(i % width, i // width) for i in self.indices]
+
+    def outline(self, width=WIDTH, height=HEIGHT):
+        """(x, y) of the mask pixels that touch a pixel outside the mask"""
+        inside = set(self.indices)
+        out = []
+        for i in self.indices:
+            x, y = i % width, i // width
+            if (x == 0 or i - 1 not in inside or x == width - 1
+                    or i + 1 not in inside or y == 0 or i - width not in inside
+                    or y == height - 1 or i + width not in inside):
+                out.append((x, y))
+        return out
+
+
+def parse_plates(lines, legacy_grid=False, width=WIDTH, height=HEIGHT):
+    """coordinates.txt lines (either format) -> {label: PlateMask}"""
+    plates = {}
+    version = None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if version is None:
+            if line.startswith("PLATES"):
+                version = int(line.split()[1])
+                if version > PLATES_VERSION:
+                    raise ValueError("unsupported plates version %d" % version)
+                continue
+            version = 1
+        if version == 1:
+            parts = line.split(":")
+            if len(parts) == 3:
+                x, y = int(parts[1]), int(parts[2])
+                if legacy_grid:
+                    x, y = x * PELTIER_W, y * PELTIER_H
+                plates[parts[0]] = PlateMask.box(x, y, width=width,
+                                                 height=height)
+            continue
+        tokens = line.split()
+        idx, weights = [], []
+        for tok in tokens[1:]:
+            xy, _, w = tok.partition("*")
+            x, y = xy.split(",")
+            x, y = int(x), int(y)
+            if not (0 <= x < width and 0 <= y < height):
+                raise ValueError("plate " + tokens[0] + " pixel outside sensor")
+            idx.append(y * width + x)
+            weights.append(float(w) if w else 1.0)
+        plates[tokens[0]] = PlateMask(
+            idx, None if all(w == 1.0 for w in weights) else weights)
+    return plates
+
+
+def read_plates(path="/coordinates.txt", legacy_grid=False):
+    """Read coordinates.txt (PLATES 2 or legacy label:x:y) as masks.
+
+    legacy_grid says how a legacy file is meant: 4x3 grid cells (True) or
+    pixel offsets (False).
+    """
+    with open(path, "r") as f:
+        return parse_plates(f, legacy_grid)
+
+
+def format_plates(plates, note=None, width=WIDTH):
+    """PLATES 2 text for {label: PlateMask}"""
+    lines = ["PLATES %d" % PLATES_VERSION]
+    if note:
+        lines.append("# " + note)
+    for lbl in sorted(plates):
+        mask = plates[lbl]
+        tokens = [lbl]
+        for k, i in enumerate(mask.indices):
+            tok = "%d,%d" % (i % width, i // width)
+            if mask.weights is not None and mask.weights[k] != 1.0:
+                tok += "*%.3g" % mask.weights[k]
+            tokens.append(tok)
+        lines.append(" ".join(tokens))
+    return "\n".join(lines) + "\n"
+
+
+def write_plates(plates, path="/coordinates.txt", note=None):
+    with open(path, "w") as f:
+        f.write(format_plates(plates, note))
+
+
+class PlateRegions:
+    """Computes max / mean / median / trimmed mean for every plate per frame.
+
+    plates maps each of A..D (no other labels; ValueError naming the
+    missing or unknown ones) -> PlateMask, or -> (x, y) for a 4x3 box: grid
+    cells with grid=True (UART test), otherwise pixel offsets. mean is
+    weighted by the mask weights; max, median and trimmed use the mask
+    pixels. reducer is the default returned by value() and values(); compute
+    lists the reducers update() fills (all by default). trim is the number of
+    samples dropped from each end for the trimmed mean.
+
+    With ulab (or dot=True and NumPy on a host) the weighted means come from
+    one matrix-vector product with the frame, when mean is computed without
+    median or trimmed.
+    """
+
+    def __init__(self, plates, grid=False, reducer="max", compute=REDUCERS,
+                 trim=2, width=WIDTH, height=HEIGHT, dot=None):
+        for name in (reducer,) + tuple(compute):
+            if name not in REDUCERS:
+                raise ValueError("unknown reducer: " + name)
+        if reducer not in compute:
+            compute = tuple(compute) + (reducer,)
+        self.reducer = reducer
+        self.compute = tuple(compute)
+        # callers index the plates A..D by position: every one is needed
+        missing = [lbl for lbl in PLATE_LABELS if lbl not in plates]
+        unknown = sorted(lbl for lbl in plates if lbl not in PLATE_LABELS)
+        if missing or unknown:
+            raise ValueError("plates: missing %s, unknown %s" % (
+                ",".join(missing) or "none", ",".join(unknown) or "none"))
+        self.labels = PLATE_LABELS
+        self.masks = []
+        for lbl in self.labels:
+            mask = plates[lbl]
+            if not isinstance(mask, PlateMask):
+                x, y = mask
+                if grid:
+                    x, y = x * PELTIER_W, y * PELTIER_H
+                mask = PlateMask.box(x, y, width=width, height=height)
+            if not mask.indices:
+                raise ValueError("plate " + lbl + " is outside the sensor")
+            self.masks.append(mask)
+        self.indices = [m.indices for m in self.masks]
+
+        # flat tables: plate p owns entries bounds[p] .. bounds[p + 1] - 1,
+        # weights normalised so each plate's sum to 1
+        self._idx = array.array("H")
+        self._w = array.array("f")
+        self._bounds = [0]
+        for m in self.masks:
+            ws = m.weights or (1.0,) * len(m.indices)
+            total = sum(ws)
+            if total <= 0:
+                raise ValueError("mask weights must sum to > 0")
+            for i, w in zip(m.indices, ws):
+                self._idx.append(i)
+                self._w.append(w / total)
+            self._bounds.append(len(self._idx))
+
+        self.trim = trim
+        self._sorted = "median" in self.compute or "trimmed" in self.compute
+        # the matrix (plates x 768 floats) only serves the mean of the
+        # max / mean pass; the sorting pass computes its mean itself
+        self._np = None
+        if ("mean" in self.compute and not self._sorted
+                and (dot or (dot is None and ulab_np is not None))):
+            self._weight_matrix(width * height)
+        self.stats = {name: [0.0] * len(self.labels) for name in REDUCERS}
+        self._slot = {lbl: i for i, lbl in enumerate(self.labels)}
+        self._scratch = [0.0] * max(len(idx) for idx in self.indices)
+        self._frame_id = None
+
+    def _weight_matrix(self, n_pixels):
+        """Dense plates x pixels matrix of the normalised weights"""
+        if ulab_np is not None:
+            self._np, self._float = ulab_np, ulab_np.float
+        else:
+            import numpy                     # host: dot=True without ulab
+            self._np, self._float = numpy, numpy.float32
+        wmat = self._np.zeros((len(self.masks), n_pixels), dtype=self._float)
+        for p in range(len(self.masks)):
+            for k in range(self._bounds[p], self._bounds[p + 1]):
+                wmat[p, self._idx[k]] = self._w[k]
+        self._wmat = wmat
+
+    def _dot_means(self, frame, s_mean):
+        np = self._np
+        try:
+            v = np.frombuffer(frame, dtype=self._float)  # array('f'): no copy
+        except (TypeError, ValueError):
+            v = np.array(frame, dtype=self._float)
+        means = np.dot(self._wmat, v)
+        for p in range(len(s_mean)):
+            s_mean[p] = float(means[p])
+
+    def update(self, frame, frame_id=None):
+        """Reduce all plates for this frame; no-op if frame_id is unchanged"""
+        if frame_id is not None and frame_id == self._frame_id:
+            return
+        self._frame_id = frame_id
+        stats = self.stats
+        idx = self._idx
+        w = self._w
+        bounds = self._bounds
+        if self._sorted:
+            s_max = stats["max"]
+            s_mean = stats["mean"]
+            s_med = stats["median"]
+            s_trim = stats["trimmed"]
+            trim = self.trim
+            vals = self._scratch
+            for p in range(len(self.masks)):
+                # insertion sort into the preallocated scratch list
+                a = bounds[p]
+                n = bounds[p + 1] - a
+                total = 0.0
+                wsum = 0.0
+                for j in range(n):
+                    v = frame[idx[a + j]]
+                    total += v
+                    wsum += w[a + j] * v
+                    k = j
+                    while k and vals[k - 1] > v:
+                        vals[k] = vals[k - 1]
+                        k -= 1
+                    vals[k] = v
+                s_max[p] = vals[n - 1]
+                s_mean[p] = wsum
+                h = n // 2
+                s_med[p] = vals[h] if n & 1 else (vals[h - 1] + vals[h]) * 0.5
+                k = trim if n > 2 * trim else 0
+                for j in range(k):
+                    total -= vals[j] + vals[n - 1 - j]
+                s_trim[p] = total / (n - 2 * k)
+            return
+        # max / mean only: one pass over the flat tables, no temporaries
+        want_max = "max" in self.compute
+        want_mean = "mean" in self.compute
+        s_max = stats["max"]
+        s_mean = stats["mean"]
+        if want_mean and self._np is not None:
+            self._dot_means(frame, s_mean)
+            want_mean = False
+        if not (want_max or want_mean):
+            return
+        for p in range(len(self.masks)):
+            a = bounds[p]
+            m = frame[idx[a]]
+            acc = 0.0
+            for k in range(a, bounds[p + 1]):
+                t = frame[idx[k]]
+                if t > m:
+                    m = t
+                acc += w[k] * t
+            if want_max:
+                s_max[p] = m
+            if want_mean:
+                s_mean[p] = acc
+
+    def value(self, lbl, reducer=None):
+        """Cached value for one plate (default reducer unless given)"""
+        return self.stats[reducer or self.reducer][self._slot[lbl]]
+
+    def values(self, reducer=None):
+        """Cached values for all plates, in label order"""
+        return self.stats[reducer or self.reducer]
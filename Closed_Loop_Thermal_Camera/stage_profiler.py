@@ -0,0 +1,68 @@
+"""
+Per-stage timing for CircuitPython loops.
+
+Wrap a stage in start() / stop(stage) and its duration (time.monotonic_ns,
+stored in microseconds) goes into a fixed-size ring buffer for that stage,
+so memory use does not grow and old samples fall out. report() returns the
+min/mean/p95/max of every ring as short lines that fit the ESP32's 64-byte
+line buffer:
+
+    PROFILE:ms=123456,win=10000
+    PROFILE:acquire=40/812/1033/1420/1502
+    PROFILE:render=40/5120/5310/5600/5980      (n/min/mean/p95/max, us)
+
+When disabled, start() and stop() return straight away. host/profile_report.py
+turns captured PROFILE lines into a table and compares captures.
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+import array
+import time
+
+
+class StageProfiler:
+    def __init__(self, stages, size=64, enabled=False):
+        self.stages = tuple(stages)
+        self.size = size
+        self.enabled = enabled
+        self.rings = [array.array("L", [0] * size) for _ in self.stages]
+        self.counts = [0] * len(self.stages)
+        self._t0 = 0
+        self._window = time.monotonic_ns()
+
+    def start(self):
+        if self.enabled:
+            self._t0 = time.monotonic_ns()
+
+    def stop(self, stage):
+        if not self.enabled:
+            return
+        n = self.counts[stage]
+        self.rings[stage][n % self.size] = (time.monotonic_ns() - self._t0) // 1000
+        self.counts[stage] = n + 1
+
+    def clear(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self._window = time.monotonic_ns()
+
+    def summary(self, stage):
+        """(n, min, mean, p95, max) in us over the samples in the ring"""
+        n = min(self.counts[stage], self.size)
+        if not n:
+            return (0, 0, 0, 0, 0)
+        spans = sorted(self.rings[stage][:n])
+        p95 = spans[min(n - 1, (95 * n + 99) // 100 - 1)]
+        return (n, spans[0], sum(spans) // n, p95, spans[-1])
+
+    def report(self, clear=True):
+        """PROFILE: lines for all stages (list of str), then clear the rings"""
+        now = time.monotonic_ns()
+        lines = ["PROFILE:ms=%d,win=%d" % (now // 1000000,
+                                           (now - self._window) // 1000000)]
+        for i, name in enumerate(self.stages):
+            lines.append("PROFILE:%s=%d/%d/%d/%d/%d" % ((name,) + self.summary(i)))
+        if clear:
+            self.clear()
+        return lines
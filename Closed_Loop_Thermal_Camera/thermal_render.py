@@ -0,0 +1,157 @@
+"""
+Shared thermal image renderer for the PyBadge scripts.
+
+Maps an MLX90640 frame (32x24 temperatures, row-major) to palette indices
+through a precomputed quantized temperature -> palette-index table and a
+prebuilt (optionally horizontally flipped) destination index map, then writes
+the whole image into a displayio.Bitmap in one pass.
+
+When ulab is available the index computation is vectorized (quantize, then
+one take through the LUT and one through the inverse index map), and when
+bitmaptools is available the result is written with a single arrayblit.
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+try:
+    from ulab import numpy as np
+except ImportError:
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+try:
+    import bitmaptools
+except ImportError:
+    bitmaptools = None
+
+WIDTH, HEIGHT = 32, 24
+QUANT = 20   # LUT steps per degree C (0.05 C resolution)
+
+
+def build_index_map(width, height, flip):
+    """Destination bitmap index for every source pixel (row-major)"""
+    dst = []
+    for y in range(height):
+        for x in range(width):
+            dx = width - 1 - x if flip else x
+            dst.append(y * width + dx)
+    return tuple(dst)
+
+
+def invert_index_map(index_map):
+    """Source pixel for every destination index (inverse permutation)"""
+    src = [0] * len(index_map)
+    for s, d in enumerate(index_map):
+        src[d] = s
+    return src
+
+
+def build_lut(t_min, t_max, color_depth, quant=QUANT):
+    """Palette index for every quantized temperature step in [t_min, t_max]"""
+    steps = max(1, int((t_max - t_min) * quant + 0.5))
+    lut = bytearray(steps + 1)
+    for k in range(steps + 1):
+        lut[k] = (k * (color_depth - 1)) // steps
+    return lut
+
+
+class ThermalRenderer:
+    """Renders thermal frames into a displayio.Bitmap"""
+
+    def __init__(self, bitmap, t_min=20.0, t_max=40.0, color_depth=64,
+                 flip=True, width=WIDTH, height=HEIGHT, use_ulab=True):
+        self.bitmap = bitmap
+        self.width = width
+        self.height = height
+        self.color_depth = color_depth
+        self.flip = flip
+        self.index_map = build_index_map(width, height, flip)
+        self._np = np if use_ulab else None
+        if self._np is not None:
+            self._src_map = np.array(invert_index_map(self.index_map),
+                                     dtype=np.uint16)
+        self._buf = bytearray(width * height)
+        self.set_range(t_min, t_max)
+
+    def set_range(self, t_min, t_max):
+        """Change the fixed temperature scale and rebuild the LUT"""
+        self.t_min = t_min
+        self.t_max = t_max
+        self.lut = build_lut(t_min, t_max, self.color_depth)
+        if self._np is not None:
+            self._lut_np = np.array(self.lut, dtype=np.uint8)
+
+    # ---------- fixed scale ----------
+    def render(self, frame):
+        """Render using the fixed [t_min, t_max] scale"""
+        if self._np is not None:
+            self._render_vector(frame, self.t_min, QUANT, self._lut_np)
+            return
+
+        lut = self.lut
+        top = len(lut) - 1
+        t0 = self.t_min
+        q = QUANT
+        if bitmaptools is not None:
+            buf = self._buf
+            for t, d in zip(frame, self.index_map):
+                k = int((t - t0) * q)
+                if k < 0:
+                    k = 0
+                elif k > top:
+                    k = top
+                buf[d] = lut[k]
+            bitmaptools.arrayblit(self.bitmap, buf)
+        else:
+            bitmap = self.bitmap
+            for t, d in zip(frame, self.index_map):
+                k = int((t - t0) * q)
+                if k < 0:
+                    k = 0
+                elif k > top:
+                    k = top
+                bitmap[d] = lut[k]
+
+    # ---------- per-frame scale ----------
+    def render_autoscale(self, frame, lo=None, hi=None):
+        """Render scaled to the frame's own min/max, returns (lo, hi)"""
+        if lo is None:
+            lo = min(frame)
+        if hi is None:
+            hi = max(frame)
+        top = self.color_depth - 1
+        scale = top / (hi - lo) if hi > lo else 0.0
+
+        if self._np is not None:
+            self._render_vector(frame, lo, scale)
+            return lo, hi
+
+        if bitmaptools is not None:
+            buf = self._buf
+            for t, d in zip(frame, self.index_map):
+                i = int((t - lo) * scale)
+                buf[d] = top if i > top else 0 if i < 0 else i
+            bitmaptools.arrayblit(self.bitmap, buf)
+        else:
+            bitmap = self.bitmap
+            for t, d in zip(frame, self.index_map):
+                i = int((t - lo) * scale)
+                bitmap[d] = top if i > top else 0 if i < 0 else i
+        return lo, hi
+
+    # ---------- ulab / numpy path ----------
+    def _render_vector(self, frame, t0, scale, lut=None):
+        """Quantize to LUT steps (palette indices without a LUT), then gather
+        through the LUT and into destination order"""
+        top = (len(lut) if lut is not None else self.color_depth) - 1
+        a = np.clip((np.array(frame) - t0) * scale, 0, top)
+        k = np.take(np.array(a, dtype=np.uint16), self._src_map)
+        idx = np.take(lut, k) if lut is not None else np.array(k, dtype=np.uint8)
+        if bitmaptools is not None:
+            bitmaptools.arrayblit(self.bitmap, idx)
+        else:
+            bitmap = self.bitmap
+            for i, v in enumerate(idx):
+                bitmap[i] = int(v)
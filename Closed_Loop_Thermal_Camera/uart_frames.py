@@ -0,0 +1,165 @@
+"""
+Binary framed UART protocol between the PyBadge and the ESP32.
+
+Frame layout (little endian):
+
+    offset  size  field
+    0       1     SYNC (0xA5, never appears in the ASCII protocol)
+    1       1     VERSION (1)
+    2       1     COUNT, number of records in this frame (1..MAX_BATCH)
+    3       2     SEQ, uint16 sequence number of the first record
+    5       12*n  records: uint32 timestamp_ms, int16 A, B, C, D (centi-C)
+    5+12n   2     CRC16-CCITT (poly 0x1021, init 0xFFFF) of bytes 1..5+12n-1
+
+A single-record frame is 19 bytes against ~38 for "TEMP:A:35.20,...".
+Records in one frame have consecutive sequence numbers.
+
+Binary mode is negotiated through the calibration handshake: the ESP32 sends
+"REQUEST_CALIB:BIN1" and the PyBadge answers "CALIB_OK:BIN1"; a plain
+"REQUEST_CALIB" is answered with "CALIB_OK" and keeps the ASCII format.
+
+The record timestamp is the PyBadge capture time (monotonic ms when the
+sub-page was read). For latency statistics the ESP32 maps it to its own
+clock by sending "TIME?<esp_ms>", answered with "TIME:<esp_ms>,<pybadge_ms>".
+
+AsciiEncoder writes the legacy TEMP: line with fixed-width fields into a
+preallocated buffer ("TEMP:A: 35.20,B:..."), which strtof() and float()
+read like the old variable-width line.
+
+Copy this file next to code.py (or into /lib) on the CIRCUITPY drive.
+"""
+
+import struct
+
+SYNC = 0xA5
+VERSION = 1
+MAX_BATCH = 8
+HEADER_SIZE = 5
+RECORD_SIZE = 12
+CRC_SIZE = 2
+BIN_REQUEST = b"REQUEST_CALIB:BIN1"
+BIN_ACK = b"CALIB_OK:BIN1\n"
+TIME_REQUEST = b"TIME?"
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return tuple(table)
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(buf, start=0, end=None, crc=0xFFFF):
+    """CRC16-CCITT (0x1021, init 0xFFFF) of buf[start:end]"""
+    table = CRC_TABLE
+    if end is None:
+        end = len(buf)
+    for i in range(start, end):
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ buf[i]]
+    return crc
+
+
+def frame_size(count):
+    return HEADER_SIZE + RECORD_SIZE * count + CRC_SIZE
+
+
+def centi(t):
+    """Temperature in C -> clamped int16 centi-degrees"""
+    v = int(t * 100 + (0.5 if t >= 0 else -0.5))
+    if v > 32767:
+        return 32767
+    if v < -32768:
+        return -32768
+    return v
+
+
+class FrameEncoder:
+    """Builds frames in a preallocated buffer.
+
+    With batch=1 every add() completes a frame; with batch=n records are
+    collected and add() returns the frame length once n are queued.
+    """
+
+    def __init__(self, batch=1):
+        if not 1 <= batch <= MAX_BATCH:
+            raise ValueError("batch must be 1..%d" % MAX_BATCH)
+        self.batch = batch
+        self.buf = bytearray(frame_size(MAX_BATCH))
+        self.view = memoryview(self.buf)
+        self.seq = 0
+        self._count = 0
+
+    def add(self, timestamp_ms, temps):
+        """Queue one record; returns frame length when a frame is ready, else 0"""
+        if self._count == 0:
+            struct.pack_into("<BBBH", self.buf, 0, SYNC, VERSION, 0,
+                             self.seq & 0xFFFF)
+        struct.pack_into("<I4h", self.buf,
+                         HEADER_SIZE + RECORD_SIZE * self._count,
+                         timestamp_ms & 0xFFFFFFFF,
+                         centi(temps[0]), centi(temps[1]),
+                         centi(temps[2]), centi(temps[3]))
+        self._count += 1
+        self.seq = (self.seq + 1) & 0xFFFF
+        if self._count < self.batch:
+            return 0
+        return self.finish()
+
+    def finish(self):
+        """Close the pending frame (even if short); returns its length"""
+        n = self._count
+        if n == 0:
+            return 0
+        self.buf[2] = n
+        end = HEADER_SIZE + RECORD_SIZE * n
+        struct.pack_into("<H", self.buf, end, crc16(self.buf, 1, end))
+        self._count = 0
+        return end + CRC_SIZE
+
+    def frame(self, length):
+        """View of the finished frame (no copy)"""
+        return self.view[:length]
+
+
+class AsciiEncoder:
+    """Fixed-width TEMP line, formatted in place (no string building).
+
+    Every value is 6 characters: sign (or hundreds digit), two digits, the
+    point and two decimals, clamped to -99.99 .. 999.99.
+    """
+
+    FIELD = 6
+
+    def __init__(self, labels="ABCD"):
+        line = b"TEMP:" + b",".join(
+            lbl.encode() + b":" + b" 00.00" for lbl in labels) + b"\n"
+        self.buf = bytearray(line)
+        self.offsets = tuple(5 + i * (self.FIELD + 3) + 2
+                             for i in range(len(labels)))
+
+    def encode(self, temps):
+        """Fill in the values; returns the (reused) buffer"""
+        buf = self.buf
+        for pos, t in zip(self.offsets, temps):
+            v = centi(t)
+            if v < 0:
+                buf[pos] = 45                      # "-"
+                v = -v
+                if v > 9999:
+                    v = 9999
+            else:
+                if v > 99999:
+                    v = 99999
+                buf[pos] = 48 + v // 10000 if v >= 10000 else 32
+                v %= 10000
+            buf[pos + 1] = 48 + v // 1000
+            buf[pos + 2] = 48 + v // 100 % 10
+            buf[pos + 4] = 48 + v // 10 % 10
+            buf[pos + 5] = 48 + v % 10
+        return buf
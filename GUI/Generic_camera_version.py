@@ -0,0 +1,157 @@
+"""
+Generic camera version: OpenCV capture and fly tracking.
+
+Runs tracking_engine.py on a camera, a video file, the synthetic source
+or the frame ring of a capture process (frame_ring.py) and writes the
+flies of every frame to a CSV file (frame, time, x, y, area, angle of the
+long axis in degrees); --show draws them on the live picture in an OpenCV
+window (q or Esc stops). The status line gives the
+processed frame rate and the frames dropped because tracking fell behind
+the camera. --coarse uses roi_detector.py: flies found at low resolution
+and measured in full-resolution crops, for 4K cameras. --track keeps
+identities with fly_tracker.py: the CSV then has one row per track (frame,
+time, id, x, y, coasting: no detection of its own this frame).
+
+    python Generic_camera_version.py --source camera:0 --csv flies.csv --show
+    python Generic_camera_version.py --source trial.mp4 --arena 960,540,500
+    python Generic_camera_version.py --source synthetic --fps 60 --show
+    python Generic_camera_version.py --source camera:0 --track --csv ids.csv
+    python Generic_camera_version.py --source ring:arena_cam --csv flies.csv
+    python Generic_camera_version.py --source camera:0 --width 3840 \
+        --height 2160 --fps 30 --coarse 8 --csv flies.csv
+"""
+
+import argparse
+import csv
+import math
+import sys
+import threading
+import time
+
+from tracking_engine import (TrackingEngine, Detector, open_source,
+                             circle_mask, cv2, BACKGROUNDS, POLARITIES)
+from roi_detector import RoiDetector
+from fly_tracker import FlyTracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--source", default="camera:0",
+                        help="camera:<n>, synthetic, ring:<name>, or a "
+                             "video file")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--fps", type=float, default=None,
+                        help="camera rate; paces a video or synthetic source")
+    parser.add_argument("--arena", help="cx,cy,r of the arena circle, px "
+                        "(default: the largest circle in the frame)")
+    parser.add_argument("--threshold", type=int, default=25)
+    parser.add_argument("--background", choices=BACKGROUNDS,
+                        default="median")
+    parser.add_argument("--bg-every", type=int, default=4)
+    parser.add_argument("--polarity", choices=POLARITIES, default="dark")
+    parser.add_argument("--min-area", type=int, default=20)
+    parser.add_argument("--max-area", type=int, default=2000)
+    parser.add_argument("--coarse", type=int, default=0,
+                        help="find flies at 1/coarse resolution and refine "
+                             "them in full-resolution crops (4-8, for 4K; "
+                             "0: whole frame)")
+    parser.add_argument("--track", action="store_true",
+                        help="keep fly identities (Kalman tracks)")
+    parser.add_argument("--csv", help="write the flies here")
+    parser.add_argument("--show", action="store_true",
+                        help="preview window (OpenCV)")
+    args = parser.parse_args()
+    if args.show and cv2 is None:
+        sys.exit("--show needs OpenCV (pip install opencv-python)")
+
+    source = open_source(args.source, args.width, args.height, args.fps,
+                         realtime=args.fps is not None)
+    cx = cy = r = None
+    if args.arena:
+        cx, cy, r = (float(v) for v in args.arena.split(","))
+    arena = circle_mask(source.width, source.height, cx, cy, r)
+    if args.coarse:
+        detector = RoiDetector(source.width, source.height, arena,
+                               args.threshold, args.bg_every, args.polarity,
+                               args.min_area, args.max_area,
+                               scale=args.coarse)
+    else:
+        detector = Detector(source.width, source.height, arena,
+                            args.threshold, args.background, args.bg_every,
+                            args.polarity, args.min_area, args.max_area)
+    engine = TrackingEngine(source, detector)
+    # gate: twice a fly length (24 px at 1080 rows)
+    tracker = (FlyTracker(gate_px=48 * source.height / 1080.0)
+               if args.track else None)
+    out = open(args.csv, "w", newline="") if args.csv else None
+    writer = csv.writer(out) if out else None
+    if writer and tracker:
+        writer.writerow(["frame", "time", "id", "x", "y", "coasting"])
+    elif writer:
+        writer.writerow(["frame", "time", "x", "y", "area", "angle"])
+    latest = [None]
+
+    def on_result(det):
+        latest[0] = det
+        if tracker:
+            tracks = tracker.update(det.centroids, det.areas)
+            if writer:
+                writer.writerows((det.index, "%.3f" % det.time, i,
+                                  "%.2f" % x, "%.2f" % y, int(c))
+                                 for i, (x, y), c in zip(tracks.ids,
+                                                         tracks.centroids,
+                                                         tracks.coasting))
+        elif writer:
+            writer.writerows((det.index, "%.3f" % det.time, "%.2f" % x,
+                              "%.2f" % y, a, "%.1f" % math.degrees(t))
+                             for (x, y), a, t in zip(det.centroids, det.areas,
+                                                     det.angles))
+
+    worker = threading.Thread(target=engine.run, args=(on_result,))
+    worker.start()
+    try:
+        last_print = 0.0
+        while worker.is_alive():
+            if args.show:
+                show(latest[0], engine.frame)
+                if cv2.waitKey(15) & 0xFF in (ord("q"), 27):
+                    break
+            else:
+                time.sleep(0.1)
+            if time.monotonic() - last_print >= 1.0:
+                last_print = time.monotonic()
+                s = engine.status()
+                det = latest[0]
+                print(f"\r{s['fps']:5.1f} fps, {s['processed']} frames, "
+                      f"dropped {s['dropped']}, flies "
+                      f"{len(det.centroids) if det else '-'}   ",
+                      end="", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        worker.join()
+        if out:
+            out.close()
+        if args.show:
+            cv2.destroyAllWindows()
+    print()
+    print(engine.status())
+
+
+def show(det, frame):
+    """The latest frame with its flies circled, at most 900 px"""
+    if det is None or frame is None:
+        return
+    view = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    for x, y in det.centroids:
+        cv2.circle(view, (int(x), int(y)), 12, (0, 0, 255), 2)
+    scale = 900.0 / max(view.shape[:2])
+    if scale < 1:
+        view = cv2.resize(view, None, fx=scale, fy=scale)
+    cv2.imshow("flies", view)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Throughput and core scaling of pose_export.py with the mock backend.
+
+The synthetic source is exported with each --workers count in turn (a
+fresh output directory each time, the true flies as tracks), and the
+report gives frames/s and crops/s, the speedup over the first count, and
+where the worker time goes (decode: making the frame, crop: cutting and
+packing, infer: the backend). Before that, the backend alone is timed per
+crop at each --batches size, the gain of batching, and after, a run is
+stopped halfway and resumed, and its poses compared with the uninterrupted
+run's. The thorax error (mock keypoint against the true centre) checks
+that crops and frame coordinates line up.
+
+BLAS is limited to one thread per process (set before numpy is imported),
+so the workers count is the number of cores used.
+
+    python bench_pose.py --workers 1,2,4 --frames 1200
+    python bench_pose.py --mock-channels 32 --batches 1,16,64,256
+"""
+
+import os
+
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, "1")
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from tracking_engine import SyntheticSource
+from pose_export import MockBackend, export, load_poses, synthetic_tracks
+
+
+def bench_batches(args):
+    src = SyntheticSource(args.width, args.height, args.flies)
+    frame = src.read()
+    crop = args.crop
+    x, y = src.pos[0].astype(int) - crop // 2
+    one = frame[y:y + crop, x:x + crop]
+    print(f"backend alone, {crop} px crops, {args.mock_channels} channels:")
+    for b in (int(v) for v in args.batches.split(",")):
+        backend = MockBackend(crop, b, args.mock_channels)
+        batch = np.repeat(one[None], b, 0)
+        backend.predict(batch)
+        n = max(1, 256 // b)
+        t0 = time.perf_counter()
+        for _ in range(n):
+            backend.predict(batch)
+        dt = (time.perf_counter() - t0) / (n * b)
+        print(f"  batch {b:4d}: {1e3 * dt:6.3f} ms/crop")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", default=",".join(
+        str(w) for w in (1, 2, 4, 8, 16) if w <= (os.cpu_count() or 1)))
+    parser.add_argument("--frames", type=int, default=1200)
+    parser.add_argument("--chunk", type=int, default=150)
+    parser.add_argument("--flies", type=int, default=15)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--crop", type=int, default=64)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--batches", default="1,4,16,64",
+                        help="batch sizes for the backend alone")
+    parser.add_argument("--mock-channels", type=int, default=16)
+    args = parser.parse_args()
+
+    bench_batches(args)
+    tracks = synthetic_tracks(args.frames, args.width, args.height,
+                              args.flies)
+    tmp = tempfile.mkdtemp(prefix="poses_")
+    cfg = {"video": "synthetic", "chunk": args.chunk, "crop": args.crop,
+           "batch": args.batch, "backend": "mock",
+           "channels": args.mock_channels, "width": args.width,
+           "height": args.height, "flies": args.flies}
+    try:
+        print(f"{args.frames} frames {args.width} x {args.height}, "
+              f"{args.flies} flies, chunks of {args.chunk}, batches of "
+              f"{args.batch}:")
+        base = None
+        for w in (int(v) for v in args.workers.split(",")):
+            cfg["out"] = os.path.join(tmp, f"w{w}")
+            t0 = time.perf_counter()
+            done = export(tracks, cfg, args.frames, w)
+            wall = time.perf_counter() - t0
+            base = base or wall
+            busy = {k: sum(r[k] for r in done)
+                    for k in ("decode", "crop", "infer")}
+            total = sum(busy.values())
+            crops = sum(r["crops"] for r in done)
+            print(f"  {w:2d} workers: {args.frames / wall:6.1f} frames/s "
+                  f"{crops / wall:7.0f} crops/s  speedup "
+                  f"{base / wall:4.2f}  (decode "
+                  f"{100 * busy['decode'] / total:.0f} %, crop "
+                  f"{100 * busy['crop'] / total:.0f} %, infer "
+                  f"{100 * busy['infer'] / total:.0f} %)")
+        ref = load_poses(os.path.join(cfg["out"], "poses.npz"))
+
+        # stopped halfway, then resumed
+        cfg["out"] = os.path.join(tmp, "resume")
+        n_chunks = len(range(0, args.frames, args.chunk))
+        first = export(tracks, cfg, args.frames, 1,
+                       max_chunks=n_chunks // 2)
+        rest = export(tracks, cfg, args.frames, 1)
+        again = load_poses(os.path.join(cfg["out"], "poses.npz"))
+        same = all(np.array_equal(ref[k], again[k]) for k in ref)
+        print(f"  resume: {len(first)} chunks, stopped, then {len(rest)} "
+              f"more; poses {'identical' if same else 'DIFFERENT'}")
+
+        _, _, xy = tracks
+        err = np.hypot(ref["x"][:, 1] - xy[:, 0], ref["y"][:, 1] - xy[:, 1])
+        print(f"  thorax error (mock): median {np.median(err):.3f} px, "
+              f"{100 * np.mean(err < 2):.1f} % within 2 px")
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
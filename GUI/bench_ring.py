@@ -0,0 +1,213 @@
+"""
+Per-frame transport cost of frame_ring.py between processes, at 4K/60.
+
+A capture process writes --fps frames of --width x --height (grey) into a
+FrameRing of --slots for --seconds; three processes read it at the same
+time:
+
+    tracker    every frame in order, a light look at each (the mean of
+               every 16th pixel of every 16th row)
+    recorder   every frame in order, --record-ms per frame (a disk that
+               cannot keep up: it has to drop frames)
+    display    the newest frame at --display-hz
+
+Reported per process: frames read and dropped, torn frames (the frame's
+stamp, written into its first pixels, does not match its sequence number,
+or valid() failed after the work), the cost of get() per frame once the
+frame is there, and the latency from publish() to get() (median and 99th
+percentile). For the writer: publish with the copy into the ring (put)
+and without it (claim/publish, a camera filling the slot in place). For comparison the
+same frames are sent through a multiprocessing.Queue (pickled and copied)
+to one reader.
+
+    python bench_ring.py --width 3840 --height 2160 --fps 60 --seconds 5
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from frame_ring import FrameRing, Reader
+
+STAMP = 8                     # bytes of the sequence number in a frame
+
+
+def stamp(frame, n):
+    frame.reshape(-1)[:STAMP] = np.frombuffer(np.int64(n).tobytes(),
+                                              np.uint8)
+
+
+def stamped(frame):
+    return int(np.frombuffer(frame.reshape(-1)[:STAMP].tobytes(),
+                             np.int64)[0])
+
+
+def frames_for(args):
+    rng = np.random.default_rng(1)
+    return [rng.integers(0, 255, (args.height, args.width), dtype=np.uint8)
+            for _ in range(4)]
+
+
+# ===== Processes =====
+def writer(args, name, ready, results, in_place):
+    ring = FrameRing.attach(name)
+    pool = frames_for(args)
+    ready.wait()
+    cost = []
+    next_t = time.monotonic()
+    for n in range(int(args.seconds * args.fps)):
+        now = time.monotonic()
+        if next_t > now:
+            time.sleep(next_t - now)
+        next_t += 1.0 / args.fps
+        t0 = time.perf_counter()
+        if in_place:
+            view = ring.claim()
+            stamp(view, ring.head + 1)
+            ring.publish(time.time())
+        else:
+            frame = pool[n % len(pool)]
+            stamp(frame, ring.head + 1)
+            ring.put(frame, time.time())
+        cost.append(time.perf_counter() - t0)
+    ring.header[1] = 1                    # closed
+    results.put(("writer", {"cost": cost}))
+
+
+def reader(args, name, ready, results, role):
+    ring = FrameRing.attach(name)
+    r = Reader(ring, latest=role == "display")
+    ready.wait()
+    cost, latency = [], []
+    torn = 0
+    while True:
+        # waiting for the next frame is not transport cost
+        while ring.head < r.next and not ring.closed:
+            time.sleep(0.0002)
+        t0 = time.perf_counter()
+        got = r.get()
+        dt = time.perf_counter() - t0
+        if got is None:
+            break
+        seq, t, frame = got
+        latency.append(time.time() - t)
+        cost.append(dt)
+        ok = stamped(frame) == seq
+        if role == "tracker":
+            float(frame[::16, ::16].mean())
+        elif role == "recorder":
+            time.sleep(args.record_ms / 1000.0)
+        else:
+            float(frame[::64, ::64].max())
+            time.sleep(1.0 / args.display_hz)
+        if not ok or not r.valid(seq):
+            torn += 1
+        del frame
+    results.put((role, {"cost": cost, "latency": latency, "got": r.got,
+                        "dropped": r.dropped, "torn": torn}))
+
+
+def queue_reader(q, results):
+    cost, latency = [], []
+    while True:
+        while q.empty():
+            time.sleep(0.0002)
+        t0 = time.perf_counter()
+        item = q.get()
+        dt = time.perf_counter() - t0
+        if item is None:
+            break
+        t, frame = item
+        latency.append(time.time() - t)
+        cost.append(dt)
+    results.put(("queue reader", {"cost": cost, "latency": latency,
+                                  "got": len(cost), "dropped": 0,
+                                  "torn": 0}))
+
+
+def run_ring(args, in_place):
+    ring = FrameRing.create(args.height, args.width, slots=args.slots)
+    ready = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    roles = ("tracker", "recorder", "display")
+    procs = [multiprocessing.Process(target=reader, args=(
+        args, ring.name, ready, results, role)) for role in roles]
+    procs.append(multiprocessing.Process(target=writer, args=(
+        args, ring.name, ready, results, in_place)))
+    for p in procs:
+        p.start()
+    time.sleep(0.5)
+    ready.set()
+    out = dict(results.get() for _ in procs)
+    for p in procs:
+        p.join()
+    ring.close()
+    return out
+
+
+def run_queue(args):
+    q = multiprocessing.Queue(maxsize=args.slots)
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=queue_reader, args=(q, results))
+    p.start()
+    pool = frames_for(args)
+    cost = []
+    next_t = time.monotonic()
+    for n in range(int(args.seconds * args.fps)):
+        now = time.monotonic()
+        if next_t > now:
+            time.sleep(next_t - now)
+        next_t += 1.0 / args.fps
+        t0 = time.perf_counter()
+        q.put((time.time(), pool[n % len(pool)]))
+        cost.append(time.perf_counter() - t0)
+    q.put(None)
+    out = {"queue writer": {"cost": cost}}
+    out.update([results.get()])
+    p.join()
+    return out
+
+
+def report(name, d):
+    c = 1e6 * np.array(d["cost"] or [np.nan])
+    line = (f"  {name:<13} {np.median(c):8.1f} us/frame "
+            f"(p99 {np.percentile(c, 99):8.1f})")
+    if "latency" in d:
+        lat = 1e3 * np.array(d["latency"] or [np.nan])
+        line += (f"  latency {np.median(lat):6.2f} ms (p99 "
+                 f"{np.percentile(lat, 99):6.2f})  read {d['got']:5d} "
+                 f"dropped {d['dropped']:5d} torn {d['torn']}")
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--fps", type=float, default=60.0)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--record-ms", type=float, default=25.0,
+                        help="recorder time per frame")
+    parser.add_argument("--display-hz", type=float, default=30.0)
+    args = parser.parse_args()
+
+    mb = args.width * args.height / 1e6
+    print(f"{args.width} x {args.height} grey ({mb:.1f} MB/frame) at "
+          f"{args.fps:g} fps for {args.seconds:g} s, {args.slots} slots")
+    for in_place, what in ((False, "put: frame copied into the ring"),
+                           (True, "claim/publish: filled in place")):
+        print(f"frame ring, {what}:")
+        out = run_ring(args, in_place)
+        report("writer", out.pop("writer"))
+        for role in ("tracker", "recorder", "display"):
+            report(role, out[role])
+    print("multiprocessing.Queue (pickled), one reader:")
+    for name, d in run_queue(args).items():
+        report(name, d)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Coarse-to-fine (roi_detector.py) against full-frame detection
+(tracking_engine.py) on the same frames.
+
+Every frame of the source is given to each detector in turn; only the
+detect() call is timed (the source is not), as ms per frame and the frame
+rate that allows. The detectors: full frame, coarse-to-fine at each
+--scales (contrast-weighted centroids), and the first scale with plain
+(binary) centroids. All use the same background (--bg-every).
+
+Synthetic source: found flies are matched to the true positions (nearest
+within half a body length) for found %, spurious flies per frame, the
+centroid error (median and 95th percentile, px) and the error of the long
+axis against the true heading (median, degrees). A recorded video (--video,
+needs OpenCV) has no truth, so the full-frame flies stand in for it: found
+% and centroid offset are then agreement with full-frame detection.
+
+    python bench_roi.py --width 3840 --height 2160 --flies 30
+    python bench_roi.py --width 1920 --height 1080 --flies 15 --scales 4,8
+    python bench_roi.py --video trial.mp4 --arena 1920,1080,1000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from tracking_engine import Detector, SyntheticSource, VideoSource, circle_mask
+from roi_detector import RoiDetector
+
+
+class Score:
+    def __init__(self, name, detector):
+        self.name = name
+        self.detector = detector
+        self.seconds = 0.0
+        self.frames = 0
+        self.flies = self.found = self.spurious = 0
+        self.error = []
+        self.axis = []
+
+    def add(self, out, truth, gate):
+        """out: the detector's flies; truth: (positions, headings or None)"""
+        pos, heading = truth
+        self.frames += 1
+        self.flies += len(pos)
+        c, angles = out[0], out[2]
+        if not len(c) or not len(pos):
+            self.spurious += len(c)
+            return
+        d = np.hypot(pos[:, None, 0] - c[None, :, 0],
+                     pos[:, None, 1] - c[None, :, 1])
+        j = d.argmin(axis=1)
+        near = d[np.arange(len(pos)), j]
+        hit = near < gate
+        self.found += hit.sum()
+        self.spurious += len(c) - len(np.unique(j[hit]))
+        self.error.extend(near[hit])
+        if heading is not None:
+            diff = np.abs(angles[j[hit]] - heading[hit]) % np.pi
+            self.axis.extend(np.degrees(np.minimum(diff, np.pi - diff)))
+
+    def report(self, truth):
+        ms = 1e3 * self.seconds / max(self.frames, 1)
+        found = 100.0 * self.found / max(self.flies, 1)
+        err = np.array(self.error) if self.error else np.array([np.nan])
+        line = (f"  {self.name:<18} {ms:6.2f} ms {1e3 / ms:6.0f} fps   "
+                f"found {found:5.1f} %  spurious "
+                f"{self.spurious / max(self.frames, 1):5.2f}/frame  ")
+        if truth or self.name != "full frame":
+            line += (f"{'error' if truth else 'offset'} px median "
+                     f"{np.median(err):.3f} p95 {np.percentile(err, 95):.2f}")
+        if self.axis:
+            line += f"  axis {np.median(self.axis):.1f} deg"
+        ds = self.detector
+        if isinstance(ds, RoiDetector):
+            line += (f"  ({100.0 * ds.coarse_passes / max(ds.frame_no, 1):.0f}"
+                     f" % coarse passes, "
+                     f"{ds.windows / max(ds.frame_no, 1):.1f} windows/frame)")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--video", help="a recorded video instead of the "
+                        "synthetic source (needs OpenCV)")
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--flies", type=int, default=30)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--arena", help="cx,cy,r of the arena circle, px")
+    parser.add_argument("--scales", default="4,8",
+                        help="coarse downscale factors to compare")
+    parser.add_argument("--rescan", type=int, default=8,
+                        help="coarse pass every this many frames")
+    parser.add_argument("--window", type=int, default=None,
+                        help="crop size, px (default twice a fly length)")
+    parser.add_argument("--threshold", type=int, default=25)
+    parser.add_argument("--bg-every", type=int, default=16,
+                        help="background band update period, for all "
+                             "detectors")
+    args = parser.parse_args()
+
+    if args.video:
+        source = VideoSource(args.video)
+    else:
+        source = SyntheticSource(args.width, args.height, args.flies)
+    w, h = source.width, source.height
+    if args.arena:
+        cx, cy, r = (float(v) for v in args.arena.split(","))
+    elif args.video:
+        cx = cy = r = None
+    else:
+        cx, cy, r = source.arena
+        r += 4
+    arena = circle_mask(w, h, cx, cy, r)
+    scales = [int(s) for s in args.scales.split(",")]
+    scores = [Score("full frame", Detector(w, h, arena, args.threshold,
+                                           bg_every=args.bg_every))]
+    for s in scales:
+        scores.append(Score(f"coarse 1/{s}", RoiDetector(
+            w, h, arena, args.threshold, args.bg_every, scale=s,
+            window=args.window, rescan=args.rescan)))
+    scores.append(Score(f"coarse 1/{scales[0]} binary", RoiDetector(
+        w, h, arena, args.threshold, args.bg_every, scale=scales[0],
+        window=args.window, rescan=args.rescan, weighted=False)))
+    truth = not args.video
+    gate = source.body_px / 2 if truth else 2.0
+    skip = 20                                  # background learning
+
+    n = 0
+    while n < args.frames:
+        frame = source.read()
+        if frame is None:
+            break
+        outs = []
+        for sc in scores:
+            t0 = time.perf_counter()
+            out = sc.detector.detect(frame)
+            dt = time.perf_counter() - t0
+            outs.append(out)
+            if n >= skip and out is not None:
+                sc.seconds += dt
+        if n >= skip and all(o is not None for o in outs):
+            if truth:
+                ref = source.truth[source.count - 1]
+            else:
+                ref = (outs[0][0], None)
+            for sc, out in zip(scores, outs):
+                sc.add(out, ref, gate)
+        n += 1
+    source.close()
+
+    what = (f"{args.video}" if args.video else
+            f"synthetic, {args.flies} flies {source.body_px:.0f} px long")
+    print(f"{w} x {h}, {what}, {n - skip} frames scored")
+    for sc in scores:
+        sc.report(truth)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Identity benchmark of fly_tracker.py with simulated flies, no images.
+
+--flies flies walk in a circular arena (flies --body px long): bouts of
+walking and standing, a random turn every frame, bouncing off the wall,
+attracted to the cool tile of the current trial (one of four plates,
+changing every --trial frames), where they crowd. The detector is
+simulated from the true positions: centroid noise --noise px, a fly
+missed with --miss probability, spurious blobs at --spurious per frame,
+and flies closer than 0.8 body lengths merged into one blob at their
+mean position, with the sum of their areas (touching flies).
+
+Each frame the tracks are matched to the true flies (optimal assignment
+within a body length). Reported per tracker: identity switches (a fly's
+track id differs from its last one, judged on tracks with a detection of
+their own: in a blob of touching flies the tracks are not told apart),
+fly-frames missed, false track-frames, MOTA, and the update time per
+frame. The arena grows with --flies to keep the density of 50 flies in
+--radius. "nearest" is the CTRAX-like centroid tracker for comparison:
+each detection goes to the nearest track of the last frame, no prediction
+and no coasting.
+
+    python bench_tracker.py --flies 25,50,100,200 --frames 3000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from fly_tracker import FlyTracker, Tracks, pairs_within, groups, assign
+
+
+class Arena:
+    def __init__(self, n, radius, body, speed, seed):
+        self.rng = np.random.default_rng(seed)
+        self.radius, self.body, self.speed = radius, body, speed
+        a = self.rng.uniform(0, 2 * np.pi, n)
+        r = radius * 0.9 * np.sqrt(self.rng.uniform(0, 1, n))
+        self.pos = np.stack([r * np.cos(a), r * np.sin(a)], 1)
+        self.heading = self.rng.uniform(0, 2 * np.pi, n)
+        self.walking = self.rng.uniform(0, 1, n) < 0.5
+
+    def tile(self, plate):
+        a = np.pi / 4 + plate * np.pi / 2
+        return 0.5 * self.radius * np.array([np.cos(a), np.sin(a)])
+
+    def step(self, plate):
+        n = len(self.pos)
+        to = self.tile(plate) - self.pos
+        far = np.hypot(*to.T) > 0.25 * self.radius
+        want = np.arctan2(to[:, 1], to[:, 0])
+        turn = np.angle(np.exp(1j * (want - self.heading)))
+        self.heading += self.rng.normal(0, 0.1, n) + 0.05 * turn * far
+        # bouts of walking and stopping, 1 s long on average at 60 fps
+        flip = self.rng.uniform(0, 1, n) < 1 / 60.0
+        self.walking ^= flip
+        v = self.speed * self.walking
+        new = self.pos + v[:, None] * np.stack(
+            [np.cos(self.heading), np.sin(self.heading)], 1)
+        out = np.hypot(*new.T) > self.radius - self.body / 2
+        self.heading[out] += np.pi
+        self.pos = np.where(out[:, None], self.pos, new)
+
+    def detect(self, args):
+        """(centroids, areas) the centroid detector would give"""
+        area = 0.6 * self.body ** 2
+        seen = self.pos[self.rng.uniform(0, 1, len(self.pos)) >= args.miss]
+        # flies touching: components of the pairs, each fly paired with
+        # itself among them
+        ia, ib = pairs_within(seen, seen, 0.8 * self.body)
+        label = np.zeros(len(seen), dtype=np.int64)
+        label[ia] = groups(ia, ib, len(seen))
+        _, inv, size = np.unique(label, return_inverse=True,
+                                 return_counts=True)
+        cent = np.stack([np.bincount(inv, seen[:, 0]),
+                         np.bincount(inv, seen[:, 1])], 1) / size[:, None]
+        areas = area * size * self.rng.uniform(0.9, 1.0, len(size))
+        cent += self.rng.normal(0, args.noise, cent.shape)
+        k = self.rng.poisson(args.spurious)
+        if k:
+            a = self.rng.uniform(0, 2 * np.pi, k)
+            r = self.radius * np.sqrt(self.rng.uniform(0, 1, k))
+            cent = np.concatenate([cent, np.stack([r * np.cos(a),
+                                                   r * np.sin(a)], 1)])
+            areas = np.concatenate([areas, np.full(k, area)])
+        return cent, areas
+
+
+class NearestTracker:
+    """Centroid tracking as in CTRAX: detections to the nearest last
+    position, within one body length"""
+
+    def __init__(self, body):
+        self.body = body
+        self.pos = np.zeros((0, 2))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.next_id = 1
+
+    def update(self, centroids, areas=None):
+        ti, di = pairs_within(self.pos, centroids, self.body)
+        d = np.hypot(*(self.pos[ti] - centroids[di]).T)
+        m = assign(ti, di, d, self.body)
+        ids = np.zeros(len(centroids), dtype=np.int64)
+        ids[di[m]] = self.ids[ti[m]]
+        new = ids == 0
+        ids[new] = self.next_id + np.arange(new.sum())
+        self.next_id += new.sum()
+        self.pos, self.ids = centroids.copy(), ids
+        return Tracks(ids, centroids.copy(), np.zeros_like(centroids),
+                      np.zeros(len(ids), dtype=bool))
+
+
+class Score:
+    def __init__(self, n):
+        self.last = np.zeros(n, dtype=np.int64)
+        self.switches = self.missed = self.false = self.truth = 0
+        self.seconds = 0.0
+        self.frames = 0
+
+    def add(self, truth, tracks, gate):
+        ti, ki = pairs_within(truth, tracks.centroids, gate)
+        d = np.hypot(*(truth[ti] - tracks.centroids[ki]).T)
+        m = assign(ti, ki, d, gate)
+        fly, trk = ti[m], tracks.ids[ki[m]]
+        self.truth += len(truth)
+        self.missed += len(truth) - len(m)
+        self.false += len(tracks.ids) - len(m)
+        # identity is judged on tracks with a detection of their own: in a
+        # blob of touching flies the tracks are not told apart
+        own = ~tracks.coasting[ki[m]]
+        fly, trk = fly[own], trk[own]
+        before = self.last[fly]
+        self.switches += ((before != 0) & (before != trk)).sum()
+        self.last[fly] = trk
+
+
+def run(args, n):
+    # the arena grows with the flies, at the density of 50 in radius
+    radius = args.radius * np.sqrt(n / 50.0)
+    arena = Arena(n, radius, args.body, args.speed, args.seed)
+    trackers = {"kalman": FlyTracker(gate_px=args.body * 2),
+                "nearest": NearestTracker(args.body)}
+    scores = {k: Score(n) for k in trackers}
+    merged = 0
+    for f in range(args.frames):
+        arena.step((f // args.trial) % 4)
+        cent, areas = arena.detect(args)
+        merged += (areas > 1.5 * 0.6 * args.body ** 2).sum()
+        for name, tr in trackers.items():
+            t0 = time.perf_counter()
+            tracks = tr.update(cent, areas)
+            scores[name].seconds += time.perf_counter() - t0
+            scores[name].frames += 1
+            if f >= args.warmup:
+                scores[name].add(arena.pos, tracks, args.body)
+    print(f"{n} flies, {args.frames} frames, "
+          f"{merged / args.frames:.2f} merged blobs/frame")
+    for name, s in scores.items():
+        ms = 1e3 * s.seconds / s.frames
+        mota = 1 - (s.missed + s.false + s.switches) / max(s.truth, 1)
+        print(f"  {name:<8} id switches {s.switches:5d} "
+              f"({1e3 * s.switches / max(s.truth, 1):.2f} per 1000 fly-frames)"
+              f"  missed {100 * s.missed / max(s.truth, 1):5.2f} %  false "
+              f"{100 * s.false / max(s.truth, 1):5.2f} %  MOTA {mota:.4f}  "
+              f"{ms:.3f} ms/frame ({1e3 * ms / n:.1f} us/fly)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--flies", default="25,50,100,200",
+                        help="comma separated fly counts")
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--radius", type=float, default=500.0,
+                        help="arena radius for 50 flies, px (scaled to keep "
+                             "the density)")
+    parser.add_argument("--body", type=float, default=24.0)
+    parser.add_argument("--speed", type=float, default=3.0,
+                        help="px per frame when walking")
+    parser.add_argument("--trial", type=int, default=600,
+                        help="frames per cool tile")
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--miss", type=float, default=0.005)
+    parser.add_argument("--spurious", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for n in (int(v) for v in args.flies.split(",")):
+        run(args, n)
+
+
+if __name__ == "__main__":
+    main()
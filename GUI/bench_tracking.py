@@ -0,0 +1,157 @@
+"""
+Throughput benchmark of tracking_engine.py, headless.
+
+live: a synthetic camera (or --video, paced at its frame rate) delivers
+--fps frames a second for --seconds; reports the processed frame rate, the
+frames dropped at the queue, the capture-to-result latency and the CPU
+time of the capture thread and the processing stage as a share of one
+core. max: the same source unpaced (nothing dropped), as fast as the
+processing stage goes. For the synthetic source the found flies are
+matched to the true positions (nearest fly within half a body length):
+found %, spurious per frame (found flies no true fly is nearest to) and
+the mean centroid error. Touching flies are one blob whose centroid may
+still be within reach of both.
+
+--core pins the whole process to one CPU, so both threads share it.
+
+    python bench_tracking.py --width 1920 --height 1080 --fps 60 --core 0
+    python bench_tracking.py --width 3840 --height 2160 --fps 30 --flies 30
+    python bench_tracking.py --width 3840 --height 2160 --coarse 8 --bg-every 16
+    python bench_tracking.py --video arena.mp4 --arena 960,540,500
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from tracking_engine import (TrackingEngine, Detector, SyntheticSource,
+                             VideoSource, circle_mask, BACKGROUNDS,
+                             POLARITIES)
+from roi_detector import RoiDetector
+
+
+def pct(values, q):
+    v = sorted(values)
+    return v[min(len(v) - 1, int(q * len(v)))] if v else float("nan")
+
+
+class Score:
+    """Found flies against the synthetic source's truth"""
+
+    def __init__(self, source):
+        self.source = source
+        self.latency = []
+        self.flies = self.found = self.spurious = 0
+        self.error = []
+
+    def __call__(self, det):
+        self.latency.append(det.latency)
+        truth = getattr(self.source, "truth", {}).get(det.index)
+        if truth is None:
+            return
+        pos = truth[0]
+        self.flies += len(pos)
+        if not len(det.centroids):
+            return
+        d = np.hypot(pos[:, None, 0] - det.centroids[None, :, 0],
+                     pos[:, None, 1] - det.centroids[None, :, 1])
+        near = d.min(axis=1)
+        hit = near < self.source.body_px / 2
+        self.found += hit.sum()
+        matched = np.unique(d.argmin(axis=1)[hit])
+        self.spurious += len(det.centroids) - len(matched)
+        self.error.extend(near[hit])
+
+
+def make_source(args, paced):
+    if args.video:
+        return VideoSource(args.video, realtime=paced)
+    frames = None if paced else args.max_frames
+    return SyntheticSource(args.width, args.height, args.flies,
+                           args.fps if paced else None, frames=frames)
+
+
+def make_detector(args, source):
+    if args.arena:
+        cx, cy, r = (float(v) for v in args.arena.split(","))
+    elif isinstance(source, SyntheticSource):
+        cx, cy, r = source.arena
+        r += 4
+    else:
+        cx = cy = r = None
+    arena = circle_mask(source.width, source.height, cx, cy, r)
+    if args.coarse:
+        return RoiDetector(source.width, source.height, arena, args.threshold,
+                           args.bg_every, args.polarity, scale=args.coarse)
+    return Detector(source.width, source.height, arena, args.threshold,
+                    args.background, args.bg_every, args.polarity)
+
+
+def bench(args, paced):
+    source = make_source(args, paced)
+    engine = TrackingEngine(source, make_detector(args, source),
+                            args.queue)
+    score = Score(source)
+    if paced:
+        t_end = time.monotonic() + args.seconds
+
+        def on_result(det):
+            score(det)
+            if time.monotonic() >= t_end:
+                engine.stop()
+    else:
+        on_result = score
+    cpu0 = time.process_time()
+    engine.run(on_result)
+    cpu = time.process_time() - cpu0
+    s = engine.status()
+    wall = s["wall_s"]
+    name = "live" if paced else "max "
+    rate = f"{source.fps:g} fps source, " if paced else ""
+    print(f"{name}: {rate}{s['processed']} frames in {wall:.1f} s = "
+          f"{s['fps']:.1f} fps, dropped {s['dropped']} of {s['captured']}, "
+          f"process {s['process_ms']:.2f} ms/frame")
+    print(f"      latency ms p50 {1e3 * pct(score.latency, 0.5):.1f} p99 "
+          f"{1e3 * pct(score.latency, 0.99):.1f}; CPU: capture "
+          f"{100 * s['capture_cpu_s'] / wall:.0f} %, processing "
+          f"{100 * s['process_cpu_s'] / wall:.0f} %, process total "
+          f"{100 * cpu / wall:.0f} % of one core")
+    if score.flies:
+        print(f"      flies found {100 * score.found / score.flies:.1f} %, "
+              f"spurious {score.spurious / max(len(score.latency), 1):.3f}/"
+              f"frame, centroid error {np.mean(score.error):.2f} px")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--video", help="a video file instead of the "
+                        "synthetic source (needs OpenCV)")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--fps", type=float, default=60.0)
+    parser.add_argument("--flies", type=int, default=15)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--max-frames", type=int, default=600,
+                        help="frames of the unpaced run")
+    parser.add_argument("--arena", help="cx,cy,r of the arena circle, px")
+    parser.add_argument("--threshold", type=int, default=25)
+    parser.add_argument("--background", choices=BACKGROUNDS,
+                        default="median")
+    parser.add_argument("--bg-every", type=int, default=4)
+    parser.add_argument("--polarity", choices=POLARITIES, default="dark")
+    parser.add_argument("--coarse", type=int, default=0,
+                        help="coarse-to-fine detection at 1/coarse "
+                             "(roi_detector.py)")
+    parser.add_argument("--queue", type=int, default=4)
+    parser.add_argument("--core", type=int, help="pin to this CPU")
+    args = parser.parse_args()
+    if args.core is not None:
+        os.sched_setaffinity(0, {args.core})
+    bench(args, paced=True)
+    bench(args, paced=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Multi-fly tracker on top of the centroid detector (tracking_engine.py).
+
+CTRAX loses identities when flies converge on the cool tile: assigning
+each centroid to the nearest fly of the last frame swaps two flies as soon
+as they touch. FlyTracker keeps one constant-velocity Kalman filter per
+fly (x, y, vx, vy in px and px/frame) and assigns detections to tracks
+frame by frame:
+
+    predict   all tracks at once (batched 4x4 filter algebra)
+    gate      a uniform grid over the detections, cells gate_px wide: each
+              track looks only at the 3 x 3 cells around its prediction,
+              then keeps the detections within the chi-square gate of its
+              innovation covariance (Mahalanobis distance)
+    assign    the gated track-detection pairs split into independent
+              groups (connected components); a group with one track or one
+              detection takes its cheapest pair, a larger one is solved
+              optimally (Hungarian: minimum total cost, the negative log
+              likelihood of the pair, with a cost for leaving a track or a
+              detection unassigned)
+    merge     a detection of more than merge_area times the usual fly
+              area that gates two or more tracks is flies touching: no
+              track is given it as its own, so no identity has to be given
+              away inside the blob. The tracks follow it (its centroid a
+              measurement as uncertain as a fly is big), as many as it has
+              flies, and are reported as coasting
+    again     a track still without a detection takes the nearest free one
+              within gate_px (a start, stop or turn sharper than the
+              filter allows) and restarts there
+    coast     a track without a detection runs on its prediction with its
+              velocity damped, its covariance growing; it is dropped after
+              max_coast frames
+    birth     a detection no track takes or gates starts a track, reported
+              once it was seen confirm frames
+
+The cost is close to linear in the number of flies: the grid keeps the
+pairs to the flies nearby and only the groups of touching or crowding
+flies need the Hungarian solve. scipy's linear_sum_assignment is used for
+it when scipy is installed; otherwise the numpy implementation below.
+
+    python bench_tracker.py --flies 25,50,100,200
+"""
+
+import collections
+import itertools
+import math
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# ids: n track ids; centroids: n x 2 (x, y) px; velocities: n x 2 px/frame;
+# coasting: n bool (no detection this frame)
+Tracks = collections.namedtuple("Tracks", "ids centroids velocities coasting")
+
+CHI2_2DOF_99 = 9.21
+SMALL = 5040            # problems with no more ways to assign: try them all
+_permutations = {}
+
+
+# ===== Assignment =====
+def hungarian(cost):
+    """(rows, cols) of the minimum-cost assignment of a cost matrix, every
+    row of a matrix no wider than high assigned (small ones by trying every
+    assignment, larger ones by shortest augmenting paths with potentials,
+    the inner loop over columns vectorised)"""
+    cost = np.asarray(cost, dtype=np.float64)
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(cost)
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = hungarian(cost.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+    n, m = cost.shape
+    if math.perm(m, n) <= SMALL:
+        if (n, m) not in _permutations:
+            _permutations[n, m] = np.array(
+                list(itertools.permutations(range(m), n)))
+        perms = _permutations[n, m]
+        best = perms[cost[np.arange(n), perms].sum(axis=1).argmin()]
+        return np.arange(n), best
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_of = np.zeros(m + 1, dtype=np.int64)   # 1-based row of column j
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        row_of[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = row_of[j0]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            free = ~used[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            cand = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(cand)) + 1
+            delta = cand[j1 - 1]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if row_of[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+    cols = np.flatnonzero(row_of[1:])
+    rows = row_of[1:][cols] - 1
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def pairs_within(a, b, radius):
+    """(i, j) of all points a[i], b[j] (n x 2, m x 2) closer than radius,
+    found through a grid of radius-wide cells over b"""
+    if not len(a) or not len(b):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    origin = np.minimum(a.min(axis=0), b.min(axis=0)) - radius
+    cb = np.floor((b - origin) / radius).astype(np.int64)
+    ca = np.floor((a - origin) / radius).astype(np.int64)
+    stride = max(cb[:, 0].max(), ca[:, 0].max()) + 3
+    key = cb[:, 1] * stride + cb[:, 0]
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    ia, ib = [], []
+    for dy in (-1, 0, 1):
+        # the three cells of one row of the 3 x 3 block are consecutive keys
+        k0 = (ca[:, 1] + dy) * stride + ca[:, 0] - 1
+        lo = np.searchsorted(key, k0)
+        hi = np.searchsorted(key, k0 + 2, "right")
+        count = np.maximum(hi - lo, 0)
+        ia.append(np.repeat(np.arange(len(a)), count))
+        ib.append(order[np.arange(count.sum()) - np.repeat(
+            np.cumsum(count) - count, count) + np.repeat(lo, count)])
+    ia = np.concatenate(ia)
+    ib = np.concatenate(ib)
+    d = np.hypot(*(a[ia] - b[ib]).T)
+    near = d < radius
+    return ia[near], ib[near]
+
+
+def groups(ia, ib, nb):
+    """Connected component of each pair (ia track, ib detection): the
+    smallest node number in it, detections numbered after the tracks"""
+    na = ia.max() + 1 if len(ia) else 0
+    a, b = ia, ib + na
+    labels = np.arange(na + nb)
+    while True:
+        low = np.minimum(labels[a], labels[b])
+        new = labels.copy()
+        np.minimum.at(new, a, low)
+        np.minimum.at(new, b, low)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels[a]
+        labels = new
+
+
+def assign(ia, ib, cost, miss_cost):
+    """Matched pairs (indices into ia/ib) minimising the total cost, where
+    leaving a track or a detection unmatched costs miss_cost. A group with
+    one track or one detection takes its cheapest pair; the rest are solved
+    one by one."""
+    if not len(ia):
+        return np.zeros(0, dtype=np.int64)
+    nb = ib.max() + 1
+    g = groups(ia, ib, nb)
+    _, inv = np.unique(g, return_inverse=True)
+    ng = inv.max() + 1
+    # distinct tracks and detections per group
+    first_a = np.unique(inv * (ia.max() + 1) + ia) // (ia.max() + 1)
+    first_b = np.unique(inv * nb + ib) // nb
+    tracks = np.bincount(first_a, minlength=ng)
+    dets = np.bincount(first_b, minlength=ng)
+    star = (tracks == 1) | (dets == 1)
+    # one match at most in a star: its cheapest pair, when that beats
+    # leaving both ends unmatched
+    order = np.lexsort((cost, inv))
+    head = np.ones(len(order), dtype=bool)
+    head[1:] = inv[order][1:] != inv[order][:-1]
+    best = order[head]
+    chosen = [best[star[inv[best]] & (cost[best] < 2 * miss_cost)]]
+    multi = np.flatnonzero(~star[inv])
+    if len(multi):
+        order = multi[np.argsort(inv[multi], kind="stable")]
+        bounds = np.flatnonzero(np.diff(inv[order])) + 1
+        for part in np.split(order, bounds):
+            chosen.append(solve_group(ia[part], ib[part], cost[part],
+                                      miss_cost, part))
+    return np.concatenate(chosen)
+
+
+def solve_group(ia, ib, cost, miss_cost, index):
+    # a match saves the two misses of its ends: minimise the sum of
+    # cost - 2 miss_cost over the matches; a row of the smaller side put on
+    # a pair that is no gain (or no pair) stays unmatched
+    tracks, ti = np.unique(ia, return_inverse=True)
+    dets, di = np.unique(ib, return_inverse=True)
+    gain = np.minimum(cost - 2 * miss_cost, 0.0)
+    c = np.zeros((len(tracks), len(dets)))
+    c[ti, di] = gain
+    rows, cols = hungarian(c)
+    want = np.zeros(c.shape, dtype=bool)
+    want[rows, cols] = True
+    return index[want[ti, di] & (gain < 0)]
+
+
+# ===== Tracker =====
+class FlyTracker:
+    """Kalman filters plus gated assignment; update() once per frame"""
+
+    def __init__(self, gate_px=48.0, accel_px=1.0, noise_px=0.5,
+                 max_coast=30, confirm=3, merge_area=1.6, damping=0.9):
+        self.gate_px = gate_px
+        self.noise_px = noise_px
+        self.max_coast = max_coast
+        self.confirm = confirm
+        self.merge_area = merge_area
+        self.damping = damping
+        self.F = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0],
+                           [0, 0, 0, 1]], dtype=np.float64)
+        g = np.array([[0.5, 0], [0, 0.5], [1, 0], [0, 1]])
+        self.Q = accel_px ** 2 * g @ g.T
+        self.R = noise_px ** 2 * np.eye(2)
+        # a new track: its position known, its velocity anything in the gate
+        self.P0 = np.diag([noise_px ** 2] * 2 + [(gate_px / 4) ** 2] * 2)
+        self.X = np.zeros((0, 4))
+        self.P = np.zeros((0, 4, 4))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.misses = np.zeros(0, dtype=np.int64)
+        self.next_id = 1
+        self.fly_area = None
+        self.merged = 0
+
+    def predict(self):
+        self.X = self.X @ self.F.T
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+    def update(self, centroids, areas=None):
+        """Tracks after the detections of one frame (confirmed only)"""
+        z = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        n = len(self.X)
+        self.predict()
+
+        # gate: grid neighbours, then the chi-square test
+        Si, logdet = inverse_2x2(self.P[:, :2, :2] + self.R)
+        ti, di = pairs_within(self.X[:, :2], z, self.gate_px)
+        innov = z[di] - self.X[ti, :2]
+        d2 = np.einsum("ni,nij,nj->n", innov, Si[ti], innov)
+        ok = d2 < CHI2_2DOF_99
+        ti, di, d2 = ti[ok], di[ok], d2[ok]
+        gated = np.zeros(len(z), dtype=bool)
+        gated[di] = True
+
+        merged = self.merged_blobs(areas, di, len(z))
+        blob = merged[di]
+        bt, bd, bd2 = ti[blob], di[blob], d2[blob]
+        ti, di, d2 = ti[~blob], di[~blob], d2[~blob]
+
+        # assign: the cost is the negative log likelihood, so a coasting
+        # track with a wide gate does not outbid a track sure of its fly
+        miss = CHI2_2DOF_99 + (np.median(logdet) if n else 0.0)
+        match = assign(ti, di, d2 + logdet[ti], miss)
+        mt, md = ti[match], di[match]
+        self.correct(mt, z[md], self.R)
+
+        # merge: the other tracks gated by a blob follow it, its centroid a
+        # measurement as uncertain as a fly is big, with no detection of
+        # their own; no more of them than the blob has flies
+        free = np.ones(n, dtype=bool)
+        free[mt] = False
+        keep = free[bt]
+        bt, bd, bd2 = bt[keep], bd[keep], bd2[keep]
+        if len(bt):
+            order = np.lexsort((bd2, bt))
+            first = np.ones(len(bt), dtype=bool)
+            first[1:] = bt[order][1:] != bt[order][:-1]
+            bt, bd, bd2 = bt[order][first], bd[order][first], bd2[order][first]
+            order = np.lexsort((bd2, bd))
+            bt, bd = bt[order], bd[order]
+            rank = np.arange(len(bd)) - np.searchsorted(bd, bd)
+            room = rank < np.rint(areas[bd] / self.fly_area)
+            bt, bd = bt[room], bd[room]
+            self.correct(bt, z[bd], self.fly_area * np.eye(2))
+        free[bt] = False
+
+        # second chance by plain distance within gate_px, for a fly that
+        # started, stopped or turned harder than the filter allows: the
+        # track restarts at the detection
+        left = ~merged
+        left[md] = False
+        rt, rd = np.flatnonzero(free), np.flatnonzero(left)
+        pi, pj = pairs_within(self.X[rt, :2], z[rd], self.gate_px)
+        d = np.hypot(*(self.X[rt[pi], :2] - z[rd[pj]]).T)
+        again = assign(pi, pj, d, self.gate_px)
+        rt, rd = rt[pi[again]], rd[pj[again]]
+        self.X[rt, :2] = z[rd]
+        self.P[rt] = self.P0
+        free[rt] = False
+        left[rd] = False
+        seen = ~free
+        self.hits[mt] += 1
+        self.hits[rt] += 1
+        self.misses[seen] = 0
+
+        # coast
+        self.misses[free] += 1
+        self.X[free, 2:] *= self.damping
+        alive = self.misses <= self.max_coast
+        # tentative tracks that miss are dropped at once
+        alive &= (self.hits >= self.confirm) | seen
+        coasting = free.copy()
+        coasting[bt] = True
+
+        # birth: a detection no track took or gated
+        born = left & ~gated
+        nb = born.sum()
+        self.X = np.concatenate([self.X[alive], np.column_stack(
+            [z[born], np.zeros((nb, 2))])])
+        self.P = np.concatenate([self.P[alive],
+                                 np.repeat(self.P0[None], nb, 0)])
+        self.ids = np.concatenate([self.ids[alive],
+                                   self.next_id + np.arange(nb)])
+        self.next_id += nb
+        self.hits = np.concatenate([self.hits[alive], np.ones(nb, np.int64)])
+        self.misses = np.concatenate([self.misses[alive],
+                                      np.zeros(nb, np.int64)])
+        coasting = np.concatenate([coasting[alive], np.zeros(nb, bool)])
+        shown = self.hits >= self.confirm
+        return Tracks(self.ids[shown], self.X[shown, :2].copy(),
+                      self.X[shown, 2:].copy(), coasting[shown])
+
+    def merged_blobs(self, areas, di, n):
+        """Detections that are flies touching: more than merge_area times
+        the running fly area, gated by two tracks or more"""
+        if areas is None or not n:
+            return np.zeros(n, dtype=bool)
+        areas = np.asarray(areas, dtype=np.float64)
+        if self.fly_area is None:
+            self.fly_area = float(np.median(areas))
+        merged = ((areas > self.merge_area * self.fly_area)
+                  & (np.bincount(di, minlength=n) >= 2))
+        if (~merged).any():
+            self.fly_area += 0.05 * (float(np.median(areas[~merged]))
+                                     - self.fly_area)
+        self.merged += merged.sum()
+        return merged
+
+    def correct(self, rows, z, R):
+        """Kalman update of the tracks rows with positions z (n x 2)"""
+        P = self.P[rows]
+        Si, _ = inverse_2x2(P[:, :2, :2] + R)
+        K = P[:, :, :2] @ Si
+        self.X[rows] += np.einsum("nij,nj->ni", K, z - self.X[rows, :2])
+        self.P[rows] = P - K @ P[:, :2, :]
+
+
+def inverse_2x2(S):
+    """Inverses and log determinants of a stack of 2 x 2 matrices"""
+    det = S[:, 0, 0] * S[:, 1, 1] - S[:, 0, 1] * S[:, 1, 0]
+    Si = np.stack([np.stack([S[:, 1, 1], -S[:, 0, 1]], -1),
+                   np.stack([-S[:, 1, 0], S[:, 0, 0]], -1)], 1)
+    return Si / det[:, None, None], np.log(det)
@@ -0,0 +1,277 @@
+"""
+Zero-copy frame transport between the processes of the camera GUI.
+
+Display, recording and tracking in one Python process share one GIL, so a
+slow step holds up the others. FrameRing lets each of them run in its own
+process: one writer (capture) and any number of readers (tracker,
+recorder, display) share a fixed ring of preallocated frames in
+multiprocessing.shared_memory, each seeing them as NumPy arrays.
+
+Layout of the shared block (attached by name, nothing is pickled):
+
+    header    head (the sequence number of the newest frame, -1 before the
+              first), closed flag, slots, height, width, channels
+    seq       per slot: the sequence number of the frame in it, -1 while
+              it is being written
+    time      per slot: the capture time of its frame (unix s)
+    frames    slots x height x width (x channels) uint8, every frame
+              aligned to 4096 bytes
+
+The writer never waits: claim() gives the view of the next slot to fill
+(or put() copies a frame in), publish() stamps it and moves head. A Reader
+keeps its own position: get() returns the next frame as a view into the
+shared block, with no copy. A reader that falls behind does not hold the
+writer up: once it is more than half a ring behind it skips to the newest
+frame and counts the frames dropped (latest=True always takes the newest
+frame, for a display). A frame can still be overwritten while a slow
+reader is using its view: valid(seq) after the work tells whether it was
+(a sequence lock per slot), and the result is then thrown away. Readers
+poll head (sleeping poll_s between looks), so there is no lock or pipe at
+all between the processes.
+
+    ring = FrameRing.create(2160, 3840, slots=8)        # capture process
+    ring.put(frame, time.time())
+    ring = FrameRing.attach(name)                       # any other process
+    reader = Reader(ring)
+    seq, t, frame = reader.get()
+
+Run as a script, this is the capture process: it reads a source of
+tracking_engine.py into a ring that other processes open by name, e.g.
+Generic_camera_version.py --source ring:<name>.
+
+    python frame_ring.py --source camera:0 --width 3840 --height 2160 \
+        --fps 60 --name arena_cam
+    python Generic_camera_version.py --source ring:arena_cam --csv flies.csv
+    python bench_ring.py --width 3840 --height 2160 --fps 60
+"""
+
+import argparse
+import multiprocessing
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+HEADER = 8                    # int64 words: head, closed, slots, h, w, c
+ALIGN = 4096
+
+
+class FrameRing:
+    """A ring of slots frames in shared memory; create() in the writer,
+    attach() in the readers"""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        buf = shm.buf
+        self.header = np.ndarray(HEADER, np.int64, buf)
+        slots, h, w, c = (int(v) for v in self.header[2:6])
+        self.slots = slots
+        self.shape = (h, w) if c == 1 else (h, w, c)
+        self.seq = np.ndarray(slots, np.int64, buf, HEADER * 8)
+        self.time = np.ndarray(slots, np.float64, buf, (HEADER + slots) * 8)
+        start, size = layout(slots, h * w * c)
+        self.frames = np.ndarray((slots,) + self.shape, np.uint8, buf, start,
+                                 (size,) + strides(self.shape))
+        self.claimed = None
+
+    @classmethod
+    def create(cls, height, width, channels=1, slots=8, name=None):
+        start, size = layout(slots, height * width * channels)
+        shm = shared_memory.SharedMemory(name, create=True,
+                                         size=start + slots * size)
+        header = np.ndarray(HEADER, np.int64, shm.buf)
+        header[:] = (-1, 0, slots, height, width, channels, 0, 0)
+        np.ndarray(slots, np.int64, shm.buf, HEADER * 8)[:] = -1
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # before Python 3.13 every attach is tracked: a process that
+            # is not a child of the creator (its own resource tracker)
+            # would unlink the block when it exits
+            shm = shared_memory.SharedMemory(name)
+            if multiprocessing.parent_process() is None:
+                resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def head(self):
+        return int(self.header[0])
+
+    @property
+    def closed(self):
+        return bool(self.header[1])
+
+    # ===== Writer =====
+    def claim(self):
+        """View of the slot the next frame goes to, to be filled in place
+        (a camera decoding straight into shared memory) before publish()"""
+        n = self.head + 1
+        slot = n % self.slots
+        self.seq[slot] = -1
+        self.claimed = n
+        return self.frames[slot]
+
+    def publish(self, t=None):
+        """Make the claimed frame visible to the readers"""
+        n = self.claimed
+        slot = n % self.slots
+        self.time[slot] = time.time() if t is None else t
+        self.seq[slot] = n
+        self.header[0] = n
+        self.claimed = None
+        return n
+
+    def put(self, frame, t=None):
+        """Copy a frame into the ring; its sequence number"""
+        np.copyto(self.claim(), frame)
+        return self.publish(t)
+
+    def close(self):
+        """Writer: tell the readers no more frames come, free the block"""
+        if self.owner:
+            self.header[1] = 1
+        self.header = self.seq = self.time = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass                # frame views still held: unmapped at exit
+        if self.owner:
+            self.shm.unlink()
+
+    # ===== Readers =====
+    def valid(self, seq):
+        """True while the frame seq is still in its slot"""
+        return int(self.seq[seq % self.slots]) == seq
+
+
+class Reader:
+    """One consumer's position in a ring; frames from the next published
+    on. latest: always the newest frame (display) rather than the next in
+    order (recorder, tracker)."""
+
+    def __init__(self, ring, latest=False, poll_s=0.0005):
+        self.ring = ring
+        self.latest = latest
+        self.poll_s = poll_s
+        self.next = ring.head + 1
+        self.got = 0
+        self.dropped = 0
+
+    def get(self, timeout=None):
+        """(seq, time, frame view) of the next frame; None when the writer
+        closed the ring or nothing came within timeout s"""
+        ring = self.ring
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head = ring.head
+            if head < self.next:
+                if ring.closed or (end is not None
+                                   and time.monotonic() > end):
+                    return None
+                time.sleep(self.poll_s)
+                continue
+            if self.latest:
+                n = head
+            elif head - self.next > ring.slots // 2:
+                # more than half a ring behind: on to the newest frame, so
+                # that there is time to use it before its slot comes round
+                n = head
+            else:
+                n = self.next
+            slot = n % ring.slots
+            t = float(ring.time[slot])
+            if not ring.valid(n):
+                continue                    # overwritten meanwhile
+            self.dropped += n - self.next
+            self.got += 1
+            self.next = n + 1
+            return n, t, ring.frames[slot]
+
+    def valid(self, seq):
+        return self.ring.valid(seq)
+
+
+class RingSource:
+    """A FrameRing as a frame source of tracking_engine.py (live, the
+    newest frame each time): the tracker in its own process. Its frames
+    are views into the ring, so the ring needs more than twice as many
+    slots as the engine's queue."""
+
+    live = True
+
+    def __init__(self, name, fps=60.0):
+        self.ring = FrameRing.attach(name)
+        self.reader = Reader(self.ring, latest=True)
+        self.height, self.width = self.ring.shape[:2]
+        self.fps = fps
+
+    def read(self):
+        got = self.reader.get()
+        return None if got is None else got[2]
+
+    def close(self):
+        self.ring.close()
+
+
+def layout(slots, frame_bytes):
+    """(offset of the first frame, bytes per frame slot)"""
+    start = (HEADER + 2 * slots) * 8
+    start = -(-start // ALIGN) * ALIGN
+    return start, -(-frame_bytes // ALIGN) * ALIGN
+
+
+def strides(shape):
+    s = [1]
+    for d in reversed(shape[1:]):
+        s.insert(0, s[0] * d)
+    return tuple(s)
+
+
+def main():
+    from tracking_engine import open_source
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--source", default="camera:0",
+                        help="camera:<n>, synthetic, or a video file")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--fps", type=float, default=None)
+    parser.add_argument("--name", default="arena_cam",
+                        help="shared memory name the readers open")
+    parser.add_argument("--slots", type=int, default=16)
+    args = parser.parse_args()
+
+    source = open_source(args.source, args.width, args.height, args.fps,
+                         realtime=args.fps is not None)
+    first = source.read()
+    if first is None:
+        raise SystemExit("no frames from %s" % args.source)
+    channels = first.shape[2] if first.ndim == 3 else 1
+    ring = FrameRing.create(first.shape[0], first.shape[1], channels,
+                            args.slots, args.name)
+    print(f"ring {ring.name}: {args.slots} x {first.shape}, Ctrl-C stops")
+    frame = first
+    n = 0
+    try:
+        while frame is not None:
+            n = ring.put(frame) + 1
+            frame = source.read()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        ring.close()
+    print(f"{n} frames")
+
+
+if __name__ == "__main__":
+    main()
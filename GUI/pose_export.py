@@ -0,0 +1,451 @@
+"""
+Batched pose inference over recorded arena video, for SLEAP.
+
+Pose inference one frame at a time (load, crop, run the model on one
+picture) leaves the model idle most of the time. This stage works on many
+frames in parallel:
+
+    chunks    the video is split into chunks of --chunk frames; a process
+              pool (--workers) takes one chunk at a time and decodes it
+              itself (a seek to the first frame, frames without tracks are
+              grabbed but not decoded)
+    crops     a --crop px square around every tracked fly of the frame
+              (the tracks CSV of Generic_camera_version.py --track: frame,
+              time, id, x, y, coasting), cut into a preallocated batch
+    batches   every batch has --batch crops, the last of a chunk included
+              (padded), so the model always sees the same shape; the
+              backend returns n x nodes x (x, y, score) in crop pixels
+    output    one file per chunk, <out>/chunk_00012.npz, columns frame,
+              track, x, y, score (x, y, score: n x nodes, frame pixels),
+              written to a temporary name and renamed when complete; then
+              all chunks are merged into <out>/poses.npz, sorted by frame
+              and track id
+
+Resuming: a chunk whose file exists is done, so a run that was stopped
+starts again at its first missing chunk (<out>/run.json must match: same
+video, chunk size, crop and backend).
+
+Backends (--backend):
+
+    mock             MockBackend: a small convolution stack per crop for
+                     the cost (--mock-channels) and keypoints from the
+                     dark blob of the crop; numpy only, for measuring
+                     throughput and core scaling without a GPU or SLEAP
+    sleap:<model>    a SLEAP centered-instance model (pip install sleap)
+    <module>:<Class> any class with .nodes (names) and .predict(batch)
+                     -> batch x nodes x 3, constructed as Class(crop,
+                     batch)
+
+    python pose_export.py trial.mp4 --tracks ids.csv --out trial_poses \\
+        --backend sleap:models/centered_instance --workers 4
+    python pose_export.py synthetic --frames 3600 --out /tmp/poses
+    python bench_pose.py --workers 1,2,4
+"""
+
+import argparse
+import csv
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from tracking_engine import SyntheticSource, cv2
+
+COLUMNS = ("frame", "track", "x", "y", "score")
+
+
+# ===== Video =====
+def open_video(spec, width=1920, height=1080, flies=15):
+    """(source, frame count); spec is a video file or synthetic"""
+    if spec == "synthetic":
+        return SyntheticSource(width, height, flies), None
+    if cv2 is None:
+        raise RuntimeError("video files need OpenCV (pip install "
+                           "opencv-python)")
+    cap = cv2.VideoCapture(spec)
+    if not cap.isOpened():
+        raise RuntimeError("cannot open %s" % spec)
+    return cap, int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+
+def read_chunk(spec, start, stop, wanted, width, height, flies):
+    """(frame number, grey frame) for the frames of [start, stop) in the
+    set wanted"""
+    src, _ = open_video(spec, width, height, flies)
+    if isinstance(src, SyntheticSource):
+        # the walk is replayed without drawing, so every chunk sees the
+        # same flies as a run from the start
+        for _ in range(start):
+            src.step()
+        src.count = start
+        for n in range(start, stop):
+            if n in wanted:
+                yield n, src.read()
+            else:
+                src.step()
+                src.count += 1
+        return
+    src.set(cv2.CAP_PROP_POS_FRAMES, start)
+    try:
+        for n in range(start, stop):
+            if n not in wanted:
+                if not src.grab():
+                    return
+                continue
+            ok, frame = src.read()
+            if not ok:
+                return
+            if frame.ndim == 3:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            yield n, frame
+    finally:
+        src.release()
+
+
+# ===== Tracks =====
+def read_tracks(path):
+    """(frame, track id, x, y) arrays of a tracks CSV, sorted by frame"""
+    rows = []
+    with open(path, newline="") as f:
+        for r in csv.DictReader(f):
+            rows.append((int(r["frame"]), int(r["id"]), float(r["x"]),
+                         float(r["y"])))
+    return sort_tracks(np.array(rows, dtype=np.float64).reshape(-1, 4))
+
+
+def synthetic_tracks(frames, width, height, flies):
+    """The true flies of the synthetic source as tracks, id = fly + 1"""
+    src = SyntheticSource(width, height, flies)
+    rows = []
+    ids = np.arange(1, flies + 1)
+    for n in range(frames):
+        src.step()
+        rows.append(np.column_stack([np.full(flies, n), ids, src.pos]))
+    return sort_tracks(np.concatenate(rows))
+
+
+def sort_tracks(rows):
+    order = np.lexsort((rows[:, 1], rows[:, 0]))
+    rows = rows[order]
+    return (rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64),
+            rows[:, 2:4].copy())
+
+
+# ===== Backends =====
+class MockBackend:
+    """Stand-in for a pose model: a fixed random convolution stack (the
+    cost, scaled by channels) and keypoints from the crop itself: thorax
+    at the contrast-weighted centre of the dark blob, head and abdomen at
+    the ends of its long axis"""
+
+    nodes = ("head", "thorax", "abdomen")
+
+    def __init__(self, crop, batch, channels=16, layers=3, seed=0):
+        rng = np.random.default_rng(seed)
+        self.weights = []
+        c_in = 1
+        for _ in range(layers):
+            self.weights.append(rng.normal(0, 1.0 / np.sqrt(9 * c_in),
+                                           (9 * c_in, channels))
+                                .astype(np.float32))
+            c_in = channels
+        self.head = rng.normal(0, 1.0 / np.sqrt(channels),
+                               (channels, len(self.nodes))).astype(np.float32)
+        ys, xs = np.mgrid[0:crop, 0:crop]
+        self.xs = xs.astype(np.float32).ravel()
+        self.ys = ys.astype(np.float32).ravel()
+        r2 = (self.xs - crop / 2.0) ** 2 + (self.ys - crop / 2.0) ** 2
+        self.centre = np.exp(-r2 / (2 * (crop / 6.0) ** 2))
+
+    def predict(self, batch):
+        n, h, w = batch.shape
+        x = batch.astype(np.float32)[..., None] / 255.0
+        # half resolution, then 3 x 3 convolutions as one matrix product
+        x = x[:, :h // 2 * 2, :w // 2 * 2].reshape(
+            n, h // 2, 2, w // 2, 2, 1).mean(axis=(2, 4))
+        for wt in self.weights:
+            p = np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)))
+            cols = sliding_window_view(p, (3, 3), axis=(1, 2))
+            cols = cols.reshape(n, h // 2, w // 2, -1)
+            x = np.maximum(cols @ wt, 0.0)
+        score = 1.0 / (1.0 + np.exp(-(x.mean(axis=(1, 2)) @ self.head)))
+
+        # keypoints: moments of the pixels darker than the median, weighted
+        # towards the centre (the tracked fly, not a neighbour at the edge)
+        flat = batch.reshape(n, -1).astype(np.float32)
+        dark = np.maximum(np.median(flat, axis=1, keepdims=True) - 20.0
+                          - flat, 0.0) * self.centre
+        m = dark.sum(axis=1) + 1e-6
+        cx = (dark @ self.xs) / m
+        cy = (dark @ self.ys) / m
+        dx = self.xs[None] - cx[:, None]
+        dy = self.ys[None] - cy[:, None]
+        sxx = (dark * dx * dx).sum(axis=1) / m
+        syy = (dark * dy * dy).sum(axis=1) / m
+        sxy = (dark * dx * dy).sum(axis=1) / m
+        angle = 0.5 * np.arctan2(2 * sxy, sxx - syy)
+        half = np.sqrt(np.maximum(sxx + syy, 0.0)) * 1.7
+        out = np.empty((n, len(self.nodes), 3), dtype=np.float32)
+        for k, s in enumerate((1.0, 0.0, -1.0)):
+            out[:, k, 0] = cx + s * half * np.cos(angle)
+            out[:, k, 1] = cy + s * half * np.sin(angle)
+        out[:, :, 2] = score
+        return out
+
+
+class SleapBackend:
+    """A SLEAP centered-instance model run on the crops"""
+
+    def __init__(self, crop, batch, model):
+        try:
+            import sleap
+        except ImportError:
+            raise RuntimeError("the sleap backend needs SLEAP (pip install "
+                               "sleap)")
+        self.predictor = sleap.load_model(model, batch_size=batch)
+        self.model = self.predictor.inference_model
+        self.nodes = None
+
+    def predict(self, batch):
+        out = self.model.predict_on_batch(batch[..., None])
+        peaks = np.asarray(out["instance_peaks"]).reshape(len(batch), -1, 2)
+        vals = np.asarray(out["instance_peak_vals"]).reshape(len(batch), -1)
+        if self.nodes is None:
+            self.nodes = tuple("node%d" % i for i in range(peaks.shape[1]))
+        return np.concatenate([peaks, vals[..., None]], axis=2)
+
+
+def load_backend(spec, crop, batch, channels=16):
+    """mock, sleap:<model path> or <module>:<Class>"""
+    if spec == "mock":
+        return MockBackend(crop, batch, channels)
+    name, _, arg = spec.partition(":")
+    if name == "sleap":
+        return SleapBackend(crop, batch, arg)
+    if not arg:
+        raise ValueError("unknown backend %r" % spec)
+    return getattr(importlib.import_module(name), arg)(crop, batch)
+
+
+# ===== Chunks =====
+def chunk_path(out, k):
+    return os.path.join(out, "chunk_%05d.npz" % k)
+
+
+def run_chunk(k, start, stop, tracks, cfg, backend):
+    """Pose columns of chunk k, written to its file; timing dict"""
+    frames, ids, xy = tracks
+    lo, hi = np.searchsorted(frames, [start, stop])
+    frames, ids, xy = frames[lo:hi], ids[lo:hi], xy[lo:hi]
+    crop, size = cfg["crop"], cfg["batch"]
+    batch = np.zeros((size, crop, crop), dtype=np.uint8)
+    origin = np.zeros((size, 2), dtype=np.float32)
+    rows = np.zeros(size, dtype=np.int64)
+    poses = np.zeros((len(frames), len(backend_nodes(backend, batch)), 3),
+                     dtype=np.float32)
+    t = {"decode": 0.0, "crop": 0.0, "infer": 0.0}
+    fill = 0
+
+    def flush(fill):
+        t0 = time.perf_counter()
+        out = backend.predict(batch)[:fill]
+        t["infer"] += time.perf_counter() - t0
+        out[:, :, :2] += origin[:fill, None]
+        poses[rows[:fill]] = out
+
+    wanted = set(np.unique(frames).tolist())
+    first = np.searchsorted(frames, np.arange(start, stop + 1))
+    t0 = time.perf_counter()
+    for n, frame in read_chunk(cfg["video"], start, stop, wanted,
+                               cfg["width"], cfg["height"], cfg["flies"]):
+        t1 = time.perf_counter()
+        t["decode"] += t1 - t0
+        infer = t["infer"]
+        h, w = frame.shape
+        windows = sliding_window_view(frame, (crop, crop))
+        r0, r1 = first[n - start], first[n - start + 1]
+        while r0 < r1:
+            m = min(r1 - r0, size - fill)
+            c = xy[r0:r0 + m]
+            ox = np.clip(np.rint(c[:, 0]).astype(int) - crop // 2, 0,
+                         w - crop)
+            oy = np.clip(np.rint(c[:, 1]).astype(int) - crop // 2, 0,
+                         h - crop)
+            # whole windows by their origins, copied into the batch
+            batch[fill:fill + m] = windows[oy, ox]
+            origin[fill:fill + m, 0] = ox
+            origin[fill:fill + m, 1] = oy
+            rows[fill:fill + m] = np.arange(r0, r0 + m)
+            fill += m
+            r0 += m
+            if fill == size:
+                flush(fill)
+                fill = 0
+        t0 = time.perf_counter()
+        t["crop"] += t0 - t1 - (t["infer"] - infer)
+    if fill:
+        flush(fill)
+    tmp = chunk_path(cfg["out"], k) + ".tmp.npz"
+    np.savez(tmp, frame=frames, track=ids, x=poses[:, :, 0],
+             y=poses[:, :, 1], score=poses[:, :, 2],
+             nodes=np.array(backend_nodes(backend, batch)))
+    os.replace(tmp, chunk_path(cfg["out"], k))
+    t.update(chunk=k, frames=stop - start, crops=len(frames))
+    return t
+
+
+def backend_nodes(backend, batch):
+    if backend.nodes is None:
+        backend.predict(batch)
+    return backend.nodes
+
+
+# ===== Process pool =====
+_WORKER = {}
+
+
+def _init_worker(tracks, cfg):
+    _WORKER.clear()
+    _WORKER.update(tracks=tracks, cfg=cfg,
+                   backend=load_backend(cfg["backend"], cfg["crop"],
+                                        cfg["batch"], cfg["channels"]))
+
+
+def _run(job):
+    return run_chunk(*job, _WORKER["tracks"], _WORKER["cfg"],
+                     _WORKER["backend"])
+
+
+def export(tracks, cfg, frames, workers=1, max_chunks=None, progress=None):
+    """Run the missing chunks of frames [0, frames) and merge them; a list
+    of the timing dicts of the chunks run"""
+    os.makedirs(cfg["out"], exist_ok=True)
+    meta_path = os.path.join(cfg["out"], "run.json")
+    meta = {key: cfg[key] for key in ("video", "chunk", "crop", "backend")}
+    meta["frames"] = frames
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            old = json.load(f)
+        if old != meta:
+            raise ValueError("%s holds another run: %s" % (cfg["out"], old))
+    else:
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+    step = cfg["chunk"]
+    jobs = [(k, s, min(s + step, frames))
+            for k, s in enumerate(range(0, frames, step))
+            if not os.path.exists(chunk_path(cfg["out"], k))]
+    if max_chunks is not None:
+        jobs = jobs[:max_chunks]
+    done = []
+    if workers <= 1 or len(jobs) <= 1:
+        _init_worker(tracks, cfg)
+        results = map(_run, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(min(workers, len(jobs)), _init_worker,
+                                    (tracks, cfg))
+        results = pool.imap_unordered(_run, jobs)
+    try:
+        for r in results:
+            done.append(r)
+            if progress:
+                progress(r, len(done), len(jobs))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    n_chunks = len(range(0, frames, step))
+    if all(os.path.exists(chunk_path(cfg["out"], k))
+           for k in range(n_chunks)):
+        merge(cfg["out"], n_chunks)
+    return done
+
+
+def merge(out, n_chunks):
+    """<out>/poses.npz from the chunk files, sorted by frame and track"""
+    parts = [np.load(chunk_path(out, k)) for k in range(n_chunks)]
+    cols = {c: np.concatenate([p[c] for p in parts]) for c in COLUMNS}
+    order = np.lexsort((cols["track"], cols["frame"]))
+    tmp = os.path.join(out, "poses.tmp.npz")
+    np.savez(tmp, nodes=parts[0]["nodes"],
+             **{c: v[order] for c, v in cols.items()})
+    os.replace(tmp, os.path.join(out, "poses.npz"))
+
+
+def load_poses(path):
+    """The columns of a poses.npz as a dict of arrays"""
+    with np.load(path) as f:
+        return {k: f[k] for k in f.files}
+
+
+def find(poses, frame, track):
+    """Row of (frame, track) in loaded poses, or None"""
+    lo, hi = np.searchsorted(poses["frame"], [frame, frame + 1])
+    i = lo + np.searchsorted(poses["track"][lo:hi], track)
+    if i < hi and poses["track"][i] == track:
+        return i
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("video", help="a video file, or synthetic")
+    parser.add_argument("--tracks", help="tracks CSV (Generic_camera_version"
+                        ".py --track); synthetic: the true flies")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="frames to export (default: all)")
+    parser.add_argument("--chunk", type=int, default=600)
+    parser.add_argument("--crop", type=int, default=64,
+                        help="crop size, px (SLEAP: the model's input)")
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--backend", default="mock")
+    parser.add_argument("--mock-channels", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--width", type=int, default=1920,
+                        help="synthetic frame size")
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--flies", type=int, default=15)
+    args = parser.parse_args()
+
+    _, count = open_video(args.video, args.width, args.height, args.flies)
+    frames = args.frames or count
+    if not frames:
+        sys.exit("--frames is needed for this source")
+    if args.tracks:
+        tracks = read_tracks(args.tracks)
+    elif args.video == "synthetic":
+        tracks = synthetic_tracks(frames, args.width, args.height,
+                                  args.flies)
+    else:
+        sys.exit("--tracks is needed for a video file")
+    cfg = {"video": args.video, "out": args.out, "chunk": args.chunk,
+           "crop": args.crop, "batch": args.batch, "backend": args.backend,
+           "channels": args.mock_channels, "width": args.width,
+           "height": args.height, "flies": args.flies}
+
+    def progress(r, i, n):
+        print(f"\rchunk {r['chunk']}: {r['crops']} crops  ({i}/{n})",
+              end="", flush=True)
+
+    t0 = time.perf_counter()
+    try:
+        done = export(tracks, cfg, frames, args.workers, progress=progress)
+    except ValueError as e:
+        sys.exit(str(e))
+    wall = time.perf_counter() - t0
+    print()
+    crops = sum(r["crops"] for r in done)
+    print(f"{len(done)} chunks, {sum(r['frames'] for r in done)} frames, "
+          f"{crops} crops in {wall:.1f} s ({crops / max(wall, 1e-9):.0f} "
+          f"crops/s) -> {os.path.join(args.out, 'poses.npz')}")
+
+
+if __name__ == "__main__":
+    main()
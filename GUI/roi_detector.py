@@ -0,0 +1,189 @@
+"""
+Coarse-to-fine fly detection for 4K frames.
+
+At 3840 x 2160 the flies cover well under 1 % of the arena, yet the
+full-frame Detector (tracking_engine.py) compares every arena pixel with
+the background on every frame. RoiDetector looks at the whole arena only
+at 1/scale resolution, and at full resolution only around the flies:
+
+    coarse   every --rescan frames, and on the frame after a fly was lost:
+             the frame and the background limits sampled every scale-th
+             pixel of every scale-th row (strided views, no resampling
+             pass), thresholded inside the arena mask; every component is
+             a candidate fly
+    predict  every frame: each fly of the last frame is expected at its
+             last position plus its last step, and its window is cut
+             there without a coarse pass
+    refine   a window x window full-resolution crop around every predicted
+             fly and every new candidate (a candidate within a quarter
+             window of a prediction is the same fly). The crops are
+             gathered into one stack (window views of the frame, one block
+             copy per crop row) and labelled in one go; in each crop the
+             component nearest the centre is the fly, its centroid and
+             long axis weighted by the contrast to the background
+
+A window that loses its fly, finds the same blob as another window (flies
+touching) or holds a second blob away from every fly (flies parting)
+starts a coarse pass on the next frame, which picks the other fly up. The
+background is the running median of tracking_engine.py at full
+resolution; one band of its rows is stepped per frame, 1/bg_every of a
+full pass (default 16 here: at 4K a full pass costs about 4 ms).
+
+    python bench_roi.py --width 3840 --height 2160 --flies 30
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from tracking_engine import Detector, components, no_flies
+
+
+class RoiDetector(Detector):
+    """Detector with the same results (centroids, areas, angles) from a
+    coarse pass and full-resolution crops around the flies"""
+
+    def __init__(self, width, height, arena=None, threshold=25, bg_every=16,
+                 polarity="dark", min_area=20, max_area=2000, learn=15,
+                 flood_frac=0.05, scale=8, window=None, rescan=8,
+                 weighted=True):
+        if polarity not in ("dark", "light"):
+            raise ValueError("ROI detection needs polarity dark or light")
+        Detector.__init__(self, width, height, arena, threshold, "median",
+                          bg_every, polarity, min_area, max_area, learn,
+                          flood_frac)
+        self.scale = scale
+        # twice the length of a fly (24 px at 1080 rows), even
+        self.window = window or 2 * int(round(24 * height / 1080.0))
+        self.window = min(self.window, self.y1 - self.y0, self.x1 - self.x0)
+        self.views = {}
+        self.rescan = rescan
+        self.weighted = weighted
+        self.coarse_mask = np.ascontiguousarray(self.mask[::scale, ::scale])
+        self.coarse_w = self.coarse_mask.shape[1]
+        self.coarse_min = max(1, min_area // (scale * scale))
+        self.coarse_max_fg = self.max_fg // (scale * scale)
+        self.pos = np.zeros((0, 2))
+        self.step = np.zeros((0, 2))
+        self.lost = True
+        self.frame_no = 0
+        self.coarse_passes = 0
+        self.windows = 0
+
+    def detect(self, frame):
+        """(centroids n x 2 (x, y) in frame pixels, areas n, angles n); None
+        while the background is being learned"""
+        if self.learning is not None:
+            return Detector.detect(self, frame)
+        box = self.crop(frame)
+        self.bg.update(box)
+        self.frame_no += 1
+        centres = self.pos + self.step
+        steps = self.step
+        if self.lost or self.frame_no % self.rescan == 0:
+            found = self.coarse(box)
+            if found is None:
+                self.floods += 1
+                self.bg.reset(box)
+                self.pos = self.step = np.zeros((0, 2))
+                self.lost = True
+                return no_flies()
+            if len(centres) and len(found):
+                d = np.hypot(found[:, None, 0] - centres[None, :, 0],
+                             found[:, None, 1] - centres[None, :, 1])
+                found = found[d.min(axis=1) > self.window / 4]
+            centres = np.concatenate([centres, found])
+            steps = np.concatenate([steps, np.zeros((len(found), 2))])
+        predicted = len(self.pos)
+        has, pos, areas, angles = self.refine(box, centres, self.window)
+        # two windows on one blob: keep the first
+        idx = np.flatnonzero(has)
+        if len(idx) > 1:
+            p = pos[idx]
+            d = np.hypot(p[:, None, 0] - p[None, :, 0],
+                         p[:, None, 1] - p[None, :, 1])
+            dup = np.triu(d < 1.0, 1).any(axis=0)
+            has[idx[dup]] = False
+        self.lost = self.crowded or not has[:predicted].all()
+        self.step = (pos - centres + steps)[has]
+        self.pos = pos[has]
+        return self.pos + (self.x0, self.y0), areas[has], angles[has]
+
+    def coarse(self, box):
+        """Candidate flies (x, y) in box pixels; None when the frame is
+        flooded"""
+        self.coarse_passes += 1
+        s = self.scale
+        view = box[::s, ::s]
+        if self.bg.polarity == "dark":
+            fg = np.less(view, self.bg.lo[::s, ::s])
+        else:
+            fg = np.greater(view, self.bg.hi[::s, ::s])
+        fg &= self.coarse_mask
+        idx = np.flatnonzero(fg)
+        if len(idx) > self.coarse_max_fg:
+            return None
+        centroids, _, _ = components(idx, self.coarse_w, self.coarse_min)
+        return centroids * s
+
+    def refine(self, box, centres, win):
+        """Per window win px square: (found, centroid (x, y) in box pixels,
+        area, angle) of the component nearest its centre"""
+        n = len(centres)
+        self.windows += n
+        h, w = box.shape
+        win = min(win, h, w)
+        oy = np.clip(np.rint(centres[:, 1]).astype(int) - win // 2, 0, h - win)
+        ox = np.clip(np.rint(centres[:, 0]).astype(int) - win // 2, 0, w - win)
+        if win not in self.views:
+            # window views of the arrays that stay, made once
+            limit = self.bg.lo if self.bg.polarity == "dark" else self.bg.hi
+            self.views[win] = (sliding_window_view(limit, (win, win)),
+                               sliding_window_view(self.mask, (win, win)))
+        limit_windows, mask_windows = self.views[win]
+        # (y, x) pairs of window origins pick whole windows: one block copy
+        # per crop row
+        crops = sliding_window_view(box, (win, win))[oy, ox].astype(np.int16)
+        limit = limit_windows[oy, ox].astype(np.int16)
+        t = self.bg.threshold
+        if self.bg.polarity == "dark":
+            contrast = limit + t - crops
+        else:
+            contrast = crops - limit + t
+        fg = contrast > t
+        fg &= mask_windows[oy, ox]
+        flat = np.flatnonzero(fg)
+        weights = contrast.ravel()[flat] if self.weighted else None
+        # labelled as one image win wide with a blank row under each crop,
+        # which keeps the crops apart
+        idx = flat + flat // (win * win) * win
+        cent, areas, angles = components(idx, win, self.min_area,
+                                         self.max_area, weights)
+        self.crowded = False
+        has = np.zeros(n, dtype=bool)
+        pos = centres.copy()
+        out_areas = np.zeros(n, dtype=np.int64)
+        out_angles = np.zeros(n)
+        if len(cent):
+            k = (cent[:, 1] // (win + 1)).astype(int)
+            x = cent[:, 0] + ox[k]
+            y = cent[:, 1] - k * (win + 1) + oy[k]
+            d = np.hypot(x - centres[k, 0], y - centres[k, 1])
+            order = np.lexsort((d, k))
+            _, first = np.unique(k[order], return_index=True)
+            best = order[first]
+            kb = k[best]
+            has[kb] = True
+            pos[kb] = np.stack([x[best], y[best]], 1)
+            out_areas[kb] = areas[best]
+            out_angles[kb] = angles[best]
+            # a blob that is no window's fly and not near one is a fly
+            # without a window (parting from its neighbour)
+            other = np.ones(len(k), dtype=bool)
+            other[best] = False
+            if other.any() and has.any():
+                d = np.hypot(x[other, None] - pos[None, has, 0],
+                             y[other, None] - pos[None, has, 1])
+                self.crowded = bool((d.min(axis=1) > win / 4).any())
+            else:
+                self.crowded = bool(other.any())
+        return has, pos, out_areas, out_angles
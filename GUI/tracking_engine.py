@@ -0,0 +1,568 @@
+"""
+Capture and fly tracking engine of the generic camera GUI.
+
+A capture thread reads frames from a source and puts them on a bounded
+queue; the processing stage takes them off and finds the flies:
+
+    source      camera:<n> (OpenCV), a video file (OpenCV), or synthetic
+                (flies walking in a lit arena, no camera or OpenCV needed)
+    background  running median (numpy): once every --bg-every frames each
+                pixel steps 1 grey level towards the frame (1/bg-every of
+                the rows per frame), after starting from the median of the
+                first --learn frames; or OpenCV's MOG2
+    foreground  pixels darker (or lighter, --polarity) than the background
+                by more than --threshold grey levels, inside the arena mask
+    flies       8-connected components of the foreground pixels with an
+                area in [min_area, max_area], as area, centroid and the
+                angle of the long axis
+
+Only the bounding box of the arena mask is processed, and the threshold is
+folded into per-pixel limits (background -+ threshold) that are updated
+with the background, so a frame costs one or two comparisons and an AND.
+Flies cover a tiny part of the arena, so the components are labelled on
+the horizontal runs of the foreground pixels (the runs of the next row
+that touch a run found by binary search, labels merged by min propagation
+with pointer jumping), not by a scan of the image.
+
+A live source (a camera, or a paced synthetic source) never waits for the
+processing stage: when the queue is full the oldest frame is dropped and
+counted, so the results stay current. A video file or an unpaced
+synthetic source waits instead, so every frame is processed. A frame in
+which the foreground covers more than flood_frac of the arena (lights
+switched, camera knocked) gives no flies and restarts the background from
+that frame.
+
+    python bench_tracking.py --width 1920 --height 1080 --fps 60
+"""
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# index: frame number from the source; time: capture time (unix s);
+# latency: capture to result, s; centroids: n x 2 (x, y) px; areas: n px;
+# angles: n, long axis, rad
+Detections = collections.namedtuple(
+    "Detections", "index time latency centroids areas angles")
+
+BACKGROUNDS = ("median", "mog2")
+POLARITIES = ("dark", "light", "both")
+
+
+# ===== Frame sources =====
+class CameraSource:
+    """An OpenCV camera, as 8-bit grey frames"""
+
+    live = True
+
+    def __init__(self, index=0, width=1920, height=1080, fps=60):
+        if cv2 is None:
+            raise RuntimeError("camera capture needs OpenCV (pip install "
+                               "opencv-python)")
+        self.cap = cv2.VideoCapture(index)
+        if not self.cap.isOpened():
+            raise RuntimeError("cannot open camera %d" % index)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.cap.set(cv2.CAP_PROP_FPS, fps)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or fps
+
+    def read(self):
+        ok, frame = self.cap.read()
+        if not ok:
+            return None
+        return grey(frame)
+
+    def close(self):
+        self.cap.release()
+
+
+class VideoSource(CameraSource):
+    """A video file; live only when paced at its frame rate"""
+
+    def __init__(self, path, realtime=False):
+        if cv2 is None:
+            raise RuntimeError("video files need OpenCV (pip install "
+                               "opencv-python)")
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError("cannot open %s" % path)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.live = realtime
+        self.next_t = None
+
+    def read(self):
+        if self.live:
+            self.next_t = pace(self.next_t, self.fps)
+        return CameraSource.read(self)
+
+
+class SyntheticSource:
+    """Dark flies walking in a lit circular arena, with sensor noise.
+
+    Flies are antialiased ellipses body_px long, drawn at sub-pixel
+    positions; truth[index] holds their centroids (x, y) and headings for
+    the last few hundred frames. With fps the source is paced like a
+    camera (live), without it frames come as fast as they are taken.
+    """
+
+    def __init__(self, width=1920, height=1080, flies=15, fps=None,
+                 body_px=None, speed_px=None, noise=3.0, frames=None,
+                 seed=1):
+        self.width, self.height = width, height
+        self.fps = fps or 60.0
+        self.live = fps is not None
+        self.frames = frames
+        self.count = 0
+        self.next_t = None
+        self.rng = np.random.default_rng(seed)
+        scale = height / 1080.0
+        self.body_px = body_px or 24.0 * scale
+        self.speed_px = speed_px or 3.0 * scale
+        self.arena = (width / 2.0, height / 2.0, 0.46 * min(width, height))
+        cx, cy, r = self.arena
+        y, x = np.ogrid[0:height, 0:width]
+        d = np.sqrt((x - cx) ** 2 + (y - cy) ** 2) / r
+        lit = np.where(d < 1.0, 190.0 - 25.0 * d ** 2, 60.0)
+        # a few noisy copies of the background, used in turn
+        self.plates = [np.clip(lit + self.rng.normal(0, noise, lit.shape), 0,
+                               255).astype(np.uint8) for _ in range(4)]
+        a = self.rng.uniform(0, 2 * np.pi, flies)
+        rr = r * 0.8 * np.sqrt(self.rng.uniform(0, 1, flies))
+        self.pos = np.stack([cx + rr * np.cos(a), cy + rr * np.sin(a)], 1)
+        self.heading = self.rng.uniform(0, 2 * np.pi, flies)
+        self.truth = {}
+
+    def step(self):
+        """Walk: turn a little, sometimes stop, bounce off the arena wall"""
+        n = len(self.pos)
+        self.heading += self.rng.normal(0, 0.25, n)
+        v = self.speed_px * (self.rng.uniform(0, 1, n) > 0.2)
+        new = self.pos + v[:, None] * np.stack(
+            [np.cos(self.heading), np.sin(self.heading)], 1)
+        cx, cy, r = self.arena
+        out = np.hypot(new[:, 0] - cx, new[:, 1] - cy) > r - self.body_px
+        self.heading[out] += np.pi
+        self.pos = np.where(out[:, None], self.pos, new)
+
+    def draw(self, frame):
+        half = int(self.body_px * 0.7) + 2
+        a_len, b_len = self.body_px / 2.0, self.body_px / 5.0
+        oy, ox = np.mgrid[-half:half + 1, -half:half + 1]
+        for (x, y), h in zip(self.pos, self.heading):
+            ix, iy = int(round(x)), int(round(y))
+            u = ox + (ix - x)
+            w = oy + (iy - y)
+            along = u * np.cos(h) + w * np.sin(h)
+            across = -u * np.sin(h) + w * np.cos(h)
+            e = np.sqrt((along / a_len) ** 2 + (across / b_len) ** 2)
+            cover = np.clip((1.0 - e) * b_len + 0.5, 0.0, 1.0)
+            y0, x0 = iy - half, ix - half
+            patch = frame[y0:y0 + 2 * half + 1, x0:x0 + 2 * half + 1]
+            dark = patch * (1.0 - 0.7 * cover)
+            np.minimum(patch, dark.astype(np.uint8), out=patch)
+
+    def read(self):
+        if self.frames is not None and self.count >= self.frames:
+            return None
+        if self.live:
+            self.next_t = pace(self.next_t, self.fps)
+        self.step()
+        frame = self.plates[self.count % len(self.plates)].copy()
+        self.draw(frame)
+        self.truth[self.count] = (self.pos.copy(), self.heading.copy())
+        self.truth.pop(self.count - 512, None)
+        self.count += 1
+        return frame
+
+    def close(self):
+        pass
+
+
+def grey(frame):
+    if frame.ndim == 3:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return frame
+
+
+def pace(next_t, fps):
+    """Sleep until next_t; the time of the frame after"""
+    now = time.monotonic()
+    if next_t is None or now - next_t > 1.0:
+        next_t = now
+    elif next_t > now:
+        time.sleep(next_t - now)
+    return next_t + 1.0 / fps
+
+
+def open_source(spec, width=1920, height=1080, fps=None, flies=15,
+                frames=None, realtime=False):
+    """camera:<n>, synthetic, ring:<name> (frame_ring.py), or a video
+    file path"""
+    if spec.startswith("ring:"):
+        from frame_ring import RingSource
+        return RingSource(spec.partition(":")[2], fps or 60)
+    if spec.startswith("camera"):
+        index = int(spec.partition(":")[2] or 0)
+        return CameraSource(index, width, height, fps or 60)
+    if spec == "synthetic":
+        return SyntheticSource(width, height, flies, fps, frames=frames)
+    return VideoSource(spec, realtime)
+
+
+# ===== Arena mask =====
+def circle_mask(width, height, cx=None, cy=None, r=None):
+    """height x width bool, True inside the circle (default: the largest
+    one centred in the frame)"""
+    cx = width / 2.0 if cx is None else cx
+    cy = height / 2.0 if cy is None else cy
+    r = min(width, height) / 2.0 if r is None else r
+    y, x = np.ogrid[0:height, 0:width]
+    return (x - cx) ** 2 + (y - cy) ** 2 <= r * r
+
+
+def mask_box(mask):
+    """(y0, y1, x0, x1) of the True pixels"""
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        raise ValueError("empty arena mask")
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+# ===== Connected components =====
+def pixel_runs(idx, width):
+    """(row, first column, last column) of the horizontal runs of the
+    foreground pixels at sorted flat indices idx"""
+    row, col = np.divmod(idx, width)
+    brk = np.flatnonzero((np.diff(idx) != 1) | (col[1:] == 0)) + 1
+    first = np.concatenate([[0], brk])
+    last = np.concatenate([brk - 1, [len(idx) - 1]])
+    return row[first], col[first], col[last]
+
+
+def label_runs(row, x0, x1, width):
+    """Component of each run (8-connected): the number of the component's
+    first run. Runs are in image order; a run touches the runs of the next
+    row that start at most one column after its end and end at most one
+    column before its start."""
+    n = len(row)
+    labels = np.arange(n)
+    stride = width + 2                     # x0 - 1, x1 + 1 stay in the row
+    starts = row * stride + x0
+    ends = row * stride + x1
+    lo = np.searchsorted(ends, (row + 1) * stride + x0 - 1)
+    hi = np.searchsorted(starts, (row + 1) * stride + x1 + 1, "right")
+    count = np.maximum(hi - lo, 0)
+    if not count.any():
+        return labels
+    a = np.repeat(np.arange(n), count)
+    b = (np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+         + np.repeat(lo, count))
+    while True:
+        low = np.minimum(labels[a], labels[b])
+        new = labels.copy()
+        np.minimum.at(new, a, low)
+        np.minimum.at(new, b, low)
+        new = new[new]                     # pointer jumping
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def components(idx, width, min_area=1, max_area=None, weights=None):
+    """(centroids n x 2 (x, y), areas n, angles n) of the 8-connected
+    components of the foreground pixels at sorted flat indices idx. The
+    angle is that of the long axis from the second moments, -pi/2..pi/2
+    from +x towards +y (head and tail are not told apart). With weights,
+    one per pixel (the contrast to the background, say), centroid and axis
+    are weighted; without, they come from the runs in closed form."""
+    if not len(idx):
+        return no_flies()
+    row, x0, x1 = pixel_runs(idx, width)
+    _, comp = np.unique(label_runs(row, x0, x1, width), return_inverse=True)
+    length = x1 - x0 + 1
+    areas = np.bincount(comp, length).astype(np.int64)
+    if weights is None:
+        y = row.astype(np.float64)
+        sx = length * (x0 + x1) / 2.0
+        sxx = square_sum(x1) - square_sum(x0 - 1)
+        m = [np.bincount(comp, v) for v in
+             (length, sx, length * y, sxx, length * y * y, sx * y)]
+    else:
+        pix = np.repeat(comp, length)
+        y, x = np.divmod(idx, width)
+        w = np.asarray(weights, dtype=np.float64)
+        m = [np.bincount(pix, v) for v in
+             (w, w * x, w * y, w * x * x, w * y * y, w * x * y)]
+    m0, mx, my, mxx, myy, mxy = m
+    keep = (areas >= min_area) & (m0 > 0)
+    if max_area is not None:
+        keep &= areas <= max_area
+    m0, mx, my, mxx, myy, mxy = (v[keep] for v in m)
+    cx, cy = mx / m0, my / m0
+    angles = 0.5 * np.arctan2(2 * (mxy / m0 - cx * cy),
+                              (mxx / m0 - cx * cx) - (myy / m0 - cy * cy))
+    return np.stack([cx, cy], 1), areas[keep], angles
+
+
+def no_flies():
+    return np.zeros((0, 2)), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+
+def square_sum(n):
+    """0^2 + 1^2 + ... + n^2 (0 for n = -1)"""
+    n = n.astype(np.float64)
+    return n * (n + 1) * (2 * n + 1) / 6.0
+
+
+# ===== Background =====
+class MedianBackground:
+    """Approximate running median with the threshold folded into per-pixel
+    limits: a pixel is foreground when it is below lo (or above hi). Each
+    frame steps one band of 1/every of the rows, so every pixel is updated
+    once in every frames at an even cost per frame."""
+
+    def __init__(self, threshold=25, every=4, polarity="dark"):
+        self.threshold = threshold
+        self.every = every
+        self.polarity = polarity
+        self.bg = None
+        self.lo = self.hi = None
+        self.count = 0
+
+    def learn(self, frames):
+        self.bg = np.median(np.stack(frames), axis=0).astype(np.uint8)
+        self.lo = np.empty_like(self.bg)
+        self.hi = np.empty_like(self.bg)
+        self.limits(slice(None))
+
+    def limits(self, rows):
+        t = np.uint8(self.threshold)
+        if self.polarity != "light":
+            lo = self.lo[rows]
+            np.maximum(self.bg[rows], t, out=lo)
+            lo -= t
+        if self.polarity != "dark":
+            hi = self.hi[rows]
+            np.minimum(self.bg[rows], 255 - t, out=hi)
+            hi += t
+
+    def foreground(self, frame, out, scratch):
+        if self.polarity == "light":
+            np.greater(frame, self.hi, out=out)
+        else:
+            np.less(frame, self.lo, out=out)
+            if self.polarity == "both":
+                np.greater(frame, self.hi, out=scratch)
+                out |= scratch
+        self.update(frame)
+        return out
+
+    def update(self, frame):
+        """Step the next band of rows one grey level towards frame"""
+        h = len(self.bg)
+        band = self.count % self.every
+        rows = slice(band * h // self.every, (band + 1) * h // self.every)
+        self.count += 1
+        bg, f = self.bg[rows], frame[rows]
+        np.add(bg, np.greater(f, bg), out=bg, casting="unsafe")
+        np.subtract(bg, np.less(f, bg), out=bg, casting="unsafe")
+        self.limits(rows)
+
+    def reset(self, frame):
+        self.bg[:] = frame
+        self.limits(slice(None))
+
+
+class Mog2Background:
+    """OpenCV's Gaussian mixture background (shadows off)"""
+
+    def __init__(self, threshold=25, history=500):
+        if cv2 is None:
+            raise RuntimeError("the mog2 background needs OpenCV")
+        self.history = history
+        self.threshold = threshold
+        self.reset(None)
+
+    def learn(self, frames):
+        for f in frames:
+            self.mog.apply(f)
+
+    def foreground(self, frame, out, scratch):
+        np.greater(self.mog.apply(frame), 0, out=out)
+        return out
+
+    def reset(self, frame):
+        self.mog = cv2.createBackgroundSubtractorMOG2(
+            self.history, float(self.threshold) ** 2, False)
+        if frame is not None:
+            self.mog.apply(frame, learningRate=1.0)
+
+
+# ===== Detector =====
+class Detector:
+    """Flies of one frame: background subtraction, threshold, arena mask
+    and connected components, inside the bounding box of the mask"""
+
+    def __init__(self, width, height, arena=None, threshold=25,
+                 background="median", bg_every=4, polarity="dark",
+                 min_area=20, max_area=2000, learn=15, flood_frac=0.05):
+        if arena is None:
+            arena = circle_mask(width, height)
+        self.y0, self.y1, self.x0, self.x1 = mask_box(arena)
+        self.mask = np.ascontiguousarray(arena[self.y0:self.y1,
+                                               self.x0:self.x1])
+        self.box_w = self.x1 - self.x0
+        self.min_area = min_area
+        self.max_area = max_area
+        self.learn_n = learn
+        self.max_fg = int(flood_frac * self.mask.sum())
+        if background == "mog2":
+            self.bg = Mog2Background(threshold)
+        else:
+            self.bg = MedianBackground(threshold, bg_every, polarity)
+        self.fg = np.empty(self.mask.shape, dtype=bool)
+        self.scratch = np.empty(self.mask.shape, dtype=bool)
+        self.learning = []
+        self.floods = 0
+
+    def crop(self, frame):
+        return frame[self.y0:self.y1, self.x0:self.x1]
+
+    def detect(self, frame):
+        """(centroids n x 2 (x, y) in frame pixels, areas n, angles n); None
+        while the background is being learned"""
+        box = self.crop(frame)
+        if self.learning is not None:
+            self.learning.append(box.copy())
+            if len(self.learning) < self.learn_n:
+                return None
+            self.bg.learn(self.learning)
+            self.learning = None
+            return None
+        fg = self.bg.foreground(box, self.fg, self.scratch)
+        fg &= self.mask
+        idx = np.flatnonzero(fg)
+        if len(idx) > self.max_fg:
+            self.floods += 1
+            self.bg.reset(box)
+            return no_flies()
+        centroids, areas, angles = components(idx, self.box_w, self.min_area,
+                                              self.max_area)
+        centroids += (self.x0, self.y0)
+        return centroids, areas, angles
+
+
+# ===== Engine =====
+class TrackingEngine:
+    """Capture thread -> bounded queue -> processing stage (run())"""
+
+    def __init__(self, source, detector, queue_size=4, drop=None):
+        self.source = source
+        self.detector = detector
+        self.queue = queue.Queue(queue_size)
+        self.drop = source.live if drop is None else drop
+        self.stopping = threading.Event()
+        self.thread = None
+        self.frame = None
+        self.captured = 0
+        self.dropped = 0
+        self.processed = 0
+        self.capture_cpu = 0.0
+        self.process_cpu = 0.0
+        self.process_s = 0.0
+        self.started = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._capture, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _capture(self):
+        try:
+            while not self.stopping.is_set():
+                frame = self.source.read()
+                if frame is None:
+                    break
+                item = (self.captured, time.time(), frame)
+                self.captured += 1
+                if not self.drop:
+                    self._put(item)
+                    continue
+                try:
+                    self.queue.put_nowait(item)
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()      # oldest frame
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+                    self.queue.put_nowait(item)
+        finally:
+            self.capture_cpu = time.thread_time()
+            self._put(None)
+
+    def _put(self, item):
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self, on_result=None, max_frames=None):
+        """Process frames in this thread until the source ends, stop() or
+        max_frames; on_result gets the Detections of every frame"""
+        if self.thread is None:
+            self.start()
+        cpu0 = time.thread_time()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    item = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                index, t, frame = item
+                self.frame = frame                # for a preview
+                t0 = time.perf_counter()
+                found = self.detector.detect(frame)
+                self.process_s += time.perf_counter() - t0
+                self.processed += 1
+                if found is not None and on_result is not None:
+                    on_result(Detections(index, t, time.time() - t, *found))
+                if max_frames is not None and self.processed >= max_frames:
+                    break
+        finally:
+            self.process_cpu += time.thread_time() - cpu0
+            self.stop()
+            self.thread.join()
+            self.source.close()
+
+    def status(self):
+        wall = time.monotonic() - self.started if self.started else 0.0
+        return {"captured": self.captured, "dropped": self.dropped,
+                "processed": self.processed,
+                "floods": self.detector.floods,
+                "fps": self.processed / wall if wall else 0.0,
+                "process_ms": 1e3 * self.process_s / max(self.processed, 1),
+                "capture_cpu_s": self.capture_cpu,
+                "process_cpu_s": self.process_cpu, "wall_s": wall}
@@ -0,0 +1,268 @@
+"""
+Command round-trip benchmark for the serial bridge, against fake ESP32s.
+
+Starts fake_esp32.py processes (thermal + display) on ptys, then runs
+--clients concurrent clients for --seconds, each sending STATS:<n> with a
+unique n and checking that the reply names its own n:
+
+    bridge   clients call SerialBridge.command() directly
+    http     clients POST /command to server.py (aiohttp, localhost)
+    legacy   the old server.py pattern: threads sharing one pyserial port,
+             write() then readline() (shows mismatched replies)
+
+Reports replies, mismatches, timeouts, link errors, throughput and the
+round-trip latency distribution. --unplug-at unplugs the thermal fake at
+that second (for --unplug-s) to measure the reconnect. The --chatter LOG:
+lines start once the thermal fake gets LOG:ON (sent by server.py on every
+connect, and here by the bench in the other modes).
+
+    python bench_bridge.py --mode bridge --clients 20 --chatter 20
+    python bench_bridge.py --mode http --clients 50 --unplug-at 3
+    python bench_bridge.py --mode legacy --clients 4 --chatter 20
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+from serial_bridge import (SerialBridge, EventBus, BridgeError,  # noqa: E402
+                           BridgeTimeout)
+
+
+class Tally:
+    def __init__(self):
+        self.latency = []
+        self.mismatch = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def add(self, outcome, seconds=None):
+        with self.lock:
+            if outcome == "ok":
+                self.latency.append(seconds)
+            else:
+                setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def report(self, wall):
+        lat = sorted(self.latency)
+        n = len(lat)
+        total = n + self.mismatch + self.timeouts + self.errors
+        print(f"requests {total}, ok {n}, mismatched {self.mismatch}, "
+              f"timeouts {self.timeouts}, link errors {self.errors}")
+        print(f"throughput {total / wall:.0f} commands/s over {wall:.1f} s")
+        if n:
+            def pct(q):
+                return 1e3 * lat[min(n - 1, int(q * n))]
+            print(f"round trip ms: p50 {pct(0.5):.1f}  p95 {pct(0.95):.1f}  "
+                  f"p99 {pct(0.99):.1f}  max {1e3 * lat[-1]:.1f}")
+
+
+def start_fakes(tmp, args):
+    procs = {}
+    for kind in ("thermal", "display"):
+        link = os.path.join(tmp, kind)
+        procs[kind] = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "fake_esp32.py"),
+             "--link", link, "--kind", kind, "--chatter", str(args.chatter),
+             "--loop-ms", str(args.loop_ms), "--unplug-s", str(args.unplug_s)],
+            stdout=subprocess.DEVNULL)
+        for _ in range(100):
+            if os.path.lexists(link):
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError("fake %s did not start" % kind)
+    return procs
+
+
+def check(n, reply):
+    return "ok" if reply == "STATS EVERY %d ms" % n else "mismatch"
+
+
+# ---------- bridge / http clients ----------
+async def run_async(args, ports, tally):
+    from aiohttp import ClientSession, web
+    from server import make_app, BUS, BRIDGES
+
+    counter = itertools.count(100000)
+    bus = EventBus()
+    links = []
+
+    def on_link(e):
+        links.append((time.monotonic(), e.line))
+
+    if args.mode == "http":
+        app = make_app(ports, timeout=args.timeout)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", args.http_port)
+        await site.start()
+        bus = app[BUS]
+        bridge = app[BRIDGES]["thermal"]
+    else:
+        bridge = SerialBridge("thermal", ports["thermal"], bus=bus,
+                              timeout=args.timeout, reconnect_s=0.1)
+        bridge.start()
+    watch = bus.subscribe(maxsize=4096)
+    await asyncio.wait_for(bridge.connected.wait(), 5)
+
+    async def log_on():
+        try:
+            await bridge.command("LOG:ON")
+        except BridgeError:
+            pass
+
+    async def watcher():
+        while True:
+            e = await watch.get()
+            if e.kind == "link":
+                on_link(e)
+                # as server.py does: the fake boots with its chatter off
+                if args.mode != "http" and e.line.startswith("CONNECTED"):
+                    asyncio.get_running_loop().create_task(log_on())
+
+    async def client(session):
+        end = time.monotonic() + args.seconds
+        while time.monotonic() < end:
+            n = next(counter)
+            t0 = time.perf_counter()
+            try:
+                if session is None:
+                    reply = await bridge.command("STATS:%d" % n)
+                else:
+                    async with session.post(
+                            "http://127.0.0.1:%d/command" % args.http_port,
+                            json={"command": "STATS:%d" % n}) as r:
+                        body = await r.json()
+                    if r.status == 504:
+                        raise BridgeTimeout(body["message"])
+                    if r.status != 200:
+                        raise BridgeError(body["message"])
+                    reply = body["response"]
+                tally.add(check(n, reply), time.perf_counter() - t0)
+            except BridgeTimeout:
+                tally.add("timeouts")
+            except BridgeError:
+                tally.add("errors")
+                await asyncio.sleep(0.05)
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000.0)
+
+    async def unplug(proc):
+        await asyncio.sleep(args.unplug_at)
+        proc.send_signal(signal.SIGUSR1)
+
+    w = asyncio.get_running_loop().create_task(watcher())
+    extra = ([asyncio.get_running_loop().create_task(unplug(args.thermal_proc))]
+             if args.unplug_at is not None else [])
+    t0 = time.monotonic()
+    if args.mode == "http":
+        async with ClientSession() as session:
+            await asyncio.gather(*[client(session) for _ in range(args.clients)])
+    else:
+        await asyncio.gather(*[client(None) for _ in range(args.clients)])
+    wall = time.monotonic() - t0
+    w.cancel()
+    for t in extra:
+        t.cancel()
+    if args.mode == "http":
+        await runner.cleanup()
+    else:
+        await bridge.close()
+    downs = [t for t, line in links if line == "DISCONNECTED"]
+    ups = [t for t, line in links if line.startswith("CONNECTED")]
+    for d in downs:
+        back = [u for u in ups if u > d]
+        print(f"link lost at {d - t0:.1f} s, back after "
+              + (f"{back[0] - d:.2f} s" if back else "never"))
+    return wall
+
+
+# ---------- legacy: blocking write + readline ----------
+def run_legacy(args, ports, tally):
+    import serial
+
+    ser = serial.Serial(ports["thermal"], 115200, timeout=args.timeout)
+    ser.write(b"LOG:ON\n")                  # the chatter starts with logging
+    while ser.readline().strip() not in (b"LOG ON", b""):
+        pass
+    counter = itertools.count(100000)
+    lock = threading.Lock()
+    end = time.monotonic() + args.seconds
+
+    def client():
+        while time.monotonic() < end:
+            with lock:
+                n = next(counter)
+            t0 = time.perf_counter()
+            try:
+                ser.write(b"STATS:%d\n" % n)
+                reply = ser.readline().decode("utf-8", "replace").strip()
+            except serial.SerialException:
+                # two threads in read() at once: pyserial reports a dead port
+                tally.add("errors")
+                continue
+            if not reply:
+                tally.add("timeouts")
+            else:
+                tally.add(check(n, reply), time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ser.close()
+    return time.monotonic() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=("bridge", "http", "legacy"),
+                        default="bridge")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--think-ms", type=float, default=0.0,
+                        help="pause between a client's commands")
+    parser.add_argument("--chatter", type=float, default=20.0,
+                        help="unsolicited ESP32 lines per second")
+    parser.add_argument("--loop-ms", type=int, default=20,
+                        help="fake ESP32 loop() period")
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--unplug-at", type=float, default=None)
+    parser.add_argument("--unplug-s", type=float, default=1.0)
+    parser.add_argument("--http-port", type=int, default=5077)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="arena_")
+    procs = start_fakes(tmp, args)
+    args.thermal_proc = procs["thermal"]
+    ports = {k: os.path.join(tmp, k) for k in procs}
+    tally = Tally()
+    try:
+        print(f"{args.mode}: {args.clients} clients, {args.chatter:g} "
+              f"unsolicited lines/s, ESP32 loop {args.loop_ms} ms")
+        if args.mode == "legacy":
+            wall = run_legacy(args, ports, tally)
+        else:
+            wall = asyncio.run(run_async(args, ports, tally))
+        tally.report(wall)
+    finally:
+        for p in procs.values():
+            p.terminate()
+            p.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Load test of the /ws live feed: many browsers on one Raspberry Pi server.
+
+Starts the fake ESP32s (fake_esp32.py), writes a synthetic frame archive
+(a cool spot moving over a 36 C arena, --hz frames a second) and runs
+server.py on it in its own process, so its CPU time can be measured. Then
+--clients WebSocket clients connect for --seconds; --slow of them read
+their socket at only --slow-kbps, like a phone on bad WiFi. Meanwhile a
+command probe POSTs STATS:<n> to the thermal ESP32 four times a second,
+which stalls if anything blocks the server's event loop.
+
+Reports per-client telemetry and frame rates, message age on arrival
+(server send to client receive), key/delta frames and decode errors, the
+slow clients' skipped messages, the command round trip, and the server's
+CPU time as a share of one core.
+
+    python bench_live.py --clients 50 --hz 8 --slow 5
+    python bench_live.py --clients 50 --frames key --downsample 2
+"""
+
+import argparse
+import asyncio
+import json
+import base64
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from aiohttp import ClientSession, WSMsgType
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+from bench_bridge import start_fakes                     # noqa: E402
+from live_feed import decode_frame, KEY, DELTA           # noqa: E402
+# on the path set up by live_feed
+from frame_archive import FrameWriter                    # noqa: E402
+from frame_recorder import WIDTH, HEIGHT                 # noqa: E402
+
+
+def write_archive(path, hz, seconds=10.0):
+    """A cool spot circling a 36 C arena, with sensor noise"""
+    rng = np.random.default_rng(1)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    n = int(hz * seconds)
+    with FrameWriter(path) as w:
+        for i in range(n):
+            a = 2 * np.pi * i / n
+            cx, cy = 16 + 9 * np.cos(a), 12 + 6 * np.sin(a)
+            temps = (36.0 - 11.0 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / 18.0)
+                     + rng.normal(0, 0.15, x.shape))
+            centi = np.rint(temps * 100).astype("<i2")
+            w.append(i, int(i * 1000 / hz), 0, centi.tobytes())
+
+
+def cpu_seconds(pid):
+    with open("/proc/%d/stat" % pid) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def pct(values, q):
+    v = sorted(values)
+    return v[min(len(v) - 1, int(q * len(v)))] if v else float("nan")
+
+
+class ClientStats:
+    def __init__(self, slow):
+        self.slow = slow
+        self.telemetry = 0
+        self.frames = 0
+        self.keys = 0
+        self.events = 0
+        self.errors = 0
+        self.age = []
+        self.last = None
+
+
+    def message(self, binary, data, counting):
+        now = time.time()
+        if binary:
+            frame = check_frame(data, self.last)
+            if frame is None:
+                self.errors += 1
+                self.last = None
+                return
+            head, q = frame
+            self.last = (head["seq"], q)
+            if counting:
+                self.frames += 1
+                self.keys += head["kind"] == KEY
+                self.age.append(now - head["time"])
+            return
+        body = json.loads(data)
+        if counting and body["type"] == "telemetry":
+            self.telemetry += 1
+            self.age.append(now - body["time"])
+        elif counting and body["type"] == "event":
+            self.events += 1
+
+
+async def client(session, url, stats, t_start, t_end):
+    async with session.ws_connect(url) as ws:
+        async for msg in ws:
+            now = time.time()
+            if now >= t_end:
+                break
+            stats.message(msg.type == WSMsgType.BINARY, msg.data,
+                          now >= t_start)
+
+
+async def slow_client(args, stats, t_start, t_end):
+    """A WebSocket client on a link of --slow-kbps: reads its socket at that
+    rate through a small receive buffer (aiohttp's client would read ahead
+    into memory at any rate)"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await loop.sock_connect(sock, ("127.0.0.1", args.http_port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    await loop.sock_sendall(sock, (
+        f"GET /ws?frames={args.frames}&downsample={args.downsample} HTTP/1.1"
+        f"\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade"
+        f"\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13"
+        f"\r\n\r\n").encode())
+    buf = bytearray()
+    while b"\r\n\r\n" not in buf:
+        buf += await loop.sock_recv(sock, 1)
+    buf.clear()
+    step = 0.05
+    try:
+        while time.time() < t_end:
+            buf += await loop.sock_recv(
+                sock, max(1, int(args.slow_kbps * 1024 * step)))
+            while len(buf) >= 2:
+                opcode, n = buf[0] & 0x0F, buf[1] & 0x7F
+                head = 2 + {126: 2, 127: 8}.get(n, 0)
+                if len(buf) < head:
+                    break
+                if n == 126:
+                    n = struct.unpack_from(">H", buf, 2)[0]
+                elif n == 127:
+                    n = struct.unpack_from(">Q", buf, 2)[0]
+                if len(buf) < head + n:
+                    break
+                data = bytes(buf[head:head + n])
+                del buf[:head + n]
+                if opcode == 9:                 # ping: masked pong, zero key
+                    await loop.sock_sendall(sock, bytes(
+                        (0x8A, 0x80 | len(data))) + b"\0" * 4 + data)
+                elif opcode in (1, 2):
+                    stats.message(opcode == 2, data if opcode == 2
+                                  else data.decode(), time.time() >= t_start)
+            await asyncio.sleep(step)
+    finally:
+        sock.close()
+
+
+def check_frame(data, last):
+    """(header, frame) of a binary message, or None for a frame that cannot
+    be decoded; last is the (seq, frame) decoded before it"""
+    seq, prev = last or (None, None)
+    try:
+        head, q = decode_frame(data, prev)
+    except ValueError:
+        return None
+    if head["kind"] & DELTA and head["base"] != seq:
+        return None
+    return head, q
+
+
+async def probe(session, base, rtt, t_end):
+    n = 1
+    while time.time() < t_end:
+        t0 = time.perf_counter()
+        async with session.post(base + "/command",
+                                json={"command": "STATS:%d" % n}) as r:
+            await r.read()
+        if r.status == 200:
+            rtt.append(time.perf_counter() - t0)
+        n += 1
+        await asyncio.sleep(0.25)
+
+
+async def run(args, server_pid):
+    base = "http://127.0.0.1:%d" % args.http_port
+    url = "ws://127.0.0.1:%d/ws?frames=%s&downsample=%d" % (
+        args.http_port, args.frames, args.downsample)
+    async with ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(base + "/status") as r:
+                    if (await r.json())["thermal_connected"]:
+                        break
+            except OSError:
+                pass
+            await asyncio.sleep(0.1)
+        t_start = time.time() + args.warmup
+        t_end = t_start + args.seconds
+        stats = [ClientStats(i < args.slow) for i in range(args.clients)]
+        rtt = []
+        tasks = [asyncio.create_task(
+            slow_client(args, s, t_start, t_end) if s.slow else
+            client(session, url, s, t_start, t_end)) for s in stats]
+        await asyncio.sleep(args.warmup)
+        async with session.post(base + "/pattern",
+                                json={"pattern": "A-B-C-D"}) as r:
+            await r.read()
+        cpu0, wall0 = cpu_seconds(server_pid), time.monotonic()
+        await probe(session, base, rtt, t_end)
+        cpu1, wall1 = cpu_seconds(server_pid), time.monotonic()
+        await asyncio.wait(tasks, timeout=2)
+        async with session.get(base + "/status") as r:
+            live = (await r.json())["live"]
+        async with session.post(base + "/stop") as r:
+            await r.read()
+        for t in tasks:
+            t.cancel()
+    return stats, rtt, (cpu1 - cpu0) / (wall1 - wall0), live
+
+
+def report(args, stats, rtt, cpu, live):
+    fast = [s for s in stats if not s.slow]
+    slow = [s for s in stats if s.slow]
+    secs = args.seconds
+    print(f"{len(fast)} clients + {len(slow)} slow, {args.hz:g} Hz telemetry "
+          f"and frames ({args.frames}, downsample {args.downsample}), "
+          f"{secs:g} s")
+    if fast:
+        tel = [s.telemetry / secs for s in fast]
+        frm = [s.frames / secs for s in fast]
+        age = [a for s in fast for a in s.age]
+        print(f"per client: telemetry {min(tel):.2f}-{max(tel):.2f}/s, frames "
+              f"{min(frm):.2f}-{max(frm):.2f}/s, key frames "
+              f"{sum(s.keys for s in fast)} of {sum(s.frames for s in fast)}, "
+              f"events {min(s.events for s in fast)}, decode errors "
+              f"{sum(s.errors for s in fast)}")
+        print(f"message age ms: p50 {1e3 * pct(age, 0.5):.1f}  p99 "
+              f"{1e3 * pct(age, 0.99):.1f}  max {1e3 * max(age):.1f}")
+    if slow:
+        got = [s.telemetry + s.frames for s in slow]
+        age = [a for s in slow for a in s.age]
+        print(f"slow clients: {min(got)}-{max(got)} messages each, age ms "
+              f"p50 {1e3 * pct(age, 0.5):.0f} max {1e3 * max(age):.0f}, key "
+              f"frames {sum(s.keys for s in slow)} of "
+              f"{sum(s.frames for s in slow)}, decode "
+              f"errors {sum(s.errors for s in slow)}; server skipped "
+              f"{live['skipped_telemetry']} telemetry and "
+              f"{live['skipped_frames']} frames for them, dropped "
+              f"{live['dropped_clients']} clients")
+    print(f"command round trip ms: p50 {1e3 * pct(rtt, 0.5):.1f}  p99 "
+          f"{1e3 * pct(rtt, 0.99):.1f}  ({len(rtt)} probes)")
+    print(f"server CPU: {100 * cpu:.0f} % of one core "
+          f"(clients share the machine: {os.cpu_count()} cpu)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--slow", type=int, default=5,
+                        help="how many of the clients read slowly")
+    parser.add_argument("--slow-kbps", type=float, default=4.0,
+                        help="link speed of a slow client, KiB/s")
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--hz", type=float, default=8.0,
+                        help="telemetry and frame rate")
+    parser.add_argument("--frames", choices=("off", "key", "delta"),
+                        default="delta")
+    parser.add_argument("--downsample", type=int, choices=(1, 2), default=1)
+    parser.add_argument("--http-port", type=int, default=5078)
+    args = parser.parse_args()
+    # for start_fakes: ESP32 LOG: lines at the telemetry rate
+    args.chatter, args.loop_ms, args.unplug_s = args.hz, 20, 1.0
+
+    tmp = tempfile.mkdtemp(prefix="arena_live_")
+    archive = os.path.join(tmp, "synthetic.tfa")
+    write_archive(archive, args.hz)
+    procs = start_fakes(tmp, args)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "server.py"),
+         "--thermal", os.path.join(tmp, "thermal"),
+         "--display", os.path.join(tmp, "display"),
+         "--port", str(args.http_port), "--log", "",
+         "--frames", archive, "--live-hz", str(args.hz)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        report(args, *asyncio.run(run(args, server.pid)))
+    finally:
+        for p in [server, *procs.values()]:
+            p.terminate()
+            p.wait()
+
+
+if __name__ == "__main__":
+    main()
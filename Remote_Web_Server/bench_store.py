@@ -0,0 +1,219 @@
+"""
+Write and query benchmark of telemetry_store.py.
+
+Write: --arenas arenas log one sample each per add_sample() call, 8 a
+second of simulated time, for --hours, with a flush every --flush-s of
+simulated time (one write + fsync per segment file). Reports the cost of a
+sample and of a flush, and what that is as a share of one core at the real
+rate.
+
+Query: --days days of 8 Hz data per arena are loaded in blocks, then each
+query is timed cold (segment pages dropped from the page cache with
+posix_fadvise) and warm, up to rows in memory: one day at the automatic
+level, one day at 1 s, one hour raw, the events of a day and a week. The
+conversion to JSON columns that /history does is timed separately.
+
+Server: a fake thermal ESP32 (fake_esp32.py, booting with its LOG: samples
+off like the firmware) is recorded by server.py with --store for
+--server-s seconds, unplugged halfway; reports the samples stored before
+and after the replug, which come only if the server sent LOG:ON on each
+connect. --server-s 0 skips it (it needs aiohttp and pyserial).
+
+    python bench_store.py --dir /home/pi/bench_store --arenas 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from telemetry_store import (TelemetryStore, SAMPLE, DAY_MS, rows_to_json,
+                             day_of)
+
+RATE_HZ = 8
+
+
+def drop_cache(root):
+    for folder, _, files in os.walk(root):
+        for name in files:
+            fd = os.open(os.path.join(folder, name), os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def synthetic(t_ms, rng):
+    rows = np.zeros(len(t_ms), SAMPLE)
+    rows["t_ms"] = t_ms
+    phase = (t_ms // 300000) % 4                  # 5 min trials
+    cool = np.arange(4)[None, :] == phase[:, None]
+    rows["temp"] = np.where(cool, 25.0, 36.0) + rng.normal(0, 0.2, (len(t_ms), 4))
+    rows["pwm"] = np.where(cool, -180, 120)
+    return rows
+
+
+def bench_write(args, root):
+    store = TelemetryStore(root, flush_s=1e9, max_pending=1 << 30)
+    rng = np.random.default_rng(1)
+    n = int(args.hours * 3600 * RATE_HZ)
+    start = (day_of(time.time() * 1000) - 1) * DAY_MS
+    t = start + np.arange(n) * (1000 // RATE_HZ)
+    data = {a: synthetic(t, rng) for a in range(args.arenas)}
+    flush_every = int(args.flush_s * RATE_HZ)
+    add_s = flush_s = 0.0
+    flushes = 0
+    for i in range(n):
+        t0 = time.perf_counter()
+        for a in range(args.arenas):
+            r = data[a][i]
+            store.add_sample("arena%d" % (a + 1), int(r["t_ms"]), r["temp"],
+                             r["pwm"])
+            if i % 2400 == 0:
+                store.add_event("arena%d" % (a + 1), int(r["t_ms"]), "phase",
+                                "TRIAL %s" % "ABCD"[(i // 2400) % 4])
+        t1 = time.perf_counter()
+        add_s += t1 - t0
+        if (i + 1) % flush_every == 0:
+            store.flush()
+            flush_s += time.perf_counter() - t1
+            flushes += 1
+    fsyncs = store.fsyncs
+    store.close()
+    samples = n * args.arenas
+    per_sample = add_s / samples
+    per_flush = flush_s / max(flushes, 1)
+    load = (per_sample * RATE_HZ * args.arenas + per_flush / args.flush_s)
+    print(f"write: {args.arenas} arenas x {args.hours:g} h at {RATE_HZ} Hz = "
+          f"{samples} samples")
+    print(f"  add_sample {1e6 * per_sample:.1f} us, flush {1e3 * per_flush:.1f}"
+          f" ms ({fsyncs / max(flushes, 1):.1f} fsyncs) every {args.flush_s:g} s"
+          f" -> {100 * load:.2f} % of one core")
+
+
+def bench_query(args, root):
+    store = TelemetryStore(root, flush_s=1e9, max_pending=1 << 30)
+    rng = np.random.default_rng(2)
+    today = day_of(time.time() * 1000)
+    first = today - args.days
+    for day in range(first, today):
+        t = day * DAY_MS + np.arange(86400 * RATE_HZ) * (1000 // RATE_HZ)
+        for a in range(args.arenas):
+            rows = synthetic(t, rng)
+            for i in range(0, len(rows), 65536):
+                store.add_samples("arena%d" % (a + 1), rows[i:i + 65536])
+            for k in range(0, 86400, 300):
+                store.add_event("arena%d" % (a + 1), day * DAY_MS + k * 1000,
+                                "phase", "TRIAL %s" % "ABCD"[k // 300 % 4])
+    store.close()
+    size = sum(os.path.getsize(os.path.join(d, f))
+               for d, _, files in os.walk(root) for f in files)
+    print(f"query: {args.arenas} arenas x {args.days} days, "
+          f"{size / 1e6:.0f} MB on disk")
+
+    day = (today - 1) * DAY_MS
+    cases = [
+        ("1 day, auto", lambda s: s.query("arena1", day, day + DAY_MS)),
+        ("1 day, 1 s", lambda s: s.query("arena1", day, day + DAY_MS, "1s")),
+        ("1 h, raw", lambda s: s.query("arena1", day, day + 3600000, "raw")),
+        ("1 day, events", lambda s: ("events", s.events("arena1", day,
+                                                         day + DAY_MS))),
+        ("7 days, auto", lambda s: s.query("arena1", day - 6 * DAY_MS,
+                                           day + DAY_MS)),
+    ]
+    for name, run in cases:
+        times = {}
+        for state in ("cold", "warm"):
+            if state == "cold":
+                drop_cache(root)
+            store = TelemetryStore(root)        # no segments mapped yet
+            t0 = time.perf_counter()
+            level, rows = run(store)
+            rows = np.array(rows)               # touch every page
+            times[state] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        body = json.dumps(rows_to_json(level, rows))
+        times["json"] = time.perf_counter() - t0
+        print(f"  {name:<14} {level:>6} {len(rows):7d} rows: read cold "
+              f"{1e3 * times['cold']:6.2f} ms, warm {1e3 * times['warm']:6.2f}"
+              f" ms; JSON {len(body) / 1e3:6.0f} kB {1e3 * times['json']:6.1f}"
+              f" ms")
+
+
+def bench_server(args, root):
+    from aiohttp import web
+    from server import make_app
+
+    link = os.path.join(root, "thermal")
+    os.makedirs(root)
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), "fake_esp32.py"),
+         "--link", link, "--chatter", str(RATE_HZ),
+         "--unplug-s", "0.5"], stdout=subprocess.DEVNULL)
+
+    async def record():
+        for _ in range(100):
+            if os.path.lexists(link):
+                break
+            await asyncio.sleep(0.05)
+        app = make_app({"thermal": link}, store_dir=os.path.join(root, "db"),
+                       flush_s=1.0)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        t0 = time.time()
+        await asyncio.sleep(args.server_s / 2)
+        fake.send_signal(signal.SIGUSR1)
+        t_unplug = time.time()
+        await asyncio.sleep(args.server_s / 2)
+        await runner.cleanup()               # closes the store
+        return t0, t_unplug, time.time()
+
+    try:
+        t0, t_unplug, t1 = asyncio.run(record())
+    finally:
+        fake.terminate()
+        fake.wait()
+    store = TelemetryStore(os.path.join(root, "db"))
+    t = store.read("arena1", "raw", int(t0 * 1000), int(t1 * 1000))["t_ms"]
+    after = int((t >= t_unplug * 1000).sum())
+    print(f"server: {args.server_s:g} s of a fake ESP32 booting with logging "
+          f"off, {RATE_HZ} Hz, unplugged at {t_unplug - t0:.1f} s")
+    print(f"  samples stored: {len(t) - after} before the unplug, {after} "
+          f"after ({len(t) / (t1 - t0):.1f} per s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dir", default=None,
+                        help="where to write (default: a temp dir); use the "
+                             "SD card to include its fsync cost")
+    parser.add_argument("--arenas", type=int, default=4)
+    parser.add_argument("--hours", type=float, default=1.0,
+                        help="simulated time of the write test")
+    parser.add_argument("--flush-s", type=float, default=5.0)
+    parser.add_argument("--days", type=int, default=7,
+                        help="days of data for the query test")
+    parser.add_argument("--server-s", type=float, default=4.0,
+                        help="seconds of the server test, 0 to skip")
+    args = parser.parse_args()
+    root = tempfile.mkdtemp(prefix="store_", dir=args.dir)
+    try:
+        bench_write(args, os.path.join(root, "write"))
+        bench_query(args, os.path.join(root, "query"))
+        if args.server_s > 0:
+            bench_server(args, os.path.join(root, "server"))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
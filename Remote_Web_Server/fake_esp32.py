@@ -0,0 +1,211 @@
+"""
+Fake ESP32s on pseudo-terminals, for testing serial_bridge.py and
+server.py without hardware.
+
+Each fake owns a pty and a symlink (--link) that plays the role of
+/dev/ttyUSB0; unplug() closes the pty and removes the link, replug() makes
+a new pty behind the same link, like a USB device coming back.
+
+    thermal   the thermal controller: commands go to the Python port of
+              ESP32.py (esp32_port.Esp32Controller), stepped every loop_ms,
+              so replies and phase lines are the firmware's own
+    display   the OK:/ERR: protocol of docs/software/remote_web_server.md
+              (ROTATE, SET_TEMP, COOL_TILE)
+
+--chatter adds unsolicited lines at that rate (LOG: samples), the traffic
+that used to fill the serial buffer of the blocking server. Like the
+firmware, the thermal fake boots (and comes back from an unplug) with its
+LOG: samples off until it gets LOG:ON.
+
+    python fake_esp32.py --link /tmp/arena/thermal --kind thermal --chatter 8
+    kill -USR1 <pid>      unplug for --unplug-s seconds, then replug
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+import tty
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+THERMAL_HOST = os.path.join(os.path.dirname(HERE), "Closed_Loop_Thermal_Camera",
+                            "host")
+if THERMAL_HOST not in sys.path:
+    sys.path.insert(0, THERMAL_HOST)
+
+from esp32_port import Esp32Controller    # noqa: E402
+
+DISPLAY_REPLIES = {
+    "ROTATE:": "OK:DISPLAY_ROTATED",
+    "SET_TEMP:": "OK:TEMP_SET",
+    "COOL_TILE:": "OK:COOL_TILE_ACTIVE",
+}
+
+
+class FakeEsp32:
+    def __init__(self, link, kind="thermal", loop_ms=20, chatter_hz=0.0):
+        self.link = link
+        self.kind = kind
+        self.loop_ms = loop_ms
+        self.chatter_hz = chatter_hz
+        self.master = None
+        self.rx = bytearray()
+        self.commands = 0
+        self.esp = Esp32Controller() if kind == "thermal" else None
+        self.t0 = time.monotonic()
+        self._sent_log = 0
+        self._tasks = []
+
+    def now_ms(self):
+        return int((time.monotonic() - self.t0) * 1000)
+
+    # ---------- the pty ----------
+    def plug(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)                 # no echo / line editing
+        os.set_blocking(master, False)
+        name = os.ttyname(slave)
+        # the slave stays open here so the pty survives between opens
+        self._slave = slave
+        self.master = master
+        tmp = self.link + ".tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(name, tmp)
+        os.replace(tmp, self.link)
+        asyncio.get_running_loop().add_reader(master, self._on_readable)
+        if self.esp is not None:
+            self.esp.log_enabled = False      # a reset boots with logging off
+            self.esp.setup(self.now_ms())
+            self._sent_log = 0
+            self._drain_log()
+        else:
+            self.write("DISPLAY READY")
+
+    def unplug(self):
+        if self.master is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.master)
+        os.close(self.master)
+        os.close(self._slave)
+        self.master = None
+        if os.path.lexists(self.link):
+            os.remove(self.link)
+
+    async def replug_after(self, seconds):
+        self.unplug()
+        await asyncio.sleep(seconds)
+        self.plug()
+
+    def write(self, line):
+        if self.master is None:
+            return
+        try:
+            os.write(self.master, line.encode() + b"\r\n")
+        except (BlockingIOError, OSError):
+            pass                          # nobody reading: bytes are lost
+
+    # ---------- commands ----------
+    def _on_readable(self):
+        try:
+            data = os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        self.rx += data
+        while b"\n" in self.rx:
+            line, _, rest = self.rx.partition(b"\n")
+            self.rx = bytearray(rest)
+            line = line.strip().decode("ascii", "replace")
+            if line:
+                self.commands += 1
+                self.handle(line)
+
+    def handle(self, line):
+        if self.esp is not None:
+            self.esp.command(line)       # answered on the next loop()
+            return
+        cmd = line.upper()
+        for prefix, reply in DISPLAY_REPLIES.items():
+            if cmd.startswith(prefix):
+                self.write(reply)
+                return
+        self.write("ERR:UNKNOWN_COMMAND")
+
+    def _drain_log(self):
+        log = self.esp.log
+        while self._sent_log < len(log):
+            self.write(log[self._sent_log][1])
+            self._sent_log += 1
+        if len(log) > 1000:              # keep the port's log short
+            del log[:self._sent_log]
+            self._sent_log = 0
+
+    # ---------- tasks ----------
+    async def esp_loop(self):
+        while True:
+            await asyncio.sleep(self.loop_ms / 1000.0)
+            if self.esp is not None and self.master is not None:
+                self.esp.loop(self.now_ms())
+                self._drain_log()
+
+    async def chatter(self):
+        period = 1.0 / self.chatter_hz
+        n = 0
+        while True:
+            await asyncio.sleep(period)
+            n += 1
+            if self.esp is None:
+                self.write("HEARTBEAT:%d" % n)
+            elif self.esp.log_enabled:
+                self.write("LOG:%d,36.00,0,36.00,0,25.00,0,36.00,0"
+                           % self.now_ms())
+
+    def start(self):
+        self.plug()
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.create_task(self.esp_loop()))
+        if self.chatter_hz > 0:
+            self._tasks.append(loop.create_task(self.chatter()))
+
+    def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        self.unplug()
+
+
+async def serve(args):
+    fake = FakeEsp32(args.link, args.kind, args.loop_ms, args.chatter)
+    fake.start()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(
+        signal.SIGUSR1,
+        lambda: loop.create_task(fake.replug_after(args.unplug_s)))
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    print(f"{args.kind} fake ESP32 on {args.link} -> {os.readlink(args.link)}"
+          f" (pid {os.getpid()})", flush=True)
+    await stop.wait()
+    fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--link", required=True,
+                        help="symlink to create for the pty (the 'port')")
+    parser.add_argument("--kind", choices=("thermal", "display"),
+                        default="thermal")
+    parser.add_argument("--loop-ms", type=int, default=20,
+                        help="ESP32 loop() period")
+    parser.add_argument("--chatter", type=float, default=0.0,
+                        help="unsolicited lines per second")
+    parser.add_argument("--unplug-s", type=float, default=1.0,
+                        help="how long SIGUSR1 unplugs the port")
+    args = parser.parse_args()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
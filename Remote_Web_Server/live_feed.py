@@ -0,0 +1,539 @@
+"""
+Live push of arena telemetry and thermal frames to WebSocket clients.
+
+One reader per data source feeds a LiveHub, which fans out to any number of
+browsers on GET /ws (server.py):
+
+    thermal ESP32   the bridge's EventBus (serial_bridge.py): LOG: samples
+                    give the plate temperatures and drive, the phase lines
+                    (TRIAL START, BUFFER, FINAL HEAT, EXPERIMENT COMPLETE,
+                    STOPPED) the trial state
+    thermal frames  optional: the PyBadge frame recording on its usb_cdc
+                    data port (frame_recorder.py, RECORD = "usb"), or a
+                    frame archive replayed in a loop (frame_archive.py)
+
+Telemetry is sent at rate_hz as one JSON text message; frames are sent as
+they arrive, as binary messages (FRAME_HEAD + int16 0.1 C key frame or
+int8 0.1 C differences to the previous frame, optionally 2x2 averaged to
+16x12). Each message is encoded once and shared by all clients.
+
+Every client has a latest-wins slot per stream and its own sender task: a
+slow phone only ever has the newest telemetry and newest frame waiting
+(the ones it missed are counted, not queued), so neither the readers nor
+the other clients wait for it. The sender writes only while the socket
+has less than max_buffered bytes queued, and the kernel send buffer is
+capped at sndbuf, so what a slow client gets next is the newest data, not
+a backlog. A client that missed a frame gets a key frame next; one whose
+socket does not drain at all for send_timeout seconds is dropped.
+
+Client options, as query (/ws?frames=delta&downsample=2) or later as a
+JSON text message ({"frames": "off"}):
+
+    frames       off | key | delta (default delta)
+    downsample   1 | 2 (default 1)
+"""
+
+import asyncio
+import collections
+import json
+import os
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+from aiohttp import web, WSMsgType
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+THERMAL_HOST = os.path.join(os.path.dirname(HERE), "Closed_Loop_Thermal_Camera",
+                            "host")
+if THERMAL_HOST not in sys.path:
+    sys.path.insert(0, THERMAL_HOST)
+
+# magic, kind (bit 0 delta), downsample, seq, base seq (delta), device ts_ms,
+# hub receive time (unix s), width, height
+FRAME_HEAD = struct.Struct("<2sBBIIIdBB")
+FRAME_MAGIC = b"LF"
+KEY, DELTA = 0, 1
+FRAME_MODES = ("off", "key", "delta")
+PLATES = "ABCD"
+PHASE_LINES = (
+    ("TRIAL START", "TRIAL"),
+    ("BUFFER", "BUFFER"),
+    ("FINAL HEAT", "FINAL"),
+    ("EXPERIMENT COMPLETE", "COMPLETE"),
+    ("STOPPED", "IDLE"),
+)
+
+
+# ===== Telemetry state =====
+def parse_log(line):
+    """(esp_ms, temps, pwms) of a LOG: sample line, else None"""
+    if not line.startswith("LOG:"):
+        return None
+    fields = line[4:].split(",")
+    try:
+        return (int(fields[0]),
+                [float(fields[1 + 2 * i]) for i in range(len(PLATES))],
+                [int(fields[2 + 2 * i]) for i in range(len(PLATES))])
+    except (ValueError, IndexError):
+        return None
+
+
+def parse_phase(line):
+    """Phase a thermal ESP32 line starts (TRIAL, BUFFER, ...), else None"""
+    for prefix, phase in PHASE_LINES:
+        if line.startswith(prefix):
+            return phase
+    return None
+
+
+class Telemetry:
+    """Arena state rebuilt from the thermal ESP32's output lines"""
+
+    def __init__(self):
+        self.plates = [{"plate": p, "temp": None, "pwm": 0} for p in PLATES]
+        self.esp_ms = None
+        self.samples = 0
+        self.phase = "IDLE"
+        self.cool = None
+        self.trial = 0
+        self.phase_since = time.time()
+
+    def feed(self, line):
+        """Update from one line; True when the phase changed"""
+        sample = parse_log(line)
+        if sample is not None:
+            self.esp_ms, temps, pwms = sample
+            for plate, t, pwm in zip(self.plates, temps, pwms):
+                plate["temp"], plate["pwm"] = t, pwm
+            self.samples += 1
+            return False
+        phase = parse_phase(line)
+        if phase is None:
+            return False
+        if phase == "TRIAL":
+            if self.phase in ("IDLE", "COMPLETE"):
+                self.trial = 0
+            self.trial += 1
+            self.cool = line.rstrip()[-1]
+        elif phase != "BUFFER":
+            self.cool = None
+        self.phase = phase
+        self.phase_since = time.time()
+        return True
+
+    def snapshot(self):
+        return {"phase": self.phase, "trial": self.trial, "cool": self.cool,
+                "phase_s": round(time.time() - self.phase_since, 1),
+                "esp_ms": self.esp_ms, "plates": self.plates}
+
+
+# ===== Frames =====
+class Frame:
+    """One thermal frame; encodings are made on first use and shared"""
+
+    __slots__ = ("seq", "ts_ms", "time", "q", "prev", "_cache")
+
+    def __init__(self, seq, ts_ms, centi, prev=None):
+        self.seq = seq
+        self.ts_ms = ts_ms
+        self.time = time.time()
+        # 0.1 C steps; int16 holds -3276.8 .. 3276.7 C
+        self.q = {1: np.rint(centi / 10.0).astype(np.int16)}
+        self.prev = prev
+        self._cache = {}
+
+    def quantized(self, ds):
+        q = self.q.get(ds)
+        if q is None:
+            full = self.q[1].astype(np.int32)
+            h, w = full.shape
+            q = full.reshape(h // ds, ds, w // ds, ds).sum(axis=(1, 3))
+            q = np.floor_divide(q + ds * ds // 2, ds * ds).astype(np.int16)
+            self.q[ds] = q
+        return q
+
+    def encode(self, ds, delta):
+        """Bytes of the key frame, or of the delta to the previous frame
+        (None when there is none or a step is over 12.7 C)"""
+        key = (ds, delta)
+        if key in self._cache:
+            return self._cache[key]
+        q = self.quantized(ds)
+        h, w = q.shape
+        if not delta:
+            data = FRAME_HEAD.pack(FRAME_MAGIC, KEY, ds, self.seq, 0,
+                                   self.ts_ms, self.time, w, h) + q.tobytes()
+        elif self.prev is None:
+            data = None
+        else:
+            d = q.astype(np.int32) - self.prev.quantized(ds)
+            data = (None if d.size and np.abs(d).max() > 127 else
+                    FRAME_HEAD.pack(FRAME_MAGIC, DELTA, ds, self.seq,
+                                    self.prev.seq, self.ts_ms, self.time, w,
+                                    h) + d.astype(np.int8).tobytes())
+        self._cache[key] = data
+        return data
+
+
+def decode_frame(data, previous=None):
+    """(header dict, int16 0.1 C array) of one binary message; previous is
+    the client's last decoded frame, needed for a delta"""
+    magic, kind, ds, seq, base, ts_ms, t, w, h = FRAME_HEAD.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError("not a live frame")
+    head = {"kind": kind, "downsample": ds, "seq": seq, "base": base,
+            "ts_ms": ts_ms, "time": t}
+    body = data[FRAME_HEAD.size:]
+    if kind & DELTA:
+        if previous is None:
+            raise ValueError("delta without a key frame")
+        q = previous + np.frombuffer(body, np.int8).reshape(h, w)
+    else:
+        q = np.frombuffer(body, "<i2").reshape(h, w)
+    return head, q.astype(np.int16)
+
+
+async def archive_frames(path, speed=1.0, loop=True):
+    """(counter, ts_ms, centi) of an archive, paced by its capture times"""
+    from frame_archive import FrameArchive
+
+    arch = FrameArchive(path, index=False)
+    if not arch.count:
+        raise ValueError(path + " has no frames")
+    ts = arch.timestamps()
+    while True:
+        t0 = time.monotonic()
+        for i in range(arch.count):
+            if speed > 0:
+                wait = t0 + (ts[i] - ts[0]) / 1000.0 / speed - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            rec = arch.records[i]
+            yield int(rec["counter"]), int(rec["ts_ms"]), np.array(rec["pixels"])
+        if not loop:
+            return
+        await asyncio.sleep(0.125 / speed if speed > 0 else 0)
+
+
+async def serial_frames(port, baudrate=115200, reconnect_s=1.0):
+    """(counter, ts_ms, centi) from the PyBadge usb_cdc data port.
+
+    Read with add_reader like serial_bridge.py; if the hub falls behind
+    only the newest record is kept. The port is reopened when it is lost.
+    """
+    import serial                           # pyserial
+    from frame_receiver import RecordParser
+
+    loop = asyncio.get_running_loop()
+    latest = asyncio.Queue(maxsize=1)
+    while True:
+        try:
+            ser = await loop.run_in_executor(
+                None, lambda: serial.Serial(port, baudrate, timeout=0))
+        except (OSError, serial.SerialException):
+            await asyncio.sleep(reconnect_s)
+            continue
+        parser = RecordParser()
+        lost = asyncio.Event()
+
+        def on_readable():
+            try:
+                data = os.read(ser.fileno(), 65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                loop.remove_reader(ser.fileno())
+                lost.set()
+                return
+            for counter, ts_ms, _, pixels in parser.feed(data):
+                if latest.full():
+                    latest.get_nowait()
+                latest.put_nowait((counter, ts_ms, np.frombuffer(
+                    pixels, "<i2").reshape(-1, 32)))
+
+        loop.add_reader(ser.fileno(), on_readable)
+        try:
+            while not lost.is_set():
+                get = loop.create_task(latest.get())
+                gone = loop.create_task(lost.wait())
+                done, _ = await asyncio.wait(
+                    (get, gone), return_when=asyncio.FIRST_COMPLETED)
+                gone.cancel()
+                if get in done:
+                    yield get.result()
+                else:
+                    get.cancel()
+        finally:
+            if not lost.is_set():
+                loop.remove_reader(ser.fileno())
+            ser.close()
+        await asyncio.sleep(reconnect_s)
+
+
+def frame_source(spec, speed=1.0):
+    """An archive file (.tfa) is replayed in a loop, anything else is a
+    serial port"""
+    if spec.endswith(".tfa") or (os.path.isfile(spec)
+                                 and not spec.startswith("/dev/")):
+        return archive_frames(spec, speed)
+    return serial_frames(spec)
+
+
+# ===== Clients =====
+class LiveClient:
+    """Latest-wins slots and the sender task of one WebSocket"""
+
+    def __init__(self, ws, transport, frames="delta", downsample=1):
+        self.ws = ws
+        self.transport = transport
+        self.frames = frames
+        self.downsample = downsample
+        self.telemetry = None
+        self.frame = None
+        self.events = collections.deque()
+        self.wake = asyncio.Event()
+        self.last_seq = None
+        self.sent = 0
+        self.keys = 0
+        self.deltas = 0
+        self.skipped_telemetry = 0
+        self.skipped_frames = 0
+        self.skipped_events = 0
+        self.connected = time.time()
+
+    def configure(self, options):
+        frames = options.get("frames", self.frames)
+        ds = int(options.get("downsample", self.downsample))
+        if frames not in FRAME_MODES or ds not in (1, 2):
+            raise ValueError("frames must be off/key/delta, downsample 1/2")
+        self.frames, self.downsample = frames, ds
+        self.last_seq = None                 # the next frame is a key frame
+
+    def offer_telemetry(self, text):
+        if self.telemetry is not None:
+            self.skipped_telemetry += 1
+        self.telemetry = text
+        self.wake.set()
+
+    def offer_frame(self, frame):
+        if self.frames == "off":
+            return
+        if self.frame is not None:
+            self.skipped_frames += 1
+        self.frame = frame
+        self.wake.set()
+
+    def offer_event(self, text, limit=32):
+        if len(self.events) >= limit:
+            self.events.popleft()
+            self.skipped_events += 1
+        self.events.append(text)
+        self.wake.set()
+
+    def _frame_bytes(self, frame):
+        data = None
+        if (self.frames == "delta" and self.last_seq is not None
+                and frame.prev is not None and frame.prev.seq == self.last_seq):
+            data = frame.encode(self.downsample, True)
+        if data is None:
+            self.keys += 1
+            return frame.encode(self.downsample, False)
+        self.deltas += 1
+        return data
+
+    async def run(self, send_timeout, max_buffered):
+        """Send whatever is waiting until the socket closes or its write
+        buffer has not drained for send_timeout seconds"""
+        ws = self.ws
+        while not ws.closed:
+            await self.wake.wait()
+            await self._writable(send_timeout, max_buffered)
+            self.wake.clear()
+            while self.events:
+                await ws.send_str(self.events.popleft())
+                self.sent += 1
+            if self.telemetry is not None:
+                text, self.telemetry = self.telemetry, None
+                await ws.send_str(text)
+                self.sent += 1
+            if self.frame is not None:
+                frame, self.frame = self.frame, None
+                await ws.send_bytes(self._frame_bytes(frame))
+                self.last_seq = frame.seq
+                self.sent += 1
+
+    async def _writable(self, send_timeout, max_buffered):
+        """Wait until at most max_buffered bytes are queued for the socket;
+        meanwhile newer telemetry and frames replace the waiting ones"""
+        transport = self.transport
+        last = None
+        while transport.get_write_buffer_size() > max_buffered:
+            if transport.is_closing():
+                raise ConnectionResetError("client gone")
+            size = transport.get_write_buffer_size()
+            now = time.monotonic()
+            if last is None or size < last:
+                since = now
+            elif now - since > send_timeout:
+                raise asyncio.TimeoutError("client stalled")
+            last = size
+            await asyncio.sleep(0.05)
+
+    def status(self):
+        return {"frames": self.frames, "downsample": self.downsample,
+                "sent": self.sent, "keys": self.keys, "deltas": self.deltas,
+                "skipped_telemetry": self.skipped_telemetry,
+                "skipped_frames": self.skipped_frames,
+                "skipped_events": self.skipped_events,
+                "age_s": round(time.time() - self.connected, 1)}
+
+
+# ===== Hub =====
+class LiveHub:
+    """Readers of the bus and the frame source, fan-out to LiveClients"""
+
+    def __init__(self, bus, bridges=None, frames=None, rate_hz=8.0,
+                 send_timeout=10.0, max_buffered=4096, sndbuf=4096):
+        self.bus = bus
+        self.bridges = bridges or {}
+        self.frame_iter = frames
+        self.rate_hz = rate_hz
+        self.send_timeout = send_timeout
+        self.max_buffered = max_buffered
+        self.sndbuf = sndbuf
+        self.telemetry = Telemetry()
+        self.clients = set()
+        self.frame = None
+        self.frames_in = 0
+        self.ticks = 0
+        self.dropped_clients = 0
+        self.served_clients = 0
+        self.retired = collections.Counter()  # skips of clients that left
+        self._tasks = []
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._read_bus(self.bus.subscribe(4096))),
+                       loop.create_task(self._tick())]
+        if self.frame_iter is not None:
+            self._tasks.append(loop.create_task(self._read_frames()))
+
+    async def close(self):
+        for t in self._tasks:
+            t.cancel()
+        for c in list(self.clients):
+            await c.ws.close(code=1001, message=b"server shutdown")
+
+    # ---------- readers ----------
+    async def _read_bus(self, q):
+        while True:
+            e = await q.get()
+            if e.kind == "cmd" or (e.port != "thermal" and e.kind != "link"):
+                continue
+            changed = e.kind != "link" and self.telemetry.feed(e.line)
+            if changed or e.kind == "link":
+                text = json.dumps({"type": "event", "time": e.time,
+                                   "port": e.port, "line": e.line,
+                                   **self.telemetry.snapshot()})
+                for c in self.clients:
+                    c.offer_event(text)
+
+    async def _read_frames(self):
+        seq = 0
+        async for counter, ts_ms, centi in self.frame_iter:
+            seq += 1
+            prev = self.frame
+            if prev is not None:
+                prev.prev = None             # keep one frame of history
+            self.frame = Frame(seq, ts_ms, centi, prev)
+            self.frames_in += 1
+            for c in self.clients:
+                c.offer_frame(self.frame)
+
+    async def _tick(self):
+        period = 1.0 / self.rate_hz
+        next_t = time.monotonic()
+        while True:
+            next_t += period
+            await asyncio.sleep(max(0.0, next_t - time.monotonic()))
+            if time.monotonic() - next_t > period:
+                next_t = time.monotonic()    # fell behind: do not burst
+            if not self.clients:
+                continue
+            self.ticks += 1
+            text = json.dumps({
+                "type": "telemetry", "time": time.time(), "tick": self.ticks,
+                "frame": self.frame.seq if self.frame else None,
+                "links": {n: b.ser is not None for n, b in self.bridges.items()},
+                **self.telemetry.snapshot()})
+            for c in self.clients:
+                c.offer_telemetry(text)
+
+    # ---------- clients ----------
+    async def handle(self, request):
+        """GET /ws"""
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        client = LiveClient(ws, request.transport)
+        try:
+            client.configure(request.query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        sock = request.transport.get_extra_info("socket")
+        if sock is not None and self.sndbuf:
+            # a small kernel buffer keeps a slow client's backlog short:
+            # what does not fit waits in its latest-wins slots instead
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        await ws.prepare(request)
+        self.clients.add(client)
+        self.served_clients += 1
+        await ws.send_str(json.dumps({
+            "type": "hello", "rate_hz": self.rate_hz,
+            "frame_source": self.frame_iter is not None, **client.status()}))
+        client.offer_telemetry(json.dumps({"type": "telemetry",
+                                           "time": time.time(),
+                                           **self.telemetry.snapshot()}))
+        if self.frame is not None:
+            client.offer_frame(self.frame)
+        sender = asyncio.get_running_loop().create_task(
+            client.run(self.send_timeout, self.max_buffered))
+        sender.add_done_callback(lambda t: self._sender_done(t, client))
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    try:
+                        client.configure(json.loads(msg.data))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        await ws.send_str(json.dumps({"type": "error",
+                                                      "message": str(e)}))
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            self.retired.update(skipped_frames=client.skipped_frames,
+                                skipped_telemetry=client.skipped_telemetry)
+        return ws
+
+    def _sender_done(self, task, client):
+        """Sender failed (stuck or broken socket): disconnect the client"""
+        if task.cancelled() or task.exception() is None:
+            return
+        if client in self.clients:
+            self.clients.discard(client)
+            self.dropped_clients += 1
+            asyncio.get_running_loop().create_task(
+                client.ws.close(code=1011, message=b"too slow"))
+
+    def status(self):
+        """Totals since start; skips count clients that have left too"""
+        return {"clients": len(self.clients), "rate_hz": self.rate_hz,
+                "frames_in": self.frames_in, "ticks": self.ticks,
+                "served_clients": self.served_clients,
+                "dropped_clients": self.dropped_clients,
+                "skipped_frames": self.retired["skipped_frames"]
+                + sum(c.skipped_frames for c in self.clients),
+                "skipped_telemetry": self.retired["skipped_telemetry"]
+                + sum(c.skipped_telemetry for c in self.clients)}
@@ -0,0 +1,322 @@
+"""
+Asynchronous bridge between the Raspberry Pi web server and the ESP32s.
+
+One SerialBridge per USB serial port. The port is read continuously by the
+asyncio loop (add_reader on the serial file descriptor), so the ESP32's
+unsolicited output (TRIAL START, EXPERIMENT COMPLETE, STATS:, LOG: ...) is
+always drained and never mistaken for the answer to a command.
+
+    bus = EventBus()
+    thermal = SerialBridge("thermal", "/dev/ttyUSB0", bus=bus)
+    thermal.start()
+    reply = await thermal.command("PATTERN:C-D-A-B")   # "TRIAL START — Cool C"
+    events = bus.subscribe()                           # every line, as Event
+
+command() writes one line and waits for the first line that matches the
+reply expected for that command (expected_reply(), or expect=...); other
+lines go to the event bus. Commands are answered in the order they were
+sent, so concurrent callers of the same command get their own reply. A
+command fails with BridgeTimeout after timeout seconds and with BridgeError
+when the port is not connected or is lost while waiting. A lost port (USB
+unplugged, ESP32 reset) is reopened every reconnect_s seconds, backing off
+to reconnect_max_s.
+
+Needs pyserial; works on any POSIX serial device, including the ptys of
+fake_esp32.py.
+"""
+
+import asyncio
+import collections
+import os
+import time
+
+import serial                                   # pyserial
+
+# Reply prefixes of the thermal ESP32 (Closed_Loop_Thermal_Camera/ESP32.py);
+# PATTERN: is answered by the first trial of the pattern sent, see
+# expected_reply()
+REPLIES = (
+    ("STOP", ("STOPPED",)),
+    ("STATS:", ("STATS EVERY",)),
+    ("LOG:", ("LOG ON", "LOG OFF")),
+    ("DRIVE:", ("DRIVE ",)),
+    # its acknowledgement: PROFILE: lines are the PyBadge's reports, which
+    # also come unasked
+    ("PROFILE", ("PROFILE SENT",)),
+    ("SET_TEMP:", ("OK:TEMP_SET", "ERR:TEMP_RANGE")),
+)
+# Everything else: the OK:/ERR: protocol of docs/software/remote_web_server.md
+GENERIC_REPLY = ("OK", "ERR")
+MAX_LINE = 4096
+
+Event = collections.namedtuple("Event", "time port kind line")
+# kind: "line" (unsolicited), "reply" (answered a command), "cmd" (sent to
+# the ESP32), "link"
+
+
+class BridgeError(Exception):
+    pass
+
+
+class BridgeTimeout(BridgeError):
+    pass
+
+
+def expected_reply(command):
+    """Reply prefixes for a command line"""
+    cmd = command.strip().upper()
+    if cmd.startswith("PATTERN:"):
+        # only the first trial of this pattern: a TRIAL START of the running
+        # schedule (buffer -> next trial) must not answer it. Same check as
+        # the firmware's processCommand().
+        labels = cmd[8:].replace("-", "")
+        if not labels or len(labels) > 10:
+            return ("INVALID PATTERN",)
+        return ("TRIAL START — Cool " + labels[0], "INVALID PATTERN")
+    for prefix, replies in REPLIES:
+        if cmd.startswith(prefix):
+            return replies
+    return GENERIC_REPLY
+
+
+class EventBus:
+    """Fan-out of bridge events to bounded subscriber queues.
+
+    A subscriber that falls behind loses its oldest events (counted in
+    dropped), so a stalled client never blocks the serial readers.
+    """
+
+    def __init__(self, history=200):
+        self.history = collections.deque(maxlen=history)
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, maxsize=256):
+        q = asyncio.Queue(maxsize)
+        self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        self.subscribers.discard(q)
+
+    def publish(self, event):
+        self.history.append((self.published, event))
+        self.published += 1
+        for q in self.subscribers:
+            if q.full():
+                q.get_nowait()
+                self.dropped += 1
+            q.put_nowait(event)
+
+
+class _Pending:
+    __slots__ = ("expect", "future", "sent")
+
+    def __init__(self, expect, future):
+        self.expect = expect
+        self.future = future
+        self.sent = time.monotonic()
+
+
+class SerialBridge:
+    def __init__(self, name, port, baudrate=115200, timeout=1.0, bus=None,
+                 reconnect_s=0.5, reconnect_max_s=5.0):
+        self.name = name
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.bus = bus or EventBus()
+        self.reconnect_s = reconnect_s
+        self.reconnect_max_s = reconnect_max_s
+        self.ser = None
+        self.pending = collections.deque()
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._writing = False
+        self._lost = None
+        self._task = None
+        self._closing = False
+        self.connected = asyncio.Event()
+        # counters for /status and the benchmark
+        self.connects = 0
+        self.lines = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.last_rx = None
+
+    # ---------- life cycle ----------
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def close(self):
+        self._closing = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._detach(BridgeError(self.name + " closed"))
+
+    async def run(self):
+        """Open the port, serve it until it is lost, reopen; forever"""
+        loop = asyncio.get_running_loop()
+        delay = self.reconnect_s
+        reported = False
+        while not self._closing:
+            try:
+                ser = await loop.run_in_executor(None, self._open)
+            except (OSError, serial.SerialException) as e:
+                if not reported:
+                    self._publish("link", "OPEN FAILED: %s" % e)
+                    reported = True
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_max_s)
+                continue
+            delay = self.reconnect_s
+            reported = False
+            self._attach(ser)
+            await self._lost.wait()
+
+    def _open(self):
+        return serial.Serial(self.port, self.baudrate, timeout=0)
+
+    def _attach(self, ser):
+        loop = asyncio.get_running_loop()
+        self.ser = ser
+        self._rx.clear()
+        self._tx.clear()
+        self._lost = asyncio.Event()
+        loop.add_reader(ser.fileno(), self._on_readable)
+        self.connects += 1
+        self.connected.set()
+        self._publish("link", "CONNECTED " + self.port)
+
+    def _detach(self, error):
+        ser, self.ser = self.ser, None
+        if ser is None:
+            return
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(ser.fileno())
+        if self._writing:
+            loop.remove_writer(ser.fileno())
+            self._writing = False
+        try:
+            ser.close()
+        except (OSError, serial.SerialException):
+            pass
+        self.connected.clear()
+        while self.pending:
+            p = self.pending.popleft()
+            if not p.future.done():
+                p.future.set_exception(error)
+        self._publish("link", "DISCONNECTED")
+        self._lost.set()
+
+    # ---------- reading ----------
+    def _on_readable(self):
+        try:
+            data = os.read(self.ser.fileno(), 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._detach(BridgeError("%s lost: %s" % (self.name, e)))
+            return
+        if not data:
+            self._detach(BridgeError(self.name + " lost"))
+            return
+        self.last_rx = time.monotonic()
+        rx = self._rx
+        rx += data
+        while True:
+            end = rx.find(b"\n")
+            if end < 0:
+                if len(rx) > MAX_LINE:          # no newline: not a line protocol
+                    del rx[:]
+                break
+            line = rx[:end].rstrip(b"\r").decode("utf-8", "replace")
+            del rx[:end + 1]
+            if line:
+                self._on_line(line)
+
+    def _on_line(self, line):
+        self.lines += 1
+        for p in self.pending:
+            if not p.future.done() and line.startswith(p.expect):
+                p.future.set_result(line)
+                self.pending.remove(p)
+                self.replies += 1
+                self._publish("reply", line)
+                return
+        self._publish("line", line)
+
+    def _publish(self, kind, line):
+        self.bus.publish(Event(time.time(), self.name, kind, line))
+
+    # ---------- writing ----------
+    def write_line(self, text):
+        """Queue one line for the ESP32 without waiting for a reply"""
+        if self.ser is None:
+            raise BridgeError(self.name + " not connected")
+        self._tx += text.strip().encode() + b"\n"
+        self._publish("cmd", text.strip())
+        if not self._writing:
+            self._flush()
+
+    def _flush(self):
+        try:
+            n = os.write(self.ser.fileno(), self._tx)
+        except BlockingIOError:
+            n = 0
+        except OSError as e:
+            self._detach(BridgeError("%s lost: %s" % (self.name, e)))
+            return
+        del self._tx[:n]
+        loop = asyncio.get_running_loop()
+        if self._tx and not self._writing:
+            loop.add_writer(self.ser.fileno(), self._flush)
+            self._writing = True
+        elif not self._tx and self._writing:
+            loop.remove_writer(self.ser.fileno())
+            self._writing = False
+
+    async def command(self, text, expect=None, timeout=None):
+        """Send a command and return its reply line.
+
+        expect: reply prefixes (default expected_reply(text)); () sends
+        without waiting and returns None.
+        """
+        if expect is None:
+            expect = expected_reply(text)
+        if not expect:
+            self.write_line(text)
+            return None
+        if self.ser is None:
+            raise BridgeError(self.name + " not connected")
+        future = asyncio.get_running_loop().create_future()
+        pending = _Pending(tuple(expect), future)
+        self.pending.append(pending)     # failed by _detach if the write fails
+        self.write_line(text)
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise BridgeTimeout("%s: no reply to %s" % (self.name, text.strip()))
+        finally:
+            if pending in self.pending:
+                self.pending.remove(pending)
+
+    def status(self):
+        return {
+            "port": self.port,
+            "connected": self.ser is not None,
+            "connects": self.connects,
+            "lines": self.lines,
+            "replies": self.replies,
+            "timeouts": self.timeouts,
+            "pending": len(self.pending),
+            "last_rx_age": (None if self.last_rx is None
+                            else round(time.monotonic() - self.last_rx, 3)),
+        }
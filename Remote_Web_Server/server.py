@@ -0,0 +1,345 @@
+"""
+Arena controller web server for the Raspberry Pi (aiohttp).
+
+Replaces the Flask server.py of docs/software/remote_web_server.md. Every
+endpoint awaits the serial bridge (serial_bridge.py) instead of blocking a
+request thread on readline(), so a slow or silent ESP32 delays only the
+requests that talk to it. All ESP32 output, solicited or not, is logged to
+--log with a timestamp; with --store, plate temperatures, PWM, phases and
+commands also go to a telemetry store (telemetry_store.py). The thermal
+ESP32 boots with its LOG: samples off, so LOG:ON is sent every time its
+port (re)connects.
+
+    python server.py --thermal /dev/ttyUSB0 --display /dev/ttyUSB1
+    python server.py ... --frames /dev/ttyACM1     PyBadge frame recording
+    python server.py ... --frames run.tfa          replayed frame archive
+    python server.py ... --store /home/pi/telemetry --arena arena1
+
+Endpoints (JSON):
+
+    GET  /                     templates/index.html
+    GET  /status               link state and counters of both ports
+    POST /command              {"port": "thermal", "command": "STOP",
+                                "timeout": 1.0}
+    POST /pattern              {"pattern": "C-D-A-B"}        thermal ESP32
+    POST /stop                                               thermal ESP32
+    POST /start_trial          {"quadrant": 0..3}  trial with that plate
+                               cooled + display rotated to quadrant * 90
+    POST /set_temperature      {"temperature": 25}  SET_TEMP: (doc protocol)
+    POST /rotate_display       {"angle": 90}
+    GET  /events?since=<n>     ESP32 lines after event n; waits up to
+                               `wait` seconds (default 10) for a new one
+    GET  /ws                   WebSocket: live telemetry and, with
+                               --frames, thermal frames (live_feed.py)
+    GET  /history?from=&to=    stored plate temperatures (--store), unix
+         &level=&points=       seconds, default the last hour; level auto
+                               picks the finest with at most `points` rows
+    GET  /history/events       stored phases, commands, replies and link
+         ?from=&to=&kind=      changes
+
+A reply timeout answers 504 and a disconnected port 503, with the same
+{"status": "error", "message": ...} body as before.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from aiohttp import web
+
+from serial_bridge import SerialBridge, EventBus, BridgeError, BridgeTimeout
+from live_feed import LiveHub, frame_source, parse_log, parse_phase
+from telemetry_store import TelemetryStore, LEVELS, rows_to_json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLATES = "ABCD"
+
+BUS = web.AppKey("bus", EventBus)
+BRIDGES = web.AppKey("bridges", dict)
+HUB = web.AppKey("hub", LiveHub)
+STORE = web.AppKey("store", object)      # TelemetryStore or None
+ARENA = web.AppKey("arena", str)
+
+
+def ok(**fields):
+    return web.json_response(dict(status="success", **fields))
+
+
+def error(message, status):
+    return web.json_response({"status": "error", "message": message},
+                             status=status)
+
+
+async def send(request, port, command, timeout=None):
+    """Reply line of one command, or raises web responses for errors"""
+    bridge = request.app[BRIDGES].get(port)
+    if bridge is None:
+        raise web.HTTPNotFound(text="unknown port " + str(port))
+    return await bridge.command(command, timeout=timeout)
+
+
+@web.middleware
+async def bridge_errors(request, handler):
+    try:
+        return await handler(request)
+    except BridgeTimeout as e:
+        return error(str(e), 504)
+    except BridgeError as e:
+        return error(str(e), 503)
+    except (KeyError, ValueError, TypeError) as e:
+        return error("bad request: %s" % e, 400)
+
+
+async def index(request):
+    path = os.path.join(HERE, "templates", "index.html")
+    if not os.path.exists(path):
+        return web.Response(text="Arena controller: see /status")
+    return web.FileResponse(path)
+
+
+async def status(request):
+    bridges = request.app[BRIDGES]
+    out = {name + "_connected": b.ser is not None for name, b in bridges.items()}
+    out["ports"] = {name: b.status() for name, b in bridges.items()}
+    out["events"] = request.app[BUS].published
+    out["live"] = request.app[HUB].status()
+    out["timestamp"] = time.time()
+    return web.json_response(out)
+
+
+async def command(request):
+    body = await request.json()
+    reply = await send(request, body.get("port", "thermal"), body["command"],
+                       body.get("timeout"))
+    return ok(response=reply)
+
+
+async def pattern(request):
+    body = await request.json()
+    return ok(response=await send(request, "thermal",
+                                  "PATTERN:" + body["pattern"]))
+
+
+async def stop(request):
+    return ok(response=await send(request, "thermal", "STOP"))
+
+
+async def start_trial(request):
+    quadrant = int((await request.json())["quadrant"])
+    if not 0 <= quadrant < len(PLATES):
+        raise ValueError("quadrant must be 0..3")
+    thermal, display = await asyncio.gather(
+        send(request, "thermal", "PATTERN:" + PLATES[quadrant]),
+        send(request, "display", "ROTATE:%d" % (quadrant * 90)))
+    return ok(trial_started=True, thermal=thermal, display=display)
+
+
+async def set_temperature(request):
+    temp = float((await request.json())["temperature"])
+    return ok(response=await send(request, "thermal", "SET_TEMP:%g" % temp))
+
+
+async def rotate_display(request):
+    angle = int((await request.json())["angle"])
+    return ok(response=await send(request, "display", "ROTATE:%d" % angle))
+
+
+async def events(request):
+    bus = request.app[BUS]
+    since = int(request.query.get("since", bus.published))
+    wait = float(request.query.get("wait", 10.0))
+    if since >= bus.published and wait > 0:
+        q = bus.subscribe(maxsize=1)
+        try:
+            await asyncio.wait_for(q.get(), wait)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            bus.unsubscribe(q)
+    items = [{"n": n, "time": e.time, "port": e.port, "kind": e.kind,
+              "line": e.line} for n, e in bus.history if n >= since]
+    return web.json_response({"next": bus.published, "events": items})
+
+
+def time_range(request):
+    """t0_ms, t1_ms of from/to (unix seconds); default the last hour"""
+    t1 = float(request.query.get("to", time.time()))
+    t0 = float(request.query.get("from", t1 - 3600))
+    return int(t0 * 1000), int(t1 * 1000)
+
+
+async def history(request):
+    store = request.app[STORE]
+    if store is None:
+        raise web.HTTPNotFound(text="no telemetry store (--store)")
+    t0, t1 = time_range(request)
+    level = request.query.get("level", "auto")
+    if level != "auto" and level not in LEVELS:
+        raise ValueError("unknown level " + level)
+    level, rows = store.query(request.query.get("arena", request.app[ARENA]),
+                              t0, t1, level,
+                              int(request.query.get("points", 2000)))
+    return web.json_response({"level": level, **rows_to_json(level, rows)})
+
+
+async def history_events(request):
+    store = request.app[STORE]
+    if store is None:
+        raise web.HTTPNotFound(text="no telemetry store (--store)")
+    t0, t1 = time_range(request)
+    kinds = request.query.getall("kind", None)
+    rows = store.events(request.query.get("arena", request.app[ARENA]),
+                        t0, t1, kinds)
+    return web.json_response(rows_to_json("events", rows))
+
+
+async def record_telemetry(app, flush_s):
+    """Bus events -> the telemetry store; the batch is written (and
+    fsynced) in a thread every flush_s so the SD card never stalls the
+    serial bridges"""
+    store, arena = app[STORE], app[ARENA]
+    q = app[BUS].subscribe(maxsize=4096)
+    loop = asyncio.get_running_loop()
+    writer = None
+    try:
+        while True:
+            try:
+                e = await asyncio.wait_for(q.get(), 0.5)
+            except asyncio.TimeoutError:
+                e = None
+            if e is not None:
+                t_ms = int(e.time * 1000)
+                sample = parse_log(e.line) if e.port == "thermal" else None
+                if sample is not None:
+                    store.add_sample(arena, t_ms, sample[1], sample[2])
+                elif (e.port == "thermal" and e.kind != "cmd"
+                      and parse_phase(e.line)):
+                    store.add_event(arena, t_ms, "phase", e.line)
+                elif e.kind in ("cmd", "reply", "link"):
+                    store.add_event(arena, t_ms, e.kind,
+                                    e.port + " " + e.line)
+            due = time.monotonic() - store.last_flush >= flush_s
+            if (due or store.pending_rows >= store.max_pending) and (
+                    writer is None or writer.done()):
+                writer = loop.run_in_executor(None, store.write_batch,
+                                              store.take_batch())
+    finally:
+        if writer is not None:
+            await writer
+
+
+async def enable_logging(app, q):
+    """LOG:ON to the thermal ESP32 on every (re)connect: it starts with
+    logging off, and the live feed and the store need its LOG: samples"""
+    bridge = app[BRIDGES].get("thermal")
+    while True:
+        e = await q.get()
+        if (bridge is not None and e.port == "thermal" and e.kind == "link"
+                and e.line.startswith("CONNECTED")):
+            try:
+                await bridge.command("LOG:ON")
+            except BridgeError:
+                pass                    # lost again: the next CONNECTED retries
+
+
+async def log_events(app, path):
+    q = app[BUS].subscribe(maxsize=4096)
+    with open(path, "a", buffering=1) as f:
+        while True:
+            e = await q.get()
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e.time))
+            f.write(f"{stamp} {e.port:<8} {e.kind:<5} {e.line}\n")
+
+
+def make_app(ports, log_path=None, timeout=1.0, frames=None, live_hz=8.0,
+             frame_speed=1.0, store_dir=None, arena="arena1", flush_s=5.0):
+    """ports: {name: serial device}; frames: frame_source() spec or None;
+    store_dir: telemetry store root or None. Bridges, the live hub and the
+    store recorder start with the app"""
+    app = web.Application(middlewares=[bridge_errors])
+    app[BUS] = EventBus()
+    app[BRIDGES] = {name: SerialBridge(name, dev, timeout=timeout,
+                                       bus=app[BUS])
+                    for name, dev in ports.items() if dev}
+    app[HUB] = LiveHub(app[BUS], app[BRIDGES],
+                       frame_source(frames, frame_speed) if frames else None,
+                       rate_hz=live_hz)
+    app[STORE] = (TelemetryStore(store_dir, flush_s=None) if store_dir
+                  else None)
+    app[ARENA] = arena
+
+    async def lifecycle(app):
+        # subscribed before the bridges start, not to miss their CONNECTED
+        links = app[BUS].subscribe()
+        for b in app[BRIDGES].values():
+            b.start()
+        app[HUB].start()
+        loop = asyncio.get_running_loop()
+        tasks = [loop.create_task(enable_logging(app, links))]
+        if log_path:
+            tasks.append(loop.create_task(log_events(app, log_path)))
+        if app[STORE] is not None:
+            tasks.append(loop.create_task(record_telemetry(app, flush_s)))
+        yield
+        await app[HUB].close()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if app[STORE] is not None:
+            app[STORE].close()
+        for b in app[BRIDGES].values():
+            await b.close()
+
+    app.cleanup_ctx.append(lifecycle)
+    app.add_routes([
+        web.get("/", index),
+        web.get("/status", status),
+        web.post("/command", command),
+        web.post("/pattern", pattern),
+        web.post("/stop", stop),
+        web.post("/start_trial", start_trial),
+        web.post("/set_temperature", set_temperature),
+        web.post("/rotate_display", rotate_display),
+        web.get("/events", events),
+        web.get("/ws", app[HUB].handle),
+        web.get("/history", history),
+        web.get("/history/events", history_events),
+    ])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--thermal", default="/dev/ttyUSB0")
+    parser.add_argument("--display", default="/dev/ttyUSB1",
+                        help="display ESP32 port, '' if there is none")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        help="seconds to wait for a command reply")
+    parser.add_argument("--log", default="arena.log",
+                        help="ESP32 output log, '' for none")
+    parser.add_argument("--frames", default=None,
+                        help="PyBadge frame data port, or a .tfa archive "
+                             "to replay")
+    parser.add_argument("--frame-speed", type=float, default=1.0,
+                        help="replay speed of a --frames archive")
+    parser.add_argument("--live-hz", type=float, default=8.0,
+                        help="telemetry rate on /ws")
+    parser.add_argument("--store", default=None,
+                        help="telemetry store directory (e.g. "
+                             "/home/pi/telemetry)")
+    parser.add_argument("--arena", default="arena1",
+                        help="arena name in the telemetry store")
+    parser.add_argument("--flush-s", type=float, default=5.0,
+                        help="seconds between telemetry store fsyncs")
+    args = parser.parse_args()
+    app = make_app({"thermal": args.thermal, "display": args.display},
+                   args.log or None, args.timeout, args.frames, args.live_hz,
+                   args.frame_speed, args.store, args.arena, args.flush_s)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
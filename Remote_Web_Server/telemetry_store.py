@@ -0,0 +1,513 @@
+"""
+Append-only telemetry store for the Raspberry Pi: plate temperatures, PWM,
+phase transitions and commands of one or more arenas.
+
+Layout: one directory per arena, one directory per level, one segment file
+per UTC day,
+
+    <root>/<arena>/raw/20260517.seg     every LOG: sample       32 B/row
+    <root>/<arena>/1s/20260517.seg      1 s rollups              80 B/row
+    <root>/<arena>/10s/...              10 s rollups
+    <root>/<arena>/1m/...               1 min rollups
+    <root>/<arena>/events/...           phases, commands, replies, link
+                                        changes                  64 B/row
+
+A segment is a 16-byte header (SEG_MAGIC, row size, day) and fixed-width
+rows in time order, so a reader maps it with numpy.memmap and finds a time
+range by binary search. Rollups are built as samples arrive: the 1 s row
+holds count, mean, min and max temperature and mean PWM of each plate, 10 s
+rows are made from 1 s rows and 1 min rows from 10 s rows.
+
+Writes are batched: rows wait in memory and flush() (every flush_s, or
+when max_pending rows wait) appends them with one write and one fsync per
+segment file. An event loop that must not wait for the SD card sets
+flush_s=None and calls take_batch() itself, handing the batch to
+write_batch() in a thread. A power cut loses at most the last batch; a torn last row
+is cut off when the segment is next opened. Segments older than the
+retention of their level (RETENTION, days) are deleted.
+
+    store = TelemetryStore("/home/pi/telemetry")
+    store.add_sample("arena1", t_ms, temps, pwms)
+    store.add_event("arena1", t_ms, "phase", "TRIAL A")
+    rows = store.query("arena1", t0_ms, t1_ms)      # level picked for you
+    store.close()
+
+    python telemetry_store.py info /home/pi/telemetry
+    python telemetry_store.py query /home/pi/telemetry arena1 --hours 24
+"""
+
+import argparse
+import calendar
+import os
+import sys
+import time
+
+import numpy as np
+
+PLATES = 4
+DAY_MS = 86400 * 1000
+SEG_MAGIC = b"TLMSEG01"
+SEG_HEAD = np.dtype([("magic", "S8"), ("row_size", "<u4"), ("day", "<u4")])
+SAMPLE = np.dtype([
+    ("t_ms", "<i8"),                  # unix time, ms
+    ("temp", "<f4", (PLATES,)),
+    ("pwm", "<i2", (PLATES,)),
+])
+ROLLUP = np.dtype([
+    ("t_ms", "<i8"),                  # bucket start
+    ("n", "<u4"),                     # samples in the bucket
+    ("pad", "<u4"),
+    ("mean", "<f4", (PLATES,)),
+    ("min", "<f4", (PLATES,)),
+    ("max", "<f4", (PLATES,)),
+    ("pwm", "<f4", (PLATES,)),        # mean PWM
+])
+EVENT = np.dtype([
+    ("t_ms", "<i8"),
+    ("kind", "S6"),                   # phase / cmd / reply / link
+    ("text", "S50"),                  # truncated to 50 bytes
+])
+# level: (row dtype, bucket ms, level it is rolled up from)
+LEVELS = {
+    "raw": (SAMPLE, None, None),
+    "1s": (ROLLUP, 1000, "raw"),
+    "10s": (ROLLUP, 10000, "1s"),
+    "1m": (ROLLUP, 60000, "10s"),
+    "events": (EVENT, None, None),
+}
+SERIES = ("raw", "1s", "10s", "1m")     # finest first
+RETENTION = {"raw": 7, "1s": 30, "10s": 365, "1m": None, "events": None}
+
+
+def day_of(t_ms):
+    return int(t_ms // DAY_MS)
+
+
+def day_name(day):
+    return time.strftime("%Y%m%d", time.gmtime(day * 86400))
+
+
+def day_from_name(name):
+    return calendar.timegm(time.strptime(name[:8], "%Y%m%d")) // 86400
+
+
+# ===== Rollups =====
+class Rollup:
+    """The open bucket of one rollup level; add() takes a block of samples
+    (or finer rollup rows) in time order and returns the finished rows"""
+
+    def __init__(self, bucket_ms):
+        self.bucket_ms = bucket_ms
+        self.open = None                 # ROLLUP row of sums, or None
+
+    def add(self, t_ms, n, mean, lo, hi, pwm):
+        starts = t_ms - t_ms % self.bucket_ms
+        cut = np.flatnonzero(np.diff(starts)) + 1
+        first = np.concatenate(([0], cut))
+        groups = np.zeros(len(first), ROLLUP)
+        groups["t_ms"] = starts[first]
+        groups["n"] = np.add.reduceat(n, first)
+        groups["mean"] = np.add.reduceat(n[:, None] * mean, first)  # sums
+        groups["min"] = np.minimum.reduceat(lo, first)
+        groups["max"] = np.maximum.reduceat(hi, first)
+        groups["pwm"] = np.add.reduceat(n[:, None] * pwm, first)
+        done = []
+        if self.open is not None:
+            g = groups[0]
+            if g["t_ms"] <= self.open["t_ms"]:   # same bucket (or late data)
+                g["t_ms"] = self.open["t_ms"]
+                g["n"] += self.open["n"]
+                g["mean"] += self.open["mean"]
+                g["min"] = np.minimum(g["min"], self.open["min"])
+                g["max"] = np.maximum(g["max"], self.open["max"])
+                g["pwm"] += self.open["pwm"]
+            else:
+                done.append(self.open[None])
+        done.append(groups[:-1])
+        self.open = groups[-1].copy()
+        return finish(np.concatenate(done))
+
+    def close(self):
+        """The open bucket as a finished row block (may be empty)"""
+        rows = (finish(self.open[None].copy()) if self.open is not None
+                else np.zeros(0, ROLLUP))
+        self.open = None
+        return rows
+
+
+def finish(sums):
+    """Rollup rows holding sums -> rows holding means (in place)"""
+    sums["mean"] /= sums["n"][:, None]
+    sums["pwm"] /= sums["n"][:, None]
+    return sums
+
+
+# ===== Segments =====
+class Segment:
+    """One day of one level: appends rows, maps them for reading"""
+
+    def __init__(self, path, dtype, day):
+        self.path = path
+        self.dtype = dtype
+        self.day = day
+        self.f = None
+        self._map = None
+        self._map_rows = -1
+
+    def rows(self):
+        if not os.path.exists(self.path):
+            return 0
+        return max(0, (os.path.getsize(self.path) - SEG_HEAD.itemsize)
+                   // self.dtype.itemsize)
+
+    def append(self, data):
+        """data: bytes of whole rows"""
+        if self.f is None:
+            new = not os.path.exists(self.path)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.f = open(self.path, "ab")
+            if new or self.f.tell() < SEG_HEAD.itemsize:
+                self.f.truncate(0)
+                head = np.zeros(1, SEG_HEAD)
+                head["magic"] = SEG_MAGIC
+                head["row_size"] = self.dtype.itemsize
+                head["day"] = self.day
+                self.f.write(head.tobytes())
+            else:
+                # a torn row from a crash: cut it off before appending
+                self.f.truncate(SEG_HEAD.itemsize
+                                + self.rows() * self.dtype.itemsize)
+        self.f.write(data)
+
+    def sync(self):
+        if self.f is not None:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def read(self):
+        """All rows as a memmap (cached until the segment grows)"""
+        n = self.rows()
+        if n != self._map_rows:
+            self._map = (np.memmap(self.path, self.dtype, "r",
+                                   SEG_HEAD.itemsize, (n,))
+                         if n else np.zeros(0, self.dtype))
+            self._map_rows = n
+        return self._map
+
+    def between(self, t0, t1):
+        rows = self.read()
+        lo, hi = np.searchsorted(rows["t_ms"], (t0, t1))
+        return rows[lo:hi]
+
+
+def check_segment(path):
+    head = np.fromfile(path, SEG_HEAD, 1)
+    if not len(head) or head[0]["magic"] != SEG_MAGIC:
+        raise ValueError(path + " is not a telemetry segment")
+    return head[0]
+
+
+# ===== Store =====
+class TelemetryStore:
+    def __init__(self, root, flush_s=5.0, max_pending=4096, retention=None):
+        self.root = root
+        self.flush_s = flush_s
+        self.max_pending = max_pending
+        self.retention = dict(RETENTION, **(retention or {}))
+        self.segments = {}       # (arena, level, day): Segment
+        self.pending = {}        # (arena, level): list of row blocks
+        self.pending_rows = 0
+        self.writing = {}        # batch being written by write_batch()
+        self.rollups = {}        # (arena, level): Rollup
+        self.last_flush = time.monotonic()
+        self.last_evict_day = None
+        # counters
+        self.flushes = 0
+        self.fsyncs = 0
+        self.rows_written = 0
+        os.makedirs(root, exist_ok=True)
+
+    # ---------- writing ----------
+    def add_sample(self, arena, t_ms, temps, pwms):
+        row = np.zeros(1, SAMPLE)
+        row["t_ms"] = t_ms
+        row["temp"] = temps
+        row["pwm"] = pwms
+        self.add_samples(arena, row)
+
+    def add_samples(self, arena, rows):
+        """A block of SAMPLE rows in time order"""
+        if not len(rows):
+            return
+        self._queue(arena, "raw", rows)
+        temp = rows["temp"].astype(float)
+        self._roll(arena, "1s", rows["t_ms"], np.ones(len(rows), np.uint32),
+                   temp, temp, temp, rows["pwm"].astype(float))
+        self._maybe_flush()
+
+    def add_event(self, arena, t_ms, kind, text):
+        row = np.zeros(1, EVENT)
+        row["t_ms"] = t_ms
+        row["kind"] = kind.encode()[:6]
+        row["text"] = text.encode("utf-8", "replace")[:50]
+        self._queue(arena, "events", row)
+        self._maybe_flush()
+
+    def _queue(self, arena, level, block):
+        self.pending.setdefault((arena, level), []).append(block)
+        self.pending_rows += len(block)
+
+    def _roll(self, arena, level, t_ms, n, mean, lo, hi, pwm):
+        key = (arena, level)
+        r = self.rollups.get(key)
+        if r is None:
+            r = self.rollups[key] = Rollup(LEVELS[level][1])
+        self._finish(arena, level, r.add(t_ms, n, mean, lo, hi, pwm))
+
+    def _finish(self, arena, level, rows):
+        """Queue finished rollup rows and feed them to the coarser level"""
+        if not len(rows):
+            return
+        self._queue(arena, level, rows)
+        for name, (_, _, src) in LEVELS.items():
+            if src == level:
+                self._roll(arena, name, rows["t_ms"], rows["n"], rows["mean"],
+                           rows["min"], rows["max"], rows["pwm"])
+
+    def _maybe_flush(self):
+        if self.flush_s is None:
+            return
+        if (self.pending_rows >= self.max_pending
+                or time.monotonic() - self.last_flush >= self.flush_s):
+            self.flush()
+
+    def flush(self):
+        """Append every waiting row: one write and one fsync per segment"""
+        self.write_batch(self.take_batch())
+
+    def take_batch(self):
+        """The waiting rows, for write_batch() in another thread; queries
+        still see them until that is done"""
+        batch = {k: np.concatenate(v) for k, v in self.pending.items() if v}
+        self.pending = {}
+        self.pending_rows = 0
+        self.writing = batch
+        self.last_flush = time.monotonic()
+        return batch
+
+    def write_batch(self, batch):
+        touched = set()
+        for (arena, level), block in batch.items():
+            days = block["t_ms"] // DAY_MS
+            # rows arrive in time order, so each day is one run
+            cuts = np.flatnonzero(np.diff(days)) + 1
+            for part in np.split(block, cuts):
+                seg = self._segment(arena, level, int(part["t_ms"][0]
+                                                      // DAY_MS))
+                seg.append(part.tobytes())
+                touched.add(seg)
+            self.rows_written += len(block)
+        for seg in touched:
+            seg.sync()
+        self.fsyncs += len(touched)
+        self.flushes += 1
+        if self.writing is batch:
+            self.writing = {}
+        today = day_of(time.time() * 1000)
+        if self.last_evict_day != today:
+            self.evict(today)
+            self.last_evict_day = today
+
+    def close(self, final_rollups=True):
+        """Flush, including the rollup buckets still open if final_rollups"""
+        if final_rollups:
+            for level in SERIES[1:]:              # fine to coarse
+                for (arena, lv), r in list(self.rollups.items()):
+                    if lv == level:
+                        self._finish(arena, level, r.close())
+        self.flush()
+        for seg in self.segments.values():
+            seg.close()
+        self.segments.clear()
+
+    def _segment(self, arena, level, day):
+        key = (arena, level, day)
+        seg = self.segments.get(key)
+        if seg is None:
+            path = os.path.join(self.root, arena, level, day_name(day) + ".seg")
+            seg = self.segments[key] = Segment(path, LEVELS[level][0], day)
+            # keep today's and yesterday's files open, close older ones
+            for old in [k for k in list(self.segments) if k[2] < day - 1]:
+                self.segments.pop(old).close()
+        return seg
+
+    # ---------- retention ----------
+    def evict(self, today=None):
+        """Delete segments older than their level's retention; returns
+        the paths removed"""
+        today = day_of(time.time() * 1000) if today is None else today
+        removed = []
+        for arena in self.arenas():
+            for level, days in self.retention.items():
+                if days is None:
+                    continue
+                for day, path in self._files(arena, level):
+                    if day <= today - days:
+                        seg = self.segments.pop((arena, level, day), None)
+                        if seg is not None:
+                            seg.close()
+                        os.remove(path)
+                        removed.append(path)
+        return removed
+
+    # ---------- reading ----------
+    def arenas(self):
+        return sorted(d for d in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, d)))
+
+    def _files(self, arena, level):
+        folder = os.path.join(self.root, arena, level)
+        if not os.path.isdir(folder):
+            return []
+        return sorted((day_from_name(name), os.path.join(folder, name))
+                      for name in os.listdir(folder) if name.endswith(".seg"))
+
+    def read(self, arena, level, t0_ms, t1_ms):
+        """Rows of one level with t0_ms <= t_ms < t1_ms, unflushed ones
+        included"""
+        dtype = LEVELS[level][0]
+        parts = []
+        for day in range(day_of(t0_ms), day_of(t1_ms - 1) + 1):
+            key = (arena, level, day)
+            seg = self.segments.get(key)
+            if seg is None:
+                path = os.path.join(self.root, arena, level,
+                                    day_name(day) + ".seg")
+                if not os.path.exists(path):
+                    continue
+                seg = self.segments[key] = Segment(path, dtype, day)
+            parts.append(seg.between(t0_ms, t1_ms))
+        waiting = self.pending.get((arena, level), [])
+        if (arena, level) in self.writing:
+            waiting = [self.writing[(arena, level)]] + waiting
+        if waiting:
+            block = np.concatenate(waiting)
+            parts.append(block[(block["t_ms"] >= t0_ms)
+                               & (block["t_ms"] < t1_ms)])
+        if not parts:
+            return np.zeros(0, dtype)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def estimate(self, arena, t0_ms, t1_ms):
+        """Rows each series level would return, from the 1 min rows alone
+        (their n is the raw sample count) plus the buckets still open"""
+        n = self.read(arena, "1m", t0_ms - t0_ms % 60000, t1_ms)["n"]
+        n = n.astype(np.int64)
+        open_n = sum(int(r.open["n"]) for (a, _), r in self.rollups.items()
+                     if a == arena and r.open is not None)
+        return {"raw": int(n.sum()) + open_n,
+                "1s": int(np.minimum(n, 60).sum()) + min(open_n, 60),
+                "10s": int(np.minimum(n, 6).sum()) + min(open_n, 6),
+                "1m": len(n) + (open_n > 0)}
+
+    def query(self, arena, t0_ms, t1_ms, level="auto", max_points=2000):
+        """(level, rows): the finest level with at most max_points rows in
+        the range (level="auto"), or the level asked for"""
+        if level == "auto":
+            counts = self.estimate(arena, t0_ms, t1_ms)
+            level = next((lv for lv in SERIES if counts[lv] <= max_points),
+                         SERIES[-1])
+        return level, self.read(arena, level, t0_ms, t1_ms)
+
+    def events(self, arena, t0_ms, t1_ms, kinds=None):
+        rows = self.read(arena, "events", t0_ms, t1_ms)
+        if kinds:
+            rows = rows[np.isin(rows["kind"], [k.encode() for k in kinds])]
+        return rows
+
+    def info(self):
+        out = {}
+        for arena in self.arenas():
+            out[arena] = {}
+            for level, (dtype, _, _) in LEVELS.items():
+                files = self._files(arena, level)
+                rows = sum(Segment(p, dtype, d).rows() for d, p in files)
+                size = sum(os.path.getsize(p) for _, p in files)
+                out[arena][level] = {"days": len(files), "rows": rows,
+                                     "bytes": size}
+        return out
+
+
+# ===== Output =====
+def rows_to_json(level, rows):
+    """Column lists for JSON (dashboards)"""
+    if level == "events":
+        return {"t_ms": rows["t_ms"].tolist(),
+                "kind": [k.decode() for k in rows["kind"]],
+                "text": [t.decode("utf-8", "replace") for t in rows["text"]]}
+    if level == "raw":
+        return {"t_ms": rows["t_ms"].tolist(),
+                "temp": np.round(rows["temp"], 2).tolist(),
+                "pwm": rows["pwm"].tolist()}
+    return {"t_ms": rows["t_ms"].tolist(), "n": rows["n"].tolist(),
+            "mean": np.round(rows["mean"], 2).tolist(),
+            "min": np.round(rows["min"], 2).tolist(),
+            "max": np.round(rows["max"], 2).tolist(),
+            "pwm": np.round(rows["pwm"], 1).tolist()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("info", help="days, rows and bytes per arena and level")
+    p.add_argument("root")
+    p = sub.add_parser("query", help="print a time range as CSV")
+    p.add_argument("root")
+    p.add_argument("arena")
+    p.add_argument("--hours", type=float, default=1.0,
+                   help="range ending now (or at --end)")
+    p.add_argument("--end", type=float, default=None, help="unix seconds")
+    p.add_argument("--level", default="auto",
+                   choices=("auto",) + tuple(LEVELS))
+    p.add_argument("--points", type=int, default=2000)
+    args = parser.parse_args()
+
+    store = TelemetryStore(args.root)
+    if args.cmd == "info":
+        for arena, levels in store.info().items():
+            for level, v in levels.items():
+                print(f"{arena:<10} {level:<6} {v['days']:4d} days "
+                      f"{v['rows']:10d} rows {v['bytes'] / 1e6:9.2f} MB")
+        return
+    end = (args.end or time.time()) * 1000
+    t0, t1 = int(end - args.hours * 3600e3), int(end)
+    start = time.perf_counter()
+    if args.level == "events":
+        level, rows = "events", store.events(args.arena, t0, t1)
+    else:
+        level, rows = store.query(args.arena, t0, t1, args.level, args.points)
+    ms = 1e3 * (time.perf_counter() - start)
+    print(f"# {args.arena} {level}: {len(rows)} rows in {ms:.1f} ms",
+          file=sys.stderr)
+    for r in rows:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(r["t_ms"] / 1000))
+        if level == "events":
+            print(f"{stamp},{r['kind'].decode()},"
+                  f"{r['text'].decode('utf-8', 'replace')}")
+        elif level == "raw":
+            print(stamp + "," + ",".join(f"{t:.2f},{p}" for t, p in
+                                         zip(r["temp"], r["pwm"])))
+        else:
+            print(f"{stamp},{r['n']}," + ",".join(
+                f"{m:.2f},{lo:.2f},{hi:.2f},{p:.0f}" for m, lo, hi, p in
+                zip(r["mean"], r["min"], r["max"], r["pwm"])))
+
+
+if __name__ == "__main__":
+    main()